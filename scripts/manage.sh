@@ -20,6 +20,7 @@ show_help() {
     echo "  logs            - 显示服务日志"
     echo "  config          - 验证配置文件"
     echo "  reload          - 重新加载配置（热重载）"
+    echo "  profile         - 采集运行时剖析报告（写入日志目录）"
     echo "  help            - 显示此帮助"
     echo ""
 }
@@ -236,6 +237,18 @@ reload_config() {
     fi
 }
 
+profile_service() {
+    if ! systemctl is-active --quiet $SERVICE_NAME; then
+        echo "✗ 服务未运行，无法采集剖析报告"
+        return 1
+    fi
+
+    # 发送SIGUSR1信号触发运行时剖析（服务在后台采样，完成后写入日志目录）
+    systemctl kill --signal=USR1 --kill-who=main $SERVICE_NAME
+    echo "已发送剖析信号，采样完成后报告写入 /var/log/docker-ipv6-firewall-profile-<时间>.txt"
+    echo "（采样时长见配置项 profile_duration，默认10秒）"
+}
+
 # 检查权限
 if [[ $EUID -ne 0 ]]; then
    echo "错误: 此脚本需要 root 权限运行"
@@ -269,6 +282,9 @@ case "${1:-help}" in
     reload)
         reload_config
         ;;
+    profile)
+        profile_service
+        ;;
     help|--help|-h)
         show_help
         ;;
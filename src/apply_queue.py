@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+规则变更队列模块（单写线程）
+
+Docker事件线程和周期扫描线程只提交变更意图，由唯一的应用线程执行所有规则变更。
+同一目标（容器、Service）在合并窗口内的多个意图只保留最后一个（如崩溃循环中的
+start/die/start 只执行最终的 start），连续的事件意图在一个事务中批量提交。
+延迟意图（如容器停止后的宽限期删除）到期后才进入队列，期间同一目标的新意图会取消它。
+"""
+
+import logging
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import metrics
+import tracing
+
+# (目标键, 执行函数, 是否为屏障)
+Intent = Tuple[Hashable, Callable[[], None], bool]
+
+
+class ApplyQueue:
+    """单写线程的规则变更队列
+
+    屏障意图（陈旧规则清理、规则同步）单独执行，不与事件意图合并到同一事务，
+    并且之前提交的意图总是先执行完。
+    """
+
+    SYNC_KEY = ("sync",)
+
+    def __init__(self, firewall_manager, window: float = 0.2):
+        self.firewall_manager = firewall_manager
+        # 事后发现的提交失败（常驻restore进程）同样由规则同步修复
+        firewall_manager.resync_hook = self.request_sync
+        self.window = window  # 合并窗口（秒）：收到第一个意图后等待同一批事件到齐
+        self.logger = logging.getLogger(__name__)
+        self._intents: "OrderedDict[Hashable, Tuple[Callable[[], None], bool]]" = \
+            OrderedDict()
+        # 延迟意图：目标键 -> (到期时间, 执行函数, 是否为屏障)
+        self._delayed: Dict[Hashable, Tuple[float, Callable[[], None], bool]] = {}
+        # 触发意图的Docker事件到达时间（合并的多个事件保留最早的），规则提交后计入延迟指标
+        self._received: Dict[Hashable, float] = {}
+        self._taken_received: Dict[Hashable, float] = {}
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._busy = False
+        self._thread: Optional[threading.Thread] = None
+        self.coalesced = 0  # 被后续意图覆盖（合并）的意图数量
+
+    def start(self):
+        """启动应用线程"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="rule-applier")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """停止应用线程（未执行的意图和延迟意图被丢弃）"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    def submit(self, key: Hashable, action: Callable[[], None], barrier: bool = False,
+               replace: bool = True, received: Optional[float] = None):
+        """提交意图；同一目标尚未执行的意图被新意图覆盖
+
+        replace为False时不覆盖已排队的意图（周期扫描的结果不应覆盖更新的事件）。
+        received为触发意图的事件到达时间（time.monotonic()），用于统计事件到规则生效的延迟。
+        """
+        with self._cond:
+            if key in self._intents:
+                if not replace:
+                    return
+                self.coalesced += 1
+                del self._intents[key]  # 重新排到队尾，保持提交顺序
+            if self._delayed.pop(key, None) is not None:
+                self.coalesced += 1
+            self._intents[key] = (action, barrier)
+            if received is not None:
+                self._received[key] = min(received, self._received.get(key, received))
+            self._cond.notify_all()
+
+    def request_sync(self):
+        """提交规则同步屏障：对比内核状态修复内存记录与规则的差异"""
+        self.submit(self.SYNC_KEY, self.firewall_manager.sync_rules_with_reality,
+                    barrier=True)
+
+    def submit_after(self, delay: float, key: Hashable, action: Callable[[], None],
+                     barrier: bool = False):
+        """提交延迟意图：delay秒后执行，到期前同一目标的新意图会取消它
+
+        同一目标尚未执行的即时意图被覆盖（延迟意图代表更新的最终状态）。
+        """
+        with self._cond:
+            if self._intents.pop(key, None) is not None:
+                self.coalesced += 1
+            self._received.pop(key, None)
+            if key in self._delayed:
+                # 保留最早的到期时间，连续的 die/kill 事件不会推迟删除
+                due = self._delayed[key][0]
+            else:
+                due = time.monotonic() + delay
+            self._delayed[key] = (due, action, barrier)
+            self._cond.notify_all()
+
+    def delayed(self, key: Hashable) -> bool:
+        """目标是否有尚未到期的延迟意图"""
+        with self._cond:
+            return key in self._delayed
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._intents)
+
+    def stats(self) -> Dict[str, int]:
+        """队列深度统计（用于运行时剖析）"""
+        with self._cond:
+            return {"pending": len(self._intents), "delayed": len(self._delayed),
+                    "busy": int(self._busy), "coalesced": self.coalesced}
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """等待所有已提交的意图执行完成"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._intents and not self._busy,
+                                       timeout)
+
+    def _promote_due(self) -> Optional[float]:
+        """把已到期的延迟意图移入队列，返回距下一个到期的秒数（没有延迟意图时为None）"""
+        now = time.monotonic()
+        for key, (due, action, barrier) in sorted(self._delayed.items(),
+                                                  key=lambda item: item[1][0]):
+            if due > now:
+                return due - now
+            del self._delayed[key]
+            self._intents[key] = (action, barrier)
+        return None
+
+    def _take(self) -> List[Intent]:
+        """等待意图到达，合并窗口结束后一次取出全部意图"""
+        with self._cond:
+            while not self._stop_event.is_set():
+                timeout = self._promote_due()
+                if self._intents:
+                    break
+                self._cond.wait(timeout)
+        if self.window > 0:
+            self._stop_event.wait(self.window)
+        with self._cond:
+            self._promote_due()
+            intents = [(key, action, barrier)
+                       for key, (action, barrier) in self._intents.items()]
+            self._intents.clear()
+            self._taken_received, self._received = self._received, {}
+            self._busy = bool(intents)
+        return intents
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            intents = self._take()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.apply(intents)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+        with self._cond:
+            self._busy = False
+            self._cond.notify_all()
+
+    def apply(self, intents: List[Intent]):
+        """按顺序执行一批意图：连续的事件意图合并到一个事务，屏障意图单独执行"""
+        batch = []
+        for key, action, barrier in intents:
+            if barrier:
+                self._apply_batch(batch)
+                batch = []
+                self._execute(key, action)
+            else:
+                batch.append((key, action))
+        self._apply_batch(batch)
+
+    def _apply_batch(self, batch: List[Tuple[Hashable, Callable[[], None]]]):
+        if not batch:
+            return
+        try:
+            with tracing.span("apply.batch", intents=len(batch)), \
+                    self.firewall_manager.batch():
+                for key, action in batch:
+                    self._execute(key, action)
+        except subprocess.CalledProcessError as e:
+            # 登记表的修改已随提交失败撤销；部分地址族可能已经生效，由规则同步对比内核状态修复
+            self.logger.error(f"批量提交 {len(batch)} 个变更失败: {e.stderr or e}")
+            self.request_sync()
+        else:
+            self.logger.debug(f"批量应用 {len(batch)} 个变更意图")
+            now = time.monotonic()
+            for key, _ in batch:
+                received = self._taken_received.pop(key, None)
+                if received is not None:
+                    metrics.EVENT_APPLY_SECONDS.observe(now - received)
+
+    def _execute(self, key: Hashable, action: Callable[[], None]):
+        with tracing.span("apply.intent", key=":".join(map(str, key))) as span:
+            received = self._taken_received.get(key)
+            if received is not None:
+                span.set_attribute("queued_seconds", time.monotonic() - received)
+            try:
+                action()
+            except Exception as e:
+                self.logger.error(f"执行变更 {key} 失败: {e}")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+异步Docker事件引擎模块（event_engine: asyncio）
+
+在一个后台线程的 asyncio 事件循环中直接读取 Docker Engine API 的事件流，代替阻塞的
+client.events() 线程和睡眠的扫描线程：
+- 容器start事件的inspect在事件循环中并发进行（信号量限制并发数），结果写入inspect缓存后
+  才提交意图，应用线程处理时命中缓存；一个慢inspect不阻塞后续事件，事件处理吞吐量
+  取决于Docker单次响应时间，而不是所有响应时间之和
+- 同一容器的事件按到达顺序提交（后到的事件等待前一个事件的inspect完成）
+- 周期扫描是事件循环中的定时器，不占用线程睡眠（Service容器启动后的Service重新检查
+  由 DockerMonitor 的时间轮调度，两种引擎相同）
+
+规则变更仍然只由应用线程执行；周期扫描在线程池中运行（使用 docker SDK）。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from functools import partial
+from typing import Any, Dict, Optional
+
+import metrics
+import tracing
+from docker_engine import AsyncDockerEngine
+
+
+class AsyncEventEngine:
+    """DockerMonitor 的异步事件引擎"""
+
+    EVENT_FILTERS = {'type': ['container', 'network', 'service']}
+    RECONNECT_DELAY = 5        # 事件流断开后重新连接的间隔（秒）
+
+    def __init__(self, monitor, concurrency: int = 8,
+                 engine: Optional[AsyncDockerEngine] = None):
+        self.monitor = monitor
+        self.concurrency = concurrency
+        self.engine = engine or AsyncDockerEngine.from_url(monitor.config.docker_socket)
+        self.logger = logging.getLogger(__name__)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._main_task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 容器ID -> 该容器最后一个尚未提交的事件任务（保证同一容器的事件按顺序提交）
+        self._chains: Dict[str, asyncio.Task] = {}
+        self._ready = threading.Event()
+
+    def start(self):
+        """在后台线程中启动事件循环"""
+        self._thread = threading.Thread(target=self._run, name="docker-events")
+        self._thread.daemon = True
+        self._thread.start()
+        self._ready.wait(5)
+
+    def stop(self, timeout: float = 5):
+        loop, task = self.loop, self._main_task
+        if loop is not None and task is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(task.cancel)
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._main_task = self.loop.create_task(self.run())
+            self._ready.set()
+            self.loop.run_until_complete(self._main_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._ready.set()
+            pending = asyncio.all_tasks(self.loop)
+            for task in pending:
+                task.cancel()
+            if pending:
+                self.loop.run_until_complete(
+                    asyncio.gather(*pending, return_exceptions=True))
+            self.loop.close()
+
+    async def run(self):
+        """事件流和周期扫描定时器"""
+        self.loop = asyncio.get_running_loop()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        scan = asyncio.ensure_future(self._scan_timer())
+        try:
+            await self._watch_events()
+        finally:
+            scan.cancel()
+            for task in list(self._chains.values()):
+                task.cancel()
+
+    async def _watch_events(self):
+        self.logger.info("开始监控Docker事件（异步引擎）")
+        reconnect = False
+        while self.monitor.running:
+            try:
+                if reconnect:
+                    if not await self.engine.ping():
+                        raise ConnectionError("Docker ping 失败")
+                    await self.loop.run_in_executor(None, self.monitor._after_reconnect)
+                    metrics.DOCKER_RECONNECTS.inc(result="success")
+                    self.logger.info("Docker重新连接成功")
+                    reconnect = False
+                async for event in self.engine.events(self.EVENT_FILTERS):
+                    if not self.monitor.running:
+                        return
+                    self.dispatch(event)
+                raise ConnectionError("事件流已结束")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.monitor.running:
+                    return
+                if reconnect:
+                    metrics.DOCKER_RECONNECTS.inc(result="failure")
+                    self.logger.error(f"Docker重新连接失败: {e}")
+                else:
+                    self.logger.error(f"监控Docker事件失败: {e}")
+                reconnect = True
+                await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def dispatch(self, event: Dict[str, Any]):
+        """处理一个事件（事件循环中调用，不阻塞）"""
+        received = time.monotonic()
+        self.monitor._note_event(event)
+
+        container_id = None
+        prefetch = False
+        if event.get('Type') == 'container':
+            container_id = self.monitor._event_container_id(event)
+            prefetch = bool(container_id) and event.get('Action') == 'start'
+
+        previous = self._chains.get(container_id) if container_id else None
+        if not prefetch and previous is None:
+            self.monitor._submit_event(event, received)
+            return
+
+        task = asyncio.ensure_future(
+            self._submit_in_order(event, received, container_id, prefetch, previous))
+        self._chains[container_id] = task
+        task.add_done_callback(partial(self._chain_done, container_id))
+
+    async def _submit_in_order(self, event: Dict[str, Any], received: float,
+                               container_id: str, prefetch: bool,
+                               previous: Optional[asyncio.Task]):
+        """（并发地）预取inspect，等待同一容器的前一个事件提交后再提交本事件"""
+        try:
+            if prefetch:
+                await self.prefetch(container_id)
+            if previous is not None:
+                await asyncio.wait([previous])
+            self.monitor._submit_event(event, received)
+        except Exception as e:
+            self.logger.error(f"处理容器事件失败 {container_id}: {e}")
+
+    def _chain_done(self, container_id: str, task: asyncio.Task):
+        if self._chains.get(container_id) is task:
+            del self._chains[container_id]
+
+    async def prefetch(self, container_id: str):
+        """inspect容器并写入缓存；失败时由应用线程处理时再inspect"""
+        cache = self.monitor.inspect_cache
+        async with self._semaphore:
+            token = cache.token(container_id)
+            try:
+                with tracing.span("docker inspect_container",
+                                  container_id=container_id[:12]):
+                    inspect_data = await self.engine.inspect_container(container_id)
+            except Exception as e:
+                self.logger.debug(f"预取容器信息失败 {container_id}: {e}")
+                return
+        info = self.monitor._container_info(container_id, inspect_data)
+        cache.put(container_id, info, token)
+
+    async def _scan_timer(self):
+        """周期扫描（兜底机制）：定时器到期后在线程池中执行一轮扫描"""
+        while self.monitor.running:
+            await asyncio.sleep(self.monitor.SCAN_INTERVAL)
+            if not self.monitor.running:
+                return
+            self.logger.info("执行周期性扫描（兜底机制）- 检查容器和Service状态一致性")
+            try:
+                await self.loop.run_in_executor(None, self.monitor.scan_once)
+            except Exception as e:
+                self.logger.error(f"周期性扫描失败: {e}")
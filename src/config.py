@@ -27,6 +27,9 @@ class Config:
 
     # Docker配置
     docker_socket: str = "unix:///var/run/docker.sock"
+    # 事件引擎：thread（docker SDK 阻塞读取事件）或 asyncio（异步读取事件流，并发inspect）
+    event_engine: str = "thread"
+    inspect_concurrency: int = 8                        # 异步引擎同时进行的容器inspect数量上限
 
     # 防火墙配置
     # IPv6专用链
@@ -43,6 +46,43 @@ class Config:
     iptables_cmd: str = "iptables"                      # iptables命令路径
     ipv6_link_local: str = "fe80::/10"                  # IPv6链路本地地址范围
 
+    # 规则引擎：iptables（默认）或 nftables（容器/Service规则使用集合和映射）
+    firewall_backend: str = "iptables"
+    nft_cmd: str = "nft"                                # nft命令路径
+    nft_table: str = "docker_ipv6fw"                    # nftables表名（ip6族）
+    nft_accept_mark: str = "0x20000000"                 # nftables命中放行集合时打的标记
+
+    # 容器FORWARD规则组织方式（仅iptables引擎）：chain（每个端口一条规则）、
+    # ipset（按协议的 hash:ip,port 集合）或 subchain（每个容器地址一条子链）
+    forward_mode: str = "chain"
+    ipset_cmd: str = "ipset"                            # ipset命令路径
+    ipset_prefix: str = "docker_ipv6fw"                 # ipset集合名前缀（集合名为 <前缀>_<协议>）
+
+    # iptables规则提交方式：oneshot（默认，每批启动一次restore，逐批确认）或
+    # persistent（每个地址族一个常驻restore进程，失败在写入下一批时才发现）
+    rule_applier: str = "oneshot"
+
+    # 热重启：停止时保留规则，启动时接管现有规则并只提交差异
+    warm_restart: bool = False
+
+    # 规则变更合并窗口（秒）：窗口内同一容器的多个事件只执行最终状态，并在一个事务中提交
+    apply_coalesce_window: float = 0.2
+
+    # 容器停止后保留规则的宽限期（秒）：期间重启且地址、端口不变时不修改规则；0 表示立即删除
+    container_stop_grace: float = 10
+
+    # 指标服务：Prometheus文本格式的 /metrics 监听端口（0 表示关闭），默认只绑定本机
+    metrics_port: int = 0
+    metrics_address: str = "127.0.0.1"
+
+    # 调用链追踪：记录每个事件处理过程的计时span（OpenTelemetry JSON格式）
+    trace_enabled: bool = False
+    trace_file: str = ""                                # JSON Lines输出文件，为空时只保存在内存环形缓冲区
+    trace_buffer_size: int = 1000                       # 内存中保留的最近span数量
+
+    # 运行时剖析：收到 SIGUSR1 后采样的时长（秒），报告写入日志目录
+    profile_duration: float = 10
+
     # 监控的网络类型
     monitored_networks: List[str] = None
 
@@ -110,6 +150,10 @@ class Config:
             'nat_chain_name': self.nat_chain_name,
             'ipv4_chain_name': self.ipv4_chain_name,
             'ipv4_nat_chain_name': self.ipv4_nat_chain_name,
+            'firewall_backend': self.firewall_backend,
+            'forward_mode': self.forward_mode,
+            'rule_applier': self.rule_applier,
+            'warm_restart': self.warm_restart,
             'monitored_networks': self.monitored_networks
         }
         
@@ -146,6 +190,95 @@ class Config:
                 self._add_validation_error(f"无效的日志级别: {config_data['log_level']}")
                 valid = False
 
+        # 检查规则引擎
+        if 'firewall_backend' in config_data:
+            if config_data['firewall_backend'] not in ('iptables', 'nftables'):
+                self._add_validation_error(
+                    f"无效的规则引擎: {config_data['firewall_backend']}"
+                    "（可选 iptables, nftables）")
+                valid = False
+
+        # 检查FORWARD规则组织方式
+        if 'forward_mode' in config_data:
+            if config_data['forward_mode'] not in ('chain', 'ipset', 'subchain'):
+                self._add_validation_error(
+                    f"无效的FORWARD规则模式: {config_data['forward_mode']}"
+                    "（可选 chain, ipset, subchain）")
+                valid = False
+
+        # 检查规则提交方式
+        if 'rule_applier' in config_data:
+            if config_data['rule_applier'] not in ('persistent', 'oneshot'):
+                self._add_validation_error(
+                    f"无效的规则提交方式: {config_data['rule_applier']}（可选 persistent, oneshot）")
+                valid = False
+
+        # 检查事件引擎
+        if 'event_engine' in config_data:
+            if config_data['event_engine'] not in ('thread', 'asyncio'):
+                self._add_validation_error(
+                    f"无效的事件引擎: {config_data['event_engine']}（可选 thread, asyncio）")
+                valid = False
+
+        if 'inspect_concurrency' in config_data:
+            concurrency = config_data['inspect_concurrency']
+            if (not isinstance(concurrency, int) or isinstance(concurrency, bool)
+                    or concurrency <= 0):
+                self._add_validation_error("inspect_concurrency 必须是正整数")
+                valid = False
+
+        if 'apply_coalesce_window' in config_data:
+            window = config_data['apply_coalesce_window']
+            if not isinstance(window, (int, float)) or window < 0:
+                self._add_validation_error("apply_coalesce_window 必须是非负数")
+                valid = False
+
+        if 'container_stop_grace' in config_data:
+            grace = config_data['container_stop_grace']
+            if not isinstance(grace, (int, float)) or grace < 0:
+                self._add_validation_error("container_stop_grace 必须是非负数")
+                valid = False
+
+        if 'metrics_port' in config_data:
+            port = config_data['metrics_port']
+            if (not isinstance(port, int) or isinstance(port, bool)
+                    or not 0 <= port <= 65535):
+                self._add_validation_error("metrics_port 必须是 0-65535 之间的整数")
+                valid = False
+
+        if 'metrics_address' in config_data:
+            address = config_data['metrics_address']
+            if not address or not isinstance(address, str):
+                self._add_validation_error("metrics_address 必须是非空字符串")
+                valid = False
+
+        if 'trace_enabled' in config_data:
+            if not isinstance(config_data['trace_enabled'], bool):
+                self._add_validation_error("trace_enabled 必须是布尔值")
+                valid = False
+
+        if 'trace_file' in config_data:
+            if not isinstance(config_data['trace_file'], str):
+                self._add_validation_error("trace_file 必须是字符串")
+                valid = False
+
+        if 'trace_buffer_size' in config_data:
+            size = config_data['trace_buffer_size']
+            if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+                self._add_validation_error("trace_buffer_size 必须是正整数")
+                valid = False
+
+        if 'profile_duration' in config_data:
+            duration = config_data['profile_duration']
+            if not isinstance(duration, (int, float)) or duration <= 0:
+                self._add_validation_error("profile_duration 必须是正数")
+                valid = False
+
+        if 'warm_restart' in config_data:
+            if not isinstance(config_data['warm_restart'], bool):
+                self._add_validation_error("warm_restart 必须是布尔值")
+                valid = False
+
         # 检查监控网络类型
         if 'monitored_networks' in config_data:
             if not isinstance(config_data['monitored_networks'], list):
@@ -221,6 +354,10 @@ class Config:
             'parent_interface': self.parent_interface,
             'gateway_macvlan': self.gateway_macvlan,
             'chain_name': self.chain_name,
+            'firewall_backend': self.firewall_backend,
+            'forward_mode': self.forward_mode,
+            'rule_applier': self.rule_applier,
+            'warm_restart': self.warm_restart,
             'monitored_networks': self.monitored_networks,
             'log_level': self.log_level,
             'docker_socket': self.docker_socket,
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Docker Engine API 异步客户端模块
+
+直接通过unix socket访问Docker Engine API（HTTP/1.1），只用标准库 asyncio，
+供异步事件引擎使用：事件流（chunked JSON）和容器inspect。每个请求使用独立连接，
+多个inspect可以并发进行，互不阻塞。
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+
+class DockerEngineError(Exception):
+    """Docker Engine API 返回错误状态"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class AsyncDockerEngine:
+    """Docker Engine API 的最小异步客户端（unix socket）"""
+
+    def __init__(self, socket_path: str, timeout: float = 10):
+        self.socket_path = socket_path
+        self.timeout = timeout  # 普通请求的超时（秒）；事件流不超时
+
+    @classmethod
+    def from_url(cls, base_url: str, timeout: float = 10) -> "AsyncDockerEngine":
+        """由 docker_socket 配置（unix:///var/run/docker.sock）创建"""
+        if base_url.startswith('unix://'):
+            return cls(base_url[len('unix://'):], timeout)
+        if base_url.startswith('/'):
+            return cls(base_url, timeout)
+        raise ValueError(f"异步事件引擎只支持unix socket: {base_url}")
+
+    async def ping(self) -> bool:
+        status, _ = await asyncio.wait_for(self._request('GET', '/_ping'), self.timeout)
+        return status == 200
+
+    async def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        """GET /containers/{id}/json，返回与 docker-py 的 api.inspect_container 相同的字典"""
+        path = f"/containers/{quote(container_id, safe='')}/json"
+        return await self.request_json('GET', path)
+
+    async def request_json(self, method: str, path: str,
+                           params: Optional[Dict[str, Any]] = None) -> Any:
+        status, body = await asyncio.wait_for(self._request(method, path, params),
+                                              self.timeout)
+        if status >= 400:
+            raise DockerEngineError(status, self._error_message(body))
+        return json.loads(body) if body else None
+
+    async def events(self, filters: Optional[Dict[str, Any]] = None
+                     ) -> AsyncIterator[Dict[str, Any]]:
+        """GET /events 事件流，逐个产出解码后的事件；连接断开时结束"""
+        params = {'filters': json.dumps(filters)} if filters else None
+        reader, writer, status, headers = await self._open('GET', '/events', params)
+        try:
+            if status >= 400:
+                body = await self._read_body(reader, headers)
+                raise DockerEngineError(status, self._error_message(body))
+            buffer = b''
+            async for chunk in self._iter_body(reader, headers):
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
+        finally:
+            writer.close()
+
+    async def _request(self, method: str, path: str,
+                       params: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        reader, writer, status, headers = await self._open(method, path, params)
+        try:
+            return status, await self._read_body(reader, headers)
+        finally:
+            writer.close()
+
+    async def _open(self, method: str, path: str, params: Optional[Dict[str, Any]]):
+        """建立连接并发送请求，读取状态行和响应头"""
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        try:
+            target = f"{path}?{urlencode(params)}" if params else path
+            writer.write(f"{method} {target} HTTP/1.1\r\n"
+                         "Host: docker\r\nConnection: close\r\n\r\n".encode())
+            await writer.drain()
+
+            status_line = await reader.readline()
+            parts = status_line.decode('latin-1').split(' ', 2)
+            if len(parts) < 2 or not parts[1].isdigit():
+                raise ConnectionError(f"无效的HTTP响应: {status_line!r}")
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            return reader, writer, int(parts[1]), headers
+        except BaseException:
+            writer.close()
+            raise
+
+    async def _read_body(self, reader: asyncio.StreamReader,
+                         headers: Dict[str, str]) -> bytes:
+        return b''.join([chunk async for chunk in self._iter_body(reader, headers)])
+
+    @staticmethod
+    async def _iter_body(reader: asyncio.StreamReader,
+                         headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        """按 Transfer-Encoding / Content-Length 读取响应体"""
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                size_line = await reader.readline()
+                if not size_line:
+                    return  # 连接在分块中途断开
+                size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                chunk = await reader.readexactly(size)
+                await reader.readline()  # 分块结尾的CRLF
+                yield chunk
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if length:
+                yield await reader.readexactly(length)
+        else:
+            while True:
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+
+    @staticmethod
+    def _error_message(body: bytes) -> str:
+        try:
+            return json.loads(body).get('message', '')
+        except (ValueError, AttributeError):
+            return body.decode('utf-8', 'replace').strip()
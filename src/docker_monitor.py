@@ -9,19 +9,53 @@ import subprocess
 import threading
 import time
 import json
-from typing import Dict, List, Any
+from functools import partial
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import metrics
+import tracing
+from apply_queue import ApplyQueue
+from async_monitor import AsyncEventEngine
+from inspect_cache import InspectCache
+from network_index import NetworkIndex
+from scan_snapshot import ScanSnapshot, container_fingerprint
+from timer_wheel import TimerWheel
+from rule_registry import RuleRegistry
 
 
 class DockerMonitor:
     """Docker容器监控器"""
-    
+
+    INSPECT_CACHE_SIZE = 1024  # 缓存的容器inspect结果数量上限
+    INSPECT_CACHE_MAX_AGE = 300  # inspect结果最长使用时间（秒），事件丢失时扫描最迟在此之后读到新状态
+    SCAN_INTERVAL = 60  # 周期扫描间隔（秒）
+    SERVICE_RECHECK_DELAY = 2        # Service容器启动后重新检查Service的延迟（秒）
+    SERVICE_RECHECK_MAX_DELAY = 30   # 持续有新容器启动时，重新检查最多推迟的时间（秒）
+    # 不改变容器配置、状态和网络的事件，不使inspect缓存失效
+    CACHE_NEUTRAL_ACTIONS = ('exec_', 'health_status', 'attach', 'top', 'resize',
+                             'export', 'commit', 'copy', 'archive-path',
+                             'extract-to-dir')
+
     def __init__(self, config, firewall_manager):
         self.config = config
         self.firewall_manager = firewall_manager
         self.logger = logging.getLogger(__name__)
         self.client = None
         self.monitor_thread = None
+        self.engine = None  # 异步事件引擎（event_engine: asyncio）
         self.running = False
+        # 所有规则变更由队列的应用线程执行（事件线程和扫描线程只提交意图）
+        self.apply_queue = ApplyQueue(firewall_manager, config.apply_coalesce_window)
+        self.inspect_cache = InspectCache(self.INSPECT_CACHE_SIZE,
+                                          self.INSPECT_CACHE_MAX_AGE)
+        # 延迟的Service重新检查（按Service去重）
+        self.timers = TimerWheel(name="service-timers")
+        # 与 FirewallManager（规则编译器）共用的网络索引
+        self.networks = getattr(firewall_manager, 'networks', None)
+        if self.networks is None:
+            self.networks = NetworkIndex(config)
+        # 上次成功处理时的指纹 (类型, 容器ID/Service名) -> 指纹；只在应用线程中读写
+        self._fingerprints: Dict[Tuple[str, str], str] = {}
         
     def start(self):
         """启动监控"""
@@ -29,23 +63,37 @@ class DockerMonitor:
             self.client = docker.DockerClient(base_url=self.config.docker_socket)
             self.client.ping()  # 测试连接
             self.logger.info("Docker连接成功")
-            
+
+            # 建立网络索引（之后由network事件维护）
+            self.networks.load(self.client)
+
+            self.apply_queue.start()
+            self.timers.start()
+
             # 处理现有容器
             self._process_existing_containers()
 
             # 处理现有Services
             self._process_existing_services()
 
-            # 启动事件监控线程
-            self.running = True
-            self.monitor_thread = threading.Thread(target=self._monitor_events)
-            self.monitor_thread.daemon = True
-            self.monitor_thread.start()
+            # 启动时等待现有容器的规则全部应用
+            self.apply_queue.wait_idle()
 
-            # 启动周期性扫描线程（兜底机制）
-            self.scan_thread = threading.Thread(target=self._periodic_scan)
-            self.scan_thread.daemon = True
-            self.scan_thread.start()
+            self.running = True
+            if self.config.event_engine == 'asyncio':
+                # 异步事件引擎：事件流、并发inspect和周期扫描定时器在一个事件循环中
+                self.engine = AsyncEventEngine(self, self.config.inspect_concurrency)
+                self.engine.start()
+            else:
+                # 启动事件监控线程
+                self.monitor_thread = threading.Thread(target=self._monitor_events)
+                self.monitor_thread.daemon = True
+                self.monitor_thread.start()
+
+                # 启动周期性扫描线程（兜底机制）
+                self.scan_thread = threading.Thread(target=self._periodic_scan)
+                self.scan_thread.daemon = True
+                self.scan_thread.start()
 
             self.logger.info("Docker监控已启动")
             
@@ -56,23 +104,52 @@ class DockerMonitor:
     def stop(self):
         """停止监控"""
         self.running = False
+        if self.engine:
+            self.engine.stop()
         if self.monitor_thread:
             self.monitor_thread.join(timeout=5)
         if hasattr(self, 'scan_thread') and self.scan_thread:
             self.scan_thread.join(timeout=5)
+        self.timers.stop()
+        self.apply_queue.stop()
         if self.client:
             self.client.close()
         self.logger.info("Docker监控已停止")
         
-    def _process_existing_containers(self):
-        """处理现有的运行中容器"""
+    def _process_existing_containers(self, snapshot: Optional[ScanSnapshot] = None):
+        """处理现有的运行中容器（有扫描快照时使用快照，不再列出容器）"""
         try:
-            containers = self.client.containers.list(all=False)  # 只获取运行中的容器
-            self.logger.info(f"发现 {len(containers)} 个运行中的容器")
-            
-            for container in containers:
-                self._handle_container_start(container.id)
-                
+            if snapshot is not None:
+                container_ids = [cid for cid in snapshot.containers
+                                 if cid in snapshot.running]
+            else:
+                # sparse：只需要容器ID，不让SDK为每个容器再做一次inspect（详细信息走inspect缓存）
+                # 只获取运行中的容器
+                containers = self.client.containers.list(all=False, sparse=True)
+                container_ids = [container.id for container in containers]
+            if snapshot is not None:
+                # 指纹与上次处理时相同：规则输入没有变化，跳过编译和应用；
+                # 列出容器之后事件路径已处理过的容器，快照中的信息比登记表旧，同样跳过
+                recent = self._changed_after_listing(snapshot)
+                changed = [cid for cid in container_ids
+                           if cid not in recent
+                           and self._fingerprints.get(("container", cid))
+                           != snapshot.container_fingerprint(cid)]
+                metrics.SCAN_TARGETS.inc(len(container_ids) - len(changed),
+                                         kind="container", result="unchanged")
+                metrics.SCAN_TARGETS.inc(len(changed), kind="container",
+                                         result="processed")
+                self.logger.info(f"发现 {len(container_ids)} 个运行中的容器，"
+                                 f"{len(changed)} 个有变化")
+                container_ids = changed
+            else:
+                self.logger.info(f"发现 {len(container_ids)} 个运行中的容器")
+
+            for container_id in container_ids:
+                # 不覆盖尚未执行的事件意图（事件比扫描结果更新）
+                self._submit_container(container_id, start=True, replace=False,
+                                       snapshot=snapshot)
+
         except Exception as e:
             self.logger.error(f"处理现有容器失败: {e}")
             
@@ -84,34 +161,11 @@ class DockerMonitor:
             for event in self.client.events(decode=True):
                 if not self.running:
                     break
-                    
-                if event.get('Type') == 'container':
-                    action = event.get('Action')
-                    # 尝试多种方式获取ID
-                    container_id = event.get('id') or event.get('Actor', {}).get('ID')
-
-                    if not container_id:
-                        self.logger.debug(f"收到无ID的容器事件: {action} (忽略)")
-                        continue
-
-                    if action == 'start':
-                        self.logger.debug(f"容器启动事件: {container_id}")
-                        self._handle_container_start(container_id)
-                    elif action in ['stop', 'die', 'kill']:
-                        self.logger.debug(f"容器停止事件: {container_id}")
-                        self._handle_container_stop(container_id)
 
-                elif event.get('Type') == 'service':
-                    action = event.get('Action')
-                    service_id = event.get('id') or event.get('Actor', {}).get('ID')
+                received = time.monotonic()
+                self._note_event(event)
+                self._submit_event(event, received)
 
-                    if not service_id:
-                        continue
-
-                    if action == 'remove':
-                        self.logger.debug(f"Service删除事件: {service_id}")
-                        self._handle_service_remove(service_id)
-                        
         except Exception as e:
             if self.running:
                 self.logger.error(f"监控Docker事件失败: {e}")
@@ -120,42 +174,228 @@ class DockerMonitor:
                     self.client.close()
                     self.client = docker.DockerClient(base_url=self.config.docker_socket)
                     self.client.ping()
+                    self._after_reconnect()
+                    metrics.DOCKER_RECONNECTS.inc(result="success")
                     self.logger.info("Docker重新连接成功")
                 except Exception as reconnect_error:
+                    metrics.DOCKER_RECONNECTS.inc(result="failure")
                     self.logger.error(f"Docker重新连接失败: {reconnect_error}")
 
                 time.sleep(5)
                 if self.running:
                     self._monitor_events()
 
+    @staticmethod
+    def _event_container_id(event: Dict[str, Any]) -> Optional[str]:
+        """容器事件的容器ID（尝试多种方式获取）"""
+        return event.get('id') or event.get('Actor', {}).get('ID')
+
+    def _note_event(self, event: Dict[str, Any]):
+        """按事件使inspect缓存失效、更新网络索引（按事件到达顺序立即执行）"""
+        if event.get('Type') == 'container':
+            container_id = self._event_container_id(event)
+            action = event.get('Action') or ''
+            if container_id and not action.startswith(self.CACHE_NEUTRAL_ACTIONS):
+                self.inspect_cache.invalidate(container_id)
+
+        elif event.get('Type') == 'network':
+            if self.networks.handle_event(event):
+                return
+
+            # 容器连接/断开网络：其网络配置（地址）变化
+            container_id = event.get('Actor', {}).get('Attributes', {}).get('container')
+            if container_id:
+                self.inspect_cache.invalidate(container_id)
+
+    def _submit_event(self, event: Dict[str, Any], received: float):
+        """提交事件对应的规则变更意图"""
+        if event.get('Type') == 'container':
+            action = event.get('Action')
+            container_id = self._event_container_id(event)
+
+            if not container_id:
+                self.logger.debug(f"收到无ID的容器事件: {action} (忽略)")
+                return
+
+            if action == 'start':
+                self.logger.debug(f"容器启动事件: {container_id}")
+                self._submit_container(container_id, start=True, received=received)
+            elif action in ['stop', 'die', 'kill']:
+                self.logger.debug(f"容器停止事件: {container_id}")
+                self._submit_container(container_id, start=False, received=received)
+
+        elif event.get('Type') == 'service':
+            action = event.get('Action')
+            service_id = event.get('id') or event.get('Actor', {}).get('ID')
+
+            if service_id and action == 'remove':
+                self.logger.debug(f"Service删除事件: {service_id}")
+                self.apply_queue.submit(("service-remove", service_id),
+                                        partial(self._handle_service_remove,
+                                                service_id),
+                                        received=received)
+
+    def _after_reconnect(self):
+        """断开期间的事件已丢失，缓存的inspect结果和网络索引不再可信"""
+        self.inspect_cache.clear()
+        self.networks.load(self.client)
+
     def _periodic_scan(self):
         """周期性扫描（兜底机制）- 每1分钟检查一次状态一致性"""
         import time
 
         while self.running:
             try:
-                time.sleep(60)  # 1分钟
+                time.sleep(self.SCAN_INTERVAL)
                 if not self.running:
                     break
 
                 self.logger.info("执行周期性扫描（兜底机制）- 检查容器和Service状态一致性")
-
-                # 清理不存在的容器和Service规则
-                self._cleanup_stale_rules()
-
-                # 重新扫描现有容器和Service
-                self._process_existing_containers()
-                self._process_existing_services()
+                self.scan_once()
 
             except Exception as e:
                 self.logger.error(f"周期性扫描失败: {e}")
                 time.sleep(60)  # 出错时等待1分钟再重试
 
-    def _handle_container_start(self, container_id: str):
-        """处理容器启动事件"""
+    def scan_once(self):
+        """执行一轮周期扫描，规则同步完成后返回"""
+        with metrics.SCAN_SECONDS.time():
+            # 刷新网络索引（兜底错过的network事件）
+            self.networks.load(self.client)
+
+            # 快照在扫描线程中获取，Docker API调用期间事件意图照常执行；
+            # 只有编译/应用阶段作为屏障在应用线程中执行
+            snapshot = self.take_snapshot()
+            if snapshot is None:
+                return
+            self.apply_queue.submit(("scan",), partial(self._scan_phases, snapshot),
+                                    barrier=True)
+            self.apply_queue.wait_idle()
+
+    def _scan_phases(self, snapshot: ScanSnapshot):
+        """把扫描快照交给各扫描阶段，最后对比期望规则与内核规则（在应用线程中执行）"""
+        # 清理不存在的容器和Service规则
+        self._cleanup_stale_rules(snapshot)
+
+        # 重新扫描现有容器和Service
+        self._process_existing_containers(snapshot)
+        self._process_existing_services(snapshot)
+
+        # 对比期望规则与内核规则，修复漂移（排在扫描提交的意图之后）
+        self.sync_rules()
+
+    def take_snapshot(self) -> Optional[ScanSnapshot]:
+        """一次 containers.list 加逐个容器的inspect（经缓存）得到扫描快照"""
+        listed_at = time.monotonic()
+        try:
+            containers = self.client.containers.list(all=True, sparse=True)
+        except Exception as e:
+            self.logger.error(f"获取容器列表失败: {e}")
+            return None
+
+        infos = {}
+        for container in containers:
+            info = self._get_container_info(container)
+            if info:
+                infos[container.id] = info
+        has_services = any('com.docker.swarm.service.name'
+                           in ((info.get('config') or {}).get('Labels') or {})
+                           for info in infos.values())
+        services = self._list_services() if has_services else []
+        versions = {service['Spec']['Name']: service.get('Version', {}).get('Index')
+                    for service in services}
+        service_infos = {service['Spec']['Name']: self._service_info(service)
+                         for service in services}
+        return ScanSnapshot([container.id for container in containers], infos,
+                            versions, self.networks.version, listed_at, service_infos)
+
+    def _list_services(self) -> List[Dict[str, Any]]:
+        """本集群的Service（一次API调用；非manager节点返回空，指纹只由容器决定）"""
+        try:
+            with tracing.span("docker services"):
+                return self.client.api.services()
+        except Exception as e:
+            self.logger.debug(f"获取Service列表失败（可能不是manager节点）: {e}")
+            return []
+
+    @staticmethod
+    def _service_info(service_data: Dict[str, Any]) -> Dict[str, Any]:
+        """由Service的inspect数据得到Service信息"""
+        return {
+            'id': service_data.get('ID'),
+            'name': service_data.get('Spec', {}).get('Name'),
+            'endpoint': service_data.get('Endpoint', {}),
+            'spec': service_data.get('Spec', {})
+        }
+
+    def _changed_after_listing(self, snapshot: ScanSnapshot) -> Set[str]:
+        """列出容器之后登记表中有规则变化的容器ID（在应用线程中调用）"""
+        if snapshot.listed_at is None:
+            return set()
+        registry = self.firewall_manager.registry
+        return {container_id for container_id in registry.container_ids()
+                if registry.changed_since(container_id, snapshot.listed_at)}
+
+    def _services_changed_after_listing(self, snapshot: ScanSnapshot) -> Set[str]:
+        """列出容器之后登记表中有规则变化的Service名"""
+        registry = self.firewall_manager.registry
+        return {rule.service_name
+                for container_id in self._changed_after_listing(snapshot)
+                for key in registry.keys_for_container(container_id)
+                if key[0] == RuleRegistry.SERVICE
+                for rule in registry.get(key)}
+
+    def _record_fingerprint(self, key: Tuple[str, str], fingerprint: str):
+        """规则变更提交成功后记录指纹（提交失败时不记录）"""
+        self.firewall_manager.after_commit(
+            partial(self._fingerprints.__setitem__, key, fingerprint))
+
+    def forget_fingerprints(self):
+        """下一轮扫描重新处理全部容器和Service（如配置重新加载后）
+
+        指纹只在应用线程中读写，这里（配置监控线程、信号处理）只提交清空意图。
+        """
+        self.apply_queue.submit(("fingerprints",), self._fingerprints.clear)
+
+    def _submit_container(self, container_id: str, start: bool, replace: bool = True,
+                          received: Optional[float] = None,
+                          snapshot: Optional[ScanSnapshot] = None):
+        """提交容器意图；同一容器未执行的意图只保留最后一个（start/die/start 合并为 start）
+
+        停止的容器在宽限期内保留规则（墓碑），期间重新启动会取消删除；
+        地址和端口不变时启动处理不产生任何规则变更。
+        """
+        key = ("container", container_id)
+        if start:
+            self.apply_queue.submit(key, partial(self._handle_container_start,
+                                                 container_id, snapshot),
+                                    replace=replace, received=received)
+            return
+
+        grace = self.config.container_stop_grace
+        stop = partial(self._handle_container_stop, container_id)
+        if grace > 0:
+            if not self.apply_queue.delayed(key):
+                self.logger.debug(f"容器 {container_id} 停止，规则保留 {grace} 秒")
+            self.apply_queue.submit_after(grace, key, stop)
+        else:
+            self.apply_queue.submit(key, stop, received=received)
+
+    def sync_rules(self, wait: bool = False):
+        """在应用线程中执行规则同步（排在已提交的意图之后）"""
+        self.apply_queue.request_sync()
+        if wait:
+            self.apply_queue.wait_idle()
+
+    def _handle_container_start(self, container_id: str,
+                                snapshot: Optional[ScanSnapshot] = None):
+        """处理容器启动事件（周期扫描传入扫描快照）"""
         try:
-            container = self.client.containers.get(container_id)
-            container_info = self._get_container_info(container)
+            container_info = None
+            if snapshot is not None:
+                container_info = snapshot.containers.get(container_id)
+            if container_info is None:
+                container_info = self._inspect_container(container_id)
             
             if container_info:
                 self.logger.info(f"处理容器启动: {container_info['name']}")
@@ -170,30 +410,37 @@ class DockerMonitor:
                 # 如果是Service容器，尝试从Service配置中获取自定义防火墙端口
                 # 优先使用容器自身的 labels（允许在非 manager 环境下工作）
                 if service_name and not port_info['custom_ports']:
-                    service_custom_ports = self._get_service_custom_ports(service_name)
+                    service_custom_ports = self._get_service_custom_ports(
+                        service_name, snapshot=snapshot)
                     if service_custom_ports:
                         port_info['custom_ports'] = service_custom_ports
                         self.logger.debug(f"从Service {service_name} 获取自定义端口: {service_custom_ports}")
 
+                applied = True  # 规则变更是否都已提交（或已排入当前事务）
                 if networks:
+                    # 宽限期内重启但地址已变化：墓碑中的旧地址规则不再有效
+                    self._drop_moved_container_rules(container_id, networks)
+
                     # 处理Public端口（容器级别的端口映射）
                     if port_info['public_ports']:
-                        self.firewall_manager.add_container_public_rules(
+                        if not self.firewall_manager.add_container_public_rules(
                             container_id,
                             container_info['name'],
                             port_info['public_ports'],
                             networks
-                        )
+                        ):
+                            applied = False
 
                     # 处理自定义防火墙端口
                     # FIX: 如果是Service容器，跳过此处处理，交由 Service 逻辑处理 (避免重复规则)
                     if port_info['custom_ports'] and not service_name:
-                        self.firewall_manager.add_custom_firewall_rules(
+                        if not self.firewall_manager.add_custom_firewall_rules(
                             container_id,
                             container_info['name'],
                             port_info['custom_ports'],
                             networks
-                        )
+                        ):
+                            applied = False
                         self.logger.info(f"为容器 {container_info['name']} 处理自定义防火墙端口")
 
                     if not any([port_info['public_ports'], port_info['custom_ports']]):
@@ -201,15 +448,35 @@ class DockerMonitor:
                 else:
                     self.logger.debug(f"容器 {container_info['name']} 无监控网络")
 
-                # 检查是否是Service容器，如果是则触发Service处理
-                self._check_and_handle_service_container(container_info)
+                # 事件启动的Service容器：延迟重新检查Service（周期扫描自己处理Service）
+                if snapshot is None:
+                    self._check_and_handle_service_container(container_info)
+
+                # 规则变更生效后才记录指纹：提交失败时下一轮扫描重新处理该容器
+                if applied:
+                    if snapshot is not None:
+                        salt = snapshot.salt
+                    else:
+                        salt = self.networks.version
+                    fingerprint = container_fingerprint(container_info, salt)
+                    self._record_fingerprint(("container", container_id), fingerprint)
 
         except Exception as e:
             self.logger.error(f"处理容器启动事件失败 {container_id}: {e}")
             
+    def _drop_moved_container_rules(self, container_id: str, networks: Dict[str, Any]):
+        """容器规则中的地址不再属于容器时删除这些规则（随后按新地址重新添加）"""
+        addresses = {info.get('GlobalIPv6Address') for info in networks.values()}
+        registry = self.firewall_manager.registry
+        rules = registry.get((RuleRegistry.CONTAINER, container_id))
+        if any(rule.ipv6_address not in addresses for rule in rules):
+            self.logger.info(f"容器 {container_id} 地址变化，移除旧地址规则")
+            self.firewall_manager.remove_container_rules(container_id)
+
     def _handle_container_stop(self, container_id: str):
         """处理容器停止事件"""
         try:
+            self._fingerprints.pop(("container", container_id), None)
             self.firewall_manager.remove_container_rules(container_id)
             self.logger.debug(f"处理容器停止: {container_id}")
             
@@ -220,118 +487,138 @@ class DockerMonitor:
         """处理Service删除事件"""
         try:
             self.logger.info(f"处理Service删除事件: {service_id}")
+            # 事件只有Service ID：全部Service在下一轮扫描中重新处理（应用线程中执行）
+            for key in [key for key in self._fingerprints if key[0] == "service"]:
+                del self._fingerprints[key]
             self.firewall_manager.remove_service_rules(service_id)
         except Exception as e:
             self.logger.error(f"处理Service删除事件失败 {service_id}: {e}")
 
     def _check_and_handle_service_container(self, container_info: Dict[str, Any]):
-        """检查容器是否属于Service，如果是则处理对应的Service"""
+        """检查容器是否属于Service，如果是则延迟处理对应的Service"""
         try:
             # 检查容器是否有Service标签
-            labels = container_info.get('labels', {})
+            labels = container_info.get('config', {}).get('Labels', {}) or {}
             service_name = labels.get('com.docker.swarm.service.name')
 
             if service_name:
                 self.logger.debug(f"检测到Service容器: {container_info['name']} 属于Service: {service_name}")
-
-                # 延迟一点时间确保容器完全启动
-                import time
-                time.sleep(2)
-
-                # 触发Service处理
-                self._handle_service_update(service_name)
+                self._schedule_service_update(service_name)
 
         except Exception as e:
             self.logger.error(f"检查Service容器失败: {e}")
 
-    def _cleanup_stale_rules(self):
+    def _schedule_service_update(self, service_name: str):
+        """延迟重新检查Service（确保容器完全启动）
+
+        每个Service最多一个待执行的检查，新的任务容器启动会推迟它：滚动更新期间
+        只在最后一个副本启动后检查一次（最长推迟 SERVICE_RECHECK_MAX_DELAY 秒）。
+        到期后向变更队列提交意图，由应用线程执行，不阻塞事件处理。
+        """
+        key = ("service", service_name)
+        action = partial(self._handle_service_update, service_name)
+        self.timers.schedule(key, self.SERVICE_RECHECK_DELAY,
+                             partial(self.apply_queue.submit, key, action),
+                             max_delay=self.SERVICE_RECHECK_MAX_DELAY)
+
+    def _cleanup_stale_rules(self, snapshot: Optional[ScanSnapshot] = None):
         """清理不存在的容器和Service的陈旧规则"""
         try:
             # 获取当前存在的容器ID
-            existing_containers = set()
-            for container in self.client.containers.list(all=True):
-                existing_containers.add(container.id)
+            if snapshot is not None:
+                existing_containers = set(snapshot.container_ids)
+            else:
+                containers = self.client.containers.list(all=True, sparse=True)
+                existing_containers = {container.id for container in containers}
+
+            registry = self.firewall_manager.registry
+            stale_container_ids = registry.container_ids() - existing_containers
+            if snapshot is not None:
+                # 列出容器之后才登记的是快照之后启动的容器，留给下一轮扫描判断
+                stale_container_ids -= self._changed_after_listing(snapshot)
 
             # 1. 清理不存在的容器规则
-            stale_container_ids = []
-            for container_id in self.firewall_manager.active_rules.keys():
-                if container_id not in existing_containers:
-                    stale_container_ids.append(container_id)
-
             for container_id in stale_container_ids:
-                self.logger.info(f"清理陈旧容器规则: {container_id}")
-                self.firewall_manager.remove_container_rules(container_id)
+                self._fingerprints.pop(("container", container_id), None)
+                if (RuleRegistry.CONTAINER, container_id) in registry:
+                    self.logger.info(f"清理陈旧容器规则: {container_id}")
+                    self.firewall_manager.remove_container_rules(container_id)
 
             # 2. 清理陈旧的Service规则
             # 逻辑：检查Service规则关联的容器是否存在于本节点
             # 这比检查 service exists globally 更准确，且不依赖 Manager 权限
-            services_to_remove = []
-            services_to_update = {}  # service_id -> valid_rules
-
-            for service_id, rules in self.firewall_manager.active_service_rules.items():
-                valid_rules = []
-                has_changes = False
-                
-                for rule in rules:
-                    if rule.container_id in existing_containers:
-                        valid_rules.append(rule)
-                    else:
-                        has_changes = True
-
-                if not valid_rules:
-                    services_to_remove.append(service_id)
-                elif has_changes:
-                    services_to_update[service_id] = valid_rules
-
-            # 执行删除
-            for service_id in services_to_remove:
-                self.logger.info(f"清理陈旧Service所有规则 (容器已全部消失): {service_id}")
-                self.firewall_manager.remove_service_rules(service_id)
-
-            # 执行更新
-            for service_id, valid_rules in services_to_update.items():
-                self.logger.info(f"更新Service规则 (清理部分消失的容器): {service_id}, 剩余规则数: {len(valid_rules)}")
-                
-                # 移除旧的 invalid rules
-                old_rules = self.firewall_manager.active_service_rules[service_id]
-                for rule in old_rules:
-                    if rule not in valid_rules:
-                        try:
-                            # 尝试使用内部方法移除单条规则
-                            if hasattr(self.firewall_manager, '_remove_service_rule'):
-                                self.firewall_manager._remove_service_rule(rule)
-                        except Exception as e:
-                            self.logger.error(f"移除单条陈旧Service规则失败: {e}")
-
-                # 更新内存状态
-                self.firewall_manager.active_service_rules[service_id] = valid_rules
+            # 通过按容器ID的索引只访问涉及已消失容器的记录
+            stale_keys = set()
+            for container_id in stale_container_ids:
+                stale_keys.update(key
+                                  for key in registry.keys_for_container(container_id)
+                                  if key[0] in RuleRegistry.SERVICE_KINDS)
+
+            for record_key in stale_keys:
+                service_id = RuleRegistry.id_for_key(record_key)
+                removed = self.firewall_manager.prune_service_rules(service_id,
+                                                                    stale_container_ids)
+                remaining = len(registry.get(record_key))
+                if remaining:
+                    self.logger.info(f"更新Service规则 (清理部分消失的容器): {service_id}, "
+                                     f"剩余规则数: {remaining}")
+                elif removed:
+                    self.logger.info(f"清理陈旧Service所有规则 (容器已全部消失): {service_id}")
 
         except Exception as e:
             self.logger.error(f"清理陈旧规则失败: {e}")
 
     def _get_container_info(self, container) -> Dict[str, Any]:
         """获取容器详细信息"""
+        return self._inspect_container(container.id, container)
+
+    def _inspect_container(self, container_id: str,
+                           container=None) -> Optional[Dict[str, Any]]:
+        """按容器ID获取容器详细信息：命中缓存时不访问Docker API，否则只做一次inspect
+
+        返回的字典可能被缓存共享，调用方不得修改。
+        """
+        cached = self.inspect_cache.get(container_id)
+        if cached is not None:
+            metrics.INSPECT_CACHE.inc(result="hit")
+            return cached
+        metrics.INSPECT_CACHE.inc(result="miss")
+
+        token = self.inspect_cache.token(container_id)
         try:
-            # 重新获取最新的容器信息
-            container.reload()
-            
-            # 获取inspect信息
-            inspect_data = self.client.api.inspect_container(container.id)
-            
-            return {
-                'id': container.id,
-                'name': container.name,
-                'status': container.status,
-                'config': inspect_data.get('Config', {}),
-                'host_config': inspect_data.get('HostConfig', {}),
-                'network_settings': inspect_data.get('NetworkSettings', {}),
-                'networks': inspect_data.get('NetworkSettings', {}).get('Networks', {})
-            }
-            
+            with tracing.span("docker inspect_container",
+                              container_id=container_id[:12]):
+                inspect_data = self.client.api.inspect_container(container_id)
+            info = self._container_info(container_id, inspect_data, container)
+
         except Exception as e:
-            self.logger.error(f"获取容器信息失败 {container.id}: {e}")
+            self.logger.error(f"获取容器信息失败 {container_id}: {e}")
             return None
+
+        self.inspect_cache.put(container_id, info, token)
+        return info
+
+    @staticmethod
+    def _container_info(container_id: str, inspect_data: Dict[str, Any],
+                        container=None) -> Dict[str, Any]:
+        """由inspect结果构造容器信息"""
+        state = inspect_data.get('State') or {}
+        if isinstance(state, dict) and state.get('Status'):
+            status = state.get('Status')
+        else:
+            status = getattr(container, 'status', None)
+        return {
+            'id': container_id,
+            'name': ((inspect_data.get('Name') or '').lstrip('/')
+                     or getattr(container, 'name', '')),
+            'status': status,
+            'config': inspect_data.get('Config', {}),
+            'host_config': inspect_data.get('HostConfig', {}),
+            'network_settings': inspect_data.get('NetworkSettings', {}),
+            'networks': inspect_data.get('NetworkSettings', {}).get('Networks', {})
+        }
             
+    @tracing.traced("extract_container_ports")
     def _extract_container_ports(self, container_info: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
         """提取容器端口信息，智能分类处理不同网络模式"""
         result = {
@@ -484,7 +771,10 @@ class DockerMonitor:
 
         return custom_ports
 
-    def _get_service_custom_ports(self, service_name: str) -> List[Dict[str, Any]]:
+    @tracing.traced("get_service_custom_ports")
+    def _get_service_custom_ports(self, service_name: str,
+                                  snapshot: Optional[ScanSnapshot] = None
+                                  ) -> List[Dict[str, Any]]:
         """从Service配置中获取自定义防火墙端口
         最小降级策略：
         1) 优先从本节点属于该service的容器 labels 中读取 docker-ipv6-firewall.ports
@@ -493,14 +783,8 @@ class DockerMonitor:
         try:
             # 1) 优先从本节点容器读取 labels（不需要 manager 权限）
             try:
-                service_containers = self.client.containers.list(
-                    filters={'label': f'com.docker.swarm.service.name={service_name}'}
-                )
                 collected = []
-                for container in service_containers:
-                    info = self._get_container_info(container)
-                    if not info:
-                        continue
+                for _, info in self._service_container_infos(service_name, snapshot):
                     labels = info.get('config', {}).get('Labels', {}) or {}
                     ports_cfg = labels.get('docker-ipv6-firewall.ports', '')
                     if ports_cfg:
@@ -517,10 +801,10 @@ class DockerMonitor:
                 self.logger.debug(f"尝试从本地容器 labels 获取自定义端口失败: {e}")
 
             # 2) 回退到 docker service inspect（可能需要 manager 权限）
-            result = subprocess.run(
-                ['docker', 'service', 'inspect', service_name, '--format', '{{ json .Spec.TaskTemplate.ContainerSpec.Labels }}'],
-                capture_output=True, text=True, timeout=10
-            )
+            cmd = ['docker', 'service', 'inspect', service_name,
+                   '--format', '{{ json .Spec.TaskTemplate.ContainerSpec.Labels }}']
+            with metrics.backend_call(cmd):
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
 
             if result.returncode != 0:
                 self.logger.warning(f"无法获取Service {service_name} 配置 via `docker service inspect`: {result.stderr.strip()}")
@@ -536,27 +820,49 @@ class DockerMonitor:
             self.logger.error(f"获取Service {service_name} 自定义端口失败: {e}")
             return []
 
-    def _process_existing_services(self):
+    def _process_existing_services(self, snapshot: Optional[ScanSnapshot] = None):
         """处理现有的Services"""
         try:
             # 获取本节点的Services
-            local_services = self._get_local_services()
+            local_services = self._get_local_services(snapshot)
             self.logger.info(f"周期性扫描: 发现 {len(local_services)} 个本节点的Services，检查配置变化")
+            recent = set()
+            if snapshot is not None:
+                # 列出容器之后事件路径已更新过的Service，留给下一轮扫描处理
+                recent = self._services_changed_after_listing(snapshot)
 
             for service_name in local_services:
-                self._handle_service_update(service_name)
+                if service_name in recent:
+                    continue
+                if snapshot is not None:
+                    fingerprint = snapshot.service_fingerprint(service_name)
+                    if self._fingerprints.get(("service", service_name)) == fingerprint:
+                        metrics.SCAN_TARGETS.inc(kind="service", result="unchanged")
+                        continue
+                    metrics.SCAN_TARGETS.inc(kind="service", result="processed")
+                    action = partial(self._handle_scanned_service, service_name,
+                                     snapshot, fingerprint)
+                else:
+                    action = partial(self._handle_service_update, service_name)
+                self.apply_queue.submit(("service", service_name), action,
+                                        replace=False)
 
         except Exception as e:
             self.logger.error(f"处理现有Services失败: {e}")
 
-    def _get_local_services(self) -> List[str]:
+    def _get_local_services(self, snapshot: Optional[ScanSnapshot] = None) -> List[str]:
         """获取本节点的Services
         改进：不再解析容器名，优先从容器 labels 中读取 com.docker.swarm.service.name
         （避免 service 名含 '.' 导致解析错误）
         """
+        if snapshot is not None:
+            return snapshot.service_names()
+
         service_names = []
         try:
-            containers = self.client.containers.list(filters={'label': 'com.docker.swarm.service.name'}, all=True)
+            containers = self.client.containers.list(
+                filters={'label': 'com.docker.swarm.service.name'}, all=True,
+                sparse=True)
             for c in containers:
                 info = self._get_container_info(c)
                 if not info:
@@ -570,25 +876,38 @@ class DockerMonitor:
             self.logger.error(f"获取本节点Services失败: {e}")
             return []
 
-    def _handle_service_update(self, service_name: str):
-        """处理Service更新"""
+    def _handle_scanned_service(self, service_name: str, snapshot: ScanSnapshot,
+                                fingerprint: str):
+        """周期扫描中处理有变化的Service，规则变更提交成功后记录指纹"""
+        if self._handle_service_update(service_name, snapshot):
+            self._record_fingerprint(("service", service_name), fingerprint)
+
+    def _handle_service_update(self, service_name: str,
+                               snapshot: Optional[ScanSnapshot] = None) -> bool:
+        """处理Service更新（周期扫描传入扫描快照，各步骤不再各自列出和inspect容器）
+
+        返回是否处理完成（包括无需规则的情况，规则提交失败时为False）；
+        事件路径的处理使该Service的指纹失效。
+        """
+        if snapshot is None:
+            self._fingerprints.pop(("service", service_name), None)
         try:
             # 获取Service详细信息
-            service_info = self._get_service_info(service_name)
+            service_info = self._get_service_info(service_name, snapshot)
             if not service_info:
-                return
+                return False
 
             # 获取Service的端口配置
-            service_ports = self._extract_service_ports(service_info)
+            service_ports = self._extract_service_ports(service_info, snapshot)
             if not service_ports:
                 self.logger.debug(f"Service {service_name} 没有发布端口（或无法获取published ports）")
-                return
+                return True
 
             # 获取Service对应的本节点容器
-            service_containers = self._get_service_containers(service_name)
+            service_containers = self._get_service_containers(service_name, snapshot)
             if not service_containers:
                 self.logger.debug(f"Service {service_name} 在本节点没有容器")
-                return
+                return True
 
             self.logger.info(f"检查Service: {service_name}, 端口: {len(service_ports)}, 容器: {len(service_containers)}")
 
@@ -599,7 +918,7 @@ class DockerMonitor:
             self.logger.debug(f"Service {service_name} 端口映射: {', '.join(port_details)}")
 
             # 添加Service规则
-            self.firewall_manager.add_service_rules(
+            return self.firewall_manager.add_service_rules(
                 service_info.get('id', service_name),
                 service_name,
                 service_ports,
@@ -608,24 +927,26 @@ class DockerMonitor:
 
         except Exception as e:
             self.logger.error(f"处理Service {service_name} 失败: {e}")
+            return False
 
-    def _get_service_info(self, service_name: str) -> Dict[str, Any]:
+    def _get_service_info(self, service_name: str,
+                          snapshot: Optional[ScanSnapshot] = None) -> Dict[str, Any]:
         """获取Service详细信息
         降级策略：优先通过 docker service inspect 获取（最完整），失败时从本地容器 labels 中组合一个最小信息结构。
         """
+        if snapshot is not None and service_name in snapshot.service_infos:
+            # 扫描线程列出Service时已获取，应用线程中不再执行 docker service inspect
+            return snapshot.service_infos[service_name]
+
         try:
-            result = subprocess.run([
-                'docker', 'service', 'inspect', service_name
-            ], capture_output=True, text=True, check=True, timeout=10)
+            cmd = ['docker', 'service', 'inspect', service_name]
+            with metrics.backend_call(cmd):
+                result = subprocess.run(cmd, capture_output=True, text=True, check=True,
+                                        timeout=10)
 
             service_data = json.loads(result.stdout)[0]
 
-            return {
-                'id': service_data.get('ID'),
-                'name': service_data.get('Spec', {}).get('Name'),
-                'endpoint': service_data.get('Endpoint', {}),
-                'spec': service_data.get('Spec', {})
-            }
+            return self._service_info(service_data)
 
         except subprocess.CalledProcessError as e:
             # 可能是权限不足或非 manager 节点
@@ -635,14 +956,13 @@ class DockerMonitor:
 
         # 回退方案：从本节点容器的 labels 获取 service id/name，返回最小信息结构
         try:
-            service_containers = self.client.containers.list(filters={'label': f'com.docker.swarm.service.name={service_name}'})
+            service_containers = self._service_container_infos(service_name, snapshot)
             if not service_containers:
                 self.logger.debug(f"无法通过本地容器找到 service {service_name} 的实例")
                 return None
 
             # 选第一个容器作为代表，尝试从 labels 中读取 service id/name
-            container = service_containers[0]
-            info = self._get_container_info(container)
+            _, info = service_containers[0]
             labels = info.get('config', {}).get('Labels', {}) or {}
             derived_id = labels.get('com.docker.swarm.service.id') or labels.get('com.docker.swarm.service.name') or service_name
 
@@ -658,7 +978,9 @@ class DockerMonitor:
             self.logger.error(f"从本地容器回退获取 service 信息失败: {e}")
             return None
 
-    def _extract_service_ports(self, service_info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def _extract_service_ports(self, service_info: Dict[str, Any],
+                               snapshot: Optional[ScanSnapshot] = None
+                               ) -> List[Dict[str, Any]]:
         """提取Service端口配置
         如果无法通过 service inspect 获取 Endpoint.Ports（PublishedPort），
         则回退到从本节点容器推导出端口映射（尽量保证 core 功能）
@@ -687,9 +1009,11 @@ class DockerMonitor:
                 return ports
 
             # 回退：从本节点容器推导端口映射（不会包含集群 routing-mesh 的 published_port）
-            derived = self._derive_service_ports_from_containers(service_info.get('name'))
+            derived = self._derive_service_ports_from_containers(
+                service_info.get('name'), snapshot)
             if derived:
-                self.logger.info(f"已从本节点容器推导出 Service {service_info.get('name')} 的端口映射（回退模式）: {derived}")
+                self.logger.info(f"已从本节点容器推导出 Service {service_info.get('name')} "
+                                 f"的端口映射（回退模式）: {derived}")
                 return derived
 
         except Exception as e:
@@ -697,7 +1021,9 @@ class DockerMonitor:
 
         return ports
 
-    def _derive_service_ports_from_containers(self, service_name: str) -> List[Dict[str, Any]]:
+    def _derive_service_ports_from_containers(self, service_name: str,
+                                              snapshot: Optional[ScanSnapshot] = None
+                                              ) -> List[Dict[str, Any]]:
         """从本节点属于该 service 的容器推导出端口信息（回退方案）
         逻辑：
          - 针对每个容器，读取 HostConfig.PortBindings 与 NetworkSettings.Ports
@@ -710,9 +1036,11 @@ class DockerMonitor:
         signatures = set()
         try:
             # 1. 首先尝试获取自定义端口 (Exclusive Mode check)
-            custom_ports = self._get_service_custom_ports(service_name)
+            custom_ports = self._get_service_custom_ports(service_name,
+                                                          snapshot=snapshot)
             if custom_ports:
-                self.logger.info(f"Service {service_name} 使用自定义端口配置 (Exclusive Mode)，忽略原生容器端口: {custom_ports}")
+                self.logger.info(f"Service {service_name} 使用自定义端口配置 (Exclusive Mode)，"
+                                 f"忽略原生容器端口: {custom_ports}")
                 # 转换格式以匹配 derived_ports 的结构 (如果 needed, 但 _extract_service_ports 会直接处理 custom_ports return)
                 # 实际上 _extract_service_ports 调用此时，期望返回 List[Dict] compatible with standard port objects
                 # custom_ports from _get_service_custom_ports returns: 
@@ -731,11 +1059,7 @@ class DockerMonitor:
                 return derived_ports
 
             # 2. 如果没有自定义端口，则扫描容器原生端口
-            service_containers = self.client.containers.list(filters={'label': f'com.docker.swarm.service.name={service_name}'})
-            for container in service_containers:
-                info = self._get_container_info(container)
-                if not info:
-                    continue
+            for _, info in self._service_container_infos(service_name, snapshot):
 
                 host_config = info.get('host_config', {}) or {}
                 network_settings = info.get('network_settings', {}) or {}
@@ -814,18 +1138,16 @@ class DockerMonitor:
             self.logger.error(f"从容器推导 service 端口失败: {e}")
             return []
 
-    def _get_service_containers(self, service_name: str) -> List[Dict[str, Any]]:
+    def _get_service_containers(self, service_name: str,
+                                snapshot: Optional[ScanSnapshot] = None
+                                ) -> List[Dict[str, Any]]:
         """获取Service对应的本节点容器"""
         containers = []
 
         try:
             # 获取属于该Service的本节点容器
-            service_containers = self.client.containers.list(
-                filters={'label': f'com.docker.swarm.service.name={service_name}'}
-            )
-
-            for container in service_containers:
-                container_info = self._get_container_info(container)
+            infos = self._service_container_infos(service_name, snapshot)
+            for container_id, container_info in infos:
                 if container_info:
                     # 提取容器的IPv6地址
                     networks = container_info.get('networks', {})
@@ -833,8 +1155,8 @@ class DockerMonitor:
                         ipv6_address = network_info.get('GlobalIPv6Address')
                         if ipv6_address and self._should_monitor_network(network_name):
                             containers.append({
-                                'container_id': container.id,
-                                'container_name': container.name,
+                                'container_id': container_id,
+                                'container_name': container_info['name'],
                                 'ipv6_address': ipv6_address,
                                 'network': network_name
                             })
@@ -845,12 +1167,29 @@ class DockerMonitor:
 
         return containers
 
+    def _service_container_infos(self, service_name: str,
+                                 snapshot: Optional[ScanSnapshot] = None
+                                 ) -> List[Tuple[str, Dict[str, Any]]]:
+        """本节点属于该Service的运行中容器 (容器ID, 容器信息)；有扫描快照时不访问Docker API"""
+        if snapshot is not None:
+            return snapshot.service_containers(service_name)
+        infos = []
+        for container in self.client.containers.list(
+                filters={'label': f'com.docker.swarm.service.name={service_name}'},
+                sparse=True):
+            info = self._get_container_info(container)
+            if info:
+                infos.append((container.id, info))
+        return infos
+
     def _should_monitor_network(self, network_name: str) -> bool:
-        """检查是否应该监控该网络"""
-        # 检查网络类型是否在监控列表中
-        try:
-            network = self.client.networks.get(network_name)
-            network_driver = network.attrs.get('Driver', '')
-            return network_driver in self.config.monitored_networks
-        except Exception:
-            return False
+        """检查是否应该监控该网络（网络索引查找，与规则编译器的判断一致）"""
+        if self.networks.loaded and self.networks.driver(network_name) is None:
+            # 索引中没有的网络（如错过了create事件）：查询一次并加入索引
+            try:
+                with tracing.span("docker networks.get", network=network_name):
+                    network = self.client.networks.get(network_name)
+                self.networks.set(network_name, network.attrs.get('Driver', ''))
+            except Exception as e:
+                self.logger.debug(f"查询网络 {network_name} 失败: {e}")
+        return self.networks.is_monitored(network_name)
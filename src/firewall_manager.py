@@ -6,101 +6,371 @@
 import subprocess
 import logging
 import re
-from typing import List, Dict, Set, Tuple
-from dataclasses import dataclass
-
-
-@dataclass
-class FirewallRule:
-    """容器防火墙规则"""
-    container_id: str
-    container_name: str
-    protocol: str
-    port: int
-    ipv6_address: str
-    interface_in: str
-    interface_out: str
-
-    def __str__(self):
-        return f"{self.container_name}:{self.protocol}/{self.port} -> {self.ipv6_address}"
-
-
-@dataclass
-class ServiceRule:
-    """Service防火墙和NAT规则"""
-    service_id: str
-    service_name: str
-    container_id: str
-    container_name: str
-    protocol: str
-    published_port: int  # 外部发布端口
-    target_port: int     # 容器内部端口
-    container_ipv6: str  # 容器IPv6地址
-    interface_in: str    # 入接口
-    interface_out: str   # 出接口
-
-    def __str__(self):
-        return f"{self.service_name}:{self.protocol}/{self.published_port}->{self.target_port} -> {self.container_ipv6}"
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Set, Tuple, Optional
+
+import metrics
+from rule_backend import RuleApplier, RuleTransaction, split_rule
+from nft_backend import NftablesBackend
+from ipset_backend import IpsetBackend
+from ruleset import Ruleset, rule_comment, rule_key, rule_owner
+from rule_registry import FirewallRule, ServiceRule, RuleRegistry, RegistryView
+from rule_compiler import RuleCompiler
+from network_index import NetworkIndex
 
 
 class FirewallManager:
     """IPv6防火墙管理器"""
-    
+
+    ISO_CHAIN_NAME = "DOCKER_IPV6FW_ISO"  # 容器隔离链（保留用户豁免规则）
+    SUBCHAIN_PREFIX = RuleCompiler.SUBCHAIN_PREFIX  # 容器子链前缀（forward_mode: subchain）
+
     def __init__(self, config):
         self.config = config
         self.logger = logging.getLogger(__name__)
-        self.active_rules: Dict[str, List[FirewallRule]] = {}
-        self.active_service_rules: Dict[str, List[ServiceRule]] = {}  # Service规则
+        # Docker网络索引（由 DockerMonitor 维护），规则编译时判断网络是否受监控
+        self.networks = NetworkIndex(config)
+        # 无副作用的规则编译器：规则对象和iptables参数的构建都在编译器中完成
+        self.compiler = RuleCompiler(config, self.networks)
+        # 规则登记表；active_rules / active_service_rules 为按旧接口（ID -> 规则列表）访问的视图
+        self.registry = RuleRegistry()
+        self.active_rules = RegistryView(self.registry, (RuleRegistry.CONTAINER,))
+        # Service规则
+        self.active_service_rules = RegistryView(self.registry,
+                                                 RuleRegistry.SERVICE_KINDS)
         self.ipv6_base_rules: List[List[str]] = []  # 记录IPv6基础规则
-        
+        self._transaction: Optional[RuleTransaction] = None  # 当前批量提交事务
+        self._after_commit: List[Callable[[], None]] = []  # 当前事务提交成功后执行的回调
+        self._rulesets: Dict[str, Ruleset] = {}  # iptables命令 -> 规则快照
+
+        # 常驻restore进程（rule_applier: persistent），批量变更以流的方式写入
+        self.applier: Optional[RuleApplier] = None
+        if self.config.rule_applier == "persistent":
+            self.applier = RuleApplier(on_failure=self._applier_failed)
+        # 发现之前提交的变更事后失败时调用（由 ApplyQueue 设置为提交规则同步）
+        self.resync_hook: Optional[Callable[[], None]] = None
+
+        # nftables规则引擎（firewall_backend: nftables 时启用，容器/Service规则改为集合元素）
+        self.nft: Optional[NftablesBackend] = None
+        if self.config.firewall_backend == "nftables":
+            self.nft = NftablesBackend(config)
+
+        # ipset模式（iptables引擎下 forward_mode: ipset 时启用，容器端口放入按协议的集合）
+        self.ipset: Optional[IpsetBackend] = None
+        if self.nft is None and self.config.forward_mode == "ipset":
+            self.ipset = IpsetBackend(config)
+
+        # 子链模式（iptables引擎下 forward_mode: subchain 时启用，每个容器地址一条子链）
+        self.subchains = self.nft is None and self.config.forward_mode == "subchain"
+
     def initialize(self):
         """初始化防火墙链"""
         self.logger.info("初始化防火墙链")
 
-        # 确保所有专用链存在并被正确引用
-        self._ensure_all_chains_exist()
-
-        # 清空所有链中的规则（重要：确保干净的状态）
-        self._flush_all_chains()
+        # 启动时重新读取规则快照
+        self.invalidate_rulesets()
 
-        # 设置基础规则
-        self._ensure_base_rules()  # FORWARD链的DNAT conntrack规则
-        self._setup_base_rules()   # INPUT链的IPv6基础协议和容器隔离规则
+        warm = self.config.warm_restart
 
-        # 清空内存中的规则记录
-        self.active_rules.clear()
-        self.active_service_rules.clear()
-        self.logger.info("防火墙链初始化完成，已清空所有旧规则")
-            
-    def _ensure_chain_exists(self, iptables_cmd: str, chain_name: str):
-        """确保链存在并被正确引用"""
+        # 所有链和基础规则的变更在同一个事务中提交，提交失败只在这里处理一次
         try:
-            # 检查链是否存在
-            result = subprocess.run([iptables_cmd, "-L", chain_name],
-                                  capture_output=True, text=True)
-            chain_exists = (result.returncode == 0)
-
-            if not chain_exists:
-                # 创建链
-                subprocess.run([iptables_cmd, "-N", chain_name], check=True)
-                self.logger.info(f"创建防火墙链: {chain_name}")
-
-            # 检查FORWARD链中是否有对此链的引用
-            forward_check = subprocess.run([iptables_cmd, "-C", "FORWARD", "-j", chain_name],
-                                         capture_output=True, text=True)
-
-            if forward_check.returncode != 0:
-                # FORWARD链中没有引用，添加引用
-                subprocess.run([iptables_cmd, "-I", "FORWARD", "1",
-                              "-j", chain_name], check=True)
-                self.logger.info(f"将链 {chain_name} 插入到FORWARD链")
-            else:
-                self.logger.debug(f"链 {chain_name} 已正确引用到FORWARD链")
+            with self.batch():
+                # 确保所有专用链存在并被正确引用
+                self._ensure_all_chains_exist()
+
+                if warm:
+                    # 热重启：接管现有规则，启动扫描重建内存记录后由规则同步只提交差异
+                    self.logger.info("热重启模式：保留现有防火墙规则")
+                else:
+                    # 清空所有链中的规则（重要：确保干净的状态）
+                    self._flush_all_chains()
+
+                # 设置基础规则
+                self._ensure_base_rules()  # FORWARD链的DNAT conntrack规则
+                self._setup_base_rules(adopt=warm)  # INPUT链的IPv6基础协议和容器隔离规则
 
+                if self.nft is not None:
+                    self._setup_nft_backend(adopt=warm)
+                elif self.ipset is not None:
+                    self._setup_ipset_backend(adopt=warm)
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保防火墙链存在失败: {e}")
+            # 事务未生效：排队时记录的基础规则并不存在，清理时不应删除
+            self.ipv6_base_rules = []
+            self.logger.error(
+                f"初始化防火墙链失败，规则未提交: {self._describe_error(e)}")
             raise
 
+        if warm:
+            # 容器/Service记录由启动扫描按完整ID重建，规则同步随后删除无人认领的规则
+            families = (self.config.ip6tables_cmd, self.config.iptables_cmd)
+            rulesets = [self._ruleset(cmd) for cmd in families]
+            adopted = sum(len(ruleset.owned_entries())
+                          for ruleset in rulesets if ruleset.loaded)
+            self.logger.info(f"防火墙链初始化完成，接管 {adopted} 条已有规则和 "
+                             f"{len(self.ipv6_base_rules)} 条IPv6基础规则")
+        else:
+            # 清空内存中的规则记录
+            self.registry.clear()
+            self.logger.info("防火墙链初始化完成，已清空所有旧规则")
+
+    @contextmanager
+    def batch(self):
+        """批量提交上下文：期间排队的规则变更在退出时通过一次restore原子提交
+
+        可嵌套使用，只有最外层退出时才提交；提交失败抛出 subprocess.CalledProcessError。
+        期间对规则登记表的修改只在提交成功后保留，提交失败（或出现异常）时撤销。
+        """
+        if self._transaction is not None:
+            yield self._transaction
+            return
+
+        transaction = RuleTransaction(nft_cmd=self.config.nft_cmd,
+                                      ipset_cmd=self.config.ipset_cmd,
+                                      applier=self.applier)
+        self._transaction = transaction
+        self._after_commit = []
+        self.registry.begin()
+        try:
+            yield transaction
+        except BaseException:
+            self.registry.rollback()
+            raise
+        finally:
+            self._transaction = None
+            callbacks, self._after_commit = self._after_commit, []
+
+        change_count = len(transaction)
+        if change_count:
+            operations = {cmd: transaction.operations(cmd)
+                          for cmd in transaction.families()}
+            try:
+                transaction.commit()
+            except subprocess.CalledProcessError:
+                # 提交失败时内核状态不确定，下次查询重新读取快照
+                self.registry.rollback()
+                self.invalidate_rulesets()
+                raise
+        self.registry.commit()
+        if change_count:
+            for iptables_cmd, ops in operations.items():
+                self._ruleset(iptables_cmd).apply_all(ops)
+            self.logger.debug(f"批量提交 {change_count} 条规则变更")
+            if self.nft is not None:
+                self.nft.apply_committed(transaction.nft_reset, transaction.nft_changes)
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self, callback: Callable[[], None]):
+        """规则变更生效后执行回调：在事务中时等最外层提交成功，提交失败则丢弃；否则立即执行"""
+        if self._transaction is not None:
+            self._after_commit.append(callback)
+        else:
+            callback()
+
+    def _ruleset(self, iptables_cmd: str) -> Ruleset:
+        """获取地址族的规则快照（首次查询时读取）"""
+        ruleset = self._rulesets.get(iptables_cmd)
+        if ruleset is None:
+            owned_chains = [
+                self.config.chain_name,
+                self.config.input_chain_name,
+                self.config.nat_chain_name,
+                self.config.ipv4_chain_name,
+                self.config.ipv4_nat_chain_name,
+                self.ISO_CHAIN_NAME,
+            ]
+            ruleset = Ruleset(iptables_cmd, owned_chains,
+                              owned_prefixes=[self.SUBCHAIN_PREFIX])
+            self._rulesets[iptables_cmd] = ruleset
+        return ruleset
+
+    def invalidate_rulesets(self):
+        """怀疑规则被外部修改时调用，下次查询重新执行save"""
+        for ruleset in self._rulesets.values():
+            ruleset.invalidate()
+
+    def _queue_rule(self, iptables_cmd: str, rule: List[str]):
+        """将规则变更加入当前事务；不在事务中时立即单独提交"""
+        if self._transaction is not None:
+            self._transaction.add(iptables_cmd, rule)
+            return
+
+        with self.batch() as transaction:
+            transaction.add(iptables_cmd, rule)
+
+    def _nft_element_value(self, key) -> Optional[str]:
+        """查询nftables元素的当前值（已排队但未提交的变更优先）"""
+        if self._transaction is not None:
+            decided, value = self._transaction.lookup_nft(key)
+            if decided:
+                return value
+        return self.nft.lookup(key)
+
+    def _set_nft_elements(self, elements, add: bool):
+        """增删nftables集合/映射元素，已处于目标状态的元素跳过"""
+        with self.batch() as transaction:
+            for key, value in elements:
+                current = self._nft_element_value(key)
+                if add and current == value:
+                    continue
+                if current is not None:
+                    transaction.add_nft(self.nft.element_command(key, current, False),
+                                        key, None)
+                if add:
+                    transaction.add_nft(self.nft.element_command(key, value, True),
+                                        key, value)
+
+    def _setup_nft_backend(self, adopt: bool = False):
+        """nftables模式：重建集合/映射表，主FORWARD链只保留一条按标记放行的规则
+
+        adopt为True时接管已有表中的元素（热重启），表不存在时仍然重建。
+        """
+        with self.batch() as transaction:
+            if adopt and self._adopt_nft_elements():
+                transaction.add_nft(self.nft.adopt_script())
+            else:
+                transaction.reset_nft(self.nft.setup_script())
+
+            mark_rule = self.nft.mark_accept_rule()
+            if not self._rule_exists(self.config.ip6tables_cmd, mark_rule):
+                self._queue_rule(self.config.ip6tables_cmd, mark_rule)
+
+        self.logger.info(f"nftables规则引擎已启用: table ip6 {self.nft.table}")
+
+    def _adopt_nft_elements(self) -> bool:
+        """读取已有nftables表中的元素作为内存模型；表不存在或读取失败时返回False"""
+        try:
+            with metrics.backend_call(self.nft.list_command()):
+                result = subprocess.run(self.nft.list_command(), capture_output=True,
+                                        text=True)
+        except OSError as e:
+            self.logger.debug(f"读取nftables表失败: {e}")
+            return False
+        if result.returncode != 0:
+            return False
+
+        try:
+            elements = self.nft.parse_elements(result.stdout)
+        except (ValueError, TypeError, IndexError, AttributeError) as e:
+            self.logger.warning(f"无法解析nftables表内容，重建表: {e}")
+            return False
+
+        self.nft.apply_committed(True, elements)
+        self.logger.info(f"接管nftables表 {self.nft.table} 中的 {len(elements)} 个元素")
+        return True
+
+    def _setup_ipset_backend(self, adopt: bool = False):
+        """ipset模式：创建并清空按协议的集合，主FORWARD链中每个协议一条集合匹配规则
+
+        adopt为True时保留集合中已有的元素（热重启）。
+        """
+        with self.batch() as transaction:
+            for line in self.ipset.setup_script(flush=not adopt):
+                transaction.add_ipset(line)
+
+            for match_rule in self.ipset.match_rules():
+                if not self._rule_exists(self.config.ip6tables_cmd, match_rule):
+                    self._queue_rule(self.config.ip6tables_cmd, match_rule)
+
+        set_names = ', '.join(self.ipset.set_name(p) for p in self.ipset.PROTOCOLS)
+        self.logger.info(f"ipset模式已启用: {set_names}")
+
+    def _set_ipset_element(self, rule: FirewallRule, add: bool):
+        """增删容器规则对应的ipset元素"""
+        with self.batch() as transaction:
+            transaction.add_ipset(self.ipset.element_command(rule, add))
+
+    def _ensure_subchain(self, ipv6_address: str):
+        """确保容器地址的子链存在并被主FORWARD链引用"""
+        iptables_cmd = self.config.ip6tables_cmd
+        subchain = self.compiler.subchain_name(ipv6_address)
+        if not self._chain_exists(iptables_cmd, subchain):
+            self._queue_rule(iptables_cmd, ["-N", subchain])
+            self.logger.debug(f"创建容器子链: {subchain} ({ipv6_address})")
+
+        jump_rule = self.compiler.subchain_jump_rule(ipv6_address, "-A")
+        if not self._rule_exists(iptables_cmd, jump_rule):
+            self._queue_rule(iptables_cmd, jump_rule)
+
+    def _drop_subchain(self, ipv6_address: str):
+        """删除容器地址的整条子链：一次清空 + 删除引用 + 删除链"""
+        iptables_cmd = self.config.ip6tables_cmd
+        subchain = self.compiler.subchain_name(ipv6_address)
+
+        jump_rule = self.compiler.subchain_jump_rule(ipv6_address, "-D")
+        if self._rule_exists(iptables_cmd, jump_rule):
+            self._queue_rule(iptables_cmd, jump_rule)
+        if self._chain_exists(iptables_cmd, subchain):
+            self._queue_rule(iptables_cmd, ["-F", subchain])
+            self._queue_rule(iptables_cmd, ["-X", subchain])
+            self.logger.info(f"删除容器子链: {subchain} ({ipv6_address})")
+
+    def _subchain_address_in_use(self, ipv6_address: str, exclude_key) -> bool:
+        """除指定记录外，地址是否仍有子链规则（容器规则或只有FORWARD的自定义规则）"""
+        for key in self.registry.keys_for_address(ipv6_address):
+            if key == exclude_key:
+                continue
+            if key[0] == RuleRegistry.CONTAINER:
+                return True
+            if any(self.compiler.service_forward_only(rule)
+                   and rule.container_ipv6 == ipv6_address
+                   for rule in self.registry.get(key)):
+                return True
+        return False
+
+    def _released_subchains(self, addresses: Set[str], exclude_key) -> Set[str]:
+        """删除指定记录后不再被使用、可以整条删除的子链地址"""
+        if not self.subchains:
+            return set()
+        return {address for address in addresses
+                if not self._subchain_address_in_use(address, exclude_key)}
+
+    @staticmethod
+    def _describe_error(error: subprocess.CalledProcessError) -> str:
+        """提取命令失败的错误信息"""
+        return error.stderr.strip() if error.stderr else str(error)
+
+    def _chain_exists(self, iptables_cmd: str, chain_name: str,
+                      table: str = "filter") -> bool:
+        """检查链是否存在（已排队但未提交的变更优先，其次查询规则快照）"""
+        if self._transaction is not None:
+            pending = self._transaction.lookup_chain(iptables_cmd, chain_name, table)
+            if pending is not None:
+                return pending
+
+        exists = self._ruleset(iptables_cmd).has_chain(chain_name, table)
+        if exists is not None:
+            return exists
+
+        cmd = [iptables_cmd, "-t", table, "-L", chain_name, "-n"]
+        with metrics.backend_call(cmd):
+            result = subprocess.run(cmd, capture_output=True, text=True)
+        return result.returncode == 0
+
+    def _ensure_jump_chain(self, iptables_cmd: str, parent_chain: str, chain_name: str,
+                           table: str = "filter") -> bool:
+        """确保链存在并被内置链引用（插入到第1位），返回是否新增了引用"""
+        table_args = ["-t", table] if table != "filter" else []
+
+        if not self._chain_exists(iptables_cmd, chain_name, table):
+            self._queue_rule(iptables_cmd, table_args + ["-N", chain_name])
+            self.logger.info(f"创建防火墙链: {chain_name}")
+
+        if self._rule_exists(iptables_cmd,
+                             table_args + ["-A", parent_chain, "-j", chain_name]):
+            self.logger.debug(f"链 {chain_name} 已正确引用到{parent_chain}链")
+            return False
+
+        self._queue_rule(iptables_cmd,
+                         table_args + ["-I", parent_chain, "1", "-j", chain_name])
+        self.logger.info(f"将链 {chain_name} 插入到{parent_chain}链")
+        return True
+
+    def _ensure_chain_exists(self, iptables_cmd: str, chain_name: str):
+        """确保链存在并被正确引用"""
+        self._ensure_jump_chain(iptables_cmd, "FORWARD", chain_name)
+
     def _ensure_all_chains_exist(self):
         """确保所有专用链存在并被正确引用"""
         # IPv6专用链
@@ -122,107 +392,29 @@ class FirewallManager:
 
     def _ensure_input_chain_exists(self):
         """确保INPUT专用链存在并被正确引用"""
-        try:
-            # 检查链是否存在
-            result = subprocess.run([self.config.ip6tables_cmd, "-L", self.config.input_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode != 0:
-                # 创建链
-                subprocess.run([self.config.ip6tables_cmd, "-N", self.config.input_chain_name], check=True)
-                self.logger.info(f"创建IPv6基础协议链: {self.config.input_chain_name}")
-
-            # 检查INPUT链中是否有对此链的引用
-            input_check = subprocess.run([self.config.ip6tables_cmd, "-C", "INPUT", "-j", self.config.input_chain_name],
-                                       capture_output=True, text=True)
-
-            if input_check.returncode != 0:
-                # INPUT链中没有引用，添加引用
-                subprocess.run([self.config.ip6tables_cmd, "-I", "INPUT", "1",
-                              "-j", self.config.input_chain_name], check=True)
-                self.logger.info(f"将链 {self.config.input_chain_name} 插入到INPUT链")
-
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保INPUT专用链存在失败: {e}")
-            raise
+        self._ensure_jump_chain(self.config.ip6tables_cmd, "INPUT",
+                                self.config.input_chain_name)
 
     def _ensure_nat_chain_exists(self):
         """确保NAT专用链存在并被正确引用"""
-        try:
-            # 检查链是否存在
-            result = subprocess.run([self.config.ip6tables_cmd, "-t", "nat", "-L", self.config.nat_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode != 0:
-                # 创建链
-                subprocess.run([self.config.ip6tables_cmd, "-t", "nat", "-N", self.config.nat_chain_name], check=True)
-                self.logger.info(f"创建NAT专用链: {self.config.nat_chain_name}")
-
-            # 检查PREROUTING链中是否有对此链的引用
-            prerouting_check = subprocess.run([self.config.ip6tables_cmd, "-t", "nat", "-C", "PREROUTING", "-j", self.config.nat_chain_name],
-                                            capture_output=True, text=True)
-
-            if prerouting_check.returncode != 0:
-                # PREROUTING链中没有引用，添加引用
-                subprocess.run([self.config.ip6tables_cmd, "-t", "nat", "-I", "PREROUTING", "1",
-                              "-j", self.config.nat_chain_name], check=True)
-                self.logger.info(f"将链 {self.config.nat_chain_name} 插入到PREROUTING链")
-
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保NAT专用链存在失败: {e}")
-            raise
+        self._ensure_jump_chain(self.config.ip6tables_cmd, "PREROUTING",
+                                self.config.nat_chain_name, table="nat")
 
     def _ensure_ipv4_nat_chain_exists(self):
         """确保IPv4 NAT专用链存在并被正确引用"""
-        try:
-            # 检查链是否存在
-            result = subprocess.run([self.config.iptables_cmd, "-t", "nat", "-L", self.config.ipv4_nat_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode != 0:
-                # 创建链
-                subprocess.run([self.config.iptables_cmd, "-t", "nat", "-N", self.config.ipv4_nat_chain_name], check=True)
-                self.logger.info(f"创建IPv4 NAT专用链: {self.config.ipv4_nat_chain_name}")
-
-            # 检查POSTROUTING链中是否有对此链的引用
-            postrouting_check = subprocess.run([self.config.iptables_cmd, "-t", "nat", "-C", "POSTROUTING", "-j", self.config.ipv4_nat_chain_name],
-                                            capture_output=True, text=True)
-
-            if postrouting_check.returncode != 0:
-                # POSTROUTING链中没有引用，添加引用
-                subprocess.run([self.config.iptables_cmd, "-t", "nat", "-I", "POSTROUTING", "1",
-                              "-j", self.config.ipv4_nat_chain_name], check=True)
-                self.logger.info(f"将链 {self.config.ipv4_nat_chain_name} 插入到POSTROUTING链")
-
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保IPv4 NAT专用链存在失败: {e}")
-            raise
+        self._ensure_jump_chain(self.config.iptables_cmd, "POSTROUTING",
+                                self.config.ipv4_nat_chain_name, table="nat")
 
     def _ensure_base_rules(self):
         """确保基础规则存在"""
-        try:
-            # IPv6 DNAT conntrack规则 - 允许所有经过NAT转换的连接
-            dnat_rule_check = subprocess.run([
-                self.config.ip6tables_cmd, "-C", self.config.chain_name,
-                "-i", self.config.parent_interface,
-                "-o", self.config.gateway_macvlan,
-                "-m", "conntrack", "--ctstate", "DNAT",
-                "-j", "ACCEPT"
-            ], capture_output=True, text=True)
-
-            if dnat_rule_check.returncode != 0:
-                # 添加DNAT conntrack规则
-                subprocess.run([
-                    self.config.ip6tables_cmd, "-I", self.config.chain_name, "1",
-                    "-i", self.config.parent_interface,
-                    "-o", self.config.gateway_macvlan,
-                    "-m", "conntrack", "--ctstate", "DNAT",
-                    "-j", "ACCEPT"
-                ], check=True)
-                self.logger.info("添加IPv6 DNAT conntrack基础规则")
-            else:
-                self.logger.debug("IPv6 DNAT conntrack基础规则已存在")
+        dnat_rule = self.compiler.dnat_conntrack_rule()
 
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保基础规则失败: {e}")
-            raise
+        if not self._rule_exists(self.config.ip6tables_cmd, dnat_rule):
+            # 添加DNAT conntrack规则
+            self._queue_rule(self.config.ip6tables_cmd, dnat_rule)
+            self.logger.info("添加IPv6 DNAT conntrack基础规则")
+        else:
+            self.logger.debug("IPv6 DNAT conntrack基础规则已存在")
 
     def _ensure_container_isolation_rules(self):
         """
@@ -236,221 +428,114 @@ class FirewallManager:
              ip6tables -I DOCKER_IPV6FW_ISO -i macvlan_gw -p udp -m addrtype --dst-type LOCAL -m udp --dport 53 -j ACCEPT
         """
 
-        iso_chain = "DOCKER_IPV6FW_ISO"
+        iso_chain = self.ISO_CHAIN_NAME
 
-        try:
-            # ======================= IPv4 处理 =======================
-            # 1. 尝试创建自定义链 (如果存在会报错，忽略即可)
-            subprocess.run([self.config.iptables_cmd, "-N", iso_chain], 
-                           check=False, capture_output=True)
-
-            # 2. 确保 INPUT 链跳转到自定义链 
-            # 规则：-j DOCKER_IPV6FW_ISO
-            ipv4_jump_check = subprocess.run([
-                self.config.iptables_cmd, "-C", "INPUT",
-                "-j", iso_chain
-            ], capture_output=True, text=True)
-
-            if ipv4_jump_check.returncode != 0:
-                # 插入到第1位，确保优先执行
-                subprocess.run([
-                    self.config.iptables_cmd, "-I", "INPUT", "1",
-                    "-j", iso_chain
-                ], check=True)
-                self.logger.info(f"添加IPv4隔离链跳转: INPUT -> {iso_chain} (无网卡限制)")
-
-            # 3. 确保自定义链尾部存在“兜底”隔离规则
-            # 规则：-i <macvlan> ! -p icmp -m addrtype --dst-type LOCAL -j DROP
-            ipv4_drop_check = subprocess.run([
-                self.config.iptables_cmd, "-C", iso_chain,
-                "-i", self.config.gateway_macvlan,
-                "!", "-p", "icmp",
-                "-m", "addrtype", "--dst-type", "LOCAL",
-                "-j", "DROP"
-            ], capture_output=True, text=True)
-
-            if ipv4_drop_check.returncode != 0:
-                subprocess.run([
-                    self.config.iptables_cmd, "-A", iso_chain,
-                    "-i", self.config.gateway_macvlan,
-                    "!", "-p", "icmp",
-                    "-m", "addrtype", "--dst-type", "LOCAL",
-                    "-j", "DROP"
-                ], check=True)
-                self.logger.info(f"在 {iso_chain} 尾部添加IPv4默认隔离规则 (限制来源: {self.config.gateway_macvlan})")
-            else:
-                self.logger.debug(f"IPv4默认隔离规则已存在于 {iso_chain}")
-
-            # ======================= IPv6 处理 =======================
-            # 1. 尝试创建自定义链
-            subprocess.run([self.config.ip6tables_cmd, "-N", iso_chain], 
-                           check=False, capture_output=True)
-
-            # 2. 确保在INPUT链第一行插入链跳转 
-            ipv6_jump_check = subprocess.run([
-                self.config.ip6tables_cmd, "-C", "INPUT",
-                "-j", iso_chain
-            ], capture_output=True, text=True)
-
-            if ipv6_jump_check.returncode != 0:
-                subprocess.run([
-                    self.config.ip6tables_cmd, "-I", "INPUT", "1",
-                    "-j", iso_chain
-                ], check=True)
-                self.logger.info(f"添加IPv6隔离链跳转: INPUT -> {iso_chain} (无网卡限制)")
-
-            # 3. 确保自定义链尾部存在“兜底”隔离规则
-            # 关键改动：在这里限制 -i gateway_macvlan
-            ipv6_drop_check = subprocess.run([
-                self.config.ip6tables_cmd, "-C", iso_chain,
-                "-i", self.config.gateway_macvlan,
-                "!", "-p", "ipv6-icmp",
-                "-m", "addrtype", "--dst-type", "LOCAL",
-                "-j", "DROP"
-            ], capture_output=True, text=True)
-
-            if ipv6_drop_check.returncode != 0:
-                subprocess.run([
-                    self.config.ip6tables_cmd, "-A", iso_chain,
-                    "-i", self.config.gateway_macvlan,
-                    "!", "-p", "ipv6-icmp",
-                    "-m", "addrtype", "--dst-type", "LOCAL",
-                    "-j", "DROP"
-                ], check=True)
-                self.logger.info(f"在 {iso_chain} 尾部添加IPv6默认隔离规则 (限制来源: {self.config.gateway_macvlan})")
-            else:
-                self.logger.debug(f"IPv6默认隔离规则已存在于 {iso_chain}")
+        for iptables_cmd, family, drop_rule in self.compiler.isolation_rules(iso_chain):
+            # 1. 确保自定义链存在，且 INPUT 链第一行跳转到自定义链（无网卡限制）
+            if self._ensure_jump_chain(iptables_cmd, "INPUT", iso_chain):
+                self.logger.info(f"添加{family}隔离链跳转: INPUT -> {iso_chain} (无网卡限制)")
 
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"确保容器隔离规则失败: {e}")
-            raise
+            # 2. 确保自定义链尾部存在“兜底”隔离规则
+            if not self._rule_exists(iptables_cmd, drop_rule):
+                self._queue_rule(iptables_cmd, drop_rule)
+                self.logger.info(f"在 {iso_chain} 尾部添加{family}默认隔离规则 "
+                                 f"(限制来源: {self.config.gateway_macvlan})")
+            else:
+                self.logger.debug(f"{family}默认隔离规则已存在于 {iso_chain}")
 
     def _cleanup_container_isolation_rules(self):
         """
         清理容器隔离规则。
         逻辑：仅删除 INPUT 链中对自定义链的引用，保留自定义链本身以保存用户豁免规则。
         """
-        iso_chain = "DOCKER_IPV6FW_ISO"
+        iso_chain = self.ISO_CHAIN_NAME
 
-        try:
-            # 清理 IPv4 INPUT 跳转规则 (注意：查找时不带 -i 参数)
-            subprocess.run([
-                self.config.iptables_cmd, "-D", "INPUT",
-                "-j", iso_chain
-            ], check=False, capture_output=True)
-            self.logger.debug(f"移除 IPv4 INPUT 链对 {iso_chain} 的引用")
-
-            # 清理 IPv6 INPUT 跳转规则
-            subprocess.run([
-                self.config.ip6tables_cmd, "-D", "INPUT",
-                "-j", iso_chain
-            ], check=False, capture_output=True)
-            self.logger.debug(f"移除 IPv6 INPUT 链对 {iso_chain} 的引用")
-            
-            # 不删除链本身，保留用户自定义规则
+        for iptables_cmd, family in ((self.config.iptables_cmd, "IPv4"),
+                                     (self.config.ip6tables_cmd, "IPv6")):
+            # 注意：查找时不带 -i 参数
+            jump_rule = ["-D", "INPUT", "-j", iso_chain]
+            if self._rule_exists(iptables_cmd, jump_rule):
+                self._queue_rule(iptables_cmd, jump_rule)
+                self.logger.debug(f"移除 {family} INPUT 链对 {iso_chain} 的引用")
 
-        except Exception as e:
-            self.logger.warning(f"清理容器隔离规则时出错: {e}")
+        # 不删除链本身，保留用户自定义规则
 
     def _flush_chain(self):
         """清空主FORWARD链中的所有规则"""
-        try:
-            # 清空链中的所有规则
-            result = subprocess.run([self.config.ip6tables_cmd, "-F", self.config.chain_name], capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空防火墙链 {self.config.chain_name} 中的所有规则")
-            else:
-                self.logger.warning(f"清空防火墙链失败: {result.stderr}")
-        except subprocess.CalledProcessError as e:
-            self.logger.error(f"清空防火墙链失败: {e}")
+        self._queue_rule(self.config.ip6tables_cmd, ["-F", self.config.chain_name])
+        self.logger.info(f"已清空防火墙链 {self.config.chain_name} 中的所有规则")
 
     def _flush_all_chains(self):
         """清空所有专用链中的规则"""
-        # 清空IPv6 FORWARD专用链
-        self._flush_chain()
-
-        # 清空IPv6 INPUT专用链
-        try:
-            result = subprocess.run([self.config.ip6tables_cmd, "-F", self.config.input_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空IPv6基础协议链 {self.config.input_chain_name}")
-        except subprocess.CalledProcessError as e:
-            self.logger.warning(f"清空IPv6基础协议链失败: {e}")
-
-        # 清空IPv6 NAT专用链
-        try:
-            result = subprocess.run([self.config.ip6tables_cmd, "-t", "nat", "-F", self.config.nat_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空IPv6 NAT专用链 {self.config.nat_chain_name}")
-        except subprocess.CalledProcessError as e:
-            self.logger.warning(f"清空IPv6 NAT专用链失败: {e}")
-
-        # 清空IPv4 FORWARD专用链
-        try:
-            result = subprocess.run([self.config.iptables_cmd, "-F", self.config.ipv4_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空IPv4 FORWARD专用链 {self.config.ipv4_chain_name}")
-        except subprocess.CalledProcessError as e:
-            self.logger.warning(f"清空IPv4 FORWARD专用链失败: {e}")
-
-        # 清空IPv4 NAT专用链
         try:
-            result = subprocess.run([self.config.iptables_cmd, "-t", "nat", "-F", self.config.ipv4_nat_chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空IPv4 NAT专用链 {self.config.ipv4_nat_chain_name}")
+            with self.batch():
+                # 清空IPv6 FORWARD专用链
+                self._flush_chain()
+
+                # 删除容器子链（主链清空后已无引用）
+                ip6_ruleset = self._ruleset(self.config.ip6tables_cmd)
+                if ip6_ruleset.ensure_loaded():
+                    subchains = ip6_ruleset.chains_with_prefix(self.SUBCHAIN_PREFIX)
+                    for subchain in subchains:
+                        self._queue_rule(self.config.ip6tables_cmd, ["-F", subchain])
+                        self._queue_rule(self.config.ip6tables_cmd, ["-X", subchain])
+                        self.logger.info(f"已删除容器子链 {subchain}")
+
+                # 清空IPv6 INPUT专用链、IPv6 NAT专用链和IPv4专用链
+                self._flush_if_exists(self.config.ip6tables_cmd,
+                                      self.config.input_chain_name, "IPv6基础协议链")
+                self._flush_if_exists(self.config.ip6tables_cmd,
+                                      self.config.nat_chain_name, "IPv6 NAT专用链", "nat")
+                self._flush_if_exists(self.config.iptables_cmd,
+                                      self.config.ipv4_chain_name, "IPv4 FORWARD专用链")
+                self._flush_if_exists(self.config.iptables_cmd,
+                                      self.config.ipv4_nat_chain_name, "IPv4 NAT专用链",
+                                      "nat")
+
+                # 清理容器隔离规则
+                self._cleanup_container_isolation_rules()
+
+                # 删除nftables表（初始化时会重建）
+                if self.nft is not None:
+                    self._transaction.reset_nft(self.nft.teardown_script())
         except subprocess.CalledProcessError as e:
-            self.logger.warning(f"清空IPv4 NAT专用链失败: {e}")
+            self.logger.warning(f"清空专用链失败: {self._describe_error(e)}")
 
-        # 清理容器隔离规则
-        self._cleanup_container_isolation_rules()
+    def _flush_if_exists(self, iptables_cmd: str, chain_name: str, description: str,
+                         table: str = "filter"):
+        """清空专用链；链已被外部删除时跳过，避免整个restore失败"""
+        if not self._chain_exists(iptables_cmd, chain_name, table):
+            self.logger.warning(f"{description} {chain_name} 不存在，跳过清空")
+            return
+        table_args = ["-t", table] if table != "filter" else []
+        self._queue_rule(iptables_cmd, table_args + ["-F", chain_name])
+        self.logger.info(f"已清空{description} {chain_name}")
 
     def _remove_chain_completely(self):
         """完全删除防火墙链（用于彻底清理）"""
-        try:
-            chain_name = self.config.chain_name
-
-            # 检查链是否存在
-            check_result = subprocess.run(["ip6tables", "-L", chain_name],
-                                        capture_output=True, text=True)
-
-            if check_result.returncode != 0:
-                self.logger.debug(f"防火墙链 {chain_name} 不存在，无需删除")
-                return
+        chain_name = self.config.chain_name
+        iptables_cmd = self.config.ip6tables_cmd
 
-            # 检查FORWARD链中是否有对我们链的引用
-            forward_check = subprocess.run(["ip6tables", "-C", "FORWARD", "-j", chain_name],
-                                         capture_output=True, text=True)
+        # 检查链是否存在
+        if not self._chain_exists(iptables_cmd, chain_name):
+            self.logger.debug(f"防火墙链 {chain_name} 不存在，无需删除")
+            return
 
-            if forward_check.returncode == 0:
+        try:
+            with self.batch():
                 # 从FORWARD链中删除对我们链的引用
-                result = subprocess.run(["ip6tables", "-D", "FORWARD", "-j", chain_name],
-                                      capture_output=True, text=True)
-                if result.returncode == 0:
-                    self.logger.info(f"已从FORWARD链中删除对 {chain_name} 的引用")
-                else:
-                    self.logger.warning(f"删除FORWARD链引用失败: {result.stderr}")
+                jump_rule = ["-D", "FORWARD", "-j", chain_name]
+                if self._rule_exists(iptables_cmd, jump_rule):
+                    self._queue_rule(iptables_cmd, jump_rule)
 
-            # 清空链
-            result = subprocess.run(["ip6tables", "-F", chain_name],
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                self.logger.info(f"已清空防火墙链 {chain_name}")
+                # 清空并删除链
+                self._queue_rule(iptables_cmd, ["-F", chain_name])
+                self._queue_rule(iptables_cmd, ["-X", chain_name])
 
-            # 删除链
-            result = subprocess.run(["ip6tables", "-X", chain_name],
-                                  capture_output=True, text=True)
-
-            if result.returncode == 0:
-                self.logger.info(f"已完全删除防火墙链 {chain_name}")
-            else:
-                self.logger.warning(f"删除防火墙链失败: {result.stderr}")
+            self.logger.info(f"已完全删除防火墙链 {chain_name}")
 
         except subprocess.CalledProcessError as e:
-            self.logger.error(f"删除防火墙链异常: {e}")
+            self.logger.error(f"删除防火墙链异常: {self._describe_error(e)}")
 
     def _cleanup_ipv6_base_rules(self):
         """清理IPv6基础规则 - 只删除我们添加的规则"""
@@ -460,71 +545,52 @@ class FirewallManager:
 
         self.logger.info("清理IPv6基础规则（只删除我们添加的规则）")
 
-        for rule in self.ipv6_base_rules:
-            try:
-                # 将-A替换为-D来删除规则
-                delete_rule = [r.replace("-A", "-D") if r == "-A" else r for r in rule]
-
-                # 先检查规则是否存在，避免重复删除
-                check_rule = [r.replace("-A", "-C") if r == "-A" else r for r in rule]
-                check_result = subprocess.run(["ip6tables"] + check_rule,
-                                            capture_output=True, text=True)
-
-                if check_result.returncode == 0:
-                    # 规则存在，尝试删除
-                    result = subprocess.run(["ip6tables"] + delete_rule,
-                                          capture_output=True, text=True)
-                    if result.returncode == 0:
+        try:
+            with self.batch():
+                for rule in self.ipv6_base_rules:
+                    # 将-A替换为-D来删除规则
+                    delete_rule = ["-D" if r == "-A" else r for r in rule]
+
+                    # 先检查规则是否存在，避免重复删除
+                    if self._rule_exists(self.config.ip6tables_cmd, rule):
+                        self._queue_rule(self.config.ip6tables_cmd, delete_rule)
                         self.logger.info(f"删除IPv6基础规则: {' '.join(delete_rule[2:])}")
                     else:
-                        self.logger.warning(f"删除IPv6基础规则失败: {result.stderr.strip()}")
-                else:
-                    self.logger.debug(f"IPv6基础规则不存在（可能已被删除）: {' '.join(delete_rule[2:])}")
-
-            except subprocess.CalledProcessError as e:
-                self.logger.warning(f"检查/删除IPv6基础规则异常: {e}")
+                        self.logger.debug("IPv6基础规则不存在（可能已被删除）: "
+                                          f"{' '.join(delete_rule[2:])}")
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"删除IPv6基础规则失败: {self._describe_error(e)}")
 
         # 清空记录，避免重复删除
         self.ipv6_base_rules.clear()
         self.logger.debug("IPv6基础规则记录已清空")
             
-    def _setup_base_rules(self):
-        """设置基础规则"""
+    def _setup_base_rules(self, adopt: bool = False):
+        """设置基础规则
+
+        adopt为True（热重启）时专用INPUT链中已有的基础规则是上次运行添加的，同样记录，
+        停止时按冷启动方式清理的规则与重启前一致。
+        """
         # 注意：不再添加宽泛的转发规则，只添加IPv6基础协议支持
         self.logger.info("设置IPv6基础协议支持规则")
 
-        # IPv6基础协议规则（专用INPUT链）
-        icmpv6_rules = [
-            # ICMPv6基础消息类型
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "destination-unreachable", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "packet-too-big", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "time-exceeded", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "parameter-problem", "-j", "ACCEPT"],
-            # NDP (Neighbor Discovery Protocol)
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "neighbor-solicitation", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "neighbor-advertisement", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "router-advertisement", "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-p", "icmpv6", "--icmpv6-type", "router-solicitation", "-j", "ACCEPT"],
-            # 链路本地地址
-            ["-A", self.config.input_chain_name, "-s", self.config.ipv6_link_local, "-j", "ACCEPT"],
-            ["-A", self.config.input_chain_name, "-d", self.config.ipv6_link_local, "-j", "ACCEPT"]
-        ]
+        icmpv6_rules = self.compiler.ipv6_input_base_rules()
 
         # 记录添加的IPv6基础规则（用于清理）
         self.ipv6_base_rules = []
 
         for rule in icmpv6_rules:
-            try:
-                if not self._rule_exists("ip6tables", rule):
-                    subprocess.run(["ip6tables"] + rule, check=True)
-                    self.logger.info(f"添加IPv6基础规则: {' '.join(rule[2:])}")  # 跳过-A INPUT
-                    # 只记录我们真正添加的规则
-                    self.ipv6_base_rules.append(rule)
-                else:
-                    self.logger.debug(f"IPv6基础规则已存在（系统原有）: {' '.join(rule[2:])}")
-                    # 不记录已存在的规则，避免误删系统原有规则
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"添加IPv6基础规则失败: {e}")
+            if not self._rule_exists(self.config.ip6tables_cmd, rule):
+                self._queue_rule(self.config.ip6tables_cmd, rule)
+                self.logger.info(f"添加IPv6基础规则: {' '.join(rule[2:])}")  # 跳过-A INPUT
+                # 只记录我们真正添加的规则
+                self.ipv6_base_rules.append(rule)
+            elif adopt:
+                self.logger.debug(f"接管IPv6基础规则: {' '.join(rule[2:])}")
+                self.ipv6_base_rules.append(rule)
+            else:
+                self.logger.debug(f"IPv6基础规则已存在（系统原有）: {' '.join(rule[2:])}")
+                # 不记录已存在的规则，避免误删系统原有规则
 
         self.logger.info("IPv6基础协议支持规则设置完成")
 
@@ -538,47 +604,24 @@ class FirewallManager:
         """设置ICMP/ICMPv6协议的FORWARD规则 - 确保接口间协议转发正常"""
         self.logger.info("设置ICMP/ICMPv6协议FORWARD规则")
 
-        # ICMPv6/NDP协议双向转发规则（专用FORWARD链）
-        icmpv6_forward_rules = [
-            # 主接口到macvlan网关的ICMPv6转发
-            ["-A", self.config.chain_name, "-i", self.config.parent_interface,
-             "-o", self.config.gateway_macvlan, "-p", "icmpv6", "-j", "ACCEPT"],
-            # macvlan网关到主接口的ICMPv6转发
-            ["-A", self.config.chain_name, "-i", self.config.gateway_macvlan,
-             "-o", self.config.parent_interface, "-p", "icmpv6", "-j", "ACCEPT"]
-        ]
-
-        # ICMPv4协议双向转发规则（使用IPv4专用链）
-        icmpv4_forward_rules = [
-            # 主接口到macvlan网关的ICMPv4转发
-            ["-A", self.config.ipv4_chain_name, "-i", self.config.parent_interface,
-             "-o", self.config.gateway_macvlan, "-p", "icmp", "-j", "ACCEPT"],
-            # macvlan网关到主接口的ICMPv4转发
-            ["-A", self.config.ipv4_chain_name, "-i", self.config.gateway_macvlan,
-             "-o", self.config.parent_interface, "-p", "icmp", "-j", "ACCEPT"]
-        ]
+        icmpv6_forward_rules, icmpv4_forward_rules = \
+            self.compiler.icmp_forward_base_rules()
 
         # 添加ICMPv6规则
         for rule in icmpv6_forward_rules:
-            try:
-                if not self._rule_exists(self.config.ip6tables_cmd, rule):
-                    subprocess.run([self.config.ip6tables_cmd] + rule, check=True)
-                    self.logger.info(f"添加ICMPv6 FORWARD规则: {rule[2]} -> {rule[4]}")
-                else:
-                    self.logger.debug(f"ICMPv6 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"添加ICMPv6 FORWARD规则失败: {e}")
+            if not self._rule_exists(self.config.ip6tables_cmd, rule):
+                self._queue_rule(self.config.ip6tables_cmd, rule)
+                self.logger.info(f"添加ICMPv6 FORWARD规则: {rule[2]} -> {rule[4]}")
+            else:
+                self.logger.debug(f"ICMPv6 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
 
         # 添加ICMPv4规则（使用iptables）
         for rule in icmpv4_forward_rules:
-            try:
-                if not self._rule_exists(self.config.iptables_cmd, rule):
-                    subprocess.run([self.config.iptables_cmd] + rule, check=True)
-                    self.logger.info(f"添加ICMPv4 FORWARD规则: {rule[2]} -> {rule[4]}")
-                else:
-                    self.logger.debug(f"ICMPv4 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"添加ICMPv4 FORWARD规则失败: {e}")
+            if not self._rule_exists(self.config.iptables_cmd, rule):
+                self._queue_rule(self.config.iptables_cmd, rule)
+                self.logger.info(f"添加ICMPv4 FORWARD规则: {rule[2]} -> {rule[4]}")
+            else:
+                self.logger.debug(f"ICMPv4 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
 
         self.logger.info("ICMP/ICMPv6协议FORWARD规则设置完成")
 
@@ -589,129 +632,107 @@ class FirewallManager:
         """设置IPv4容器上网的完整规则 - 确保IPv4容器能正常访问外网"""
         self.logger.info("设置IPv4容器上网规则")
 
-        # IPv4容器上网的FORWARD规则
-        ipv4_forward_rules = [
-            # 1. 容器到外网的FORWARD规则（gateway_macvlan -> parent_interface）
-            ["-A", self.config.ipv4_chain_name, "-i", self.config.gateway_macvlan,
-             "-o", self.config.parent_interface, "-j", "ACCEPT"]
-        ]
-
-        # IPv4 NAT MASQUERADE规则（POSTROUTING链）
-        ipv4_nat_rules = [
-            # 4. NAT MASQUERADE规则 - 容器访问外网时进行地址伪装
-            ["-t", "nat", "-A", self.config.ipv4_nat_chain_name,
-             "-o", self.config.parent_interface, "-j", "MASQUERADE"]
-        ]
+        ipv4_forward_rules, ipv4_nat_rules = self.compiler.ipv4_internet_base_rules()
 
         # 添加IPv4 FORWARD规则
         for rule in ipv4_forward_rules:
-            try:
-                if not self._rule_exists(self.config.iptables_cmd, rule):
-                    subprocess.run([self.config.iptables_cmd] + rule, check=True)
-                    self.logger.info(f"添加IPv4 FORWARD规则: {rule[2]} -> {rule[4]}")
-                else:
-                    self.logger.debug(f"IPv4 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"添加IPv4 FORWARD规则失败: {e}")
+            if not self._rule_exists(self.config.iptables_cmd, rule):
+                self._queue_rule(self.config.iptables_cmd, rule)
+                self.logger.info(f"添加IPv4 FORWARD规则: {rule[2]} -> {rule[4]}")
+            else:
+                self.logger.debug(f"IPv4 FORWARD规则已存在: {rule[2]} -> {rule[4]}")
 
         # 添加IPv4 NAT规则
         for rule in ipv4_nat_rules:
-            try:
-                if not self._rule_exists(self.config.iptables_cmd, rule):
-                    subprocess.run([self.config.iptables_cmd] + rule, check=True)
-                    self.logger.info(f"添加IPv4 NAT MASQUERADE规则: {rule[4]} -> {rule[6]}")
-                else:
-                    self.logger.debug(f"IPv4 NAT MASQUERADE规则已存在: {rule[4]} -> {rule[6]}")
-            except subprocess.CalledProcessError as e:
-                self.logger.error(f"添加IPv4 NAT MASQUERADE规则失败: {e}")
+            if not self._rule_exists(self.config.iptables_cmd, rule):
+                self._queue_rule(self.config.iptables_cmd, rule)
+                self.logger.info(f"添加IPv4 NAT MASQUERADE规则: {rule[4]} -> {rule[6]}")
+            else:
+                self.logger.debug(f"IPv4 NAT MASQUERADE规则已存在: {rule[4]} -> {rule[6]}")
 
         self.logger.info("IPv4容器上网规则设置完成")
 
     def _rule_exists(self, iptables_cmd: str, rule: List[str]) -> bool:
-        """检查规则是否存在"""
+        """检查规则是否存在（已排队但未提交的变更优先，其次查询规则快照）"""
+        if self._transaction is not None:
+            pending = self._transaction.lookup(iptables_cmd, rule)
+            if pending is not None:
+                return pending
+
+        exists = self._ruleset(iptables_cmd).contains(rule)
+        if exists is not None:
+            return exists
+
         try:
-            # 将-A替换为-C来检查规则
-            check_rule = [r.replace("-A", "-C") if r == "-A" else r for r in rule]
-            result = subprocess.run([iptables_cmd] + check_rule, 
-                                  capture_output=True, text=True)
+            # 将动作替换为-C来检查规则（-I 的插入位置不参与匹配）
+            table, _, chain, spec = split_rule(rule)
+            check_rule = ["-t", table, "-C", chain] + spec
+            with metrics.backend_call([iptables_cmd]):
+                result = subprocess.run([iptables_cmd] + check_rule,
+                                        capture_output=True, text=True)
             return result.returncode == 0
         except subprocess.CalledProcessError:
             return False
             
     def add_container_rules(self, container_id: str, container_name: str, 
-                          port_mappings: List[Dict], networks: Dict):
-        """为容器添加防火墙规则"""
-        if container_id in self.active_rules:
+                          port_mappings: List[Dict], networks: Dict) -> bool:
+        """为容器添加防火墙规则，返回规则变更是否已提交（在外层事务中时为已排队）"""
+        record_key = (RuleRegistry.CONTAINER, container_id)
+        if record_key in self.registry:
             self.logger.debug(f"容器 {container_name} 的规则已存在")
-            return
+            return True
             
         rules = []
-        
-        # 处理每个网络接口
-        for network_name, network_info in networks.items():
-            if not self._should_monitor_network(network_name):
-                continue
-                
-            ipv6_address = network_info.get('GlobalIPv6Address')
-            if not ipv6_address:
-                continue
-                
-            # 处理端口映射
-            for port_info in port_mappings:
-                protocol = port_info.get('protocol', 'tcp')
-                port = port_info.get('port')
-
-                if port:
-                    # 处理all协议（创建tcp和udp两条规则）
-                    protocols_to_process = ['tcp', 'udp'] if protocol == 'all' else [protocol]
-
-                    for actual_protocol in protocols_to_process:
-                        rule = FirewallRule(
-                            container_id=container_id,
-                            container_name=container_name,
-                            protocol=actual_protocol,
-                            port=port,
-                            ipv6_address=ipv6_address,
-                            interface_in=self.config.parent_interface,
-                            interface_out=self.config.gateway_macvlan
-                        )
-
-                        if self._add_firewall_rule(rule):
-                            rules.append(rule)
-                        
+
+        try:
+            with self.batch():
+                for rule in self.compiler.container_rules(container_id, container_name,
+                                                          port_mappings, networks):
+                    if self._add_firewall_rule(rule):
+                        rules.append(rule)
+
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"提交容器 {container_name} 的防火墙规则失败: "
+                              f"{self._describe_error(e)}")
+            return False
+
         if rules:
-            self.active_rules[container_id] = rules
+            self.registry.set(record_key, rules)
             self.logger.info(f"为容器 {container_name} 添加了 {len(rules)} 条规则")
-            
-    def _should_monitor_network(self, network_name: str) -> bool:
-        """判断是否应该监控此网络"""
-        for monitored in self.config.monitored_networks:
-            if monitored.lower() in network_name.lower():
-                return True
-        return False
-        
-    def _add_firewall_rule(self, rule: FirewallRule) -> bool:
+        return True
+
+    def _add_firewall_rule(self, rule: FirewallRule,
+                           kind: str = RuleRegistry.CONTAINER) -> bool:
         """添加单条防火墙规则"""
         try:
-            # 构建ip6tables规则 - 只允许特定容器的特定端口
-            iptables_rule = [
-                "-A", self.config.chain_name,
-                "-p", rule.protocol,
-                "-d", rule.ipv6_address,  # 目标是特定容器的IPv6地址
-                "--dport", str(rule.port),  # 特定端口
-                "-i", rule.interface_in,   # 从外网接口进入
-                "-o", rule.interface_out,  # 到macvlan接口
-                "-j", "ACCEPT",
-                "-m", "comment", "--comment", f"Container:{rule.container_name}"
-            ]
+            if self.nft is not None:
+                self._set_nft_elements(self.nft.firewall_rule_elements(rule), add=True)
+                self.logger.info(f"添加容器防火墙规则(nftables): {rule}")
+                return True
+
+            if self.compiler.uses_ipset(rule):
+                self._set_ipset_element(rule, add=True)
+                self.logger.info(f"添加容器防火墙规则(ipset): {rule}")
+                return True
+
+            if self.subchains:
+                with self.batch():
+                    self._ensure_subchain(rule.ipv6_address)
+                    subchain_rule = self.compiler.subchain_rule(rule, "-A", kind)
+                    if not self._rule_exists(self.config.ip6tables_cmd, subchain_rule):
+                        self._queue_rule(self.config.ip6tables_cmd, subchain_rule)
+                        self.logger.info(f"添加容器防火墙规则(子链): {rule}")
+                return True
+
+            iptables_rule = self.compiler.firewall_rule(rule, "-A", kind)
 
             # 检查规则是否已存在
-            if self._rule_exists("ip6tables", iptables_rule):
+            if self._rule_exists(self.config.ip6tables_cmd, iptables_rule):
                 self.logger.debug(f"规则已存在: {rule}")
                 return True
 
             # 添加规则
-            subprocess.run(["ip6tables"] + iptables_rule, check=True)
+            self._queue_rule(self.config.ip6tables_cmd, iptables_rule)
             self.logger.info(f"添加容器防火墙规则: {rule}")
             return True
 
@@ -721,109 +742,88 @@ class FirewallManager:
             
     def remove_container_rules(self, container_id: str):
         """移除容器的防火墙规则"""
-        if container_id not in self.active_rules:
+        record_key = (RuleRegistry.CONTAINER, container_id)
+        rules = self.registry.get(record_key)
+        if not rules:
+            self.registry.remove(record_key)
             return
-            
-        rules = self.active_rules[container_id]
+
         removed_count = 0
-        
-        for rule in rules:
-            if self._remove_firewall_rule(rule):
-                removed_count += 1
-                
-        del self.active_rules[container_id]
+
+        try:
+            with self.batch():
+                # 子链模式：地址不再被其他记录使用时整条子链一次删除
+                addresses = {rule.ipv6_address for rule in rules}
+                released = self._released_subchains(addresses, record_key)
+                for rule in rules:
+                    if rule.ipv6_address in released:
+                        removed_count += 1
+                    elif self._remove_firewall_rule(rule):
+                        removed_count += 1
+                for ipv6_address in released:
+                    self._drop_subchain(ipv6_address)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"提交容器 {rules[0].container_name} 的规则删除失败: "
+                                f"{self._describe_error(e)}")
+            removed_count = 0
+
+        self.registry.remove(record_key)
         self.logger.info(f"移除容器 {rules[0].container_name} 的 {removed_count} 条规则")
 
     def add_container_public_rules(self, container_id: str, container_name: str,
-                                  public_ports: List[Dict], networks: Dict):
-        """为容器的Public端口添加NAT和防火墙规则"""
+                                  public_ports: List[Dict], networks: Dict) -> bool:
+        """为容器的Public端口添加NAT和防火墙规则，返回规则变更是否已提交（在外层事务中时为已排队）"""
         # 使用特殊的ID来区分Public端口规则
         public_rule_id = f"{container_id}_public"
+        record_key = (RuleRegistry.PUBLIC, container_id)
+        container_key = (RuleRegistry.CONTAINER, container_id)
 
-        # 检查是否需要更新规则
-        if public_rule_id in self.active_service_rules:
-            # 比较现有规则与新配置，如果有变化则先移除旧规则
-            if self._container_public_rules_changed(public_rule_id, public_ports, networks):
-                self.logger.info(f"检测到容器 {container_name} Public端口配置变化，更新规则")
-                self.remove_service_rules(public_rule_id)
-            else:
-                self.logger.debug(f"容器 {container_name} Public端口规则无变化，跳过")
-                return
-
+        nat_rules, same_port_rules = self.compiler.public_rules(
+            container_id, container_name, public_ports, networks)
         rules = []
+        forward_rules = []  # 端口相同时只需要的FORWARD规则，提交成功后并入容器规则
 
-        # 处理每个网络接口
-        for network_name, network_info in networks.items():
-            if not self._should_monitor_network(network_name):
-                continue
+        try:
+            with self.batch():
+                # 检查是否需要更新规则
+                if record_key in self.registry:
+                    # 比较现有规则与新配置，如果有变化则先移除旧规则
+                    if self._record_changed(record_key,
+                                            {rule.signature for rule in nat_rules},
+                                            f"容器Public端口 {public_rule_id} 规则变化检测:"):
+                        self.logger.info(f"检测到容器 {container_name} Public端口配置变化，更新规则")
+                        self.remove_service_rules(public_rule_id)
+                    else:
+                        self.logger.debug(f"容器 {container_name} Public端口规则无变化，跳过")
+                        return True
 
-            ipv6_address = network_info.get('GlobalIPv6Address')
-            if not ipv6_address:
-                continue
+                # 端口不同的映射创建NAT + FORWARD规则（类似Service规则）
+                for rule in nat_rules:
+                    if self._add_service_rule(rule):
+                        rules.append(rule)
+                        self.logger.debug(f"  创建NAT规则: {rule.published_port}->"
+                                          f"{rule.target_port}/{rule.protocol} (端口不同)")
+
+                # 端口相同，只需要FORWARD规则，无需NAT转换（IPv6可直接访问）
+                for forward_rule in same_port_rules:
+                    # 检查是否已经有相同的FORWARD规则
+                    if self.registry.has_signature(container_key,
+                                                   forward_rule.signature):
+                        continue
+                    if self._add_firewall_rule(forward_rule):
+                        forward_rules.append(forward_rule)
+                        self.logger.debug(f"  添加FORWARD规则: {forward_rule.port}/"
+                                          f"{forward_rule.protocol} (端口相同)")
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"提交容器 {container_name} 的Public端口规则失败: "
+                              f"{self._describe_error(e)}")
+            return False
 
-            # 处理Public端口映射
-            for port_info in public_ports:
-                protocol = port_info.get('protocol', 'tcp')
-                container_port = port_info.get('container_port')
-                host_port = port_info.get('host_port')
-                host_ip = port_info.get('host_ip', '')
-
-                if container_port and host_port:
-                    # 处理all协议（创建tcp和udp两条规则）
-                    protocols_to_process = ['tcp', 'udp'] if protocol == 'all' else [protocol]
-
-                    for actual_protocol in protocols_to_process:
-                        # 只为端口不同的映射创建NAT规则
-                        if host_port != container_port:
-                            # 创建NAT + FORWARD规则（类似Service规则）
-                            rule = ServiceRule(
-                                service_id=public_rule_id,
-                                service_name=f"{container_name}_public",
-                                container_id=container_id,
-                                container_name=container_name,
-                                protocol=actual_protocol,
-                                published_port=host_port,
-                                target_port=container_port,
-                                container_ipv6=ipv6_address,
-                                interface_in=self.config.parent_interface,
-                                interface_out=self.config.gateway_macvlan
-                            )
-
-                            if self._add_service_rule(rule):
-                                rules.append(rule)
-                                self.logger.debug(f"  创建NAT规则: {host_port}->{container_port}/{actual_protocol} (端口不同)")
-                        else:
-                            # 端口相同，只需要FORWARD规则，无需NAT转换
-                            self.logger.debug(f"  跳过NAT规则: {host_port}->{container_port}/{actual_protocol} (端口相同，IPv6可直接访问)")
-
-                            # 创建FORWARD规则
-                            forward_rule = FirewallRule(
-                                container_id=container_id,
-                                container_name=container_name,
-                                protocol=actual_protocol,
-                                port=container_port,
-                                ipv6_address=ipv6_address,
-                                interface_in=self.config.parent_interface,
-                                interface_out=self.config.gateway_macvlan
-                            )
-
-                            # 检查是否已经有相同的FORWARD规则
-                            if container_id in self.active_rules:
-                                existing_rules = self.active_rules[container_id]
-                                rule_exists = any(
-                                    r.protocol == actual_protocol and r.port == container_port and r.ipv6_address == ipv6_address
-                                    for r in existing_rules
-                                )
-                                if not rule_exists and self._add_firewall_rule(forward_rule):
-                                    existing_rules.append(forward_rule)
-                                    self.logger.debug(f"  添加FORWARD规则: {container_port}/{actual_protocol} (端口相同)")
-                            else:
-                                if self._add_firewall_rule(forward_rule):
-                                    self.active_rules[container_id] = [forward_rule]
-                                    self.logger.debug(f"  添加FORWARD规则: {container_port}/{actual_protocol} (端口相同)")
+        if forward_rules:
+            self.registry.extend(container_key, forward_rules)
 
         if rules:
-            self.active_service_rules[public_rule_id] = rules
+            self.registry.set(record_key, rules)
             self.logger.info(f"为容器 {container_name} 添加了 {len(rules)} 条Public端口规则")
 
             # 记录详细的规则信息便于调试
@@ -831,144 +831,70 @@ class FirewallManager:
                 self.logger.debug(f"  容器Public规则: {rule.protocol}:{rule.published_port}->{rule.target_port} -> {rule.container_ipv6}")
         else:
             self.logger.debug(f"容器 {container_name} 没有生成有效Public端口规则")
+        return True
 
-    def _container_public_rules_changed(self, public_rule_id: str, new_public_ports: List[Dict],
-                                       new_networks: Dict) -> bool:
-        """检测容器Public端口规则是否发生变化"""
-        if public_rule_id not in self.active_service_rules:
+    def _record_changed(self, record_key, new_signatures: Set[Tuple],
+                        label: str) -> bool:
+        """与登记表中的规则特征对比，只计算和记录差异部分"""
+        if record_key not in self.registry:
             return True  # 没有现有规则，需要添加
 
-        existing_rules = self.active_service_rules[public_rule_id]
-
-        # 构建新规则的特征集合用于比较
-        new_rule_signatures = set()
-        for network_name, network_info in new_networks.items():
-            if not self._should_monitor_network(network_name):
-                continue
-
-            ipv6_address = network_info.get('GlobalIPv6Address')
-            if not ipv6_address:
-                continue
-
-            for port_info in new_public_ports:
-                protocol = port_info.get('protocol', 'tcp')
-                container_port = port_info.get('container_port')
-                host_port = port_info.get('host_port')
-
-                if container_port and host_port:
-                    # 处理all协议（创建tcp和udp两个特征）
-                    protocols_to_check = ['tcp', 'udp'] if protocol == 'all' else [protocol]
-
-                    for actual_protocol in protocols_to_check:
-                        # 只为端口不同的映射创建NAT规则特征
-                        if host_port != container_port:
-                            # 创建规则特征：协议_宿主机端口_容器端口_IPv6地址
-                            signature = f"{actual_protocol}_{host_port}_{container_port}_{ipv6_address}"
-                            new_rule_signatures.add(signature)
-
-        # 构建现有规则的特征集合
-        existing_rule_signatures = set()
-        for rule in existing_rules:
-            signature = f"{rule.protocol}_{rule.published_port}_{rule.target_port}_{rule.container_ipv6}"
-            existing_rule_signatures.add(signature)
-
-        # 比较两个集合是否相同
-        rules_changed = new_rule_signatures != existing_rule_signatures
-
-        if rules_changed:
-            self.logger.info(f"容器Public端口 {public_rule_id} 规则变化检测:")
-            self.logger.info(f"  现有规则: {existing_rule_signatures}")
-            self.logger.info(f"  新规则: {new_rule_signatures}")
+        added, removed = self.registry.signature_delta(record_key, new_signatures)
+        if not added and not removed:
+            return False
 
-        return rules_changed
+        self.logger.info(label)
+        if added:
+            self.logger.info(f"  新增规则: {sorted(added)}")
+        if removed:
+            self.logger.info(f"  移除规则: {sorted(removed)}")
+        return True
 
     def add_custom_firewall_rules(self, container_id: str, container_name: str,
-                                 custom_ports: List[Dict], networks: Dict):
-        """为容器的自定义防火墙端口添加规则"""
+                                 custom_ports: List[Dict], networks: Dict) -> bool:
+        """为容器的自定义防火墙端口添加规则，返回规则变更是否已提交（在外层事务中时为已排队）"""
         # 使用特殊的ID来区分自定义防火墙规则
         custom_rule_id = f"{container_id}_custom"
+        record_key = (RuleRegistry.CUSTOM, container_id)
 
-        # 检查是否需要更新规则
-        if custom_rule_id in self.active_service_rules:
-            # 比较现有规则与新配置，如果有变化则先移除旧规则
-            if self._custom_firewall_rules_changed(custom_rule_id, custom_ports, networks):
-                self.logger.info(f"检测到容器 {container_name} 自定义防火墙配置变化，更新规则")
-                self.remove_service_rules(custom_rule_id)
-            else:
-                self.logger.debug(f"容器 {container_name} 自定义防火墙规则无变化，跳过")
-                return
-
+        desired = self.compiler.custom_rules(container_id, container_name, custom_ports,
+                                             networks)
         rules = []
 
-        # 处理每个网络接口
-        for network_name, network_info in networks.items():
-            if not self._should_monitor_network(network_name):
-                continue
-
-            ipv6_address = network_info.get('GlobalIPv6Address')
-            if not ipv6_address:
-                continue
-
-            # 处理自定义防火墙端口
-            for port_info in custom_ports:
-                protocol = port_info.get('protocol', 'tcp')
-                external_port = port_info.get('external_port')
-                internal_port = port_info.get('internal_port')
-
-                if external_port and internal_port:
-                    # 处理all协议（创建tcp和udp两条规则）
-                    protocols_to_process = ['tcp', 'udp'] if protocol == 'all' else [protocol]
-
-                    for actual_protocol in protocols_to_process:
-                        if external_port != internal_port:
-                            # 需要NAT规则（端口不同）
-                            rule = ServiceRule(
-                                service_id=custom_rule_id,
-                                service_name=f"{container_name}_custom",
-                                container_id=container_id,
-                                container_name=container_name,
-                                protocol=actual_protocol,
-                                published_port=external_port,
-                                target_port=internal_port,
-                                container_ipv6=ipv6_address,
-                                interface_in=self.config.parent_interface,
-                                interface_out=self.config.gateway_macvlan
-                            )
-
-                            if self._add_service_rule(rule):
-                                rules.append(rule)
-                                self.logger.debug(f"  自定义NAT规则: {external_port}->{internal_port}/{actual_protocol}")
-                        else:
-                            # 端口相同，只需要FORWARD规则
-                            forward_rule = FirewallRule(
-                                container_id=container_id,
-                                container_name=container_name,
-                                protocol=actual_protocol,
-                                port=external_port,
-                                ipv6_address=ipv6_address,
-                                interface_in=self.config.parent_interface,
-                                interface_out=self.config.gateway_macvlan
-                            )
-
-                            if self._add_firewall_rule(forward_rule):
-                                # 将FORWARD规则也加入到service_rules中统一管理
-                                service_rule = ServiceRule(
-                                    service_id=custom_rule_id,
-                                    service_name=f"{container_name}_custom",
-                                    container_id=container_id,
-                                    container_name=container_name,
-                                    protocol=actual_protocol,
-                                    published_port=external_port,
-                                    target_port=internal_port,
-                                    container_ipv6=ipv6_address,
-                                    interface_in=self.config.parent_interface,
-                                    interface_out=self.config.gateway_macvlan
-                                )
-                                rules.append(service_rule)
-                                self.logger.debug(f"  自定义FORWARD规则: {external_port}/{actual_protocol}")
+        try:
+            with self.batch():
+                # 检查是否需要更新规则
+                if record_key in self.registry:
+                    # 比较现有规则与新配置，如果有变化则先移除旧规则
+                    if self._record_changed(record_key,
+                                            {rule.signature for rule in desired},
+                                            f"自定义防火墙规则 {custom_rule_id} 变化检测:"):
+                        self.logger.info(f"检测到容器 {container_name} 自定义防火墙配置变化，更新规则")
+                        self.remove_service_rules(custom_rule_id)
+                    else:
+                        self.logger.debug(f"容器 {container_name} 自定义防火墙规则无变化，跳过")
+                        return True
+
+                for rule in desired:
+                    if self.compiler.service_forward_only(rule):
+                        # 端口相同，只需要FORWARD规则（按容器规则格式添加，仍记录在自定义规则中统一管理）
+                        forward_rule = self.compiler.service_as_firewall_rule(rule)
+                        if self._add_firewall_rule(forward_rule, RuleRegistry.CUSTOM):
+                            rules.append(rule)
+                            self.logger.debug(f"  自定义FORWARD规则: "
+                                              f"{rule.published_port}/{rule.protocol}")
+                    elif self._add_service_rule(rule):
+                        # 需要NAT规则（端口不同）
+                        rules.append(rule)
+                        self.logger.debug(f"  自定义NAT规则: {rule.published_port}->"
+                                          f"{rule.target_port}/{rule.protocol}")
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"提交容器 {container_name} 的自定义防火墙规则失败: "
+                              f"{self._describe_error(e)}")
+            return False
 
         if rules:
-            self.active_service_rules[custom_rule_id] = rules
+            self.registry.set(record_key, rules)
             self.logger.info(f"为容器 {container_name} 添加了 {len(rules)} 条自定义防火墙规则")
 
             # 记录详细的规则信息便于调试
@@ -976,78 +902,36 @@ class FirewallManager:
                 self.logger.debug(f"  自定义规则: {rule.protocol}:{rule.published_port}->{rule.target_port} -> {rule.container_ipv6}")
         else:
             self.logger.debug(f"容器 {container_name} 没有生成有效自定义防火墙规则")
+        return True
 
-    def _custom_firewall_rules_changed(self, custom_rule_id: str, new_custom_ports: List[Dict],
-                                      new_networks: Dict) -> bool:
-        """检测自定义防火墙规则是否发生变化"""
-        if custom_rule_id not in self.active_service_rules:
-            return True  # 没有现有规则，需要添加
-
-        existing_rules = self.active_service_rules[custom_rule_id]
-
-        # 构建新规则的特征集合用于比较
-        new_rule_signatures = set()
-        for network_name, network_info in new_networks.items():
-            if not self._should_monitor_network(network_name):
-                continue
-
-            ipv6_address = network_info.get('GlobalIPv6Address')
-            if not ipv6_address:
-                continue
-
-            for port_info in new_custom_ports:
-                protocol = port_info.get('protocol', 'tcp')
-                external_port = port_info.get('external_port')
-                internal_port = port_info.get('internal_port')
-
-                if external_port and internal_port:
-                    # 处理all协议（创建tcp和udp两个特征）
-                    protocols_to_check = ['tcp', 'udp'] if protocol == 'all' else [protocol]
-
-                    for actual_protocol in protocols_to_check:
-                        # 创建规则特征：协议_外部端口_内部端口_IPv6地址
-                        signature = f"{actual_protocol}_{external_port}_{internal_port}_{ipv6_address}"
-                        new_rule_signatures.add(signature)
-
-        # 构建现有规则的特征集合
-        existing_rule_signatures = set()
-        for rule in existing_rules:
-            signature = f"{rule.protocol}_{rule.published_port}_{rule.target_port}_{rule.container_ipv6}"
-            existing_rule_signatures.add(signature)
-
-        # 比较两个集合是否相同
-        rules_changed = new_rule_signatures != existing_rule_signatures
+    def _remove_firewall_rule(self, rule: FirewallRule,
+                              kind: str = RuleRegistry.CONTAINER) -> bool:
+        """移除单条防火墙规则"""
+        try:
+            if self.nft is not None:
+                self._set_nft_elements(self.nft.firewall_rule_elements(rule), add=False)
+                self.logger.info(f"移除防火墙规则(nftables): {rule}")
+                return True
 
-        if rules_changed:
-            self.logger.info(f"自定义防火墙规则 {custom_rule_id} 变化检测:")
-            self.logger.info(f"  现有规则: {existing_rule_signatures}")
-            self.logger.info(f"  新规则: {new_rule_signatures}")
+            if self.compiler.uses_ipset(rule):
+                self._set_ipset_element(rule, add=False)
+                self.logger.info(f"移除防火墙规则(ipset): {rule}")
+                return True
 
-        return rules_changed
+            if self.subchains:
+                subchain_rule = self.compiler.subchain_rule(rule, "-D", kind)
+                if self._rule_exists(self.config.ip6tables_cmd, subchain_rule):
+                    self._queue_rule(self.config.ip6tables_cmd, subchain_rule)
+                    self.logger.info(f"移除防火墙规则(子链): {rule}")
+                return True
 
-    def _remove_firewall_rule(self, rule: FirewallRule) -> bool:
-        """移除单条防火墙规则"""
-        try:
             # 构建ip6tables规则（先检查是否存在）
-            check_rule = [
-                "-C", self.config.chain_name,
-                "-p", rule.protocol,
-                "-d", rule.ipv6_address,
-                "--dport", str(rule.port),
-                "-i", rule.interface_in,
-                "-o", rule.interface_out,
-                "-j", "ACCEPT",
-                "-m", "comment", "--comment", f"Container:{rule.container_name}"
-            ]
+            delete_rule = self.compiler.firewall_rule(rule, "-D", kind)
 
             # 先检查规则是否存在
-            check_result = subprocess.run(["ip6tables"] + check_rule,
-                                        capture_output=True, text=True)
-
-            if check_result.returncode == 0:
+            if self._rule_exists(self.config.ip6tables_cmd, delete_rule):
                 # 规则存在，执行删除
-                delete_rule = [r.replace("-C", "-D") if r == "-C" else r for r in check_rule]
-                subprocess.run(["ip6tables"] + delete_rule, check=True)
+                self._queue_rule(self.config.ip6tables_cmd, delete_rule)
                 self.logger.info(f"移除防火墙规则: {rule}")
                 return True
             else:
@@ -1062,84 +946,123 @@ class FirewallManager:
         """清理所有规则"""
         self.logger.info("清理所有防火墙规则")
 
-        # 方法1：尝试根据内存记录删除容器规则
-        for container_id in list(self.active_rules.keys()):
-            self.remove_container_rules(container_id)
+        # 规则可能已被外部修改，按内核当前状态清理
+        self.invalidate_rulesets()
 
-        # 方法2：强制清空所有链（确保彻底清理IPv4和IPv6）
-        self._flush_all_chains()
+        # 每个步骤单独提交：一步失败只记录日志，不影响后续步骤
+        try:
+            # 方法1：尝试根据内存记录删除容器规则
+            self._cleanup_all_container_rules()
 
-        # 方法3：清理IPv6基础规则
-        self._cleanup_ipv6_base_rules()
+            # 方法2：强制清空所有链（确保彻底清理IPv4和IPv6）
+            self._flush_all_chains()
 
-        # 清理Service规则
-        self._cleanup_all_service_rules()
+            # 方法3：清理IPv6基础规则
+            self._cleanup_ipv6_base_rules()
 
-        # 清空内存记录
-        self.active_rules.clear()
-        self.active_service_rules.clear()
+            # 清理Service规则
+            self._cleanup_all_service_rules()
+
+            # 删除ipset集合（在清空引用它们的链之后执行）
+            self._cleanup_ipsets()
+        finally:
+            # 清空内存记录
+            self.registry.clear()
+            self.close_applier()
         self.logger.info("防火墙规则清理完成")
+
+    def _cleanup_all_container_rules(self):
+        """根据内存记录删除所有容器规则（一次提交）"""
+        try:
+            with self.batch():
+                for _, container_id in self.registry.keys((RuleRegistry.CONTAINER,)):
+                    self.remove_container_rules(container_id)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"删除容器规则失败: {self._describe_error(e)}")
+
+    def _cleanup_ipsets(self):
+        """删除ipset集合，等引用它们的规则删除后执行"""
+        if self.ipset is None:
+            return
+        try:
+            with self.batch() as transaction:
+                for line in self.ipset.teardown_script():
+                    transaction.add_ipset(line, post=True)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"删除ipset集合失败: {self._describe_error(e)}")
+
+    def shutdown(self):
+        """服务停止：热重启模式下保留规则供下次启动接管，否则清理所有规则"""
+        if self.config.warm_restart:
+            self.close_applier()
+            self.logger.info("热重启模式：保留防火墙规则，下次启动时接管")
+            return
+        self.cleanup()
+
+    def _applier_failed(self, error: subprocess.CalledProcessError):
+        """常驻restore进程报告之前写入的变更失败：重新读取快照，由规则同步修复"""
+        self.invalidate_rulesets()
+        if self.resync_hook is not None:
+            self.resync_hook()
+
+    def close_applier(self):
+        """结束常驻restore进程，等待已写入的变更全部处理完"""
+        if self.applier is None:
+            return
+        try:
+            self.applier.close()
+        except subprocess.CalledProcessError as e:
+            self.invalidate_rulesets()
+            self.logger.error(f"常驻规则提交进程报告失败: {e.stderr}")
             
     def get_active_rules_count(self) -> int:
         """获取活跃规则数量"""
-        return sum(len(rules) for rules in self.active_rules.values())
+        return self.registry.rule_count((RuleRegistry.CONTAINER,))
 
     def list_active_rules(self) -> List[FirewallRule]:
         """列出所有活跃规则"""
         all_rules = []
-        for rules in self.active_rules.values():
+        for _, rules in self.registry.items((RuleRegistry.CONTAINER,)):
             all_rules.extend(rules)
         return all_rules
 
     def add_service_rules(self, service_id: str, service_name: str,
-                         service_ports: List[Dict], containers: List[Dict]):
-        """为Service添加防火墙和NAT规则"""
-        # 检查是否需要更新规则
-        if service_id in self.active_service_rules:
-            # 比较现有规则与新配置，如果有变化则先移除旧规则
-            if self._service_rules_changed(service_id, service_ports, containers):
-                self.logger.info(f"检测到Service {service_name} 配置变化，更新规则")
-                self.remove_service_rules(service_id)
-            else:
-                self.logger.debug(f"Service {service_name} 的规则无变化，跳过")
-                return
-
+                         service_ports: List[Dict], containers: List[Dict]) -> bool:
+        """为Service添加防火墙和NAT规则，返回规则变更是否已提交（在外层事务中时为已排队）"""
         rules = []
+        record_key = (RuleRegistry.SERVICE, service_id)
 
         for container in containers:
-            container_id = container.get('container_id')
-            container_name = container.get('container_name')
-            container_ipv6 = container.get('ipv6_address')
-
-            if not container_ipv6:
-                self.logger.warning(f"容器 {container_name} 没有IPv6地址，跳过Service规则")
-                continue
+            if not container.get('ipv6_address'):
+                self.logger.warning(f"容器 {container.get('container_name')} "
+                                    "没有IPv6地址，跳过Service规则")
+        desired = self.compiler.service_rules(service_id, service_name, service_ports,
+                                              containers)
 
-            for port_info in service_ports:
-                # 从Service inspect中动态获取协议
-                protocol = port_info.get('protocol', 'tcp').lower()
-                published_port = port_info.get('published_port')
-                target_port = port_info.get('target_port')
-
-                if published_port and target_port:
-                    rule = ServiceRule(
-                        service_id=service_id,
-                        service_name=service_name,
-                        container_id=container_id,
-                        container_name=container_name[:20], # 截断以避免过长
-                        protocol=protocol,  # 动态协议，不写死
-                        published_port=published_port,
-                        target_port=target_port,
-                        container_ipv6=container_ipv6,
-                        interface_in=self.config.parent_interface,
-                        interface_out=self.config.gateway_macvlan
-                    )
+        try:
+            with self.batch():
+                # 检查是否需要更新规则
+                if record_key in self.registry:
+                    # 比较现有规则与新配置，如果有变化则先移除旧规则
+                    if self._record_changed(record_key,
+                                            {rule.signature for rule in desired},
+                                            f"Service {service_id} 规则变化检测:"):
+                        self.logger.info(f"检测到Service {service_name} 配置变化，更新规则")
+                        self.remove_service_rules(service_id)
+                    else:
+                        self.logger.debug(f"Service {service_name} 的规则无变化，跳过")
+                        return True
 
+                for rule in desired:
                     if self._add_service_rule(rule):
                         rules.append(rule)
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"提交Service {service_name} 的规则失败: "
+                              f"{self._describe_error(e)}")
+            return False
 
         if rules:
-            self.active_service_rules[service_id] = rules
+            self.registry.set(record_key, rules)
             self.logger.info(f"为Service {service_name} 添加了 {len(rules)} 条规则")
 
             # 记录详细的规则信息便于调试
@@ -1147,90 +1070,26 @@ class FirewallManager:
                 self.logger.debug(f"  Service规则: {rule.protocol}:{rule.published_port}->{rule.target_port} -> {rule.container_ipv6}")
         else:
             self.logger.debug(f"Service {service_name} 没有生成有效规则")
-
-    def _service_rules_changed(self, service_id: str, new_service_ports: List[Dict],
-                              new_containers: List[Dict]) -> bool:
-        """检测Service规则是否发生变化"""
-        if service_id not in self.active_service_rules:
-            return True  # 没有现有规则，需要添加
-
-        existing_rules = self.active_service_rules[service_id]
-
-        # 构建新规则的特征集合用于比较
-        new_rule_signatures = set()
-        for container in new_containers:
-            container_ipv6 = container.get('ipv6_address')
-            if not container_ipv6:
-                continue
-
-            for port_info in new_service_ports:
-                protocol = port_info.get('protocol', 'tcp').lower()
-                published_port = port_info.get('published_port')
-                target_port = port_info.get('target_port')
-
-                if published_port and target_port:
-                    # 创建规则特征：协议_发布端口_目标端口_容器IPv6
-                    signature = f"{protocol}_{published_port}_{target_port}_{container_ipv6}"
-                    new_rule_signatures.add(signature)
-
-        # 构建现有规则的特征集合
-        existing_rule_signatures = set()
-        for rule in existing_rules:
-            signature = f"{rule.protocol}_{rule.published_port}_{rule.target_port}_{rule.container_ipv6}"
-            existing_rule_signatures.add(signature)
-
-        # 比较两个集合是否相同
-        rules_changed = new_rule_signatures != existing_rule_signatures
-
-        if rules_changed:
-            self.logger.info(f"Service {service_id} 规则变化检测:")
-            self.logger.info(f"  现有规则: {existing_rule_signatures}")
-            self.logger.info(f"  新规则: {new_rule_signatures}")
-
-        return rules_changed
-
-    def _build_service_forward_rule(self, rule: ServiceRule, action: str) -> List[str]:
-        """构建Service FORWARD规则"""
-        # 注意: FORWARD链是在PREROUTING(DNAT)之后处理的
-        # 因此这里需要匹配转换后的目标端口(target_port)，而不是发布端口(published_port)
-        return [
-            action, self.config.chain_name,
-            "-p", rule.protocol,
-            "-d", rule.container_ipv6,  # 添加目标地址
-            "--dport", str(rule.target_port), #这是修复点
-            "-i", rule.interface_in,
-            "-o", rule.interface_out,
-            "-j", "ACCEPT",
-            "-m", "comment", "--comment", f"Svc:{rule.service_name} {rule.published_port}->{rule.target_port}"
-        ]
-
-    def _build_service_nat_rule(self, rule: ServiceRule, action: str) -> List[str]:
-        """构建Service NAT规则 - 统一的规则构建逻辑"""
-        return [
-            "-t", "nat",
-            action, self.config.nat_chain_name,
-            "-i", rule.interface_in,
-            "-d", rule.container_ipv6,
-            "-p", rule.protocol,
-            "--dport", str(rule.published_port),
-            "-j", "DNAT",
-            "--to-destination", f"[{rule.container_ipv6}]:{rule.target_port}",
-            "-m", "comment", "--comment", f"Svc:{rule.service_name} {rule.published_port}->{rule.target_port}"
-        ]
+        return True
 
     def _add_service_rule(self, rule: ServiceRule) -> bool:
         """添加单条Service规则（FORWARD + NAT）"""
         try:
+            if self.nft is not None:
+                self._set_nft_elements(self.nft.service_rule_elements(rule), add=True)
+                self.logger.info(f"添加Service规则(nftables): {rule}")
+                return True
+
             # 1. 添加FORWARD规则
-            forward_rule = self._build_service_forward_rule(rule, "-A")
-            if not self._rule_exists("ip6tables", forward_rule):
-                subprocess.run(["ip6tables"] + forward_rule, check=True)
+            forward_rule = self.compiler.service_forward_rule(rule, "-A")
+            if not self._rule_exists(self.config.ip6tables_cmd, forward_rule):
+                self._queue_rule(self.config.ip6tables_cmd, forward_rule)
                 self.logger.info(f"添加Service FORWARD规则: {rule}")
 
             # 2. 添加NAT规则
-            nat_rule = self._build_service_nat_rule(rule, "-A")
-            if not self._rule_exists("ip6tables", nat_rule):
-                subprocess.run(["ip6tables"] + nat_rule, check=True)
+            nat_rule = self.compiler.service_nat_rule(rule, "-A")
+            if not self._rule_exists(self.config.ip6tables_cmd, nat_rule):
+                self._queue_rule(self.config.ip6tables_cmd, nat_rule)
                 self.logger.info(f"添加Service NAT规则: {rule.protocol}/{rule.published_port}->{rule.target_port}")
 
             return True
@@ -1240,33 +1099,82 @@ class FirewallManager:
             return False
 
     def remove_service_rules(self, service_id: str):
-        """移除Service的防火墙和NAT规则"""
-        if service_id not in self.active_service_rules:
+        """移除Service的防火墙和NAT规则（service_id 可以是 `<容器ID>_public` / `<容器ID>_custom`）"""
+        record_key = RuleRegistry.key_for_id(service_id)
+        rules = self.registry.get(record_key)
+        if not rules:
+            self.registry.remove(record_key)
             return
 
-        rules = self.active_service_rules[service_id]
         removed_count = 0
 
-        for rule in rules:
-            if self._remove_service_rule(rule):
-                removed_count += 1
+        try:
+            with self.batch():
+                released = self._released_subchains(
+                    {rule.container_ipv6 for rule in rules
+                     if self.compiler.service_forward_only(rule)}, record_key)
+                for rule in rules:
+                    if (self.compiler.service_forward_only(rule)
+                            and rule.container_ipv6 in released):
+                        removed_count += 1
+                    elif self._remove_service_rule(rule):
+                        removed_count += 1
+                for ipv6_address in released:
+                    self._drop_subchain(ipv6_address)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"提交Service {rules[0].service_name} 的规则删除失败: "
+                                f"{self._describe_error(e)}")
+            removed_count = 0
 
-        del self.active_service_rules[service_id]
+        self.registry.remove(record_key)
         self.logger.info(f"移除Service {rules[0].service_name} 的 {removed_count} 条规则")
 
+    def prune_service_rules(self, service_id: str, container_ids: Set[str]) -> int:
+        """删除Service记录中属于指定容器的规则，保留其余规则，返回删除数量"""
+        record_key = RuleRegistry.key_for_id(service_id)
+        rules = self.registry.get(record_key)
+        stale = [rule for rule in rules if rule.container_id in container_ids]
+        if not stale:
+            return 0
+        if len(stale) == len(rules):
+            self.remove_service_rules(service_id)
+            return len(stale)
+
+        try:
+            with self.batch():
+                for rule in stale:
+                    self._remove_service_rule(rule)
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"提交Service {rules[0].service_name} 的规则删除失败: "
+                                f"{self._describe_error(e)}")
+
+        self.registry.set(record_key, [rule for rule in rules
+                                       if rule.container_id not in container_ids])
+        return len(stale)
+
     def _remove_service_rule(self, rule: ServiceRule) -> bool:
         """移除单条Service规则（FORWARD + NAT）"""
+        if self.compiler.service_forward_only(rule):
+            # 添加时走的是容器规则路径，删除也必须匹配容器规则
+            forward_rule = self.compiler.service_as_firewall_rule(rule)
+            return self._remove_firewall_rule(forward_rule, RuleRegistry.CUSTOM)
+
+        if self.nft is not None:
+            try:
+                self._set_nft_elements(self.nft.service_rule_elements(rule), add=False)
+                self.logger.info(f"移除Service规则(nftables): {rule}")
+                return True
+            except subprocess.CalledProcessError as e:
+                self.logger.warning(f"移除Service规则失败(nftables): {rule}, 错误: {e}")
+                return False
+
         success = True
 
         try:
             # 1. 移除FORWARD规则
-            forward_check = self._build_service_forward_rule(rule, "-C")
-            check_result = subprocess.run(["ip6tables"] + forward_check,
-                                        capture_output=True, text=True)
-
-            if check_result.returncode == 0:
-                forward_delete = self._build_service_forward_rule(rule, "-D")
-                subprocess.run(["ip6tables"] + forward_delete, check=True)
+            forward_delete = self.compiler.service_forward_rule(rule, "-D")
+            if self._rule_exists(self.config.ip6tables_cmd, forward_delete):
+                self._queue_rule(self.config.ip6tables_cmd, forward_delete)
                 self.logger.info(f"移除Service FORWARD规则: {rule}")
             else:
                 self.logger.debug(f"Service FORWARD规则不存在: {rule}")
@@ -1277,13 +1185,9 @@ class FirewallManager:
 
         try:
             # 2. 移除NAT规则
-            nat_check = self._build_service_nat_rule(rule, "-C")
-            check_result = subprocess.run(["ip6tables"] + nat_check,
-                                        capture_output=True, text=True)
-
-            if check_result.returncode == 0:
-                nat_delete = self._build_service_nat_rule(rule, "-D")
-                subprocess.run(["ip6tables"] + nat_delete, check=True)
+            nat_delete = self.compiler.service_nat_rule(rule, "-D")
+            if self._rule_exists(self.config.ip6tables_cmd, nat_delete):
+                self._queue_rule(self.config.ip6tables_cmd, nat_delete)
                 self.logger.info(f"移除Service NAT规则: {rule.protocol}/{rule.published_port}->{rule.target_port}")
             else:
                 self.logger.debug(f"Service NAT规则不存在: {rule}")
@@ -1296,156 +1200,224 @@ class FirewallManager:
 
     def _cleanup_all_service_rules(self):
         """清理所有Service规则"""
-        if not self.active_service_rules:
+        service_keys = self.registry.keys(RuleRegistry.SERVICE_KINDS)
+        if not service_keys:
             return
 
         self.logger.info("清理所有Service规则")
 
-        for service_id in list(self.active_service_rules.keys()):
-            self.remove_service_rules(service_id)
+        try:
+            with self.batch():
+                for record_key in service_keys:
+                    self.remove_service_rules(RuleRegistry.id_for_key(record_key))
+        except subprocess.CalledProcessError as e:
+            self.logger.warning(f"删除Service规则失败: {self._describe_error(e)}")
+
+    def _reconcile_chain(self, iptables_cmd: str, table: str, chain: str,
+                         desired: List[List[str]]) -> Tuple[int, int]:
+        """对比单条链的期望规则与快照，排队最少的增删操作，返回 (新增数, 删除数)"""
+        table_args = ["-t", table] if table != "filter" else []
+        if not self._chain_exists(iptables_cmd, chain, table):
+            self._queue_rule(iptables_cmd, table_args + ["-N", chain])
+        entries = self._ruleset(iptables_cmd).chain_entries(chain, table)
+        actual = Counter(key for key, _ in entries)
+
+        added = 0
+        desired_keys = set()
+        for rule in desired:
+            key = rule_key(split_rule(rule)[3])
+            if key in desired_keys:
+                continue
+            desired_keys.add(key)
+            if actual[key] > 0:
+                actual[key] -= 1
+            else:
+                self._queue_rule(iptables_cmd, rule)
+                self.logger.info(f"补充缺失规则: {' '.join(rule)}")
+                added += 1
+
+        removed = 0
+        for key, spec in self._ruleset(iptables_cmd).chain_entries(chain, table):
+            if actual[key] > 0:
+                actual[key] -= 1
+                self._queue_rule(iptables_cmd, table_args + ["-D", chain] + spec)
+                owner = rule_owner(spec)
+                if owner is not None:
+                    self.logger.info(f"删除多余规则: {chain} {' '.join(spec)} "
+                                     f"(来源 {owner.kind}, 容器 {owner.container_prefix})")
+                else:
+                    self.logger.info(f"删除多余规则: {chain} {' '.join(spec)}")
+                removed += 1
+
+        return added, removed
+
+    def sync_rules_with_reality(self) -> Tuple[int, int]:
+        """同步内存中的规则状态与实际防火墙规则
 
-    def sync_rules_with_reality(self):
-        """同步内存中的规则状态与实际防火墙规则"""
+        由内存中的容器/Service状态构建专用链的完整期望规则，与重新读取的规则快照对比，
+        在一个事务中只提交缺失规则的添加和多余规则的删除。返回 (新增数, 删除数)。
+        """
         self.logger.info("同步防火墙规则状态")
 
+        # 定期同步用于发现外部修改，重新读取规则快照
+        self.invalidate_rulesets()
+        for iptables_cmd in (self.config.ip6tables_cmd, self.config.iptables_cmd):
+            if not self._ruleset(iptables_cmd).ensure_loaded():
+                self.logger.warning(f"无法读取 {iptables_cmd} 规则快照，跳过规则同步")
+                return 0, 0
+
+        added = removed = 0
         try:
-            # 获取当前链中的所有规则
-            result = subprocess.run(["ip6tables", "-L", self.config.chain_name, "-n", "--line-numbers"],
-                                  capture_output=True, text=True)
+            with self.batch():
+                # 链本身和内置链中的跳转规则
+                self._ensure_all_chains_exist()
+                self._ensure_container_isolation_rules()
+
+                # 由内存中的规则记录编译期望状态，后端只对比并提交差异
+                compiled = self.compiler.compile_records(self.registry.items())
+                desired_rules = compiled.chains
+                for (iptables_cmd, table, chain), desired in desired_rules.items():
+                    chain_added, chain_removed = self._reconcile_chain(
+                        iptables_cmd, table, chain, desired)
+                    added += chain_added
+                    removed += chain_removed
+
+                # 不再对应任何容器地址的子链（引用已在主链对比中删除）
+                ip6_ruleset = self._ruleset(self.config.ip6tables_cmd)
+                for subchain in ip6_ruleset.chains_with_prefix(self.SUBCHAIN_PREFIX):
+                    subchain_key = (self.config.ip6tables_cmd, "filter", subchain)
+                    if subchain_key not in desired_rules:
+                        self._queue_rule(self.config.ip6tables_cmd, ["-F", subchain])
+                        self._queue_rule(self.config.ip6tables_cmd, ["-X", subchain])
+                        self.logger.info(f"删除陈旧容器子链: {subchain}")
+                        removed += 1
+
+                # 集合/映射元素（nftables、ipset模式）
+                if self.nft is not None:
+                    element_added, element_removed = self._reconcile_nft_elements(
+                        compiled.nft_elements)
+                elif self.ipset is not None:
+                    element_added, element_removed = self._reconcile_ipset_elements(
+                        compiled.ipset_elements)
+                else:
+                    element_added = element_removed = 0
+                added += element_added
+                removed += element_removed
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"提交规则同步失败: {self._describe_error(e)}")
+            return 0, 0
 
+        if added or removed:
+            metrics.RECONCILE_DRIFT.inc(added, action="added")
+            metrics.RECONCILE_DRIFT.inc(removed, action="removed")
+            self.logger.warning(f"已修复规则漂移: 补充 {added} 条, 删除 {removed} 条")
+        else:
+            self.logger.info("规则状态一致")
+
+        if self.nft is not None:
+            self.logger.info(f"nftables模式: 放行集合 {self.nft.count(self.nft.ALLOW_SET)} "
+                             f"个元素, DNAT映射 {self.nft.count(self.nft.DNAT_MAP)} 个元素")
+
+        return added, removed
+
+    def _reconcile_nft_elements(self, desired: Dict) -> Tuple[int, int]:
+        """对比nftables元素的内存模型与期望元素，返回 (新增数, 删除数)"""
+        stale = [(key, value) for key, value in self.nft.elements.items()
+                 if key not in desired]
+        missing = [(key, value) for key, value in desired.items()
+                   if self.nft.lookup(key) != value]
+        self._set_nft_elements(stale, add=False)
+        self._set_nft_elements(missing, add=True)
+        return len(missing), len(stale)
+
+    def _reconcile_ipset_elements(self, desired: Set) -> Tuple[int, int]:
+        """读取ipset集合内容，与期望元素对比，返回 (新增数, 删除数)"""
+        current = set()
+        for protocol in self.ipset.PROTOCOLS:
+            with metrics.backend_call(self.ipset.save_command(protocol)):
+                result = subprocess.run(self.ipset.save_command(protocol),
+                                        capture_output=True, text=True)
             if result.returncode != 0:
-                self.logger.warning("无法读取防火墙规则，可能链不存在")
-                return
+                self.logger.warning(f"无法读取ipset集合 {self.ipset.set_name(protocol)}，"
+                                    "跳过元素同步")
+                return 0, 0
+            current |= self.ipset.parse_save(result.stdout)
+
+        with self.batch() as transaction:
+            for element in sorted(current - desired):
+                transaction.add_ipset(self.ipset.command(element, add=False))
+            for element in sorted(desired - current):
+                transaction.add_ipset(self.ipset.command(element, add=True))
+        return len(desired - current), len(current - desired)
+
+    @staticmethod
+    def _force_cleanup_target(spec: List[str], subchains: List[str]) -> bool:
+        """主FORWARD链中需要强制清理的规则：带归属标签的容器/Service规则和到子链的分发规则
+
+        旧版本生成的规则没有标签，按注释前缀识别。
+        """
+        if rule_owner(spec) is not None:
+            return True
+        if "-j" in spec[:-1] and spec[spec.index("-j") + 1] in subchains:
+            return True
+        comment = rule_comment(spec) or ""
+        return "--dport" in spec and comment.startswith(("Container:", "Svc:"))
 
-            current_rules = result.stdout
-            self.logger.debug(f"当前防火墙规则:\n{current_rules}")
+    def force_cleanup_all_container_rules(self):
+        """强制清理所有容器相关的规则（基于规则归属标签识别）"""
+        self.logger.info("强制清理所有容器规则")
 
-            # 收集所有已知的容器IPv6地址和端口
-            known_container_ips = set()
-            known_container_ports = set()
-            for rules in self.active_rules.values():
-                for rule in rules:
-                    known_container_ips.add(rule.ipv6_address)
-                    known_container_ports.add(str(rule.port))
+        if self.nft is not None:
+            try:
+                with self.batch() as transaction:
+                    transaction.reset_nft(self.nft.flush_script())
+                self.logger.info("强制清理完成，已清空nftables放行集合和DNAT映射")
+            except subprocess.CalledProcessError as e:
+                self.logger.error(f"强制清理nftables元素失败: {self._describe_error(e)}")
+            self.registry.clear((RuleRegistry.CONTAINER,))
+            return
 
-            # 收集所有已知的Service IPv6地址和发布端口
-            known_service_ips = set()
-            known_service_ports = set()
-            for rules in self.active_service_rules.values():
-                for rule in rules:
-                    known_service_ips.add(rule.container_ipv6)
-                    known_service_ports.add(str(rule.published_port))
-
-            # 调试信息
-            self.logger.debug(f"已知容器IP: {known_container_ips}")
-            self.logger.debug(f"已知容器端口: {known_container_ports}")
-            self.logger.debug(f"已知Service IP: {known_service_ips}")
-            self.logger.debug(f"已知Service端口: {known_service_ports}")
-
-            # 分别统计容器规则和Service规则
-            lines = current_rules.split('\n')
-            container_rule_count = 0
-            service_rule_count = 0
-
-            for line in lines:
-                # 检查是否包含端口规则（支持所有协议）
-                if ' dpt:' in line and 'ACCEPT' in line:
-                    # 提取目标地址和端口
-                    parts = line.strip().split()
-                    if len(parts) >= 6:
-                        destination = parts[5] if len(parts) > 5 else ""
-
-                        # 查找端口信息
-                        port_info = ""
-                        for part in parts:
-                            if 'dpt:' in part:
-                                port_info = part
-                                break
-
-                        if port_info:
-                            port = port_info.split('dpt:')[1] if 'dpt:' in port_info else ""
-
-                            # 调试信息
-                            self.logger.debug(f"解析规则: 目标={destination}, 端口={port}")
-
-                            # 判断是容器规则还是Service规则
-                            if destination in known_container_ips and port in known_container_ports:
-                                container_rule_count += 1
-                                self.logger.debug(f"识别为容器规则: {destination}:{port}")
-                            elif destination in known_service_ips and port in known_service_ports:
-                                service_rule_count += 1
-                                self.logger.debug(f"识别为Service规则: {destination}:{port}")
-                            else:
-                                self.logger.debug(f"未识别规则: {destination}:{port}")
-
-            # 统计内存中的规则数量
-            memory_container_count = sum(len(rules) for rules in self.active_rules.values())
-            memory_service_count = sum(len(rules) for rules in self.active_service_rules.values())
-
-            # 分别检查容器规则和Service规则的一致性
-            container_consistent = container_rule_count == memory_container_count
-            service_consistent = service_rule_count == memory_service_count
-
-            if container_consistent and service_consistent:
-                self.logger.info(f"规则状态一致: {container_rule_count}条容器规则, {service_rule_count}条Service规则")
-            else:
-                if not container_consistent:
-                    self.logger.warning(f"容器规则不一致: 防火墙中有{container_rule_count}条，内存中记录{memory_container_count}条")
-                if not service_consistent:
-                    self.logger.warning(f"Service规则不一致: 防火墙中有{service_rule_count}条，内存中记录{memory_service_count}条")
-                self.logger.info("建议重启服务以确保状态一致")
+        if self.ipset is not None:
+            try:
+                with self.batch() as transaction:
+                    for line in self.ipset.flush_script():
+                        transaction.add_ipset(line)
+                self.logger.info("已清空ipset放行集合")
+            except subprocess.CalledProcessError as e:
+                self.logger.error(f"清空ipset集合失败: {self._describe_error(e)}")
 
-        except Exception as e:
-            self.logger.error(f"同步规则状态失败: {e}")
+        iptables_cmd = self.config.ip6tables_cmd
+        chain_name = self.config.chain_name
 
-    def force_cleanup_all_container_rules(self):
-        """强制清理所有容器相关的规则（基于规则特征识别）"""
-        self.logger.info("强制清理所有容器规则")
+        # 一次save读取当前规则，按归属标签筛选出本程序生成的规则
+        ruleset = self._ruleset(iptables_cmd)
+        ruleset.invalidate()
+        if not ruleset.ensure_loaded():
+            self.logger.warning("无法读取防火墙规则快照")
+            return
+        if not ruleset.has_chain(chain_name):
+            self.logger.debug(f"防火墙链 {chain_name} 不存在")
+            return
 
+        deleted_count = 0
         try:
-            # 检查链是否存在
-            check_result = subprocess.run(["ip6tables", "-L", self.config.chain_name],
-                                        capture_output=True, text=True)
-            if check_result.returncode != 0:
-                self.logger.debug(f"防火墙链 {self.config.chain_name} 不存在")
-                return
-
-            # 获取当前链中的所有规则
-            result = subprocess.run(["ip6tables", "-L", self.config.chain_name, "-n", "--line-numbers"],
-                                  capture_output=True, text=True)
-
-            if result.returncode != 0:
-                self.logger.warning("无法获取防火墙规则列表")
-                return
-
-            lines = result.stdout.split('\n')
-            deleted_count = 0
-
-            # 从后往前删除（避免行号变化）
-            for line in reversed(lines):
-                # 只删除容器和Service规则（有端口特征的）
-                if ' dpt:' in line and 'ACCEPT' in line:
-                    # 提取行号
-                    parts = line.strip().split()
-                    if parts and parts[0].isdigit():
-                        line_num = parts[0]
-                        try:
-                            # 再次确认规则存在后删除
-                            check_cmd = ["ip6tables", "-L", self.config.chain_name, line_num]
-                            check_result = subprocess.run(check_cmd, capture_output=True, text=True)
-
-                            if check_result.returncode == 0:
-                                subprocess.run(["ip6tables", "-D", self.config.chain_name, line_num],
-                                             check=True, capture_output=True)
-                                self.logger.info(f"删除容器规则行 {line_num}: {line.strip()}")
-                                deleted_count += 1
-                        except subprocess.CalledProcessError as e:
-                            self.logger.warning(f"删除规则行 {line_num} 失败: {e}")
+            # 按规则内容删除（不依赖行号），非本程序的规则保持不变，所有删除一次原子提交
+            with self.batch():
+                subchains = ruleset.chains_with_prefix(self.SUBCHAIN_PREFIX)
+                for _, spec in ruleset.chain_entries(chain_name):
+                    if self._force_cleanup_target(spec, subchains):
+                        self._queue_rule(iptables_cmd, ["-D", chain_name] + spec)
+                        deleted_count += 1
+
+                # 容器子链整条删除（分发规则已在上面删除）
+                for subchain in subchains:
+                    deleted_count += len(ruleset.chain_entries(subchain))
+                    self._queue_rule(iptables_cmd, ["-F", subchain])
+                    self._queue_rule(iptables_cmd, ["-X", subchain])
 
             self.logger.info(f"强制清理完成，删除了 {deleted_count} 条容器规则")
-
-        except Exception as e:
-            self.logger.error(f"强制清理容器规则失败: {e}")
+        except subprocess.CalledProcessError as e:
+            self.logger.error(f"强制清理容器规则失败: {self._describe_error(e)}")
 
         # 清空内存记录
-        self.active_rules.clear()
+        self.registry.clear((RuleRegistry.CONTAINER,))
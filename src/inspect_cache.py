@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+容器inspect缓存模块
+
+按容器ID缓存一次inspect得到的容器信息（LRU，有容量上限），由容器/网络事件使其失效。
+同一容器在一次事件处理或周期扫描中被多处读取时只访问一次Docker API。
+
+事件可能在inspect进行期间到达：写入缓存时携带inspect之前取得的版本号，
+期间该容器被失效过则丢弃本次结果，避免把旧数据写回缓存。
+
+事件丢失时（如事件流断开前的最后几个事件）缓存不会被失效，条目超过 max_age 秒后
+视为未命中，兜底的周期扫描最迟在 max_age 之后读到容器的最新状态。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+Token = Tuple[int, int]  # (纪元, 容器版本号)
+
+
+class InspectCache:
+    """容器信息的LRU缓存（线程安全）；缓存的字典由调用方只读使用"""
+
+    def __init__(self, maxsize: int = 1024, max_age: Optional[float] = None):
+        self.maxsize = maxsize
+        self.max_age = max_age  # 条目最长使用时间（秒），None表示只由事件失效
+        # 容器ID -> (写入时间, 容器信息)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Dict[str, Any]]]" = \
+            OrderedDict()
+        # 失效次数：inspect前后版本不同说明期间收到过事件
+        self._versions: Dict[Hashable, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, container_id: Hashable,
+            now: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(container_id)
+            if (entry is not None and self.max_age is not None
+                    and now - entry[0] > self.max_age):
+                # 过期条目：重新inspect（版本号不变，新结果可以写入）
+                del self._entries[container_id]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(container_id)
+            self.hits += 1
+            return entry[1]
+
+    def token(self, container_id: Hashable) -> Token:
+        """inspect之前取得的版本号，写入时校验"""
+        with self._lock:
+            return self._epoch, self._versions.get(container_id, 0)
+
+    def put(self, container_id: Hashable, info: Dict[str, Any], token: Token,
+            now: Optional[float] = None) -> bool:
+        """写入inspect结果；取得版本号之后容器被失效过则不写入，返回是否写入"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if token != (self._epoch, self._versions.get(container_id, 0)):
+                return False
+            self._entries[container_id] = (now, info)
+            self._entries.move_to_end(container_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, container_id: Hashable):
+        with self._lock:
+            self._entries.pop(container_id, None)
+            self._versions[container_id] = self._versions.get(container_id, 0) + 1
+            if len(self._versions) > self.maxsize * 4:
+                # 版本表只需覆盖进行中的inspect：整体换代代替逐个清理
+                self._versions.clear()
+                self._epoch += 1
+
+    def clear(self):
+        """全部失效（如Docker重新连接后，期间的事件可能已丢失）"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._epoch += 1
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
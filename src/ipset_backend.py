@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+ipset规则模块
+
+容器端口按协议放入 `hash:ip,port` 集合，主FORWARD链中每个协议只需一条
+`-m set --match-set` 规则，数据包的匹配开销与开放端口数量无关。
+"""
+
+from typing import List, Set, Tuple
+
+# (集合名, 元素)
+IpsetElement = Tuple[str, str]
+
+
+class IpsetBackend:
+    """按协议划分的 hash:ip,port 放行集合"""
+
+    PROTOCOLS = ("tcp", "udp")
+
+    def __init__(self, config):
+        self.config = config
+        self.prefix = config.ipset_prefix
+
+    def set_name(self, protocol: str) -> str:
+        return f"{self.prefix}_{protocol}"
+
+    def supports(self, protocol: str) -> bool:
+        """协议是否由集合承载（其他协议仍使用逐条规则）"""
+        return protocol in self.PROTOCOLS
+
+    def setup_script(self, flush: bool = True) -> List[str]:
+        """创建集合（已存在时不报错）；flush为False时保留已有元素（热重启接管）"""
+        lines = []
+        for protocol in self.PROTOCOLS:
+            name = self.set_name(protocol)
+            lines.append(f"create {name} hash:ip,port family inet6 -exist")
+            if flush:
+                lines.append(f"flush {name}")
+        return lines
+
+    def save_command(self, protocol: str) -> List[str]:
+        """读取集合内容的命令"""
+        return [self.config.ipset_cmd, "save", self.set_name(protocol)]
+
+    def parse_save(self, text: str) -> Set[IpsetElement]:
+        """解析 `ipset save` 输出中的元素"""
+        elements = set()
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) >= 3 and parts[0] == "add":
+                elements.add((parts[1], parts[2]))
+        return elements
+
+    def flush_script(self) -> List[str]:
+        """清空集合中的所有元素"""
+        return [f"flush {self.set_name(protocol)}" for protocol in self.PROTOCOLS]
+
+    def teardown_script(self) -> List[str]:
+        """删除集合（先确保存在，保证幂等）；必须在引用集合的规则删除之后执行"""
+        lines = []
+        for protocol in self.PROTOCOLS:
+            name = self.set_name(protocol)
+            lines.append(f"create {name} hash:ip,port family inet6 -exist")
+            lines.append(f"destroy {name}")
+        return lines
+
+    def match_rules(self) -> List[List[str]]:
+        """主FORWARD链中的集合匹配规则，每个协议一条"""
+        return [
+            [
+                "-A", self.config.chain_name,
+                "-i", self.config.parent_interface,
+                "-o", self.config.gateway_macvlan,
+                "-p", protocol,
+                "-m", "set", "--match-set", self.set_name(protocol), "dst,dst",
+                "-j", "ACCEPT",
+                "-m", "comment", "--comment", f"ipset:{self.set_name(protocol)}"
+            ]
+            for protocol in self.PROTOCOLS
+        ]
+
+    def element(self, rule) -> IpsetElement:
+        """FirewallRule对应的 (集合名, 元素)"""
+        element = f"{rule.ipv6_address},{rule.protocol}:{rule.port}"
+        return self.set_name(rule.protocol), element
+
+    @staticmethod
+    def command(element: IpsetElement, add: bool) -> str:
+        """元素增删命令（-exist 使重复增删不报错）"""
+        name, value = element
+        action = "add" if add else "del"
+        return f"{action} {name} {value} -exist"
+
+    def element_command(self, rule, add: bool) -> str:
+        """FirewallRule对应的元素增删命令"""
+        return self.command(self.element(rule), add)
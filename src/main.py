@@ -4,6 +4,7 @@ Docker IPv6 Firewall Manager
 自动管理Docker容器的IPv6防火墙规则
 """
 
+import os
 import sys
 import signal
 import logging
@@ -11,9 +12,13 @@ import time
 import threading
 from pathlib import Path
 
+import metrics
+import tracing
 from docker_monitor import DockerMonitor
 from firewall_manager import FirewallManager
+from rule_registry import RuleRegistry
 from config import Config
+from profiler import RuntimeProfiler
 
 
 class DockerIPv6FirewallManager:
@@ -27,11 +32,16 @@ class DockerIPv6FirewallManager:
             self._handle_invalid_config()
 
         self.setup_logging()
+        self.setup_tracing()
         self.firewall_manager = FirewallManager(self.config)
         self.docker_monitor = DockerMonitor(self.config, self.firewall_manager)
         self.running = False
         self.config_monitor_thread = None
-        
+        self.metrics_server = None
+        self.profiler = RuntimeProfiler(os.path.dirname(self.config.log_file) or ".",
+                                        duration=self.config.profile_duration,
+                                        state=self.runtime_state)
+
     def setup_logging(self):
         """设置日志"""
         logging.basicConfig(
@@ -44,6 +54,13 @@ class DockerIPv6FirewallManager:
         )
         self.logger = logging.getLogger(__name__)
 
+    def setup_tracing(self):
+        """设置调用链追踪"""
+        tracing.TRACER.configure(self.config.trace_enabled, self.config.trace_file,
+                                 self.config.trace_buffer_size)
+        if self.config.trace_enabled:
+            self.logger.info(f"调用链追踪已启用: {self.config.trace_file or '内存缓冲区'}")
+
     def _handle_invalid_config(self):
         """处理无效配置"""
         print("配置验证失败:")
@@ -82,6 +99,10 @@ class DockerIPv6FirewallManager:
                 if hasattr(self, 'logger'):
                     logger = logging.getLogger()
                     logger.setLevel(getattr(logging, self.config.log_level.upper()))
+                    self.setup_tracing()
+
+                # 新配置可能改变规则推导结果：下一轮扫描重新处理全部容器和Service
+                self.docker_monitor.forget_fingerprints()
 
             else:
                 if hasattr(self, 'logger'):
@@ -99,6 +120,49 @@ class DockerIPv6FirewallManager:
             else:
                 print(f"配置重载异常: {e}")
 
+    def profile_handler(self, signum, frame):
+        """性能剖析信号处理器（在后台线程中采样，不阻塞服务）"""
+        self.profiler.duration = self.config.profile_duration
+        if self.profiler.trigger():
+            self.logger.info(f"收到剖析信号，采样 {self.profiler.duration} 秒")
+        else:
+            self.logger.info("上一次性能剖析尚未完成，忽略剖析信号")
+
+    def runtime_state(self):
+        """剖析报告中的运行状态"""
+        # 剖析线程只读取规则下发线程发布的计数，不遍历正在修改的登记表
+        counts = self.firewall_manager.registry.counts
+        queue_stats = self.docker_monitor.apply_queue.stats()
+        state = {f"apply_queue.{key}": value for key, value in queue_stats.items()}
+        state["registry.records"] = counts.records
+        for kind in (RuleRegistry.CONTAINER, RuleRegistry.PUBLIC,
+                     RuleRegistry.CUSTOM, RuleRegistry.SERVICE):
+            state[f"registry.{kind}_rules"] = counts.rules.get(kind, 0)
+        state["threads"] = threading.active_count()
+        return state
+
+    def _start_metrics_server(self):
+        """启动指标服务（metrics_port 为0时不启动）"""
+        if not self.config.metrics_port:
+            return
+        registry = self.firewall_manager.registry
+        kinds = (RuleRegistry.CONTAINER, RuleRegistry.PUBLIC,
+                 RuleRegistry.CUSTOM, RuleRegistry.SERVICE)
+
+        def rule_counts():
+            # 在指标服务线程中执行：只读取规则下发线程发布的计数
+            counts = registry.counts.rules
+            return {(kind,): counts.get(kind, 0) for kind in kinds}
+
+        metrics.RULES.set_function(rule_counts)
+        try:
+            self.metrics_server = metrics.MetricsServer(self.config.metrics_address,
+                                                        self.config.metrics_port)
+            self.metrics_server.start()
+        except OSError as e:
+            self.metrics_server = None
+            self.logger.error(f"启动指标服务失败: {e}")
+
     def _start_config_monitor(self):
         """启动配置文件监控线程"""
         self.config_monitor_thread = threading.Thread(target=self._monitor_config_changes)
@@ -116,8 +180,8 @@ class DockerIPv6FirewallManager:
 
                     if success:
                         self.logger.info("配置重新加载成功")
-                        # 这里可以添加配置变化后的处理逻辑
-                        # 例如重新初始化某些组件
+                        # 下一轮扫描按新配置重新处理全部容器和Service
+                        self.docker_monitor.forget_fingerprints()
                     else:
                         self.logger.error("配置重新加载失败:")
                         for error in errors:
@@ -137,6 +201,7 @@ class DockerIPv6FirewallManager:
         signal.signal(signal.SIGTERM, self.signal_handler)
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGHUP, self.reload_config_handler)
+        signal.signal(signal.SIGUSR1, self.profile_handler)
         
         try:
             # 再次检查配置（可能在setup_logging后有更新）
@@ -145,14 +210,17 @@ class DockerIPv6FirewallManager:
                 for error in self.config.get_validation_errors():
                     self.logger.warning(f"  - {error}")
 
+            # 启动指标服务（覆盖启动过程的命令调用）
+            self._start_metrics_server()
+
             # 初始化防火墙规则
             self.firewall_manager.initialize()
 
             # 启动Docker监控
             self.docker_monitor.start()
 
-            # 同步规则状态
-            self.firewall_manager.sync_rules_with_reality()
+            # 同步规则状态（在规则应用线程中执行）
+            self.docker_monitor.sync_rules(wait=True)
 
             # 启动配置监控
             self._start_config_monitor()
@@ -173,7 +241,7 @@ class DockerIPv6FirewallManager:
             # 确保在任何情况下都会清理
             if hasattr(self, 'firewall_manager'):
                 try:
-                    self.firewall_manager.cleanup()
+                    self.firewall_manager.shutdown()
                 except:
                     pass
             
@@ -189,10 +257,16 @@ class DockerIPv6FirewallManager:
         if hasattr(self, 'docker_monitor'):
             self.docker_monitor.stop()
 
+        if getattr(self, 'metrics_server', None) is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+
+        tracing.TRACER.close()
+
         # 清理防火墙规则
         if hasattr(self, 'firewall_manager'):
             try:
-                self.firewall_manager.cleanup()
+                self.firewall_manager.shutdown()
             except Exception as e:
                 if hasattr(self, 'logger'):
                     self.logger.error(f"清理防火墙规则失败: {e}")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+运行指标模块（Prometheus文本格式）
+
+只依赖标准库：计数器、仪表和直方图在进程内累计，可选的HTTP监听（默认只绑定本机）
+在 /metrics 输出Prometheus文本格式。热路径（事件到规则生效、后端命令调用）用直方图
+记录延迟分布，不依赖DEBUG日志观察性能。
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import tracing
+
+LabelValues = Tuple[str, ...]
+
+PREFIX = "docker_ipv6fw_"
+
+# 延迟直方图的默认桶（秒）：覆盖单条命令的毫秒级到全量扫描的秒级
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """指标基类：按标签值分别累计"""
+
+    TYPE = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，"
+                             f"实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_text(self, values: LabelValues,
+                    extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ""
+        text = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+        return "{" + text + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.TYPE}"] + self.samples()
+
+
+class Counter(Metric):
+    """单调递增计数器"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._labels(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        return [f"{self.name}_total{self._label_text(key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge(Metric):
+    """仪表：直接设置，或在输出时由回调函数计算（回调返回 {标签值元组: 数值}）"""
+
+    TYPE = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Optional[Callable[[], Dict[LabelValues, float]]]):
+        self._function = function
+
+    def value(self, **labels) -> float:
+        key = self._labels(labels)
+        if self._function is not None:
+            return self._function().get(key, 0)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            values = sorted(self._function().items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return [f"{self.name}{self._label_text(key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """延迟直方图（累计桶）"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # 标签值 -> (各桶计数, 总和, 总数)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            counts, total, count = (self._values.get(key)
+                                    or ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            entry = self._values.get(self._labels(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                label = self._label_text(key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{label} {cumulative}")
+            label = self._label_text(key)
+            lines.append(f"{self.name}_sum{label} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标集合"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+EVENT_APPLY_SECONDS = REGISTRY.register(Histogram(
+    "event_apply_seconds", "Docker事件到对应规则提交完成的延迟（秒）"))
+BACKEND_CALL_SECONDS = REGISTRY.register(Histogram(
+    "backend_call_seconds", "后端命令调用耗时（秒）", ["command"]))
+SUBPROCESS = REGISTRY.register(Counter(
+    "subprocess", "启动的子进程数量", ["command"]))
+RULES = REGISTRY.register(Gauge(
+    "rules", "内存登记表中的规则数量", ["kind"]))
+SCAN_SECONDS = REGISTRY.register(Histogram(
+    "scan_seconds", "周期扫描耗时（秒，含规则同步）"))
+DOCKER_RECONNECTS = REGISTRY.register(Counter(
+    "docker_reconnects", "Docker socket重新连接次数", ["result"]))
+INSPECT_CACHE = REGISTRY.register(Counter(
+    "inspect_cache_lookups", "容器inspect缓存查询次数", ["result"]))
+RECONCILE_DRIFT = REGISTRY.register(Counter(
+    "reconcile_drift_rules", "规则同步发现并修复的漂移规则数", ["action"]))
+SCAN_TARGETS = REGISTRY.register(Counter(
+    "scan_targets", "周期扫描检查的容器和Service数（result: processed 重新处理, unchanged 指纹未变跳过）",
+    ["kind", "result"]))
+
+
+def command_name(cmd: Sequence[str]) -> str:
+    """指标标签使用的命令名（去掉路径前缀）"""
+    return os.path.basename(cmd[0]) if cmd else ""
+
+
+@contextmanager
+def backend_call(cmd: Sequence[str], spawn: bool = True):
+    """记录一次后端命令调用的耗时（指标和追踪span）；spawn为True时同时计入子进程数"""
+    command = command_name(cmd)
+    if spawn:
+        SUBPROCESS.inc(command=command)
+    with tracing.span(f"backend {command}", command=command, spawn=spawn), \
+            BACKEND_CALL_SECONDS.time(command=command):
+        yield
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(f"指标请求: {format % args}")
+
+
+class MetricsServer:
+    """在后台线程中提供 /metrics 的HTTP服务"""
+
+    def __init__(self, address: str = "127.0.0.1", port: int = 9464,
+                 registry: MetricsRegistry = REGISTRY):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+        self._server = ThreadingHTTPServer((address, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="metrics-server")
+        self._thread.daemon = True
+        self._thread.start()
+        address, port = self._server.server_address[:2]
+        self.logger.info(f"指标服务已启动: http://{address}:{port}/metrics")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
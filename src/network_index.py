@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Docker网络索引模块
+
+网络名 -> 驱动类型的索引，由一次 networks.list 建立，之后由 network create/destroy
+事件增量维护。"是否监控该网络"的判断（驱动类型在 monitored_networks 中）是一次
+字典查找，DockerMonitor 和 RuleCompiler 共用同一个索引，两处的结论总是一致。
+
+索引尚未建立（或网络未知）时回退为按网络名匹配 monitored_networks
+（如名为 macvlan_net 的网络视为 macvlan），与旧版本规则编译器的行为相同。
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+
+class NetworkIndex:
+    """网络名 -> 驱动类型（线程安全）"""
+
+    def __init__(self, config):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._drivers: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.version = 0  # 每次内容变化加一（规则编译缓存的一部分）
+
+    def load(self, client) -> bool:
+        """用一次 networks.list 重建索引，失败时保留旧内容"""
+        try:
+            networks = client.networks.list()
+        except Exception as e:
+            self.logger.error(f"读取Docker网络列表失败: {e}")
+            return False
+
+        drivers = {}
+        for network in networks:
+            attrs = network.attrs or {}
+            name = attrs.get('Name') or network.name
+            if name:
+                drivers[name] = attrs.get('Driver', '')
+        with self._lock:
+            if drivers != self._drivers or not self.loaded:
+                self._drivers = drivers
+                self.version += 1
+            self.loaded = True
+        self.logger.debug(f"网络索引已建立: {len(drivers)} 个网络")
+        return True
+
+    def handle_event(self, event: Dict) -> bool:
+        """按 network create/destroy 事件更新索引，返回是否处理了该事件"""
+        action = event.get('Action')
+        attributes = event.get('Actor', {}).get('Attributes', {}) or {}
+        name = attributes.get('name')
+        if not name:
+            return False
+        if action == 'create':
+            self.set(name, attributes.get('type', ''))
+        elif action == 'destroy':
+            self.remove(name)
+        else:
+            return False
+        return True
+
+    def set(self, name: str, driver: str):
+        with self._lock:
+            if self._drivers.get(name) != driver:
+                self._drivers[name] = driver
+                self.version += 1
+
+    def remove(self, name: str):
+        with self._lock:
+            if self._drivers.pop(name, None) is not None:
+                self.version += 1
+
+    def driver(self, name: str) -> Optional[str]:
+        with self._lock:
+            return self._drivers.get(name)
+
+    def is_monitored(self, name: str) -> bool:
+        """该网络中的容器是否需要处理"""
+        driver = self._drivers.get(name)
+        if driver is not None:
+            return driver in self.config.monitored_networks
+        lowered = name.lower()
+        return any(monitored.lower() in lowered
+                   for monitored in self.config.monitored_networks)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._drivers)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+nftables规则引擎模块
+
+容器和Service的放行规则合并到一个 `ipv6_addr . inet_proto . inet_service` 集合，
+Service的DNAT规则合并到一个映射，每个数据包只做一次哈希查找。
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+# (集合/映射名, 键) -> 值（集合元素的值为空字符串）
+ElementKey = Tuple[str, str]
+
+
+class NftablesBackend:
+    """nftables集合/映射规则引擎"""
+
+    ALLOW_SET = "allowed"     # 放行集合：地址 . 协议 . 端口
+    DNAT_MAP = "svc_dnat"     # DNAT映射：地址 . 协议 . 发布端口 -> 地址 . 目标端口
+
+    def __init__(self, config):
+        self.config = config
+        self.table = config.nft_table
+        # YAML会把 0x20000000 解析为整数，统一转成十六进制字符串
+        mark = config.nft_accept_mark
+        self.mark = hex(mark) if isinstance(mark, int) else str(mark)
+        # 内核中已提交的元素（本表完全由我们管理，内存模型即权威状态）
+        self.elements: Dict[ElementKey, str] = {}
+
+    def _chain_rules(self) -> Tuple[str, str]:
+        """forward/prerouting链中的规则：(forward规则, prerouting规则)"""
+        parent = self.config.parent_interface
+        gateway = self.config.gateway_macvlan
+        return (
+            # iptables FORWARD 链（Docker 默认 DROP）通过标记放行，见 mark_accept_rule()
+            f"iifname \"{parent}\" oifname \"{gateway}\" "
+            f"ip6 daddr . meta l4proto . th dport @{self.ALLOW_SET} "
+            f"meta mark set meta mark | {self.mark}",
+            f"iifname \"{parent}\" dnat ip6 addr . port to "
+            f"ip6 daddr . meta l4proto . th dport map @{self.DNAT_MAP}",
+        )
+
+    def _table_script(self, forward_rule: str = "",
+                      prerouting_rule: str = "") -> List[str]:
+        """表定义；规则为空时只声明集合、映射和链"""
+        return [
+            f"table ip6 {self.table} {{",
+            f"    set {self.ALLOW_SET} {{ "
+            "type ipv6_addr . inet_proto . inet_service; }",
+            f"    map {self.DNAT_MAP} {{ "
+            "type ipv6_addr . inet_proto . inet_service : ipv6_addr . inet_service; }",
+            "    chain forward {",
+            "        type filter hook forward priority -10; policy accept;",
+        ] + ([f"        {forward_rule}"] if forward_rule else []) + [
+            "    }",
+            "    chain prerouting {",
+            "        type nat hook prerouting priority -100; policy accept;",
+        ] + ([f"        {prerouting_rule}"] if prerouting_rule else []) + [
+            "    }",
+            "}",
+        ]
+
+    def setup_script(self) -> str:
+        """重建nftables表的脚本（先确保表存在再删除，保证幂等）"""
+        return "\n".join([
+            f"table ip6 {self.table} {{}}",
+            f"delete table ip6 {self.table}",
+        ] + self._table_script(*self._chain_rules()))
+
+    def adopt_script(self) -> str:
+        """热重启时接管已有表的脚本：保留集合/映射元素，只在同一事务中重建链内规则"""
+        forward_rule, prerouting_rule = self._chain_rules()
+        return "\n".join(self._table_script() + [
+            f"flush chain ip6 {self.table} forward",
+            f"flush chain ip6 {self.table} prerouting",
+            f"add rule ip6 {self.table} forward {forward_rule}",
+            f"add rule ip6 {self.table} prerouting {prerouting_rule}",
+        ])
+
+    def list_command(self) -> List[str]:
+        """读取表内容（JSON格式）的命令"""
+        return [self.config.nft_cmd, "-j", "list", "table", "ip6", self.table]
+
+    @staticmethod
+    def _concat(value) -> List:
+        """JSON中的拼接键/值转换为成员列表"""
+        if isinstance(value, dict) and "elem" in value:
+            value = value["elem"].get("val")
+        if isinstance(value, dict) and "concat" in value:
+            return value["concat"]
+        return [value]
+
+    def parse_elements(self, text: str) -> Dict[ElementKey, str]:
+        """解析 `nft -j list table` 输出中的集合/映射元素"""
+        elements: Dict[ElementKey, str] = {}
+        for entry in json.loads(text).get("nftables", []):
+            for kind, name in (("set", self.ALLOW_SET), ("map", self.DNAT_MAP)):
+                body = entry.get(kind)
+                if not body or body.get("name") != name:
+                    continue
+                for elem in body.get("elem", []):
+                    if kind == "map":
+                        key_parts = self._concat(elem[0])
+                        value_parts = self._concat(elem[1])
+                        value = " . ".join(str(part) for part in value_parts)
+                    else:
+                        key_parts, value = self._concat(elem), ""
+                    if len(key_parts) == 3:
+                        elements[(name, self._key(*key_parts))] = value
+        return elements
+
+    def teardown_script(self) -> str:
+        """删除nftables表的脚本"""
+        return f"table ip6 {self.table} {{}}\ndelete table ip6 {self.table}"
+
+    def flush_script(self) -> str:
+        """清空集合和映射的脚本"""
+        return (f"flush set ip6 {self.table} {self.ALLOW_SET}\n"
+                f"flush map ip6 {self.table} {self.DNAT_MAP}")
+
+    def mark_accept_rule(self) -> List[str]:
+        """iptables主FORWARD链中唯一的放行规则：匹配nftables集合查找打上的标记"""
+        return [
+            "-A", self.config.chain_name,
+            "-i", self.config.parent_interface,
+            "-o", self.config.gateway_macvlan,
+            "-m", "mark", "--mark", f"{self.mark}/{self.mark}",
+            "-j", "ACCEPT",
+            "-m", "comment", "--comment", f"nftables:{self.table}"
+        ]
+
+    @staticmethod
+    def _key(address: str, protocol: str, port: int) -> str:
+        return f"{address} . {protocol} . {port}"
+
+    def firewall_rule_elements(self, rule) -> List[Tuple[ElementKey, str]]:
+        """FirewallRule对应的元素：放行 地址 . 协议 . 端口"""
+        key = self._key(rule.ipv6_address, rule.protocol, rule.port)
+        return [((self.ALLOW_SET, key), "")]
+
+    def service_rule_elements(self, rule) -> List[Tuple[ElementKey, str]]:
+        """ServiceRule对应的元素：放行DNAT后的目标端口 + 发布端口到目标端口的映射"""
+        # FORWARD在DNAT之后处理，放行集合中使用目标端口（与iptables规则一致）
+        return [
+            ((self.ALLOW_SET,
+              self._key(rule.container_ipv6, rule.protocol, rule.target_port)), ""),
+            ((self.DNAT_MAP,
+              self._key(rule.container_ipv6, rule.protocol, rule.published_port)),
+             f"{rule.container_ipv6} . {rule.target_port}"),
+        ]
+
+    def element_command(self, key: ElementKey, value: str, add: bool) -> str:
+        """生成单个元素的增删命令"""
+        name, element = key
+        if add:
+            element = f"{element} : {value}" if value else element
+            return f"add element ip6 {self.table} {name} {{ {element} }}"
+        return f"delete element ip6 {self.table} {name} {{ {element} }}"
+
+    def lookup(self, key: ElementKey) -> Optional[str]:
+        """查询已提交元素的值，不存在时返回None"""
+        return self.elements.get(key)
+
+    def apply_committed(self, reset: bool, changes: Dict[ElementKey, Optional[str]]):
+        """事务提交成功后更新内存模型"""
+        if reset:
+            self.elements.clear()
+        for key, value in changes.items():
+            if value is None:
+                self.elements.pop(key, None)
+            else:
+                self.elements[key] = value
+
+    def count(self, name: str) -> int:
+        """集合/映射中的元素数量"""
+        return sum(1 for key in self.elements if key[0] == name)
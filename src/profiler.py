@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+运行时性能剖析模块
+
+收到信号（SIGUSR1）后在后台线程中采集一段时间的运行状态并写入日志目录，不需要重启服务：
+- 采样剖析：按固定间隔读取所有线程的调用栈，统计 firewall_manager.py、docker_monitor.py
+  中每个函数的累计耗时（在栈中）和自身耗时（位于栈顶），平时没有任何开销
+- 所有线程的当前调用栈
+- 运行状态（变更队列深度、规则登记表大小等，由调用方提供）
+- 采样期间 tracemalloc 统计的内存分配热点
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+FunctionKey = Tuple[str, int, str]  # (文件名, 起始行号, 函数名)
+
+
+class RuntimeProfiler:
+    """按需触发的采样剖析器"""
+
+    DEFAULT_MODULES = ("firewall_manager.py", "docker_monitor.py")
+
+    def __init__(self, output_dir: str, duration: float = 10, interval: float = 0.01,
+                 modules: Sequence[str] = DEFAULT_MODULES,
+                 state: Optional[Callable[[], Dict[str, object]]] = None,
+                 top: int = 25):
+        self.output_dir = output_dir
+        self.duration = duration    # 采样时长（秒）
+        self.interval = interval    # 采样间隔（秒）
+        self.modules = tuple(modules)
+        self.state = state
+        self.top = top
+        self.logger = logging.getLogger(__name__)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def trigger(self) -> bool:
+        """开始一次剖析（信号处理函数中调用，立即返回）；上一次尚未完成时忽略"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self._run, name="profiler")
+            self._thread.daemon = True
+            self._thread.start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        try:
+            path = self.dump()
+            self.logger.info(f"性能剖析已写入: {path}")
+        except Exception as e:
+            self.logger.error(f"性能剖析失败: {e}")
+
+    def dump(self) -> str:
+        """采集并写入剖析报告，返回文件路径"""
+        started = time.time()
+        stacks = self._thread_stacks()
+        state = self.state() if self.state else {}
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            cumulative, own, samples = self._sample(time.monotonic() + self.duration)
+            allocations = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))
+        lines = [f"# 运行时剖析 {started_at} (pid {os.getpid()})", ""]
+        lines += self._format_state(state)
+        lines += self._format_profile(cumulative, own, samples)
+        lines += ["## 内存分配热点（采样期间，tracemalloc）"]
+        lines += [f"  {stat}" for stat in allocations] or ["  （无）"]
+        lines += ["", "## 线程调用栈（触发时）"] + stacks
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+        path = os.path.join(self.output_dir,
+                            f"docker-ipv6-firewall-profile-{stamp}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def _sample(self, deadline: float) -> Tuple[Counter, Counter, int]:
+        """采样所有其他线程的调用栈：返回 (累计计数, 自身计数, 采样轮数)"""
+        me = threading.get_ident()
+        cumulative: Counter = Counter()
+        own: Counter = Counter()
+        samples = 0
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                seen = set()
+                leaf = True
+                while frame is not None:
+                    code = frame.f_code
+                    key = (os.path.basename(code.co_filename), code.co_firstlineno,
+                           code.co_name)
+                    if leaf:
+                        own[key] += 1
+                        leaf = False
+                    if key not in seen:  # 递归调用只计一次
+                        seen.add(key)
+                        cumulative[key] += 1
+                    frame = frame.f_back
+            samples += 1
+            if time.monotonic() >= deadline:
+                return cumulative, own, samples
+            time.sleep(self.interval)
+
+    def _format_profile(self, cumulative: Counter, own: Counter,
+                        samples: int) -> List[str]:
+        lines = [f"## 函数耗时（{samples} 次采样，间隔 {self.interval * 1000:g}ms；"
+                 f"时间为各线程累计，包含等待）",
+                 f"  {'累计(s)':>9} {'自身(s)':>9}  函数"]
+        functions = [(count, key) for key, count in cumulative.items()
+                     if key[0] in self.modules]
+        for count, key in sorted(functions, reverse=True)[:self.top]:
+            filename, lineno, name = key
+            lines.append(f"  {count * self.interval:9.2f}"
+                         f" {own[key] * self.interval:9.2f}"
+                         f"  {filename}:{lineno} {name}")
+        if not functions:
+            lines.append("  （采样期间没有线程执行这些模块）")
+        return lines + [""]
+
+    @staticmethod
+    def _format_state(state: Dict[str, object]) -> List[str]:
+        lines = ["## 运行状态"]
+        lines += [f"  {key}: {value}" for key, value in state.items()] or ["  （无）"]
+        return lines + [""]
+
+    @staticmethod
+    def _thread_stacks() -> List[str]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        lines = []
+        for ident, frame in sys._current_frames().items():
+            lines.append(f"### {names.get(ident, '?')} ({ident})")
+            lines.extend(line.rstrip("\n") for line in traceback.format_stack(frame))
+            lines.append("")
+        return lines
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+规则批量提交模块（iptables-restore事务）
+"""
+
+import subprocess
+import logging
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+
+# 之前写入的变更失败时的回调
+FailureCallback = Callable[[subprocess.CalledProcessError], None]
+
+
+def restore_command(iptables_cmd: str) -> str:
+    """由ip6tables/iptables命令推导对应的restore命令（保留路径前缀）"""
+    return f"{iptables_cmd}-restore"
+
+
+def quote_arg(arg: str) -> str:
+    """按iptables-restore的解析规则为参数加引号（注释中可能含空格）"""
+    if arg and not any(c in arg for c in ' \t"\'\\'):
+        return arg
+    return '"' + arg.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def split_rule(rule: List[str]) -> Tuple[str, str, str, List[str]]:
+    """拆分规则参数：返回 (表, 动作, 链, 其余参数)
+
+    支持 ["-t", "nat", "-A", chain, ...] 与 ["-I", chain, "1", ...] 等形式，
+    插入位置不属于规则本身，不计入其余参数。
+    """
+    table = "filter"
+    args = list(rule)
+    if len(args) >= 2 and args[0] == "-t":
+        table, args = args[1], args[2:]
+
+    action = args[0] if args else ""
+    chain = args[1] if len(args) > 1 else ""
+    spec = args[2:]
+    if action == "-I" and spec and spec[0].isdigit():
+        spec = spec[1:]
+    return table, action, chain, spec
+
+
+class RestoreSession:
+    """常驻的 `*-restore --noflush` 进程
+
+    restore逐行读取标准输入，每个COMMIT块到达时立即原子提交，因此一个进程可以
+    持续接收多批变更，不必每批重新启动。restore没有逐批的成功回执：写入不等待确认，
+    出错时进程退出并在stderr给出原因。写入下一批时发现进程已退出，说明之前写入的
+    某一批失败了（与本批无关）：通过 on_failure 回调报告，由调用方重新读取内核状态，
+    本批写入新启动的进程。需要可靠确认时调用 sync()。
+    """
+
+    def __init__(self, cmd: List[str], on_failure: Optional[FailureCallback] = None):
+        self.cmd = cmd
+        self.on_failure = on_failure
+        self.logger = logging.getLogger(__name__)
+        self._process: Optional[subprocess.Popen] = None
+
+    def _start(self):
+        metrics.SUBPROCESS.inc(command=metrics.command_name(self.cmd))
+        self._process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.PIPE, text=True)
+        self.logger.debug(
+            f"启动常驻规则提交进程: {' '.join(self.cmd)} (pid {self._process.pid})")
+
+    def _failed(self, returncode: int) -> subprocess.CalledProcessError:
+        """进程已退出：读取错误信息并丢弃进程，下次提交时重新启动"""
+        process, self._process = self._process, None
+        stderr = ""
+        try:
+            stderr = process.stderr.read()
+        except (OSError, ValueError):
+            pass
+        return subprocess.CalledProcessError(returncode, self.cmd, stderr=stderr)
+
+    def _late_failure(self, error: subprocess.CalledProcessError):
+        """之前写入的变更在写入之后才失败：内核状态与预期不一致"""
+        self.logger.error(f"常驻规则提交进程报告之前的变更失败: {error.stderr or error}")
+        if self.on_failure is not None:
+            self.on_failure(error)
+
+    def send(self, payload: str):
+        """写入一批COMMIT块，本批无法写入时抛出 subprocess.CalledProcessError"""
+        with metrics.backend_call(self.cmd, spawn=False):
+            self._send(payload)
+
+    def _send(self, payload: str):
+        if self._process is not None and self._process.poll() is not None:
+            self._late_failure(self._failed(self._process.returncode))
+
+        fresh = self._process is None
+        if fresh:
+            self._start()
+        try:
+            self._write(payload)
+        except subprocess.CalledProcessError as e:
+            if fresh:
+                raise
+            # 进程在本批写入之前已经退出：失败的是之前的变更，本批写入新进程
+            self._late_failure(e)
+            self._start()
+            self._write(payload)
+
+    def _write(self, payload: str):
+        try:
+            self._process.stdin.write(payload)
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise self._failed(self._process.wait())
+
+    def sync(self):
+        """关闭输入并等待进程处理完所有已写入的变更（可靠确认），失败时抛出异常"""
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        returncode = self._process.wait()
+        if returncode != 0:
+            raise self._failed(returncode)
+        self._process = None
+
+
+class RuleApplier:
+    """每个地址族一个常驻restore进程，批量变更以流的方式写入，避免逐批启动进程
+
+    on_failure 在发现之前写入的变更失败时调用（参数为 subprocess.CalledProcessError）。
+    """
+
+    def __init__(self, on_failure: Optional[FailureCallback] = None):
+        self.on_failure = on_failure
+        self._sessions: Dict[Tuple[str, ...], RestoreSession] = {}
+
+    def run(self, cmd: List[str], payload: str):
+        session = self._sessions.get(tuple(cmd))
+        if session is None:
+            session = RestoreSession(cmd, self.on_failure)
+            self._sessions[tuple(cmd)] = session
+        session.send(payload)
+
+    def sync(self):
+        """等待所有常驻进程处理完已写入的变更
+
+        后续依赖这些变更的操作（如删除ipset集合）之前调用。
+        """
+        errors = []
+        for session in self._sessions.values():
+            try:
+                session.sync()
+            except subprocess.CalledProcessError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        """结束所有常驻进程"""
+        try:
+            self.sync()
+        finally:
+            self._sessions.clear()
+
+
+class RuleTransaction:
+    """iptables规则事务
+
+    收集一批规则变更（-A/-I/-D/-N/-F/-X），提交时每个地址族只调用一次
+    `*-restore --noflush`，每个表在一个COMMIT块内原子生效。
+    nftables变更（集合/映射元素）在同一事务中通过一次 `nft -f -` 提交。
+    ipset变更通过 `ipset restore` 提交：创建/增删元素在iptables规则之前，
+    删除集合在之后（引用集合的规则必须先删除）。
+    指定 applier 时iptables变更写入常驻restore进程，否则每次提交启动一次restore。
+    """
+
+    def __init__(self, nft_cmd: str = "nft", ipset_cmd: str = "ipset",
+                 applier: Optional[RuleApplier] = None):
+        self.applier = applier
+        # iptables_cmd -> 表 -> 规则行
+        self._ops: Dict[str, Dict[str, List[List[str]]]] = {}
+        # 事务内规则状态：(cmd, 表, 链, 参数) -> True(已排队添加)/False(已排队删除)
+        self._pending: Dict[Tuple, bool] = {}
+        self._flushed_chains: Set[Tuple[str, str, str]] = set()
+        # 事务内链状态：(cmd, 表, 链) -> True(已排队创建)/False(已排队删除)
+        self._pending_chains: Dict[Tuple[str, str, str], bool] = {}
+
+        # nftables脚本行；元素变更：(集合名, 键) -> 值（None表示删除）
+        self.nft_cmd = nft_cmd
+        self._nft_lines: List[str] = []
+        self.nft_changes: Dict[Tuple[str, str], Optional[str]] = {}
+        self.nft_reset = False  # 本事务是否重建/清空了nftables表
+
+        # ipset restore 命令行：iptables规则之前/之后执行
+        self.ipset_cmd = ipset_cmd
+        self._ipset_lines: List[str] = []
+        self._ipset_post_lines: List[str] = []
+
+    def add(self, iptables_cmd: str, rule: List[str]):
+        """排队一条规则变更；规则或链在本事务中已处于该变更的目标状态时忽略
+
+        只按事务内的预期状态去重：-A R, -D R, -A R 三个变更都会保留。
+        """
+        table, action, chain, spec = split_rule(rule)
+        rule_key = (iptables_cmd, table, chain, tuple(spec))
+        chain_key = (iptables_cmd, table, chain)
+        if action in ("-A", "-I"):
+            if self.lookup(iptables_cmd, rule):
+                return
+            self._pending[rule_key] = True
+        elif action == "-D":
+            if self.lookup(iptables_cmd, rule) is False:
+                return
+            self._pending[rule_key] = False
+        elif action == "-N":
+            if self._pending_chains.get(chain_key):
+                return
+            self._pending_chains[chain_key] = True
+        elif action in ("-F", "-X"):
+            if action == "-X":
+                self._pending_chains[chain_key] = False
+            self._flushed_chains.add(chain_key)
+            for key in [k for k in self._pending if k[:3] == chain_key]:
+                self._pending[key] = False
+
+        # restore输入按表分块，行内不再携带 -t 参数
+        line = list(rule[2:]) if rule and rule[0] == "-t" else list(rule)
+        self._ops.setdefault(iptables_cmd, {}).setdefault(table, []).append(line)
+
+    def lookup(self, iptables_cmd: str, rule: List[str]) -> Optional[bool]:
+        """查询规则在本事务中的预期状态：True/False；事务未涉及时返回None"""
+        table, _, chain, spec = split_rule(rule)
+        state = self._pending.get((iptables_cmd, table, chain, tuple(spec)))
+        if state is not None:
+            return state
+        if (iptables_cmd, table, chain) in self._flushed_chains:
+            return False
+        return None
+
+    def lookup_chain(self, iptables_cmd: str, chain: str,
+                     table: str = "filter") -> Optional[bool]:
+        """查询链在本事务中的预期状态：True/False；事务未涉及时返回None"""
+        return self._pending_chains.get((iptables_cmd, table, chain))
+
+    def add_nft(self, line: str, key: Optional[Tuple[str, str]] = None,
+                value: Optional[str] = None):
+        """排队一条nftables命令；key不为空时记录元素变更（value为None表示删除）"""
+        self._nft_lines.append(line)
+        if key is not None:
+            self.nft_changes[key] = value
+
+    def reset_nft(self, script: str):
+        """排队重建/清空nftables表的脚本，此前排队的元素变更全部作废"""
+        self._nft_lines.append(script)
+        self.nft_changes.clear()
+        self.nft_reset = True
+
+    def lookup_nft(self, key: Tuple[str, str]) -> Tuple[bool, Optional[str]]:
+        """查询元素在本事务中的预期值：返回 (是否由本事务决定, 值)"""
+        if key in self.nft_changes:
+            return True, self.nft_changes[key]
+        if self.nft_reset:
+            return True, None
+        return False, None
+
+    def add_ipset(self, line: str, post: bool = False):
+        """排队一条ipset restore命令；post为True时在iptables规则提交之后执行"""
+        (self._ipset_post_lines if post else self._ipset_lines).append(line)
+
+    def __len__(self) -> int:
+        return (sum(len(lines) for tables in self._ops.values()
+                    for lines in tables.values())
+                + len(self._nft_lines) + len(self._ipset_lines)
+                + len(self._ipset_post_lines))
+
+    def families(self) -> List[str]:
+        """本事务涉及的iptables命令（地址族）"""
+        return list(self._ops.keys())
+
+    def operations(self, iptables_cmd: str) -> List[Tuple[str, List[str]]]:
+        """指定地址族已排队的变更：[(表, restore行)]，同一表内保持排队顺序"""
+        return [(table, list(rule))
+                for table, rules in self._ops.get(iptables_cmd, {}).items()
+                for rule in rules]
+
+    def render(self, iptables_cmd: str) -> str:
+        """生成指定地址族的restore输入"""
+        lines = []
+        for table, rules in self._ops.get(iptables_cmd, {}).items():
+            lines.append(f"*{table}")
+            for rule in rules:
+                lines.append(" ".join(quote_arg(arg) for arg in rule))
+            lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _run(cmd: List[str], payload: str):
+        """通过标准输入提交一批命令，失败时抛出 subprocess.CalledProcessError"""
+        with metrics.backend_call(cmd):
+            result = subprocess.run(cmd, input=payload, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd,
+                                                output=result.stdout,
+                                                stderr=result.stderr)
+
+    def commit(self):
+        """提交事务，失败时抛出 subprocess.CalledProcessError"""
+        if self._ipset_lines:
+            self._run([self.ipset_cmd, "restore"], "\n".join(self._ipset_lines) + "\n")
+            self._ipset_lines.clear()
+
+        for iptables_cmd in self.families():
+            cmd = [restore_command(iptables_cmd), "--noflush"]
+            if self.applier is not None:
+                self.applier.run(cmd, self.render(iptables_cmd))
+            else:
+                self._run(cmd, self.render(iptables_cmd))
+        self._ops.clear()
+
+        if self._nft_lines:
+            self._run([self.nft_cmd, "-f", "-"], "\n".join(self._nft_lines) + "\n")
+            self._nft_lines.clear()
+
+        if self._ipset_post_lines:
+            if self.applier is not None:
+                self.applier.sync()
+            self._run([self.ipset_cmd, "restore"],
+                      "\n".join(self._ipset_post_lines) + "\n")
+            self._ipset_post_lines.clear()
@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+规则编译模块
+
+把Docker状态快照（容器、网络、Service）和配置编译为规范化的规则集：规则记录
+去重并排序，专用链的期望规则顺序确定。编译过程没有副作用（不执行命令、不写日志），
+FirewallManager 只负责把编译结果与内核状态对比并提交差异；相同快照的编译结果
+按输入哈希缓存。
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from ipset_backend import IpsetBackend, IpsetElement
+from nft_backend import ElementKey, NftablesBackend
+from network_index import NetworkIndex
+from rule_registry import FirewallRule, RecordKey, RuleRegistry, ServiceRule
+
+# (iptables命令, 表, 链)
+ChainKey = Tuple[str, str, str]
+
+
+class ContainerState(NamedTuple):
+    """容器状态：端口配置格式与 DockerMonitor 提取的结果相同"""
+    container_id: str
+    container_name: str
+    networks: Dict                # 网络名 -> {'GlobalIPv6Address': ...}
+    port_mappings: Tuple = ()     # {'port', 'protocol'}
+    public_ports: Tuple = ()      # {'container_port', 'host_port', 'protocol'}
+    custom_ports: Tuple = ()      # {'external_port', 'internal_port', 'protocol'}
+
+
+class ServiceState(NamedTuple):
+    """Swarm Service状态"""
+    service_id: str
+    service_name: str
+    service_ports: Tuple = ()     # {'published_port', 'target_port', 'protocol'}
+    containers: Tuple = ()        # {'container_id', 'container_name', 'ipv6_address'}
+
+
+class StateSnapshot(NamedTuple):
+    """编译输入：某一时刻的容器和Service状态"""
+    containers: Tuple = ()
+    services: Tuple = ()
+
+    def digest(self) -> str:
+        """输入哈希（与容器、Service的顺序无关）"""
+        payload = json.dumps([sorted(json.dumps(item, sort_keys=True, default=str)
+                                     for item in group)
+                              for group in (self.containers, self.services)])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class CompiledRuleset:
+    """编译结果：规则记录、专用链的期望规则和集合/映射元素"""
+
+    __slots__ = ("digest", "records", "chains", "nft_elements", "ipset_elements")
+
+    def __init__(self, digest: Optional[str], records: Dict[RecordKey, Tuple],
+                 chains: Dict[ChainKey, List[List[str]]],
+                 nft_elements: Dict[ElementKey, str],
+                 ipset_elements: Set[IpsetElement]):
+        self.digest = digest
+        self.records = records
+        self.chains = chains
+        self.nft_elements = nft_elements
+        self.ipset_elements = ipset_elements
+
+    def rule_count(self) -> int:
+        """链规则和集合元素的总数"""
+        return (sum(len(rules) for rules in self.chains.values())
+                + len(self.nft_elements) + len(self.ipset_elements))
+
+
+class RuleCompiler:
+    """无副作用的规则编译器"""
+
+    SUBCHAIN_PREFIX = "DOCKER_IPV6FW_C_"  # 容器子链前缀（forward_mode: subchain）
+    CACHE_SIZE = 8  # 按输入哈希缓存的编译结果数量
+
+    def __init__(self, config, networks: Optional[NetworkIndex] = None):
+        self.config = config
+        # 与 DockerMonitor 共用的网络索引（判断容器地址所在网络是否受监控）
+        self.networks = networks if networks is not None else NetworkIndex(config)
+        # 规则形态与 FirewallManager 的引擎选择一致
+        self.nft: Optional[NftablesBackend] = None
+        if config.firewall_backend == "nftables":
+            self.nft = NftablesBackend(config)
+        self.ipset: Optional[IpsetBackend] = None
+        if self.nft is None and config.forward_mode == "ipset":
+            self.ipset = IpsetBackend(config)
+        self.subchains = self.nft is None and config.forward_mode == "subchain"
+
+        self._cache: "OrderedDict[Tuple[str, int], CompiledRuleset]" = OrderedDict()
+        self.last_compile_seconds = 0.0  # 最近一次（未命中缓存的）编译耗时
+
+    # ---- 单条规则 ----
+
+    @staticmethod
+    def rule_comment(kind: str, rule, description: str) -> str:
+        """规则注释：结构化归属标签 + 便于阅读的说明"""
+        return f"{RuleRegistry.owner_tag(kind, rule)} {description}"
+
+    def uses_ipset(self, rule: FirewallRule) -> bool:
+        """容器规则是否由ipset集合承载"""
+        return self.ipset is not None and self.ipset.supports(rule.protocol)
+
+    def firewall_rule(self, rule: FirewallRule, action: str,
+                      kind: str = RuleRegistry.CONTAINER) -> List[str]:
+        """容器FORWARD规则 - 只允许特定容器的特定端口"""
+        return [
+            action, self.config.chain_name,
+            "-p", rule.protocol,
+            "-d", rule.ipv6_address,  # 目标是特定容器的IPv6地址
+            "--dport", str(rule.port),  # 特定端口
+            "-i", rule.interface_in,   # 从外网接口进入
+            "-o", rule.interface_out,  # 到macvlan接口
+            "-j", "ACCEPT",
+            "-m", "comment", "--comment",
+            self.rule_comment(kind, rule, f"Container:{rule.container_name}")
+        ]
+
+    def subchain_name(self, ipv6_address: str) -> str:
+        """容器地址对应的子链名（链名最长28个字符，使用地址哈希）"""
+        digest = hashlib.sha1(ipv6_address.encode()).hexdigest()[:10]
+        return self.SUBCHAIN_PREFIX + digest
+
+    def subchain_jump_rule(self, ipv6_address: str, action: str) -> List[str]:
+        """主FORWARD链中按目标地址分发到子链的规则"""
+        return [
+            action, self.config.chain_name,
+            "-d", ipv6_address,
+            "-i", self.config.parent_interface,
+            "-o", self.config.gateway_macvlan,
+            "-j", self.subchain_name(ipv6_address)
+        ]
+
+    def subchain_rule(self, rule: FirewallRule, action: str,
+                      kind: str = RuleRegistry.CONTAINER) -> List[str]:
+        """子链中的端口规则（地址和接口已由分发规则匹配）"""
+        return [
+            action, self.subchain_name(rule.ipv6_address),
+            "-p", rule.protocol,
+            "--dport", str(rule.port),
+            "-j", "ACCEPT",
+            "-m", "comment", "--comment",
+            self.rule_comment(kind, rule, f"Container:{rule.container_name}")
+        ]
+
+    @staticmethod
+    def service_kind(rule: ServiceRule) -> str:
+        """Service规则的来源类型（public/custom/service）"""
+        return RuleRegistry.key_for_id(rule.service_id)[0]
+
+    def service_comment(self, rule: ServiceRule) -> str:
+        return self.rule_comment(self.service_kind(rule), rule,
+                                 f"Svc:{rule.service_name} "
+                                 f"{rule.published_port}->{rule.target_port}")
+
+    def service_forward_rule(self, rule: ServiceRule, action: str) -> List[str]:
+        """Service FORWARD规则"""
+        # 注意: FORWARD链是在PREROUTING(DNAT)之后处理的
+        # 因此这里需要匹配转换后的目标端口(target_port)，而不是发布端口(published_port)
+        return [
+            action, self.config.chain_name,
+            "-p", rule.protocol,
+            "-d", rule.container_ipv6,  # 添加目标地址
+            "--dport", str(rule.target_port),  # 这是修复点
+            "-i", rule.interface_in,
+            "-o", rule.interface_out,
+            "-j", "ACCEPT",
+            "-m", "comment", "--comment", self.service_comment(rule)
+        ]
+
+    def service_nat_rule(self, rule: ServiceRule, action: str) -> List[str]:
+        """Service NAT规则 - 统一的规则构建逻辑"""
+        return [
+            "-t", "nat",
+            action, self.config.nat_chain_name,
+            "-i", rule.interface_in,
+            "-d", rule.container_ipv6,
+            "-p", rule.protocol,
+            "--dport", str(rule.published_port),
+            "-j", "DNAT",
+            "--to-destination", f"[{rule.container_ipv6}]:{rule.target_port}",
+            "-m", "comment", "--comment", self.service_comment(rule)
+        ]
+
+    @staticmethod
+    def service_forward_only(rule: ServiceRule) -> bool:
+        """自定义防火墙端口相同的规则只有FORWARD（按容器规则格式添加，没有NAT）"""
+        return (rule.service_id.endswith("_custom")
+                and rule.published_port == rule.target_port)
+
+    @staticmethod
+    def service_as_firewall_rule(rule: ServiceRule) -> FirewallRule:
+        """将只有FORWARD的Service规则转换为对应的容器规则"""
+        return FirewallRule(
+            container_id=rule.container_id,
+            container_name=rule.container_name,
+            protocol=rule.protocol,
+            port=rule.target_port,
+            ipv6_address=rule.container_ipv6,
+            interface_in=rule.interface_in,
+            interface_out=rule.interface_out
+        )
+
+    # ---- 基础规则 ----
+
+    def dnat_conntrack_rule(self) -> List[str]:
+        """IPv6 DNAT conntrack规则 - 允许所有经过NAT转换的连接（必须位于链首）"""
+        return [
+            "-I", self.config.chain_name, "1",
+            "-i", self.config.parent_interface,
+            "-o", self.config.gateway_macvlan,
+            "-m", "conntrack", "--ctstate", "DNAT",
+            "-j", "ACCEPT"
+        ]
+
+    def isolation_rules(self, iso_chain: str) -> List[Tuple[str, str, List[str]]]:
+        """容器隔离链的兜底规则：(iptables命令, 描述, 规则)"""
+        return [
+            # 规则：-i <macvlan> ! -p icmp -m addrtype --dst-type LOCAL -j DROP
+            (self.config.iptables_cmd, "IPv4", [
+                "-A", iso_chain,
+                "-i", self.config.gateway_macvlan,
+                "!", "-p", "icmp",
+                "-m", "addrtype", "--dst-type", "LOCAL",
+                "-j", "DROP"
+            ]),
+            # 关键改动：在这里限制 -i gateway_macvlan
+            (self.config.ip6tables_cmd, "IPv6", [
+                "-A", iso_chain,
+                "-i", self.config.gateway_macvlan,
+                "!", "-p", "ipv6-icmp",
+                "-m", "addrtype", "--dst-type", "LOCAL",
+                "-j", "DROP"
+            ]),
+        ]
+
+    def ipv6_input_base_rules(self) -> List[List[str]]:
+        """IPv6基础协议规则（专用INPUT链）"""
+        chain = self.config.input_chain_name
+        icmpv6_types = (
+            # ICMPv6基础消息类型
+            "destination-unreachable", "packet-too-big", "time-exceeded",
+            "parameter-problem",
+            # NDP (Neighbor Discovery Protocol)
+            "neighbor-solicitation", "neighbor-advertisement", "router-advertisement",
+            "router-solicitation",
+        )
+        rules = [["-A", chain, "-p", "icmpv6", "--icmpv6-type", icmpv6_type,
+                  "-j", "ACCEPT"]
+                 for icmpv6_type in icmpv6_types]
+        # 链路本地地址
+        rules.append(["-A", chain, "-s", self.config.ipv6_link_local, "-j", "ACCEPT"])
+        rules.append(["-A", chain, "-d", self.config.ipv6_link_local, "-j", "ACCEPT"])
+        return rules
+
+    def icmp_forward_base_rules(self) -> Tuple[List[List[str]], List[List[str]]]:
+        """ICMP/ICMPv6协议的FORWARD规则：(IPv6规则, IPv4规则)"""
+        # ICMPv6/NDP协议双向转发规则（专用FORWARD链）
+        icmpv6_forward_rules = [
+            # 主接口到macvlan网关的ICMPv6转发
+            ["-A", self.config.chain_name, "-i", self.config.parent_interface,
+             "-o", self.config.gateway_macvlan, "-p", "icmpv6", "-j", "ACCEPT"],
+            # macvlan网关到主接口的ICMPv6转发
+            ["-A", self.config.chain_name, "-i", self.config.gateway_macvlan,
+             "-o", self.config.parent_interface, "-p", "icmpv6", "-j", "ACCEPT"]
+        ]
+
+        # ICMPv4协议双向转发规则（使用IPv4专用链）
+        icmpv4_forward_rules = [
+            # 主接口到macvlan网关的ICMPv4转发
+            ["-A", self.config.ipv4_chain_name, "-i", self.config.parent_interface,
+             "-o", self.config.gateway_macvlan, "-p", "icmp", "-j", "ACCEPT"],
+            # macvlan网关到主接口的ICMPv4转发
+            ["-A", self.config.ipv4_chain_name, "-i", self.config.gateway_macvlan,
+             "-o", self.config.parent_interface, "-p", "icmp", "-j", "ACCEPT"]
+        ]
+        return icmpv6_forward_rules, icmpv4_forward_rules
+
+    def ipv4_internet_base_rules(self) -> Tuple[List[List[str]], List[List[str]]]:
+        """IPv4容器上网规则：(FORWARD规则, NAT规则)"""
+        # IPv4容器上网的FORWARD规则
+        ipv4_forward_rules = [
+            # 1. 容器到外网的FORWARD规则（gateway_macvlan -> parent_interface）
+            ["-A", self.config.ipv4_chain_name, "-i", self.config.gateway_macvlan,
+             "-o", self.config.parent_interface, "-j", "ACCEPT"]
+        ]
+
+        # IPv4 NAT MASQUERADE规则（POSTROUTING链）
+        ipv4_nat_rules = [
+            # 4. NAT MASQUERADE规则 - 容器访问外网时进行地址伪装
+            ["-t", "nat", "-A", self.config.ipv4_nat_chain_name,
+             "-o", self.config.parent_interface, "-j", "MASQUERADE"]
+        ]
+        return ipv4_forward_rules, ipv4_nat_rules
+
+    # ---- 规则记录 ----
+
+    def should_monitor_network(self, network_name: str) -> bool:
+        """判断是否应该监控此网络"""
+        return self.networks.is_monitored(network_name)
+
+    def _addresses(self, networks: Dict) -> List[str]:
+        """受监控网络中的容器IPv6地址"""
+        return [info.get('GlobalIPv6Address') for name, info in networks.items()
+                if self.should_monitor_network(name) and info.get('GlobalIPv6Address')]
+
+    @staticmethod
+    def _protocols(protocol: str) -> List[str]:
+        """all协议展开为tcp和udp两条规则"""
+        return ['tcp', 'udp'] if protocol == 'all' else [protocol]
+
+    @staticmethod
+    def _canonical(rules: Iterable) -> List:
+        """去重并按 (容器ID, 规则特征) 排序"""
+        return sorted(set(rules), key=lambda rule: (rule.container_id, rule.signature))
+
+    def _firewall_rule(self, container_id: str, container_name: str, protocol: str,
+                       port: int, ipv6_address: str) -> FirewallRule:
+        return FirewallRule(
+            container_id=container_id,
+            container_name=container_name,
+            protocol=protocol,
+            port=port,
+            ipv6_address=ipv6_address,
+            interface_in=self.config.parent_interface,
+            interface_out=self.config.gateway_macvlan
+        )
+
+    def _service_rule(self, service_id: str, service_name: str, container_id: str,
+                      container_name: str, protocol: str, published_port: int,
+                      target_port: int, ipv6_address: str) -> ServiceRule:
+        return ServiceRule(
+            service_id=service_id,
+            service_name=service_name,
+            container_id=container_id,
+            container_name=container_name,
+            protocol=protocol,
+            published_port=published_port,
+            target_port=target_port,
+            container_ipv6=ipv6_address,
+            interface_in=self.config.parent_interface,
+            interface_out=self.config.gateway_macvlan
+        )
+
+    def container_rules(self, container_id: str, container_name: str,
+                        port_mappings: Iterable[Dict],
+                        networks: Dict) -> List[FirewallRule]:
+        """容器端口规则"""
+        rules = []
+        for ipv6_address in self._addresses(networks):
+            for port_info in port_mappings:
+                port = port_info.get('port')
+                if not port:
+                    continue
+                for protocol in self._protocols(port_info.get('protocol', 'tcp')):
+                    rules.append(self._firewall_rule(container_id, container_name,
+                                                     protocol, port, ipv6_address))
+        return self._canonical(rules)
+
+    def public_rules(self, container_id: str, container_name: str,
+                     public_ports: Iterable[Dict], networks: Dict
+                     ) -> Tuple[List[ServiceRule], List[FirewallRule]]:
+        """容器Public端口规则：(端口不同的NAT规则, 端口相同时只需要的FORWARD规则)"""
+        public_rule_id = f"{container_id}_public"
+        nat_rules = []
+        forward_rules = []
+        for ipv6_address in self._addresses(networks):
+            for port_info in public_ports:
+                container_port = port_info.get('container_port')
+                host_port = port_info.get('host_port')
+                if not (container_port and host_port):
+                    continue
+                for protocol in self._protocols(port_info.get('protocol', 'tcp')):
+                    if host_port != container_port:
+                        nat_rules.append(self._service_rule(
+                            public_rule_id, f"{container_name}_public", container_id,
+                            container_name, protocol, host_port, container_port,
+                            ipv6_address))
+                    else:
+                        # 端口相同，IPv6可直接访问，无需NAT转换
+                        forward_rules.append(self._firewall_rule(
+                            container_id, container_name, protocol, container_port,
+                            ipv6_address))
+        return self._canonical(nat_rules), self._canonical(forward_rules)
+
+    def custom_rules(self, container_id: str, container_name: str,
+                     custom_ports: Iterable[Dict], networks: Dict) -> List[ServiceRule]:
+        """容器自定义防火墙规则（端口相同的规则只有FORWARD，见 service_forward_only）"""
+        custom_rule_id = f"{container_id}_custom"
+        rules = []
+        for ipv6_address in self._addresses(networks):
+            for port_info in custom_ports:
+                external_port = port_info.get('external_port')
+                internal_port = port_info.get('internal_port')
+                if not (external_port and internal_port):
+                    continue
+                for protocol in self._protocols(port_info.get('protocol', 'tcp')):
+                    rules.append(self._service_rule(
+                        custom_rule_id, f"{container_name}_custom", container_id,
+                        container_name, protocol, external_port, internal_port,
+                        ipv6_address))
+        return self._canonical(rules)
+
+    def service_rules(self, service_id: str, service_name: str,
+                      service_ports: Iterable[Dict],
+                      containers: Iterable[Dict]) -> List[ServiceRule]:
+        """Service规则（没有IPv6地址的容器被跳过）"""
+        rules = []
+        for container in containers:
+            container_ipv6 = container.get('ipv6_address')
+            if not container_ipv6:
+                continue
+            for port_info in service_ports:
+                published_port = port_info.get('published_port')
+                target_port = port_info.get('target_port')
+                if not (published_port and target_port):
+                    continue
+                # 从Service inspect中动态获取协议
+                protocol = port_info.get('protocol', 'tcp').lower()
+                rules.append(self._service_rule(
+                    service_id, service_name, container.get('container_id'),
+                    container.get('container_name')[:20],  # 截断以避免过长
+                    protocol, published_port, target_port, container_ipv6))
+        return self._canonical(rules)
+
+    def records(self, snapshot: StateSnapshot) -> Dict[RecordKey, Tuple]:
+        """快照对应的规则记录（与 FirewallManager 登记表的结构相同，空记录不出现）"""
+        records: Dict[RecordKey, Tuple] = {}
+
+        def put(key: RecordKey, rules: List):
+            if rules:
+                records[key] = tuple(rules)
+
+        for container in snapshot.containers:
+            cid, name = container.container_id, container.container_name
+            networks = container.networks
+            nat_rules, forward_rules = self.public_rules(
+                cid, name, container.public_ports, networks)
+            port_rules = self.container_rules(
+                cid, name, container.port_mappings, networks)
+            put((RuleRegistry.CONTAINER, cid),
+                self._canonical(port_rules + forward_rules))
+            put((RuleRegistry.PUBLIC, cid), nat_rules)
+            put((RuleRegistry.CUSTOM, cid),
+                self.custom_rules(cid, name, container.custom_ports, networks))
+
+        for service in snapshot.services:
+            put((RuleRegistry.SERVICE, service.service_id),
+                self.service_rules(service.service_id, service.service_name,
+                                   service.service_ports, service.containers))
+        return records
+
+    # ---- 规则集 ----
+
+    def _firewall_chain_rule(self, rule: FirewallRule, forward_rules: List[List[str]],
+                             subchain_rules: Dict[str, List[List[str]]],
+                             kind: str = RuleRegistry.CONTAINER):
+        """按当前FORWARD规则模式放置一条容器规则（ipset模式下由集合承载）"""
+        if self.uses_ipset(rule):
+            return
+        if not self.subchains:
+            forward_rules.append(self.firewall_rule(rule, "-A", kind))
+            return
+
+        subchain = self.subchain_name(rule.ipv6_address)
+        if subchain not in subchain_rules:
+            subchain_rules[subchain] = []
+            forward_rules.append(self.subchain_jump_rule(rule.ipv6_address, "-A"))
+        subchain_rules[subchain].append(self.subchain_rule(rule, "-A", kind))
+
+    @staticmethod
+    def _sorted_unique(rules: List[List[str]]) -> List[List[str]]:
+        return [list(rule) for rule in sorted({tuple(rule) for rule in rules})]
+
+    def chains(self, records: Iterable[Tuple[RecordKey, Tuple]]
+               ) -> Dict[ChainKey, List[List[str]]]:
+        """专用链的期望规则：(iptables命令, 表, 链) -> 规则
+
+        基础规则保持固定顺序在前，容器/Service规则去重排序后在后；
+        容器子链排在主FORWARD链之前，保证分发规则引用的子链先被创建。
+        """
+        container_rules: List[List[str]] = []
+        subchain_rules: Dict[str, List[List[str]]] = {}
+        nat_rules: List[List[str]] = []
+
+        if self.nft is None:
+            for (kind, _), rules in records:
+                for rule in rules:
+                    if kind == RuleRegistry.CONTAINER:
+                        self._firewall_chain_rule(rule, container_rules, subchain_rules)
+                    elif self.service_forward_only(rule):
+                        self._firewall_chain_rule(self.service_as_firewall_rule(rule),
+                                                  container_rules, subchain_rules,
+                                                  RuleRegistry.CUSTOM)
+                    else:
+                        container_rules.append(self.service_forward_rule(rule, "-A"))
+                        nat_rules.append(self.service_nat_rule(rule, "-A"))
+
+        forward_rules = [self.dnat_conntrack_rule()]
+        icmpv6_forward_rules, icmpv4_forward_rules = self.icmp_forward_base_rules()
+        ipv4_forward_rules, ipv4_nat_rules = self.ipv4_internet_base_rules()
+        forward_rules.extend(icmpv6_forward_rules)
+        if self.nft is not None:
+            # nftables模式下容器/Service规则是集合元素，链中只有标记放行规则
+            forward_rules.append(self.nft.mark_accept_rule())
+        elif self.ipset is not None:
+            # ipset模式下tcp/udp容器规则是集合元素，链中每个协议一条匹配规则
+            forward_rules.extend(self.ipset.match_rules())
+        forward_rules.extend(self._sorted_unique(container_rules))
+
+        ip6tables_cmd = self.config.ip6tables_cmd
+        iptables_cmd = self.config.iptables_cmd
+        chains = {(ip6tables_cmd, "filter", subchain): self._sorted_unique(rules)
+                  for subchain, rules in sorted(subchain_rules.items())}
+        chains.update({
+            (ip6tables_cmd, "filter", self.config.chain_name): forward_rules,
+            (ip6tables_cmd, "filter", self.config.input_chain_name):
+                self.ipv6_input_base_rules(),
+            (ip6tables_cmd, "nat", self.config.nat_chain_name):
+                self._sorted_unique(nat_rules),
+            (iptables_cmd, "filter", self.config.ipv4_chain_name):
+                icmpv4_forward_rules + ipv4_forward_rules,
+            (iptables_cmd, "nat", self.config.ipv4_nat_chain_name): ipv4_nat_rules,
+        })
+        return chains
+
+    def nft_elements(self, records: Iterable[Tuple[RecordKey, Tuple]]
+                     ) -> Dict[ElementKey, str]:
+        """nftables模式下的放行集合和DNAT映射元素"""
+        elements: Dict[ElementKey, str] = {}
+        if self.nft is None:
+            return elements
+        for (kind, _), rules in records:
+            for rule in rules:
+                if kind == RuleRegistry.CONTAINER:
+                    elements.update(self.nft.firewall_rule_elements(rule))
+                else:
+                    elements.update(self.nft.service_rule_elements(rule))
+        return elements
+
+    def ipset_elements(self, records: Iterable[Tuple[RecordKey, Tuple]]
+                       ) -> Set[IpsetElement]:
+        """ipset模式下的集合元素（容器规则和只有FORWARD的自定义规则）"""
+        elements: Set[IpsetElement] = set()
+        if self.ipset is None:
+            return elements
+        for (kind, _), rules in records:
+            for rule in rules:
+                if kind != RuleRegistry.CONTAINER:
+                    if not self.service_forward_only(rule):
+                        continue
+                    rule = self.service_as_firewall_rule(rule)
+                if self.uses_ipset(rule):
+                    elements.add(self.ipset.element(rule))
+        return elements
+
+    def compile_records(self, records: Iterable[Tuple[RecordKey, Tuple]],
+                        digest: Optional[str] = None) -> CompiledRuleset:
+        """由规则记录编译规则集"""
+        records = dict(records)
+        items = list(records.items())
+        return CompiledRuleset(digest, records, self.chains(items),
+                               self.nft_elements(items), self.ipset_elements(items))
+
+    def compile(self, snapshot: StateSnapshot) -> CompiledRuleset:
+        """由状态快照编译规则集；相同输入（快照和网络索引）直接返回缓存的结果"""
+        digest = snapshot.digest()
+        key = (digest, self.networks.version)
+        compiled = self._cache.get(key)
+        if compiled is not None:
+            self._cache.move_to_end(key)
+            return compiled
+
+        started = time.perf_counter()
+        compiled = self.compile_records(self.records(snapshot), digest)
+        self.last_compile_seconds = time.perf_counter() - started
+
+        self._cache[key] = compiled
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return compiled
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+规则登记表模块
+
+记录已下发的容器/Service规则。主键为 (来源类型, ID) 元组，并维护按容器ID、
+IPv6地址、(协议, 端口) 和来源类型的二级索引；规则对象使用 __slots__ 以降低内存占用。
+
+登记表只由规则下发线程修改。其他线程（指标服务、性能剖析）只读取写线程在每次提交后
+发布的计数 `RuleRegistry.counts`，不遍历登记表本身。
+
+生成的每条iptables规则在注释开头携带结构化归属标签
+`v6fw:<来源类型>:<容器ID前12位>:<规则哈希>`，解析规则快照时可直接确定规则归属。
+"""
+
+import hashlib
+import time
+from collections.abc import MutableMapping
+from dataclasses import dataclass
+from typing import (Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional,
+                    Set, Tuple)
+
+
+@dataclass(frozen=True)
+class FirewallRule:
+    """容器防火墙规则"""
+    __slots__ = ("container_id", "container_name", "protocol", "port",
+                 "ipv6_address", "interface_in", "interface_out")
+    container_id: str
+    container_name: str
+    protocol: str
+    port: int
+    ipv6_address: str
+    interface_in: str
+    interface_out: str
+
+    @property
+    def address(self) -> str:
+        return self.ipv6_address
+
+    @property
+    def signature(self) -> Tuple:
+        """变化检测特征：(协议, 端口, IPv6地址)"""
+        return (self.protocol, self.port, self.ipv6_address)
+
+    def __str__(self):
+        return (f"{self.container_name}:{self.protocol}/{self.port}"
+                f" -> {self.ipv6_address}")
+
+
+@dataclass(frozen=True)
+class ServiceRule:
+    """Service防火墙和NAT规则"""
+    __slots__ = ("service_id", "service_name", "container_id", "container_name",
+                 "protocol", "published_port", "target_port", "container_ipv6",
+                 "interface_in", "interface_out")
+    service_id: str
+    service_name: str
+    container_id: str
+    container_name: str
+    protocol: str
+    published_port: int  # 外部发布端口
+    target_port: int     # 容器内部端口
+    container_ipv6: str  # 容器IPv6地址
+    interface_in: str    # 入接口
+    interface_out: str   # 出接口
+
+    @property
+    def address(self) -> str:
+        return self.container_ipv6
+
+    @property
+    def port(self) -> int:
+        return self.published_port
+
+    @property
+    def signature(self) -> Tuple:
+        """变化检测特征：(协议, 发布端口, 目标端口, IPv6地址)"""
+        return (self.protocol, self.published_port, self.target_port,
+                self.container_ipv6)
+
+    def __str__(self):
+        return (f"{self.service_name}:{self.protocol}/{self.published_port}"
+                f"->{self.target_port} -> {self.container_ipv6}")
+
+
+# (来源类型, ID)
+RecordKey = Tuple[str, str]
+
+TAG_PREFIX = "v6fw"
+CONTAINER_ID_PREFIX_LEN = 12
+
+
+class OwnerTag(NamedTuple):
+    """规则注释中的归属标签"""
+    kind: str              # 来源类型（RuleRegistry.CONTAINER/PUBLIC/CUSTOM/SERVICE）
+    container_prefix: str  # 容器ID前缀
+    digest: str            # 规则哈希
+
+    def owned_by(self, container_id: str) -> bool:
+        return container_id.startswith(self.container_prefix)
+
+
+class RegistryCounts(NamedTuple):
+    """写线程发布的登记表计数（整体替换，不原地修改）"""
+    records: int           # 记录数
+    rules: Dict[str, int]  # 来源类型 -> 规则数
+
+
+class RuleRegistry:
+    """规则登记表"""
+
+    CONTAINER = "container"  # 容器端口规则（含Public端口相同时的FORWARD规则）
+    PUBLIC = "public"        # 容器Public端口NAT规则
+    CUSTOM = "custom"        # 容器自定义防火墙规则
+    SERVICE = "service"      # Swarm Service规则
+    SERVICE_KINDS = (PUBLIC, CUSTOM, SERVICE)
+
+    # 旧接口中Public/自定义规则使用的ID后缀
+    _SUFFIXES = {PUBLIC: "_public", CUSTOM: "_custom"}
+
+    # 归属标签中的来源类型代码
+    _TAG_CODES = {CONTAINER: "c", PUBLIC: "p", CUSTOM: "u", SERVICE: "s"}
+    _TAG_KINDS = {code: kind for kind, code in _TAG_CODES.items()}
+
+    def __init__(self):
+        # 事务期间被修改记录的原值（None表示原来不存在），提交失败时据此恢复
+        self._journal: Optional[Dict[RecordKey, Optional[Tuple]]] = None
+        self._reset()
+        self.counts = RegistryCounts(0, {})
+
+    def _reset(self):
+        self._records: Dict[RecordKey, Tuple] = {}
+        self._signatures: Dict[RecordKey, FrozenSet[Tuple]] = {}
+        self._by_container: Dict[str, Set[RecordKey]] = {}
+        self._by_address: Dict[str, Set[RecordKey]] = {}
+        self._by_port: Dict[Tuple[str, int], Set[RecordKey]] = {}
+        self._by_source: Dict[str, Set[RecordKey]] = {}
+        self._rule_counts: Dict[str, int] = {}
+        # 容器ID -> 该容器的记录最后一次登记的时间（time.monotonic()）
+        self._changed_at: Dict[str, float] = {}
+
+    @classmethod
+    def key_for_id(cls, record_id: str, kind: Optional[str] = None) -> RecordKey:
+        """由旧接口的ID（如 `<容器ID>_public`）得到主键；指定kind时直接使用"""
+        if kind is not None:
+            return (kind, record_id)
+        for suffix_kind, suffix in cls._SUFFIXES.items():
+            if record_id.endswith(suffix):
+                return (suffix_kind, record_id[:-len(suffix)])
+        return (cls.SERVICE, record_id)
+
+    @classmethod
+    def id_for_key(cls, key: RecordKey) -> str:
+        """主键对应的旧接口ID"""
+        kind, record_id = key
+        return record_id + cls._SUFFIXES.get(kind, "")
+
+    @classmethod
+    def owner_tag(cls, kind: str, rule) -> str:
+        """规则的归属标签：来源类型、容器ID前缀和规则特征的哈希"""
+        material = "|".join(str(part)
+                            for part in (kind, rule.container_id) + rule.signature)
+        digest = hashlib.sha1(material.encode()).hexdigest()[:8]
+        container = rule.container_id[:CONTAINER_ID_PREFIX_LEN]
+        return f"{TAG_PREFIX}:{cls._TAG_CODES[kind]}:{container}:{digest}"
+
+    @classmethod
+    def parse_owner_tag(cls, comment: Optional[str]) -> Optional[OwnerTag]:
+        """从规则注释中解析归属标签，不是本程序生成的注释返回None"""
+        if not comment or not comment.startswith(TAG_PREFIX + ":"):
+            return None
+        parts = comment.split(" ", 1)[0].split(":")
+        if len(parts) != 4 or parts[1] not in cls._TAG_KINDS:
+            return None
+        return OwnerTag(cls._TAG_KINDS[parts[1]], parts[2], parts[3])
+
+    @staticmethod
+    def _index_add(index: Dict, value, key: RecordKey):
+        index.setdefault(value, set()).add(key)
+
+    @staticmethod
+    def _index_discard(index: Dict, value, key: RecordKey):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def _unindex(self, key: RecordKey):
+        rules = self._records.get(key, ())
+        for rule in rules:
+            self._index_discard(self._by_container, rule.container_id, key)
+            self._index_discard(self._by_address, rule.address, key)
+            self._index_discard(self._by_port, (rule.protocol, rule.port), key)
+        self._index_discard(self._by_source, key[0], key)
+        if rules:
+            self._rule_counts[key[0]] -= len(rules)
+        for rule in rules:
+            if rule.container_id not in self._by_container:
+                self._changed_at.pop(rule.container_id, None)
+
+    def _index(self, key: RecordKey):
+        rules = self._records[key]
+        now = time.monotonic()
+        for rule in rules:
+            self._changed_at[rule.container_id] = now
+            self._index_add(self._by_container, rule.container_id, key)
+            self._index_add(self._by_address, rule.address, key)
+            self._index_add(self._by_port, (rule.protocol, rule.port), key)
+        self._index_add(self._by_source, key[0], key)
+        self._rule_counts[key[0]] = self._rule_counts.get(key[0], 0) + len(rules)
+
+    def _publish(self):
+        """发布当前计数：不在事务中时修改立即生效，事务中的修改等提交后发布"""
+        if self._journal is None:
+            self.counts = RegistryCounts(len(self._records), dict(self._rule_counts))
+
+    def begin(self):
+        """开始记录变更：之后的修改在 commit() 前都可以用 rollback() 撤销"""
+        self._journal = {}
+
+    def commit(self):
+        """确认事务期间的修改"""
+        self._journal = None
+        self._publish()
+
+    def rollback(self):
+        """撤销事务期间的修改（规则提交失败时调用）"""
+        journal, self._journal = self._journal, None
+        for key, rules in (journal or {}).items():
+            if rules is None:
+                self.remove(key)
+            else:
+                self.set(key, rules)
+
+    def _remember(self, key: RecordKey):
+        if self._journal is not None and key not in self._journal:
+            self._journal[key] = self._records.get(key)
+
+    def set(self, key: RecordKey, rules: Iterable):
+        """登记（替换）一条记录的全部规则"""
+        self._remember(key)
+        self._unindex(key)
+        self._records[key] = tuple(rules)
+        self._signatures[key] = frozenset(rule.signature for rule in self._records[key])
+        self._index(key)
+        self._publish()
+
+    def extend(self, key: RecordKey, rules: Iterable):
+        """向记录追加规则"""
+        self.set(key, self._records.get(key, ()) + tuple(rules))
+
+    def remove(self, key: RecordKey) -> Tuple:
+        """删除记录，返回其规则"""
+        self._remember(key)
+        self._unindex(key)
+        self._signatures.pop(key, None)
+        rules = self._records.pop(key, ())
+        self._publish()
+        return rules
+
+    def get(self, key: RecordKey) -> Tuple:
+        return self._records.get(key, ())
+
+    def __contains__(self, key: RecordKey) -> bool:
+        return key in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def keys(self, kinds: Optional[Iterable[str]] = None) -> List[RecordKey]:
+        """记录主键（可按来源类型过滤）"""
+        if kinds is None:
+            return list(self._records)
+        return [key for kind in kinds for key in self._by_source.get(kind, ())]
+
+    def items(self, kinds: Optional[Iterable[str]] = None
+              ) -> List[Tuple[RecordKey, Tuple]]:
+        return [(key, self._records[key]) for key in self.keys(kinds)]
+
+    def has_signature(self, key: RecordKey, signature: Tuple) -> bool:
+        """记录中是否已有特征相同的规则"""
+        return signature in self._signatures.get(key, ())
+
+    def signature_delta(self, key: RecordKey,
+                        signatures: Iterable[Tuple]) -> Tuple[FrozenSet, FrozenSet]:
+        """与已登记特征对比：返回 (新增特征, 消失特征)"""
+        new = frozenset(signatures)
+        old = self._signatures.get(key, frozenset())
+        return new - old, old - new
+
+    def keys_for_container(self, container_id: str) -> Set[RecordKey]:
+        return set(self._by_container.get(container_id, ()))
+
+    def keys_for_address(self, address: str) -> Set[RecordKey]:
+        return set(self._by_address.get(address, ()))
+
+    def keys_for_port(self, protocol: str, port: int) -> Set[RecordKey]:
+        return set(self._by_port.get((protocol, port), ()))
+
+    def container_ids(self) -> Set[str]:
+        """所有记录涉及的容器ID"""
+        return set(self._by_container)
+
+    def changed_since(self, container_id: str, since: float) -> bool:
+        """容器的记录是否在指定时间（time.monotonic()）之后登记过"""
+        return self._changed_at.get(container_id, float("-inf")) > since
+
+    def rule_count(self, kinds: Optional[Iterable[str]] = None) -> int:
+        if kinds is None:
+            return sum(self._rule_counts.values())
+        return sum(self._rule_counts.get(kind, 0) for kind in kinds)
+
+    def clear(self, kinds: Optional[Iterable[str]] = None):
+        """清空记录（可按来源类型）"""
+        if kinds is None:
+            for key in self._records:
+                self._remember(key)
+            self._reset()
+            self._publish()
+            return
+        for key in self.keys(kinds):
+            self.remove(key)
+
+
+class RegistryView(MutableMapping):
+    """按旧接口（ID -> 规则列表）访问登记表的视图"""
+
+    def __init__(self, registry: RuleRegistry, kinds: Tuple[str, ...]):
+        self.registry = registry
+        self.kinds = kinds
+
+    def _key(self, record_id: str) -> RecordKey:
+        if len(self.kinds) == 1:
+            return RuleRegistry.key_for_id(record_id, self.kinds[0])
+        return RuleRegistry.key_for_id(record_id)
+
+    def _id(self, key: RecordKey) -> str:
+        if len(self.kinds) == 1:
+            return key[1]
+        return RuleRegistry.id_for_key(key)
+
+    def __getitem__(self, record_id: str) -> List:
+        key = self._key(record_id)
+        if key not in self.registry:
+            raise KeyError(record_id)
+        return list(self.registry.get(key))
+
+    def __setitem__(self, record_id: str, rules):
+        self.registry.set(self._key(record_id), rules)
+
+    def __delitem__(self, record_id: str):
+        key = self._key(record_id)
+        if key not in self.registry:
+            raise KeyError(record_id)
+        self.registry.remove(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([self._id(key) for key in self.registry.keys(self.kinds)])
+
+    def __len__(self) -> int:
+        return len(self.registry.keys(self.kinds))
+
+    def clear(self):
+        self.registry.clear(self.kinds)
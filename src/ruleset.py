@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+规则快照模块（iptables-save 内存模型）
+
+一次 `*-save` 读取本程序管理的链，解析成按 (表, 链) 索引的内存模型，
+规则存在性检查直接查询模型，不再为每条规则启动一次 `-C` 子进程。
+"""
+
+import shlex
+import subprocess
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+from rule_backend import split_rule
+from rule_registry import OwnerTag, RuleRegistry
+
+# 规范化后的规则：与参数顺序无关的 (选项, 值...) 元组
+RuleKey = Tuple[Tuple[str, ...], ...]
+
+# 长选项 -> 短选项（save输出统一使用短选项）
+_OPTION_ALIASES = {
+    "--protocol": "-p",
+    "--source": "-s",
+    "--destination": "-d",
+    "--in-interface": "-i",
+    "--out-interface": "-o",
+    "--jump": "-j",
+    "--goto": "-g",
+    "--match": "-m",
+}
+
+# save输出中ICMPv6类型以数字表示
+_ICMPV6_TYPES = {
+    "destination-unreachable": "1",
+    "packet-too-big": "2",
+    "time-exceeded": "3",
+    "parameter-problem": "4",
+    "echo-request": "128",
+    "echo-reply": "129",
+    "router-solicitation": "133",
+    "router-advertisement": "134",
+    "neighbor-solicitation": "135",
+    "neighbour-solicitation": "135",
+    "neighbor-advertisement": "136",
+    "neighbour-advertisement": "136",
+}
+
+_PROTOCOL_ALIASES = {
+    "icmpv6": "ipv6-icmp",
+    "58": "ipv6-icmp",
+    "6": "tcp",
+    "17": "udp",
+}
+
+
+def _normalize_address(value: str) -> str:
+    """单个地址补全前缀长度（save输出总是带前缀）"""
+    if "/" in value or "," in value:
+        return value
+    return f"{value}/128" if ":" in value else f"{value}/32"
+
+
+def rule_key(spec: List[str]) -> RuleKey:
+    """将规则参数（不含动作和链）规范化为与书写顺序无关的键
+
+    `-m <模块>` 只是加载匹配模块，不参与比较；协议、地址和ICMPv6类型
+    统一成save输出的写法。
+    """
+    groups = []
+    current: Optional[List[str]] = None
+    negate = False
+
+    for arg in spec:
+        if arg == "!":
+            negate = True
+            continue
+        if arg.startswith("-") and len(arg) > 1 and not arg[1].isdigit():
+            option = _OPTION_ALIASES.get(arg, arg)
+            current = ["!", option] if negate else [option]
+            negate = False
+            groups.append(current)
+        elif current is not None:
+            current.append(arg)
+
+    normalized = []
+    for group in groups:
+        option_index = 1 if group[0] == "!" else 0
+        option = group[option_index]
+        values = group[option_index + 1:]
+        if option == "-m":
+            continue
+        if option == "-p" and values:
+            protocol = values[0].lower()
+            values = [_PROTOCOL_ALIASES.get(protocol, protocol)]
+        elif option in ("-s", "-d") and values:
+            values = [_normalize_address(values[0])]
+        elif option == "--icmpv6-type" and values:
+            values = [_ICMPV6_TYPES.get(values[0], values[0])]
+        normalized.append(tuple(group[:option_index + 1]) + tuple(values))
+
+    return tuple(sorted(normalized))
+
+
+def _jump_target(spec: List[str]) -> Optional[str]:
+    """规则的跳转目标链"""
+    for option in ("-j", "--jump", "-g", "--goto"):
+        if option in spec:
+            index = spec.index(option)
+            if index + 1 < len(spec):
+                return spec[index + 1]
+    return None
+
+
+def rule_comment(spec: List[str]) -> Optional[str]:
+    """规则的注释内容"""
+    if "--comment" in spec:
+        index = spec.index("--comment")
+        if index + 1 < len(spec):
+            return spec[index + 1]
+    return None
+
+
+def rule_owner(spec: List[str]) -> Optional[OwnerTag]:
+    """由注释中的结构化标签得到规则归属，非本程序生成的规则返回None"""
+    return RuleRegistry.parse_owner_tag(rule_comment(spec))
+
+
+class ChainRules:
+    """单条链中的规则：有序的 (规范化键, 原始参数) 列表 + 计数索引"""
+
+    def __init__(self):
+        self.entries: List[Tuple[RuleKey, List[str]]] = []
+        self.index: Counter = Counter()
+
+    def append(self, key: RuleKey, spec: List[str]):
+        self.entries.append((key, spec))
+        self.index[key] += 1
+
+    def insert(self, position: int, key: RuleKey, spec: List[str]):
+        self.entries.insert(max(position - 1, 0), (key, spec))
+        self.index[key] += 1
+
+    def remove(self, key: RuleKey):
+        if self.index[key] <= 0:
+            return
+        for i, (entry_key, _) in enumerate(self.entries):
+            if entry_key == key:
+                del self.entries[i]
+                break
+        self.index[key] -= 1
+
+    def remove_at(self, position: int):
+        if 0 < position <= len(self.entries):
+            key, _ = self.entries.pop(position - 1)
+            self.index[key] -= 1
+
+    def clear(self):
+        self.entries.clear()
+        self.index.clear()
+
+    def __contains__(self, key: RuleKey) -> bool:
+        return self.index[key] > 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Ruleset:
+    """单个地址族（ip6tables/iptables）的规则快照
+
+    完整记录本程序管理的链；内置链（FORWARD/INPUT/...）只记录跳转到这些链的规则。
+    超出记录范围的查询返回None，由调用方回退到 `-C` 检查。
+    """
+
+    TABLES = ("filter", "nat")
+
+    def __init__(self, iptables_cmd: str, owned_chains: Iterable[str],
+                 owned_prefixes: Iterable[str] = ()):
+        self.iptables_cmd = iptables_cmd
+        self.owned_chains: Set[str] = set(owned_chains)
+        self.owned_prefixes: Tuple[str, ...] = tuple(owned_prefixes)
+        self.logger = logging.getLogger(__name__)
+        self.chains: Dict[str, Set[str]] = {}
+        self.rules: Dict[Tuple[str, str], ChainRules] = {}
+        self.loaded = False
+
+    def save_command(self) -> List[str]:
+        """由ip6tables/iptables命令推导对应的save命令"""
+        return [f"{self.iptables_cmd}-save"]
+
+    def invalidate(self):
+        """标记快照失效（怀疑与内核状态不一致），下次查询时重新读取"""
+        self.loaded = False
+
+    def load(self) -> bool:
+        """执行一次save读取内核规则，失败时保持未加载状态"""
+        try:
+            with metrics.backend_call(self.save_command()):
+                result = subprocess.run(self.save_command(), capture_output=True,
+                                        text=True)
+        except OSError as e:
+            self.logger.debug(f"读取规则快照失败: {e}")
+            self.loaded = False
+            return False
+
+        if result.returncode != 0:
+            self.logger.debug(f"读取规则快照失败: {result.stderr.strip()}")
+            self.loaded = False
+            return False
+
+        self.parse(result.stdout)
+        self.loaded = True
+        return True
+
+    def ensure_loaded(self) -> bool:
+        return self.loaded or self.load()
+
+    def parse(self, text: str):
+        """解析save输出"""
+        self.chains = {table: set() for table in self.TABLES}
+        self.rules = {}
+        table = None
+
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("*"):
+                table = line[1:]
+                continue
+            if line == "COMMIT":
+                table = None
+                continue
+            if table not in self.chains:
+                continue
+            if line.startswith(":"):
+                self.chains[table].add(line[1:].split()[0])
+                continue
+            try:
+                args = shlex.split(line)
+            except ValueError:
+                self.logger.debug(f"无法解析规则行: {line}")
+                continue
+            self.apply(table, args)
+
+    def owns(self, chain: Optional[str]) -> bool:
+        """链是否由本程序管理（固定链名或按前缀命名的子链）"""
+        if not chain:
+            return False
+        return chain in self.owned_chains or (bool(self.owned_prefixes)
+                                              and chain.startswith(self.owned_prefixes))
+
+    def _tracked(self, chain: str, spec: List[str]) -> bool:
+        """规则是否在快照记录范围内"""
+        return self.owns(chain) or self.owns(_jump_target(spec))
+
+    def _chain(self, table: str, chain: str) -> ChainRules:
+        return self.rules.setdefault((table, chain), ChainRules())
+
+    def apply(self, table: str, line: List[str]):
+        """在模型上重放一条restore行（-A/-I/-D/-N/-F/-X）"""
+        _, action, chain, spec = split_rule(line)
+        chains = self.chains.setdefault(table, set())
+
+        if action == "-N":
+            chains.add(chain)
+        elif action == "-F":
+            self._chain(table, chain).clear()
+        elif action == "-X":
+            chains.discard(chain)
+            self.rules.pop((table, chain), None)
+        elif action == "-D" and len(spec) == 1 and spec[0].isdigit():
+            if self.owns(chain):
+                self._chain(table, chain).remove_at(int(spec[0]))
+        elif action in ("-A", "-I", "-D") and self._tracked(chain, spec):
+            rules = self._chain(table, chain)
+            key = rule_key(spec)
+            if action == "-A":
+                rules.append(key, spec)
+            elif action == "-I":
+                position = line[2] if len(line) > 2 and line[2].isdigit() else "1"
+                rules.insert(int(position), key, spec)
+            else:
+                rules.remove(key)
+
+    def apply_all(self, operations: Iterable[Tuple[str, List[str]]]):
+        """事务提交成功后重放全部变更"""
+        if not self.loaded:
+            return
+        for table, line in operations:
+            self.apply(table, line)
+
+    def contains(self, rule: List[str]) -> Optional[bool]:
+        """查询规则是否存在；快照不可用或规则不在记录范围内时返回None"""
+        table, _, chain, spec = split_rule(rule)
+        if not self._tracked(chain, spec) or not self.ensure_loaded():
+            return None
+        return rule_key(spec) in self.rules.get((table, chain), ())
+
+    def has_chain(self, chain: str, table: str = "filter") -> Optional[bool]:
+        """查询链是否存在；快照不可用时返回None"""
+        if not self.ensure_loaded():
+            return None
+        return chain in self.chains.get(table, set())
+
+    def chains_with_prefix(self, prefix: str, table: str = "filter") -> List[str]:
+        """快照中以指定前缀命名的链"""
+        return sorted(chain for chain in self.chains.get(table, set())
+                      if chain.startswith(prefix))
+
+    def chain_rules(self, chain: str, table: str = "filter") -> List[RuleKey]:
+        """链中规则的规范化键（按顺序）"""
+        return [key for key, _ in self.chain_entries(chain, table)]
+
+    def chain_entries(self, chain: str,
+                      table: str = "filter") -> List[Tuple[RuleKey, List[str]]]:
+        """链中规则的 (规范化键, 原始参数)（按顺序），原始参数可直接用于 -D"""
+        rules = self.rules.get((table, chain))
+        return list(rules.entries) if rules else []
+
+    def owned_entries(self, kinds: Optional[Iterable[str]] = None
+                      ) -> List[Tuple[str, str, List[str], OwnerTag]]:
+        """所有带归属标签的规则：[(表, 链, 原始参数, 标签)]，可按来源类型过滤"""
+        kinds = set(kinds) if kinds is not None else None
+        entries = []
+        for (table, chain), rules in self.rules.items():
+            for _, spec in rules.entries:
+                owner = rule_owner(spec)
+                if owner is not None and (kinds is None or owner.kind in kinds):
+                    entries.append((table, chain, spec, owner))
+        return entries
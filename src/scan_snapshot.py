@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+周期扫描快照模块
+
+每轮周期扫描开始时用一次 containers.list 取得本节点全部容器，逐个经inspect缓存得到容器信息，
+按容器ID和Service标签建立索引后交给扫描的各个阶段（陈旧规则清理、容器处理、Service处理）。
+各阶段不再各自列出和inspect容器，每轮扫描的Docker API调用为 O(容器数)，而不是 O(Service数 × 容器数)。
+
+快照在扫描线程中获取（不占用规则下发线程），创建后不再改变；扫描期间到达的事件照常走
+事件路径，并覆盖扫描提交的意图。快照记录列出容器的时间，清理陈旧规则时跳过此后才登记的容器。
+
+指纹：容器的ID、名称、状态、网络地址、端口绑定和相关标签（以及Service的 Version.Index）的哈希，
+即规则推导用到的全部输入。指纹与上次处理时相同的容器和Service在扫描中跳过，稳态下一轮扫描只有一次列出容器。
+"""
+
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+SERVICE_NAME_LABEL = 'com.docker.swarm.service.name'
+# 参与规则推导的标签前缀（其余标签的变化不影响规则）
+FINGERPRINT_LABEL_PREFIXES = ('docker-ipv6-firewall.', 'com.docker.swarm.service.')
+
+ContainerInfo = Dict[str, Any]
+
+
+def container_fingerprint(info: ContainerInfo, salt: Any = None) -> str:
+    """容器规则输入的哈希（salt 为其他影响结果的状态，如网络索引版本）"""
+    host_config = info.get('host_config') or {}
+    labels = (info.get('config') or {}).get('Labels') or {}
+    payload = json.dumps([
+        info.get('id'), info.get('name'), info.get('status'), salt,
+        host_config.get('NetworkMode'), host_config.get('PortBindings'),
+        (info.get('network_settings') or {}).get('Ports'),
+        {name: (network or {}).get('GlobalIPv6Address')
+         for name, network in (info.get('networks') or {}).items()},
+        {key: value for key, value in labels.items()
+         if key.startswith(FINGERPRINT_LABEL_PREFIXES)},
+    ], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class ScanSnapshot:
+    """一轮扫描看到的容器和Service（只读）"""
+
+    __slots__ = ("container_ids", "containers", "running", "services",
+                 "service_versions", "salt", "listed_at", "service_infos")
+
+    def __init__(self, container_ids, containers: Mapping[str, ContainerInfo],
+                 service_versions: Optional[Mapping[str, int]] = None,
+                 salt: Any = None, listed_at: Optional[float] = None,
+                 service_infos: Optional[Mapping[str, Dict[str, Any]]] = None):
+        # 列出的全部容器ID（包括inspect失败的，清理陈旧规则时不能把它们当作已消失）
+        self.container_ids: FrozenSet[str] = frozenset(container_ids)
+        # 容器ID -> 容器信息（与 DockerMonitor._get_container_info 的结构相同）
+        self.containers: Mapping[str, ContainerInfo] = \
+            MappingProxyType(dict(containers))
+        self.running: FrozenSet[str] = frozenset(
+            container_id for container_id, info in containers.items()
+            if info.get('status') == 'running')
+        # Service名 -> 本节点容器ID（按列出顺序）
+        services: Dict[str, List[str]] = {}
+        for container_id, info in containers.items():
+            labels = (info.get('config') or {}).get('Labels') or {}
+            service_name = labels.get(SERVICE_NAME_LABEL)
+            if service_name:
+                services.setdefault(service_name, []).append(container_id)
+        self.services: Mapping[str, Tuple[str, ...]] = MappingProxyType(
+            {name: tuple(ids) for name, ids in services.items()})
+        # Service名 -> Version.Index（非manager节点无法获取，为空）
+        self.service_versions: Mapping[str, int] = \
+            MappingProxyType(dict(service_versions or {}))
+        self.salt = salt
+        # 列出容器的时间（time.monotonic()），此后登记的规则不由本快照判断是否陈旧
+        self.listed_at = listed_at
+        # Service名 -> Service信息（与 DockerMonitor._get_service_info 的结构相同）
+        self.service_infos: Mapping[str, Dict[str, Any]] = \
+            MappingProxyType(dict(service_infos or {}))
+
+    def service_names(self) -> List[str]:
+        """本节点有容器（含已停止的）的Service"""
+        return list(self.services)
+
+    def service_containers(self, service_name: str, running_only: bool = True
+                           ) -> List[Tuple[str, ContainerInfo]]:
+        """属于该Service的容器 (容器ID, 容器信息)"""
+        return [(container_id, self.containers[container_id])
+                for container_id in self.services.get(service_name, ())
+                if not running_only or container_id in self.running]
+
+    def container_fingerprint(self, container_id: str) -> str:
+        return container_fingerprint(self.containers[container_id], self.salt)
+
+    def service_fingerprint(self, service_name: str) -> str:
+        """Service版本和本节点运行中容器指纹的哈希"""
+        containers = self.service_containers(service_name)
+        payload = json.dumps([service_name, self.service_versions.get(service_name),
+                              sorted(self.container_fingerprint(container_id)
+                                     for container_id, _ in containers)])
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.container_ids)
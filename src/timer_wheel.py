@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+时间轮定时器模块
+
+按键去重的延迟回调（如Service容器启动后延迟重新检查Service）：同一个键最多只有一个
+待执行的定时器，再次调度时推迟到期时间（可设置自第一次调度起的最长延迟，持续的事件
+不会无限推迟）。调度和取消都是 O(1)：定时器按到期刻度放入环形槽位，后台线程每个刻度
+只检查当前槽位；没有定时器时线程不唤醒。
+
+回调在时间轮线程中执行，应只做轻量操作（如向变更队列提交意图）。
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# 键 -> (到期刻度, 最晚到期刻度, 回调)
+Timer = Tuple[int, Optional[int], Callable[[], None]]
+
+
+class TimerWheel:
+    """单层哈希时间轮（线程安全）"""
+
+    def __init__(self, tick: float = 0.1, slots: int = 512, name: str = "timer-wheel"):
+        self.tick = tick      # 刻度（秒），即定时精度
+        self.slots = slots
+        self.name = name
+        self.logger = logging.getLogger(__name__)
+        self._wheel: List[Dict[Hashable, Timer]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current = self._tick_of(time.monotonic())  # 下一个待处理的刻度
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _tick_of(self, now: float) -> int:
+        return int(now / self.tick)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        """停止时间轮线程（未到期的定时器被丢弃）"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], None],
+                 max_delay: Optional[float] = None, now: Optional[float] = None):
+        """delay秒后执行回调；同一个键已有定时器时替换回调并推迟到期时间
+
+        max_delay 为自该键第一次调度起的最长延迟，推迟不会超过它。
+        """
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            deadline = max(self._tick_of(now + delay), self._current)
+            latest = None
+            previous = self._pop(key)
+            if previous is not None:
+                latest = previous[1]
+            elif max_delay is not None:
+                latest = self._tick_of(now + max_delay)
+            if latest is not None:
+                deadline = min(deadline, max(latest, self._current))
+            slot = deadline % self.slots
+            self._wheel[slot][key] = (deadline, latest, callback)
+            self._slot_of[key] = slot
+            self._cond.notify_all()
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._cond:
+            return self._pop(key) is not None
+
+    def pending(self, key: Hashable) -> bool:
+        with self._cond:
+            return key in self._slot_of
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._slot_of)
+
+    def _pop(self, key: Hashable) -> Optional[Timer]:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return None
+        return self._wheel[slot].pop(key)
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """执行到 now 为止到期的回调，返回执行的数量（后台线程调用，测试中可直接调用）"""
+        now = time.monotonic() if now is None else now
+        target = self._tick_of(now)
+        due = []
+        with self._cond:
+            if not self._slot_of:
+                self._current = max(self._current, target + 1)
+                return 0
+            # 超过一圈时每个槽位只需检查一次
+            first = max(self._current, target - self.slots + 1)
+            for tick in range(first, target + 1):
+                slot = self._wheel[tick % self.slots]
+                for key in [key for key, timer in slot.items() if timer[0] <= target]:
+                    due.append(slot.pop(key)[2])
+                    del self._slot_of[key]
+            self._current = max(self._current, target + 1)
+
+        for callback in due:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"定时回调执行失败: {e}")
+        return len(due)
+
+    def _next_wait(self) -> Optional[float]:
+        """距下一个刻度的秒数；没有定时器时为None（等待调度唤醒）"""
+        if not self._slot_of:
+            return None
+        return max(0.0, (self._current * self.tick) - time.monotonic())
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                timeout = self._next_wait()
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+            if self._stop_event.is_set():
+                break
+            self.advance()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+调用链追踪模块
+
+为单个事件的处理过程（Docker API调用、端口解析、后端命令、批量提交）记录计时span，
+格式与OpenTelemetry（OTLP JSON）的span一致：traceId/spanId/parentSpanId、纳秒时间戳、
+属性列表和状态。span保存在内存环形缓冲区中，也可以按JSON Lines追加写入文件，
+用于分析容器启动到规则生效的时间花在哪里。
+
+默认关闭；关闭时 span() 返回共享的空对象，几乎没有开销。
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute_value(value: Any) -> Dict[str, Any]:
+    """按OTLP JSON编码属性值"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空span"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """一个计时区间；在同一线程（或同一asyncio任务）中嵌套的span自动成为子span"""
+
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id",
+                 "parent_span_id", "start_ns", "end_ns", "status", "status_message",
+                 "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.end_ns = 0
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        stack = self.tracer._stack.get()
+        parent = stack[-1] if stack else None
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_span_id = parent.span_id if parent else ""
+        self.span_id = os.urandom(8).hex()
+        self._token = self.tracer._stack.set(stack + (self,))
+        self.start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.status = STATUS_ERROR
+            self.status_message = f"{exc_type.__name__}: {exc}"
+        try:
+            self.tracer._stack.reset(self._token)
+        except ValueError:
+            pass  # 在其他上下文中结束（不应发生），不影响记录
+        self.tracer._finish(self)
+        return False
+
+    @property
+    def duration(self) -> float:
+        """耗时（秒）"""
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_dict(self) -> Dict[str, Any]:
+        record = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _attribute_value(value)}
+                           for key, value in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.status_message:
+            record["status"]["message"] = self.status_message
+        return record
+
+
+class Tracer:
+    """span记录器：环形缓冲区 + 可选的JSON Lines文件"""
+
+    def __init__(self):
+        self.enabled = False
+        self.path: Optional[str] = None
+        self.logger = logging.getLogger(__name__)
+        self._buffer: deque = deque(maxlen=1000)
+        # 当前span栈：每个线程、每个asyncio任务独立（并发的协程不会互相成为父span）
+        self._stack: "contextvars.ContextVar[Tuple[Span, ...]]" = \
+            contextvars.ContextVar(f"tracing_stack_{id(self)}", default=())
+        self._lock = threading.Lock()
+        self._file = None
+
+    def configure(self, enabled: bool, path: Optional[str] = None,
+                  buffer_size: int = 1000):
+        """启用/关闭追踪；path为空时只保存在环形缓冲区"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._buffer = deque(self._buffer, maxlen=buffer_size)
+            self.path = path or None
+            if enabled and self.path:
+                try:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                except OSError as e:
+                    self.logger.error(f"无法打开追踪文件 {self.path}: {e}，只记录到内存")
+            self.enabled = enabled
+
+    def close(self):
+        self.configure(False)
+
+    def span(self, name: str, **attributes):
+        """开始一个span（用作上下文管理器）"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _finish(self, span: Span):
+        record = span.to_dict()
+        with self._lock:
+            self._buffer.append(record)
+            if self._file is not None:
+                try:
+                    self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    self._file.flush()
+                except OSError as e:
+                    self.logger.error(f"写入追踪文件失败: {e}")
+
+    def recent(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """环形缓冲区中最近完成的span（按完成顺序）"""
+        with self._lock:
+            records = list(self._buffer)
+        return records[-limit:] if limit else records
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes):
+    return TRACER.span(name, **attributes)
+
+
+def traced(name: str) -> Callable:
+    """把整个函数调用记录为一个span的装饰器"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return function(*args, **kwargs)
+            with TRACER.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+规则收敛基准测试
+
+用合成的容器集群（N个容器 × M个端口 × K个Service）驱动 DockerMonitor + FirewallManager，
+Docker客户端为内存模拟，规则下发到 fake_netfilter 的内存内核，不需要root和Docker。
+测量冷启动到完整规则集的时间、事件到规则生效的 p50/p99 延迟、周期扫描的开销、
+峰值RSS和子进程启动次数，结果写入JSON文件便于跨提交对比：
+
+    ARGS="--containers 1000 --ports 4 --services 20"
+    python3 test/bench_convergence.py $ARGS -o before.json
+    python3 test/bench_convergence.py $ARGS -o after.json --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+from unittest import mock
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(TEST_DIR), "src")
+for path in (SRC_DIR, TEST_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from docker_monitor import DockerMonitor
+from fake_netfilter import FakeNetfilter
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig
+
+SERVICE_LABEL = "com.docker.swarm.service.name"
+NETWORK_NAME = "macvlan_net"
+
+
+class FakeContainer:
+    """docker.models.containers.Container 的最小模拟"""
+
+    def __init__(self, fleet: "SyntheticFleet", container_id: str, name: str,
+                 inspect: Dict):
+        self.fleet = fleet
+        self.id = container_id
+        self.name = name
+        self.status = "running"
+        self.inspect = inspect
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        return self.inspect["Config"]["Labels"]
+
+    def reload(self):
+        self.fleet.api_calls["container.reload"] += 1
+
+
+class FakeNetwork:
+    def __init__(self, name: str, driver: str):
+        self.name = name
+        self.attrs = {"Name": name, "Driver": driver}
+
+
+class _Containers:
+    def __init__(self, fleet: "SyntheticFleet"):
+        self.fleet = fleet
+
+    def list(self, all: bool = False, filters: Optional[Dict] = None,
+             sparse: bool = False) -> List[FakeContainer]:
+        self.fleet.api_calls["containers.list"] += 1
+        containers = [c for c in self.fleet.containers.values()
+                      if all or c.status == "running"]
+        label = (filters or {}).get("label")
+        if label:
+            key, _, value = label.partition("=")
+            containers = [c for c in containers
+                          if key in c.labels and (not value or c.labels[key] == value)]
+        return containers
+
+    def get(self, container_id: str) -> FakeContainer:
+        self.fleet.api_calls["containers.get"] += 1
+        return self.fleet.containers[container_id]
+
+
+class _Networks:
+    def __init__(self, fleet: "SyntheticFleet"):
+        self.fleet = fleet
+
+    def get(self, name: str) -> FakeNetwork:
+        self.fleet.api_calls["networks.get"] += 1
+        return FakeNetwork(name, "macvlan" if name == NETWORK_NAME else "bridge")
+
+    def list(self) -> List[FakeNetwork]:
+        self.fleet.api_calls["networks.list"] += 1
+        return [FakeNetwork(NETWORK_NAME, "macvlan"), FakeNetwork("bridge", "bridge")]
+
+
+class _Api:
+    def __init__(self, fleet: "SyntheticFleet"):
+        self.fleet = fleet
+
+    def inspect_container(self, container_id: str) -> Dict:
+        self.fleet.api_calls["inspect_container"] += 1
+        return self.fleet.containers[container_id].inspect
+
+
+class SyntheticFleet:
+    """合成的容器集群和 docker.DockerClient 模拟（事件通过 emit() 注入）"""
+
+    def __init__(self, containers: int, ports: int, services: int, replicas: int):
+        self.ports = ports
+        self.containers: Dict[str, FakeContainer] = {}
+        self.api_calls: Counter = Counter()
+        self._events: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._serial = 0
+
+        self.api = _Api(self)
+        self.networks = _Networks(self)
+        self.containers_api = _Containers(self)
+
+        for _ in range(containers):
+            self.add_container()
+        for service in range(services):
+            for _ in range(replicas):
+                self.add_container(service=f"svc{service}")
+
+    def client(self) -> mock.Mock:
+        """docker.DockerClient 模拟（ping/close 等无关调用由 Mock 吸收）"""
+        client = mock.Mock()
+        client.containers = self.containers_api
+        client.networks = self.networks
+        client.api = self.api
+        client.events = self.events
+        return client
+
+    def add_container(self, service: Optional[str] = None,
+                      running: bool = True) -> FakeContainer:
+        """创建一个容器：一半端口与宿主机端口相同（只有FORWARD），一半不同（NAT）"""
+        self._serial += 1
+        serial = self._serial
+        container_id = f"{serial:012x}" + "0" * 52
+        labels = {SERVICE_LABEL: service} if service else {}
+        if service:
+            host_port = 30000 + int(service[3:])
+            bindings = {"80/tcp": [{"HostIp": "", "HostPort": str(host_port)}]}
+        else:
+            bindings = {}
+            for port in range(self.ports):
+                container_port = 8000 + port
+                host_port = container_port if port % 2 == 0 else 20000 + port
+                bindings[f"{container_port}/tcp"] = [{"HostIp": "",
+                                                      "HostPort": str(host_port)}]
+        name = f"{service or 'app'}-{serial}"
+        inspect = {
+            "Name": "/" + name,
+            "Config": {"Labels": labels},
+            "HostConfig": {"NetworkMode": NETWORK_NAME, "PortBindings": bindings},
+            "NetworkSettings": {
+                "Ports": {},
+                "Networks": {
+                    NETWORK_NAME: {"GlobalIPv6Address": f"2001:db8::{serial:x}"}},
+            },
+        }
+        container = FakeContainer(self, container_id, name, inspect)
+        container.status = "running" if running else "created"
+        self.containers[container_id] = container
+        return container
+
+    def emit(self, action: str, container: FakeContainer):
+        self._events.put({"Type": "container", "Action": action, "id": container.id})
+
+    def close_events(self):
+        self._events.put(None)
+
+    def events(self, decode: bool = True):
+        self.api_calls["events"] += 1
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            yield event
+
+
+def bench_config(args) -> DummyConfig:
+    config = DummyConfig()
+    config.docker_socket = "unix:///var/run/docker.sock"
+    config.forward_mode = args.mode if args.mode != "nftables" else "chain"
+    config.firewall_backend = "nftables" if args.mode == "nftables" else "iptables"
+    config.rule_applier = args.applier
+    config.apply_coalesce_window = args.window
+    config.container_stop_grace = 0  # 停止事件立即生效，便于测量延迟
+    return config
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(args) -> Dict:
+    logging.basicConfig(level=logging.ERROR)
+    fleet = SyntheticFleet(args.containers, args.ports, args.services, args.replicas)
+    fake = FakeNetfilter(latency=args.latency, rule_latency=args.rule_latency,
+                         lock_contention=args.lock_contention)
+    config = bench_config(args)
+    fm = FirewallManager(config)
+    monitor = DockerMonitor(config, fm)
+
+    # 记录每个目标的规则提交时间（批量事务提交成功之后）
+    applied: Dict = {}
+    apply_batch = monitor.apply_queue._apply_batch
+
+    def recording_apply_batch(batch):
+        apply_batch(batch)
+        now = time.perf_counter()
+        for key, _ in batch:
+            applied[key] = now
+
+    monitor.apply_queue._apply_batch = recording_apply_batch
+
+    results: Dict = {"params": vars(args).copy()}
+    results["params"].pop("output", None)
+    results["params"].pop("compare", None)
+
+    with fake.patch(), mock.patch("docker.DockerClient", return_value=fleet.client()), \
+            mock.patch.object(DockerMonitor, "_periodic_scan", lambda self: None):
+        # 冷启动：初始化链 + 处理现有容器/Service，直到规则全部提交
+        started = time.perf_counter()
+        fm.initialize()
+        monitor.start()
+        results["cold_start"] = {
+            "seconds": round(time.perf_counter() - started, 4),
+            "registered_rules": fm.registry.rule_count(),
+            "kernel_rules": fake.rule_count(),
+            "subprocesses": fake.exec_count,
+            "docker_api_calls": sum(fleet.api_calls.values()),
+        }
+
+        # 事件：新容器启动和已有容器停止交替，一次性注入后等待全部生效
+        exec_before, api_before = fake.exec_count, sum(fleet.api_calls.values())
+        emitted = {}
+        existing = [c for c in fleet.containers.values()
+                    if SERVICE_LABEL not in c.labels]
+        for index in range(args.events):
+            if index % 2 == 0 or not existing:
+                container = fleet.add_container()
+                action = "start"
+            else:
+                container = existing.pop()
+                container.status = "exited"
+                action = "die"
+            emitted[("container", container.id)] = time.perf_counter()
+            fleet.emit(action, container)
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline and not all(
+                key in applied and applied[key] >= at for key, at in emitted.items()):
+            time.sleep(0.005)
+        monitor.apply_queue.wait_idle(timeout=args.timeout)
+        latencies = [(applied[key] - at) * 1000 for key, at in emitted.items()
+                     if applied.get(key, 0) >= at]
+        results["events"] = {
+            "count": len(emitted),
+            "applied": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(max(latencies, default=0.0), 3),
+            "subprocesses": fake.exec_count - exec_before,
+            "docker_api_calls": sum(fleet.api_calls.values()) - api_before,
+        }
+
+        # 周期扫描：同步执行一轮
+        exec_before, api_before = fake.exec_count, sum(fleet.api_calls.values())
+        started = time.perf_counter()
+        monitor.scan_once()
+        results["scan"] = {
+            "seconds": round(time.perf_counter() - started, 4),
+            "subprocesses": fake.exec_count - exec_before,
+            "docker_api_calls": sum(fleet.api_calls.values()) - api_before,
+        }
+
+        monitor.running = False
+        fleet.close_events()
+        monitor.monitor_thread.join(timeout=5)
+        monitor.apply_queue.stop()
+        fm.close_applier()
+
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["subprocess_calls"] = dict(fake.calls)
+    results["docker_api_calls"] = dict(fleet.api_calls)
+    results["commit"] = git_commit()
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=TEST_DIR,
+                                capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+COMPARED = [("cold_start", "seconds"), ("cold_start", "subprocesses"),
+            ("events", "p50_ms"), ("events", "p99_ms"), ("scan", "seconds"),
+            ("scan", "subprocesses"), ("scan", "docker_api_calls"),
+            (None, "peak_rss_kb")]
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """与基准结果逐项对比"""
+    lines = []
+    for section, field in COMPARED:
+        old = baseline.get(section, {}).get(field) if section else baseline.get(field)
+        new = current.get(section, {}).get(field) if section else current.get(field)
+        name = f"{section}.{field}" if section else field
+        if old in (None, 0) or new is None:
+            lines.append(f"{name:28} {old} -> {new}")
+        else:
+            lines.append(f"{name:28} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="规则收敛基准测试")
+    parser.add_argument("--containers", type=int, default=200, help="普通容器数量")
+    parser.add_argument("--ports", type=int, default=4, help="每个容器的端口数量")
+    parser.add_argument("--services", type=int, default=10, help="Service数量")
+    parser.add_argument("--replicas", type=int, default=2, help="每个Service在本节点的副本数")
+    parser.add_argument("--events", type=int, default=100, help="注入的容器事件数量")
+    parser.add_argument("--mode", choices=["chain", "subchain", "ipset", "nftables"],
+                        default="chain")
+    parser.add_argument("--applier", choices=["persistent", "oneshot"],
+                        default="persistent")
+    parser.add_argument("--window", type=float, default=0.2, help="规则变更合并窗口（秒）")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="每次命令调用的模拟延迟（秒）")
+    parser.add_argument("--rule-latency", type=float, default=0.0,
+                        help="每条规则变更的模拟延迟（秒）")
+    parser.add_argument("--lock-contention", type=float, default=0.0,
+                        help="xtables锁被占用的概率")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="等待事件生效的最长时间（秒）")
+    parser.add_argument("-o", "--output", help="结果JSON文件")
+    parser.add_argument("--compare", help="用于对比的基准结果JSON文件")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(json.load(f), results)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
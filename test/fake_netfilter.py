@@ -0,0 +1,650 @@
+#!/usr/bin/env python3
+"""
+内存中的 iptables / nftables / ipset 模拟后端
+
+接收与真实命令相同的参数和 restore / `nft -f` / `ipset restore` 输入，在内存中维护
+各表各链的规则：规则按 iptables-save 的写法保存，`-C`/`-D` 按该写法匹配（与参数书写
+顺序无关，规范化逻辑独立于被测代码），restore 的每个 COMMIT 块原子生效，引用中的链
+和集合不能删除。可以为每次调用注入延迟和
+xtables 锁争用，用于无root环境下的测试和基准测试：
+
+    fake = FakeNetfilter(latency=0.002, lock_contention=0.1)
+    with fake.patch():
+        fm.initialize()
+"""
+
+import io
+import json
+import os
+import random
+import shlex
+import subprocess
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+from unittest import mock
+
+BUILTIN_CHAINS = {
+    "filter": ("INPUT", "FORWARD", "OUTPUT"),
+    "nat": ("PREROUTING", "INPUT", "OUTPUT", "POSTROUTING"),
+}
+STANDARD_TARGETS = {"ACCEPT", "DROP", "RETURN", "REJECT", "DNAT", "SNAT", "MASQUERADE",
+                    "LOG", "MARK"}
+LOCK_HELD_EXIT = 4
+
+# 以下是 iptables-save 输出规则的写法，独立于被测代码中的规则规范化逻辑
+LONG_OPTIONS = {
+    "--source": "-s", "--destination": "-d", "--in-interface": "-i",
+    "--out-interface": "-o", "--protocol": "-p", "--match": "-m", "--jump": "-j",
+    "--goto": "-g",
+    "--destination-port": "--dport", "--source-port": "--sport",
+}
+BASE_OPTIONS = ("-s", "-d", "-i", "-o", "-p")  # save输出中按此顺序排在匹配模块之前
+PROTOCOL_NAMES = {"icmpv6": "ipv6-icmp", "58": "ipv6-icmp", "6": "tcp", "17": "udp",
+                  "1": "icmp"}
+PROTOCOL_MATCHES = {"tcp": "tcp", "udp": "udp", "ipv6-icmp": "icmp6", "icmp": "icmp"}
+PROTOCOL_OPTIONS = {"--dport", "--sport", "--tcp-flags", "--syn", "--icmpv6-type",
+                    "--icmp-type"}
+ICMPV6_TYPES = {
+    "destination-unreachable": "1", "packet-too-big": "2", "time-exceeded": "3",
+    "parameter-problem": "4", "echo-request": "128", "echo-reply": "129",
+    "router-solicitation": "133", "router-advertisement": "134",
+    "neighbor-solicitation": "135", "neighbour-solicitation": "135",
+    "neighbor-advertisement": "136", "neighbour-advertisement": "136",
+}
+
+
+def split_args(args: List[str]) -> Tuple[str, str, str, List[str]]:
+    """拆分命令参数：(表, 动作, 链, 规则参数)；-I 的插入位置不属于规则参数"""
+    table = "filter"
+    if len(args) >= 2 and args[0] == "-t":
+        table, args = args[1], args[2:]
+    action = args[0] if args else ""
+    chain = args[1] if len(args) > 1 and not args[1].startswith("-") else ""
+    spec = list(args[2:] if chain else args[1:])
+    if action == "-I" and spec and spec[0].isdigit():
+        spec = spec[1:]
+    return table, action, chain, spec
+
+
+def save_form(spec: List[str]) -> List[str]:
+    """规则参数在 iptables-save 输出中的写法
+
+    基本选项按固定顺序排在前面，协议选项前补上隐式加载的 `-m <协议>`，地址补全
+    前缀长度，协议和ICMPv6类型换成save使用的名称/数字；匹配模块保持添加时的顺序。
+    内核按这种写法比较规则，-C/-D 与参数书写顺序无关。
+    """
+    base: Dict[str, List[str]] = {}
+    matches: List[List[str]] = []
+    target: List[str] = []
+    current: Optional[List[str]] = None  # 接收后续参数值的分组
+    owner: Optional[List[str]] = None    # 最近的匹配模块或目标（接收其选项）
+    negate = False
+
+    for arg in spec:
+        if arg == "!":
+            negate = True
+            continue
+        if not (arg.startswith("-") and len(arg) > 1 and not arg[1].isdigit()):
+            if current is None:
+                raise NetfilterError(f"Bad argument `{arg}'", returncode=2)
+            current.append(arg)
+            continue
+
+        option = LONG_OPTIONS.get(arg, arg)
+        tokens = ["!", option] if negate else [option]
+        negate = False
+        if option in BASE_OPTIONS:
+            current = base[option] = tokens
+        elif option == "-m":
+            current = owner = tokens
+            matches.append(tokens)
+        elif option in ("-j", "-g"):
+            current = owner = target = tokens
+        elif option in PROTOCOL_OPTIONS:
+            protocol = base.get("-p", [None])[-1]
+            module = PROTOCOL_MATCHES.get(PROTOCOL_NAMES.get(protocol, protocol))
+            if module is None:
+                raise NetfilterError(f"unknown option \"{option}\"", returncode=2)
+            group = next((m for m in matches if m[1:2] == [module]), None)
+            if group is None:
+                group = ["-m", module]
+                matches.append(group)
+            group.extend(tokens)
+            current = group
+        elif owner is not None:
+            owner.extend(tokens)
+            current = owner
+        else:
+            raise NetfilterError(f"unknown option \"{option}\"", returncode=2)
+
+    if "-p" in base:
+        protocol = base["-p"][-1].lower()
+        base["-p"][-1] = PROTOCOL_NAMES.get(protocol, protocol)
+    for option in ("-s", "-d"):
+        if option in base and "/" not in base[option][-1]:
+            address = base[option][-1]
+            base[option][-1] = f"{address}/128" if ":" in address else f"{address}/32"
+
+    form = [token for option in BASE_OPTIONS for token in base.get(option, [])]
+    for group in matches:
+        form.extend(ICMPV6_TYPES.get(token, token)
+                    if previous == "--icmpv6-type" else token
+                    for previous, token in zip([None] + group, group))
+    return form + target
+
+
+class NetfilterError(Exception):
+    """命令执行失败（对应真实命令的非零退出码）"""
+
+    def __init__(self, message: str, returncode: int = 1):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class FakeTables:
+    """单个地址族的表、链和规则"""
+
+    def __init__(self):
+        self.chains: Dict[str, Dict[str, List[List[str]]]] = {
+            table: {chain: [] for chain in chains}
+            for table, chains in BUILTIN_CHAINS.items()
+        }
+
+    def copy(self) -> "FakeTables":
+        clone = FakeTables()
+        clone.chains = {table: {chain: [list(rule) for rule in rules]
+                                for chain, rules in chains.items()}
+                        for table, chains in self.chains.items()}
+        return clone
+
+    def _chain(self, table: str, chain: str) -> List[List[str]]:
+        try:
+            return self.chains[table][chain]
+        except KeyError:
+            raise NetfilterError("iptables: No chain/target/match by that name. "
+                                 f"({table}/{chain})")
+
+    @staticmethod
+    def _find(rules: List[List[str]], spec: List[str]) -> int:
+        form = save_form(spec)
+        for index, rule in enumerate(rules):
+            if rule == form:
+                return index
+        return -1
+
+    def references(self, table: str, chain: str) -> int:
+        """跳转到指定链的规则数量"""
+        count = 0
+        for rules in self.chains.get(table, {}).values():
+            for rule in rules:
+                for option in ("-j", "-g"):
+                    if option in rule[:-1] and rule[rule.index(option) + 1] == chain:
+                        count += 1
+        return count
+
+    def match_sets(self) -> Set[str]:
+        """规则中引用的ipset集合"""
+        sets = set()
+        for chains in self.chains.values():
+            for rules in chains.values():
+                for rule in rules:
+                    if "--match-set" in rule[:-1]:
+                        sets.add(rule[rule.index("--match-set") + 1])
+        return sets
+
+    def _check_target(self, table: str, spec: List[str]):
+        for option in ("-j", "-g"):
+            if option in spec[:-1]:
+                target = spec[spec.index(option) + 1]
+                if target not in STANDARD_TARGETS and target not in self.chains[table]:
+                    raise NetfilterError(f"iptables: Couldn't load target `{target}'")
+
+    def execute(self, args: List[str]) -> str:
+        """执行一条规则命令（不含程序名），返回标准输出"""
+        table, action, chain, spec = split_args(args)
+        if table not in self.chains:
+            raise NetfilterError(f"can't initialize iptables table `{table}'")
+        chains = self.chains[table]
+
+        if action == "-A":
+            rules = self._chain(table, chain)
+            self._check_target(table, spec)
+            rules.append(save_form(spec))
+        elif action == "-I":
+            rules = self._chain(table, chain)
+            self._check_target(table, spec)
+            rest = args[args.index("-I") + 2:]
+            position = int(rest[0]) if rest and rest[0].isdigit() else 1
+            if position > len(rules) + 1:
+                raise NetfilterError("iptables: Index of insertion too big.")
+            rules.insert(position - 1, save_form(spec))
+        elif action == "-D":
+            rules = self._chain(table, chain)
+            if len(spec) == 1 and spec[0].isdigit():
+                index = int(spec[0]) - 1
+                if not 0 <= index < len(rules):
+                    raise NetfilterError("iptables: Index of deletion too big.")
+            else:
+                index = self._find(rules, spec)
+                if index < 0:
+                    raise NetfilterError("iptables: Bad rule "
+                                         "(does a matching rule exist in that chain?).")
+            del rules[index]
+        elif action == "-C":
+            if self._find(self._chain(table, chain), spec) < 0:
+                raise NetfilterError("iptables: Bad rule "
+                                     "(does a matching rule exist in that chain?).")
+        elif action == "-N":
+            if chain in chains:
+                raise NetfilterError("iptables: Chain already exists.")
+            chains[chain] = []
+        elif action == "-F":
+            if chain:
+                self._chain(table, chain).clear()
+            else:
+                for rules in chains.values():
+                    rules.clear()
+        elif action == "-X":
+            self._chain(table, chain)
+            if chain in BUILTIN_CHAINS[table]:
+                raise NetfilterError("iptables: Invalid argument (built-in chain).")
+            if chains[chain]:
+                raise NetfilterError("iptables: Directory not empty.")
+            if self.references(table, chain):
+                raise NetfilterError("iptables: Too many links.")
+            del chains[chain]
+        elif action in ("-L", "-S"):
+            rules = self._chain(table, chain)
+            return "".join(f"-A {chain} {' '.join(rule)}\n" for rule in rules)
+        else:
+            raise NetfilterError(f"iptables: unsupported action {action}", returncode=2)
+        return ""
+
+    def save(self) -> str:
+        """iptables-save 格式的输出"""
+        lines = []
+        for table, chains in self.chains.items():
+            lines.append(f"*{table}")
+            for chain in chains:
+                policy = "ACCEPT" if chain in BUILTIN_CHAINS[table] else "-"
+                lines.append(f":{chain} {policy} [0:0]")
+            for chain, rules in chains.items():
+                for rule in rules:
+                    lines.append(" ".join(["-A", chain]
+                                          + [shlex.quote(arg) for arg in rule]))
+            lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    def restore(self, payload: str, noflush: bool) -> int:
+        """按 COMMIT 块原子地应用restore输入，返回应用的规则行数"""
+        applied = 0
+        table = None
+        block: Optional[FakeTables] = None
+        block_lines = 0
+        for number, line in enumerate(payload.splitlines(), start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                if line.startswith("*"):
+                    table = line[1:]
+                    if table not in self.chains:
+                        raise NetfilterError(
+                            f"can't initialize iptables table `{table}'")
+                    block, block_lines = self.copy(), 0
+                    if not noflush:
+                        for chain in list(block.chains[table]):
+                            block.chains[table][chain] = []
+                            if chain not in BUILTIN_CHAINS[table]:
+                                del block.chains[table][chain]
+                elif block is None:
+                    raise NetfilterError("no table specified")
+                elif line == "COMMIT":
+                    self.chains = block.chains
+                    applied += block_lines
+                    table, block = None, None
+                elif line.startswith(":"):
+                    chain = line[1:].split()[0]
+                    # --noflush 下声明已存在的用户链会清空该链
+                    block.chains[table][chain] = []
+                else:
+                    block.execute(["-t", table] + shlex.split(line))
+                    block_lines += 1
+            except (NetfilterError, ValueError) as e:
+                raise NetfilterError(f"{e}\nError occurred at line: {number}")
+        if block is not None:
+            raise NetfilterError("COMMIT expected at line: EOF")
+        return applied
+
+
+class FakeRestoreStdin:
+    """常驻restore进程的标准输入：每个完整的COMMIT块写入后立即生效"""
+
+    def __init__(self, process: "FakeRestoreProcess"):
+        self.process = process
+        self.buffer = ""
+        self.closed = False
+
+    def write(self, text: str):
+        if self.closed or self.process.returncode is not None:
+            raise BrokenPipeError()
+        self.buffer += text
+        return len(text)
+
+    def flush(self):
+        if self.process.returncode is not None:
+            raise BrokenPipeError()
+        end = self.buffer.rfind("COMMIT\n")
+        if end < 0:
+            return
+        end += len("COMMIT\n")
+        payload, self.buffer = self.buffer[:end], self.buffer[end:]
+        self.process.feed(payload)
+
+    def close(self):
+        if not self.closed and self.process.returncode is None and self.buffer.strip():
+            self.process.feed(self.buffer)
+        self.buffer = ""
+        self.closed = True
+
+
+class FakeRestoreProcess:
+    """模拟 `*-restore --noflush` 常驻进程（subprocess.Popen 接口）"""
+
+    _next_pid = 40000
+
+    def __init__(self, netfilter: "FakeNetfilter", cmd: List[str]):
+        self.netfilter = netfilter
+        self.cmd = cmd
+        self.returncode: Optional[int] = None
+        self.stdin = FakeRestoreStdin(self)
+        self.stderr = io.StringIO()
+        FakeRestoreProcess._next_pid += 1
+        self.pid = FakeRestoreProcess._next_pid
+
+    def feed(self, payload: str):
+        result = self.netfilter.run(self.cmd, input=payload)
+        if result.returncode != 0:
+            self.stderr = io.StringIO(result.stderr)
+            self.returncode = result.returncode
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if self.returncode is not None:
+            return self.returncode
+        if not self.stdin.closed:
+            if timeout is not None:
+                raise subprocess.TimeoutExpired(self.cmd, timeout)
+            self.stdin.close()
+        if self.returncode is None:
+            self.returncode = 0
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            self.returncode = -9
+
+
+class FakeNetfilter:
+    """iptables/ip6tables、nft 和 ipset 命令的内存模拟
+
+    latency 为每次命令调用的固定开销（秒），rule_latency 为每条规则变更的开销；
+    lock_contention 为每次iptables调用时xtables锁正被其他程序（如dockerd）持有的概率，
+    持有时间为 lock_hold 秒。lock_wait 为 False 时不等待锁，直接以退出码4失败
+    （与不带 -w 的 iptables 相同）。
+    """
+
+    IPTABLES = ("ip6tables", "iptables")
+
+    def __init__(self, latency: float = 0.0, rule_latency: float = 0.0,
+                 lock_contention: float = 0.0, lock_hold: float = 0.01,
+                 lock_wait: bool = True, seed: int = 0):
+        self.tables: Dict[str, FakeTables] = {family: FakeTables()
+                                              for family in self.IPTABLES}
+        self.nft_tables: Set[str] = set()
+        self.nft_elements: Dict[Tuple[str, str], str] = {}  # (集合名, 元素) -> 值
+        self.ipsets: Dict[str, Set[str]] = {}
+
+        self.latency = latency
+        self.rule_latency = rule_latency
+        self.lock_contention = lock_contention
+        self.lock_hold = lock_hold
+        self.lock_wait = lock_wait
+        self._random = random.Random(seed)
+        self._xtables_lock = threading.Lock()
+        self._state_lock = threading.RLock()
+
+        self.calls: Counter = Counter()  # 程序名 -> 调用次数
+        self.rule_ops = 0     # 已应用的规则变更数
+        self.lock_waits = 0   # 因锁争用等待的次数
+        self.lock_wait_seconds = 0.0
+
+    # ---- subprocess 接口 ----
+
+    @contextmanager
+    def patch(self):
+        """用本模拟替换 subprocess.run / subprocess.Popen"""
+        with mock.patch("subprocess.run", side_effect=self.run), \
+                mock.patch("subprocess.Popen", side_effect=self.popen):
+            yield self
+
+    def popen(self, cmd: List[str], **kwargs) -> FakeRestoreProcess:
+        self.calls["popen"] += 1
+        return FakeRestoreProcess(self, list(cmd))
+
+    def run(self, cmd: List[str], input: Optional[str] = None, check: bool = False,
+            **kwargs) -> subprocess.CompletedProcess:
+        program = os.path.basename(cmd[0])
+        self.calls[program] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        try:
+            if program in self.IPTABLES or program.endswith(("-save", "-restore")):
+                stdout = self._run_xtables(program, list(cmd[1:]), input or "")
+            elif program == "nft":
+                stdout = self._run_nft(list(cmd[1:]), input or "")
+            elif program == "ipset":
+                stdout = self._run_ipset(list(cmd[1:]), input or "")
+            else:
+                raise NetfilterError(f"{program}: command not found", returncode=127)
+        except NetfilterError as e:
+            result = subprocess.CompletedProcess(cmd, e.returncode, stdout="",
+                                                 stderr=str(e))
+        else:
+            result = subprocess.CompletedProcess(cmd, 0, stdout=stdout, stderr="")
+        if check:
+            result.check_returncode()
+        return result
+
+    @property
+    def exec_count(self) -> int:
+        """模拟的子进程启动次数"""
+        return sum(self.calls.values())
+
+    # ---- iptables ----
+
+    def _acquire_xtables_lock(self):
+        if self.lock_contention and self._random.random() < self.lock_contention:
+            if not self.lock_wait:
+                raise NetfilterError(
+                    "Another app is currently holding the xtables lock.",
+                    LOCK_HELD_EXIT)
+            self.lock_waits += 1
+            self.lock_wait_seconds += self.lock_hold
+            time.sleep(self.lock_hold)
+        self._xtables_lock.acquire()
+
+    def _run_xtables(self, program: str, args: List[str], payload: str) -> str:
+        family = program.split("-")[0]
+        if family not in self.tables:
+            raise NetfilterError(f"{program}: command not found", returncode=127)
+        args = [arg for arg in args if arg not in ("-w", "--wait", "-n")]
+
+        self._acquire_xtables_lock()
+        try:
+            with self._state_lock:
+                tables = self.tables[family]
+                if program.endswith("-save"):
+                    return tables.save()
+                if program.endswith("-restore"):
+                    applied = tables.restore(payload, noflush="--noflush" in args)
+                    self._charge_rules(applied)
+                    return ""
+                output = tables.execute(args)
+                if split_args(args)[1] not in ("-C", "-L", "-S"):
+                    self._charge_rules(1)
+                return output
+        finally:
+            self._xtables_lock.release()
+
+    def _charge_rules(self, count: int):
+        self.rule_ops += count
+        if self.rule_latency and count:
+            time.sleep(self.rule_latency * count)
+
+    # ---- nftables ----
+
+    def _run_nft(self, args: List[str], payload: str) -> str:
+        with self._state_lock:
+            if args[:1] == ["-j"] and "list" in args:
+                table = args[-1]
+                if table not in self.nft_tables:
+                    raise NetfilterError(
+                        f"Error: No such file or directory; table ip6 {table}")
+                return self._nft_json(table)
+            if args[:2] == ["-f", "-"]:
+                elements = dict(self.nft_elements)
+                tables = set(self.nft_tables)
+                for line in payload.splitlines():
+                    self._nft_line(line.strip(), tables, elements)
+                self.nft_tables, self.nft_elements = tables, elements
+                return ""
+        raise NetfilterError(f"nft: unsupported arguments {' '.join(args)}",
+                             returncode=2)
+
+    def _nft_line(self, line: str, tables: Set[str],
+                  elements: Dict[Tuple[str, str], str]):
+        words = line.split()
+        if len(words) >= 3 and words[0] == "table" and words[1] == "ip6":
+            tables.add(words[2])
+        elif words[:3] == ["delete", "table", "ip6"]:
+            tables.discard(words[3])
+            elements.clear()
+        elif words[:1] == ["flush"] and words[1:2] in (["set"], ["map"]):
+            name = words[4]
+            for key in [key for key in elements if key[0] == name]:
+                del elements[key]
+        elif words[:2] in (["add", "element"], ["delete", "element"]):
+            name = words[4]
+            body = line[line.index("{") + 1:line.rindex("}")].strip()
+            element, _, value = body.partition(" : ")
+            if words[0] == "add":
+                self.rule_ops += 1
+                elements[(name, element.strip())] = value.strip()
+            elif elements.pop((name, element.strip()), None) is None:
+                raise NetfilterError("Error: Could not process rule: "
+                                     f"No such file or directory\n{line}")
+            else:
+                self.rule_ops += 1
+
+    @staticmethod
+    def _concat(text: str) -> dict:
+        return {"concat": [int(part) if part.isdigit() else part
+                           for part in text.split(" . ")]}
+
+    def _nft_json(self, table: str) -> str:
+        sets: Dict[str, list] = {}
+        for (name, element), value in sorted(self.nft_elements.items()):
+            if value:
+                entry = [self._concat(element), self._concat(value)]
+            else:
+                entry = self._concat(element)
+            sets.setdefault(name, []).append(entry)
+        items = [{"metainfo": {"json_schema_version": 1}},
+                 {"table": {"family": "ip6", "name": table, "handle": 1}}]
+        for name, elem in sets.items():
+            kind = "map" if isinstance(elem[0], list) else "set"
+            items.append({kind: {"family": "ip6", "name": name, "table": table,
+                                 "elem": elem}})
+        return json.dumps({"nftables": items})
+
+    # ---- ipset ----
+
+    def _run_ipset(self, args: List[str], payload: str) -> str:
+        with self._state_lock:
+            if args[:1] == ["save"]:
+                name = args[1]
+                if name not in self.ipsets:
+                    raise NetfilterError(
+                        "ipset v7: The set with the given name does not exist")
+                lines = [f"create {name} hash:ip,port family inet6"]
+                lines.extend(f"add {name} {element}"
+                             for element in sorted(self.ipsets[name]))
+                return "\n".join(lines) + "\n"
+            if args[:1] == ["restore"]:
+                ipsets = {name: set(elements) for name, elements in self.ipsets.items()}
+                for line in payload.splitlines():
+                    if line.strip():
+                        self._ipset_line(line.split(), ipsets)
+                self.ipsets = ipsets
+                return ""
+        raise NetfilterError(f"ipset: unsupported arguments {' '.join(args)}",
+                             returncode=2)
+
+    def _ipset_line(self, words: List[str], ipsets: Dict[str, Set[str]]):
+        action, name = words[0], words[1]
+        exist = "-exist" in words
+        if action == "create":
+            if name in ipsets and not exist:
+                raise NetfilterError("ipset v7: Set cannot be created: "
+                                     "set with the same name already exists")
+            ipsets.setdefault(name, set())
+            return
+        if name not in ipsets:
+            raise NetfilterError("ipset v7: The set with the given name does not exist")
+        if action == "flush":
+            ipsets[name].clear()
+        elif action == "destroy":
+            if any(name in tables.match_sets() for tables in self.tables.values()):
+                raise NetfilterError("ipset v7: Set cannot be destroyed: "
+                                     "it is in use by a kernel component")
+            del ipsets[name]
+        elif action == "add":
+            if words[2] in ipsets[name] and not exist:
+                raise NetfilterError("ipset v7: Element cannot be added to the set: "
+                                     "it's already added")
+            ipsets[name].add(words[2])
+            self.rule_ops += 1
+        elif action == "del":
+            if words[2] not in ipsets[name] and not exist:
+                raise NetfilterError("ipset v7: Element cannot be deleted from the set:"
+                                     " it's not added")
+            ipsets[name].discard(words[2])
+            self.rule_ops += 1
+        else:
+            raise NetfilterError(f"ipset v7: unsupported command {action}")
+
+    # ---- 查询 ----
+
+    def rules(self, family: str, chain: str, table: str = "filter") -> List[List[str]]:
+        """链中的规则（不含 -A 和链名）"""
+        with self._state_lock:
+            rules = self.tables[family].chains[table].get(chain, [])
+            return [list(rule) for rule in rules]
+
+    def has_chain(self, family: str, chain: str, table: str = "filter") -> bool:
+        with self._state_lock:
+            return chain in self.tables[family].chains[table]
+
+    def rule_count(self) -> int:
+        """所有链中的规则总数"""
+        with self._state_lock:
+            return sum(len(rules) for tables in self.tables.values()
+                       for chains in tables.chains.values()
+                       for rules in chains.values())
@@ -0,0 +1,161 @@
+import sys
+import os
+import subprocess
+import time
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from apply_queue import ApplyQueue
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from rule_registry import FirewallRule, RuleRegistry
+from test_rule_backend import DummyConfig
+
+
+class RecordingManager:
+    """记录批量提交范围的防火墙管理器"""
+
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+
+    @contextmanager
+    def batch(self):
+        self.events.append("begin")
+        yield
+        self.events.append("commit")
+        if self.fail:
+            raise subprocess.CalledProcessError(1, ["ip6tables-restore"], stderr="boom")
+
+    def sync_rules_with_reality(self):
+        self.events.append("sync")
+
+
+class TestApplyQueue(unittest.TestCase):
+    def setUp(self):
+        self.manager = RecordingManager()
+        self.queue = ApplyQueue(self.manager, window=0)
+
+    def record(self, name):
+        return lambda: self.manager.events.append(name)
+
+    def drain(self):
+        self.queue.start()
+        self.assertTrue(self.queue.wait_idle(timeout=5))
+        self.queue.stop()
+
+    def test_crash_loop_collapses_to_final_state(self):
+        self.queue.submit(("container", "a"), self.record("start a"))
+        self.queue.submit(("container", "a"), self.record("stop a"))
+        self.queue.submit(("container", "b"), self.record("start b"))
+        self.queue.submit(("container", "a"), self.record("start a again"))
+
+        self.assertEqual(self.queue.pending(), 2)
+        self.drain()
+
+        self.assertEqual(self.manager.events,
+                         ["begin", "start b", "start a again", "commit"])
+        self.assertEqual(self.queue.coalesced, 2)
+
+    def test_barrier_runs_outside_batches_in_order(self):
+        self.queue.submit(("container", "a"), self.record("start a"))
+        self.queue.submit(ApplyQueue.SYNC_KEY, self.manager.sync_rules_with_reality,
+                          barrier=True)
+        self.queue.submit(("container", "b"), self.record("start b"))
+        self.drain()
+
+        self.assertEqual(self.manager.events, ["begin", "start a", "commit", "sync",
+                                               "begin", "start b", "commit"])
+
+    def test_scan_does_not_override_pending_event(self):
+        self.queue.submit(("container", "a"), self.record("stop a"))
+        self.queue.submit(("container", "a"), self.record("scan start a"),
+                          replace=False)
+        self.drain()
+
+        self.assertEqual(self.manager.events, ["begin", "stop a", "commit"])
+
+    def test_delayed_intent_runs_after_grace(self):
+        self.queue.submit_after(0.05, ("container", "a"), self.record("stop a"))
+        # 不推迟到期时间
+        self.queue.submit_after(5, ("container", "a"), self.record("stop a again"))
+        self.assertTrue(self.queue.delayed(("container", "a")))
+        self.assertEqual(self.queue.pending(), 0)
+
+        self.queue.start()
+        try:
+            deadline = time.monotonic() + 5
+            while (self.queue.delayed(("container", "a"))
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+            self.assertTrue(self.queue.wait_idle(timeout=5))
+        finally:
+            self.queue.stop()
+
+        self.assertEqual(self.manager.events, ["begin", "stop a again", "commit"])
+
+    def test_restart_within_grace_cancels_delayed_stop(self):
+        self.queue.submit_after(60, ("container", "a"), self.record("stop a"))
+        self.queue.submit(("container", "a"), self.record("start a"))
+        self.assertFalse(self.queue.delayed(("container", "a")))
+        self.drain()
+
+        self.assertEqual(self.manager.events, ["begin", "start a", "commit"])
+
+    def test_failed_batch_schedules_sync(self):
+        manager = RecordingManager(fail=True)
+        queue = ApplyQueue(manager, window=0)
+        queue.submit(("container", "a"), lambda: manager.events.append("start a"))
+
+        with mock.patch.object(queue, "submit", wraps=queue.submit) as submit:
+            queue.apply([(("container", "a"),
+                          lambda: manager.events.append("start a"), False)])
+
+        submit.assert_called_once_with(ApplyQueue.SYNC_KEY,
+                                       manager.sync_rules_with_reality, barrier=True)
+
+
+class TestContainerStopGrace(unittest.TestCase):
+    def setUp(self):
+        self.config = DummyConfig()
+        self.fm = FirewallManager(self.config)
+        self.monitor = DockerMonitor(self.config, self.fm)
+
+    def test_stop_is_tombstoned(self):
+        self.monitor._submit_container("a", start=False)
+        self.assertTrue(self.monitor.apply_queue.delayed(("container", "a")))
+        self.assertEqual(self.monitor.apply_queue.pending(), 0)
+
+        self.monitor._submit_container("a", start=True)
+        self.assertFalse(self.monitor.apply_queue.delayed(("container", "a")))
+        self.assertEqual(self.monitor.apply_queue.pending(), 1)
+
+    def test_zero_grace_stops_immediately(self):
+        self.config.container_stop_grace = 0
+        self.monitor._submit_container("a", start=False)
+        self.assertFalse(self.monitor.apply_queue.delayed(("container", "a")))
+        self.assertEqual(self.monitor.apply_queue.pending(), 1)
+
+    def test_restart_with_new_address_drops_tombstoned_rules(self):
+        rule = FirewallRule("a", "web", "tcp", 80, "2001:db8::10", "ens3", "macvlan_gw")
+        self.fm.registry.set((RuleRegistry.CONTAINER, "a"), [rule])
+
+        with mock.patch.object(self.fm, 'remove_container_rules') as remove:
+            self.monitor._drop_moved_container_rules(
+                "a", {'net': {'GlobalIPv6Address': '2001:db8::10'}})
+            remove.assert_not_called()
+            self.monitor._drop_moved_container_rules(
+                "a", {'net': {'GlobalIPv6Address': '2001:db8::11'}})
+            remove.assert_called_once_with("a")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+for path in (SRC_DIR, os.path.abspath(TEST_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from async_monitor import AsyncEventEngine
+from docker_engine import AsyncDockerEngine, DockerEngineError
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig
+
+
+class FakeDaemon:
+    """unix socket上的Docker Engine API模拟
+
+    /_ping、/events（chunked）和 /containers/{id}/json
+    """
+
+    def __init__(self, events=(), inspect_delay=0.0):
+        self.events = list(events)
+        self.inspect_delay = inspect_delay
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+        self.path = os.path.join(tempfile.mkdtemp(), "docker.sock")
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_unix_server(self._handle, self.path)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        request = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        target = request.split(" ")[1]
+        self.requests.append(target)
+        path = target.split("?")[0]
+        if path == "/_ping":
+            self._respond(writer, 200, b"OK")
+        elif path == "/events":
+            writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+            payload = b"".join(json.dumps(event).encode() + b"\n"
+                               for event in self.events)
+            # 事件跨分块边界
+            for start in range(0, len(payload), 7):
+                chunk = payload[start:start + 7]
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            writer.write(b"0\r\n\r\n")
+        elif path.startswith("/containers/"):
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            await asyncio.sleep(self.inspect_delay)
+            self.active -= 1
+            container_id = path.split("/")[2]
+            if container_id.startswith("missing"):
+                body = {"message": "No such container"}
+                self._respond(writer, 404, json.dumps(body).encode())
+            else:
+                self._respond(writer, 200, json.dumps({
+                    "Name": f"/{container_id}", "State": {"Status": "running"},
+                    "Config": {"Labels": {}},
+                    "NetworkSettings": {"Networks": {}}}).encode())
+        await writer.drain()
+        writer.close()
+
+    @staticmethod
+    def _respond(writer, status, body):
+        writer.write(b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\n"
+                     b"Content-Length: %d\r\n\r\n%s" % (status, len(body), body))
+
+
+def start_event(container_id):
+    return {"Type": "container", "Action": "start", "id": container_id,
+            "Actor": {"Attributes": {}}}
+
+
+class TestAsyncDockerEngine(unittest.TestCase):
+    def test_events_and_inspect(self):
+        events = [start_event(f"c{i}") for i in range(3)]
+
+        async def scenario():
+            async with FakeDaemon(events) as daemon:
+                engine = AsyncDockerEngine.from_url(f"unix://{daemon.path}")
+                self.assertTrue(await engine.ping())
+                received = [event async for event in
+                            engine.events({"type": ["container"]})]
+                inspect = await engine.inspect_container("c1")
+                with self.assertRaises(DockerEngineError) as ctx:
+                    await engine.inspect_container("missing")
+                return daemon, received, inspect, ctx.exception
+
+        daemon, received, inspect, error = asyncio.run(scenario())
+        self.assertEqual(received, events)
+        self.assertEqual(inspect["Name"], "/c1")
+        self.assertEqual(error.status, 404)
+        self.assertIn("filters=", daemon.requests[1])
+
+
+class TestAsyncEventEngine(unittest.TestCase):
+    def setUp(self):
+        self.monitor = DockerMonitor(DummyConfig(), FirewallManager(DummyConfig()))
+        self.queue = self.monitor.apply_queue  # 不启动应用线程，只检查提交的意图
+
+    def run_events(self, events, daemon_kwargs=None, concurrency=4):
+        async def scenario():
+            async with FakeDaemon(**(daemon_kwargs or {})) as daemon:
+                engine = AsyncEventEngine(self.monitor, concurrency,
+                                          AsyncDockerEngine(daemon.path))
+                engine.loop = asyncio.get_running_loop()
+                engine._semaphore = asyncio.Semaphore(concurrency)
+                started = time.monotonic()
+                for event in events:
+                    engine.dispatch(event)
+                while engine._chains:
+                    await asyncio.wait(list(engine._chains.values()))
+                return daemon, time.monotonic() - started
+
+        return asyncio.run(scenario())
+
+    def test_inspects_run_concurrently_and_prefill_cache(self):
+        events = [start_event(f"c{i}") for i in range(12)]
+        daemon, elapsed = self.run_events(events, {"inspect_delay": 0.05},
+                                          concurrency=4)
+
+        self.assertEqual(daemon.max_active, 4)
+        self.assertLess(elapsed, 12 * 0.05)
+        for i in range(12):
+            self.assertEqual(self.monitor.inspect_cache.get(f"c{i}")["name"], f"c{i}")
+            self.assertIn(("container", f"c{i}"), self.queue._intents)
+
+    def test_events_for_one_container_stay_in_order(self):
+        events = [start_event("c1"), {"Type": "container", "Action": "die", "id": "c1"}]
+        self.run_events(events, {"inspect_delay": 0.02})
+
+        # 停止意图在启动意图之后提交：进入宽限期的延迟意图
+        self.assertNotIn(("container", "c1"), self.queue._intents)
+        self.assertTrue(self.queue.delayed(("container", "c1")))
+
+
+if __name__ == '__main__':
+    unittest.main()
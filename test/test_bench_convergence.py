@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+for path in (SRC_DIR, os.path.abspath(TEST_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import bench_convergence
+
+
+class TestBenchConvergence(unittest.TestCase):
+    """小规模运行基准测试，保证它不会随代码演进失效"""
+
+    def test_small_fleet_converges(self):
+        args = bench_convergence.parse_args(["--containers", "6", "--ports", "2",
+                                             "--services", "2", "--events", "4",
+                                             "--window", "0", "--timeout", "10"])
+        results = bench_convergence.run(args)
+
+        # 6个容器 × 2个端口 + 2个Service
+        self.assertGreaterEqual(results["cold_start"]["registered_rules"], 14)
+        self.assertGreater(results["cold_start"]["kernel_rules"], 0)
+        self.assertEqual(results["events"]["applied"], 4)
+        self.assertGreater(results["scan"]["docker_api_calls"], 0)
+        self.assertIn("seconds", results["scan"])
+
+    def test_compare_reports_relative_change(self):
+        lines = bench_convergence.compare({"scan": {"seconds": 2.0}},
+                                          {"scan": {"seconds": 1.0}})
+        self.assertIn("scan.seconds                 2.0 -> 1.0 (-50.0%)", lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,8 @@ class DummyConfig:
     def __init__(self):
         self.docker_socket = "unix:///var/run/docker.sock"
         self.monitored_networks = ["macvlan", "bridge"]
+        self.apply_coalesce_window = 0.2
+        self.container_stop_grace = 10
 
 
 class DummyFirewallManager:
@@ -0,0 +1,146 @@
+import sys
+import os
+import unittest
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from fake_netfilter import FakeNetfilter, LOCK_HELD_EXIT
+from firewall_manager import FirewallManager
+from ruleset import rule_owner
+from test_rule_backend import DummyConfig
+
+NETWORKS = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+
+class TestFakeNetfilter(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeNetfilter()
+
+    def test_check_and_delete_match_normalized_rules(self):
+        self.fake.run(["ip6tables", "-N", "FW"])
+        self.fake.run(["ip6tables", "-A", "FW", "-p", "tcp", "-d", "2001:db8::10",
+                       "--dport", "80", "-j", "ACCEPT"])
+
+        # 按 iptables-save 的写法保存
+        same = ["-d", "2001:db8::10/128", "-p", "tcp", "-m", "tcp", "--dport", "80",
+                "-j", "ACCEPT"]
+        self.assertEqual(self.fake.rules("ip6tables", "FW"), [same])
+
+        # 参数顺序不同、地址带前缀长度仍然匹配
+        self.assertEqual(self.fake.run(["ip6tables", "-C", "FW"] + same).returncode, 0)
+        self.assertEqual(self.fake.run(["ip6tables", "-D", "FW"] + same).returncode, 0)
+        self.assertEqual(self.fake.run(["ip6tables", "-D", "FW"] + same).returncode, 1)
+        self.assertEqual(self.fake.run(["ip6tables", "-X", "FW"]).returncode, 0)
+
+    def test_save_form_of_generated_rules(self):
+        self.fake.run(["ip6tables", "-N", "IN"])
+        self.fake.run(["ip6tables", "-A", "IN", "-p", "icmpv6",
+                       "--icmpv6-type", "neighbor-solicitation", "-j", "ACCEPT"])
+        self.fake.run(["ip6tables", "-A", "IN", "-p", "tcp", "-d", "2001:db8::10",
+                       "--dport", "80", "-i", "ens3", "-j", "ACCEPT",
+                       "-m", "comment", "--comment", "v6fw:c:cid:1 Container:web"])
+
+        self.assertIn('-A IN -p ipv6-icmp -m icmp6 --icmpv6-type 135 -j ACCEPT',
+                      self.fake.tables["ip6tables"].save())
+        self.assertEqual(self.fake.rules("ip6tables", "IN")[1],
+                         ["-d", "2001:db8::10/128", "-i", "ens3", "-p", "tcp",
+                          "-m", "tcp", "--dport", "80",
+                          "-m", "comment", "--comment", "v6fw:c:cid:1 Container:web",
+                          "-j", "ACCEPT"])
+
+    def test_restore_commit_blocks_are_atomic(self):
+        payload = "*filter\n-N FW\n-A FW -j ACCEPT\n-A MISSING -j ACCEPT\nCOMMIT\n"
+        result = self.fake.run(["ip6tables-restore", "--noflush"], input=payload)
+
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("line: 4", result.stderr)
+        self.assertFalse(self.fake.has_chain("ip6tables", "FW"))
+
+    def test_referenced_chain_cannot_be_deleted(self):
+        self.fake.run(["ip6tables", "-N", "FW"])
+        self.fake.run(["ip6tables", "-A", "FORWARD", "-j", "FW"])
+        self.assertNotEqual(self.fake.run(["ip6tables", "-X", "FW"]).returncode, 0)
+
+    def test_lock_contention(self):
+        fake = FakeNetfilter(lock_contention=1.0, lock_wait=False)
+        self.assertEqual(fake.run(["ip6tables", "-N", "FW"]).returncode, LOCK_HELD_EXIT)
+
+        fake = FakeNetfilter(lock_contention=1.0, lock_hold=0)
+        self.assertEqual(fake.run(["ip6tables", "-N", "FW"]).returncode, 0)
+        self.assertEqual(fake.lock_waits, 1)
+
+
+class TestFirewallManagerOnFake(unittest.TestCase):
+    def lifecycle(self, **overrides):
+        config = DummyConfig()
+        for key, value in overrides.items():
+            setattr(config, key, value)
+        fake = FakeNetfilter()
+        fm = FirewallManager(config)
+        with fake.patch():
+            fm.initialize()
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                   NETWORKS)
+            fm.add_service_rules('svc', 'api',
+                                 [{'published_port': 8080, 'target_port': 80,
+                                   'protocol': 'tcp'}],
+                                 [{'container_id': 'cid', 'container_name': 'web',
+                                   'ipv6_address': '2001:db8::10'}])
+            self.assertEqual(fm.sync_rules_with_reality(), (0, 0))
+            fm.close_applier()
+            owned = [rule for rule in fake.rules("ip6tables", config.chain_name)
+                     if rule_owner(rule)]
+            fm.cleanup()
+        return fake, config, owned
+
+    def test_lifecycle_oneshot(self):
+        fake, config, owned = self.lifecycle()
+        self.assertEqual(len(owned), 2)
+        self.assertEqual(fake.rules("ip6tables", config.chain_name), [])  # 清理后链为空
+        self.assertEqual(fake.rules("ip6tables", config.nat_chain_name, "nat"), [])
+
+    def test_lifecycle_persistent_applier(self):
+        fake, config, owned = self.lifecycle(rule_applier="persistent")
+        self.assertEqual(len(owned), 2)
+        self.assertGreater(fake.calls["popen"], 0)
+
+    def test_lifecycle_ipset(self):
+        fake, config, owned = self.lifecycle(forward_mode="ipset")
+        self.assertEqual(len(owned), 1)  # 容器规则在集合中，只有Service规则在链中
+        self.assertEqual(fake.ipsets, {})
+
+    def test_lifecycle_nftables(self):
+        fake, config, owned = self.lifecycle(firewall_backend="nftables")
+        self.assertEqual(owned, [])  # 容器/Service规则都是nftables元素
+        self.assertNotIn(config.nft_table, fake.nft_tables)
+
+    def test_cleanup_survives_missing_chain(self):
+        config = DummyConfig()
+        fake = FakeNetfilter()
+        fm = FirewallManager(config)
+        with fake.patch():
+            fm.initialize()
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                   NETWORKS)
+            # IPv4 NAT专用链被外部删除
+            nat_chain = config.ipv4_nat_chain_name
+            for args in (["-D", "POSTROUTING", "-j", nat_chain], ["-F", nat_chain],
+                         ["-X", nat_chain]):
+                fake.run(["iptables", "-t", "nat"] + args)
+
+            fm.cleanup()
+
+        self.assertEqual(fake.rules("iptables", config.ipv4_chain_name), [])
+        self.assertEqual(fake.rules("ip6tables", config.chain_name), [])
+        self.assertEqual(len(fm.registry), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from inspect_cache import InspectCache
+from test_rule_backend import DummyConfig
+
+
+class TestInspectCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = InspectCache(maxsize=2)
+        for container_id in ("a", "b"):
+            cache.put(container_id, {"id": container_id}, cache.token(container_id))
+        cache.get("a")
+        cache.put("c", {"id": "c"}, cache.token("c"))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"id": "a"})
+        self.assertEqual(len(cache), 2)
+
+    def test_invalidation_during_inspect_discards_result(self):
+        cache = InspectCache()
+        token = cache.token("a")
+        cache.invalidate("a")  # 事件在inspect进行期间到达
+
+        self.assertFalse(cache.put("a", {"id": "a"}, token))
+        self.assertIsNone(cache.get("a"))
+        self.assertTrue(cache.put("a", {"id": "a"}, cache.token("a")))
+
+    def test_entries_expire_after_max_age(self):
+        cache = InspectCache(max_age=30)
+        cache.put("a", {"id": "a"}, cache.token("a"), now=100)
+
+        self.assertEqual(cache.get("a", now=130), {"id": "a"})
+        self.assertIsNone(cache.get("a", now=131))
+        self.assertEqual(len(cache), 0)
+        # 过期不改变版本号，重新inspect的结果可以写入
+        self.assertTrue(cache.put("a", {"id": "a"}, cache.token("a"), now=131))
+
+
+class TestMonitorInspectCache(unittest.TestCase):
+    def setUp(self):
+        self.monitor = DockerMonitor(DummyConfig(), FirewallManager(DummyConfig()))
+        self.monitor.client = mock.MagicMock()
+        self.inspect = self.monitor.client.api.inspect_container
+        self.inspect.side_effect = lambda container_id: {
+            "Name": f"/{container_id}", "Config": {"Labels": {}},
+            "NetworkSettings": {"Networks": {}}}
+
+    def events(self, *events):
+        self.monitor.running = True
+        self.monitor.client.events.return_value = iter(events)
+        self.monitor._monitor_events()
+
+    def test_repeated_reads_use_one_inspect(self):
+        for _ in range(3):
+            for container_id in ("a", "b"):
+                info = self.monitor._inspect_container(container_id)
+        self.assertEqual(info["name"], "b")
+        self.assertEqual(self.inspect.call_count, 2)
+
+    def test_events_invalidate_changed_containers_only(self):
+        for container_id in ("a", "b", "c"):
+            self.monitor._inspect_container(container_id)
+
+        self.events({"Type": "container", "Action": "die", "id": "a"},
+                    {"Type": "container", "Action": "exec_start: sh", "id": "b"},
+                    {"Type": "network", "Action": "connect",
+                     "Actor": {"Attributes": {"container": "c"}}})
+        for container_id in ("a", "b", "c"):
+            self.monitor._inspect_container(container_id)
+
+        self.assertEqual([call.args[0] for call in self.inspect.call_args_list],
+                         ["a", "b", "c", "a", "c"])
+
+    def test_missed_event_is_seen_after_max_age(self):
+        self.monitor._inspect_container("a")
+        expired = time.monotonic() + self.monitor.INSPECT_CACHE_MAX_AGE + 1
+        with mock.patch("time.monotonic", return_value=expired):
+            self.monitor._inspect_container("a")
+        self.assertEqual(self.inspect.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig, completed
+
+
+class TestIpsetMode(unittest.TestCase):
+    def setUp(self):
+        cfg = DummyConfig()
+        cfg.forward_mode = "ipset"
+        self.fm = FirewallManager(cfg)
+        self.networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+        self.calls = []
+
+    def fake_run(self, cmd, **kwargs):
+        self.calls.append((cmd[0], kwargs.get('input', '')))
+        return completed(1 if "-C" in cmd else 0)
+
+    def test_initialize_creates_sets_before_match_rules(self):
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.initialize()
+
+        commits = [name for name, _ in self.calls
+                   if name in ("ipset", "ip6tables-restore")]
+        self.assertEqual(commits[:2], ["ipset", "ip6tables-restore"])
+        payload = dict(self.calls)["ip6tables-restore"]
+        self.assertIn("-m set --match-set docker_ipv6fw_tcp dst,dst -j ACCEPT", payload)
+        self.assertIn("-m set --match-set docker_ipv6fw_udp dst,dst -j ACCEPT", payload)
+
+    def test_container_ports_become_set_elements(self):
+        ports = [{'port': 53, 'protocol': 'all'}, {'port': 9000, 'protocol': 'sctp'}]
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.add_container_rules('cid', 'web', ports, self.networks)
+
+        ipset_input = [data for name, data in self.calls if name == "ipset"]
+        self.assertEqual(ipset_input,
+                         ["add docker_ipv6fw_tcp 2001:db8::10,tcp:53 -exist\n"
+                          "add docker_ipv6fw_udp 2001:db8::10,udp:53 -exist\n"])
+        # 集合不承载的协议仍使用逐条规则
+        payload = dict(self.calls)["ip6tables-restore"]
+        self.assertEqual(payload.count("-A DOCKER_IPV6FW_FORWARD"), 1)
+        self.assertIn("--dport 9000", payload)
+
+        self.calls.clear()
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.remove_container_rules('cid')
+        self.assertIn("del docker_ipv6fw_tcp 2001:db8::10,tcp:53 -exist",
+                      dict(self.calls)["ipset"])
+
+    def test_cleanup_destroys_sets_after_flushing_chains(self):
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.cleanup()
+
+        commits = [(name, data) for name, data in self.calls
+                   if name in ("ipset", "ip6tables-restore")]
+        self.assertEqual(commits[-1][0], "ipset")
+        self.assertIn("destroy docker_ipv6fw_tcp", commits[-1][1])
+
+    def test_sync_reconciles_set_elements(self):
+        saved = {
+            "docker_ipv6fw_tcp": "create docker_ipv6fw_tcp hash:ip,port family inet6\n"
+                                 "add docker_ipv6fw_tcp 2001:db8::10,tcp:80\n"
+                                 "add docker_ipv6fw_tcp 2001:db8::99,tcp:22\n",
+            "docker_ipv6fw_udp": "create docker_ipv6fw_udp hash:ip,port family inet6\n",
+        }
+
+        def fake_run(cmd, **kwargs):
+            if cmd[:2] == ["ipset", "save"]:
+                return completed(stdout=saved[cmd[2]])
+            return self.fake_run(cmd, **kwargs)
+
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                        self.networks)
+        self.calls.clear()
+
+        with mock.patch('subprocess.run', side_effect=fake_run):
+            self.fm.sync_rules_with_reality()
+
+        ipset_input = [data for name, data in self.calls if name == "ipset" and data]
+        self.assertEqual(ipset_input,
+                         ["del docker_ipv6fw_tcp 2001:db8::99,tcp:22 -exist\n"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import metrics
+from apply_queue import ApplyQueue
+from test_apply_queue import RecordingManager
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter_and_gauge_text_format(self):
+        counter = self.registry.register(metrics.Counter("calls", "调用次数", ["command"]))
+        gauge = self.registry.register(metrics.Gauge("rules", "规则数", ["kind"]))
+        counter.inc(command="ip6tables-restore")
+        counter.inc(2, command="ip6tables-restore")
+        gauge.set_function(lambda: {("container",): 7})
+
+        text = self.registry.render()
+
+        self.assertIn("# TYPE docker_ipv6fw_calls counter", text)
+        self.assertIn('docker_ipv6fw_calls_total{command="ip6tables-restore"} 3', text)
+        self.assertIn('docker_ipv6fw_rules{kind="container"} 7', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.register(
+            metrics.Histogram("latency_seconds", "延迟", buckets=(0.1, 1)))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+
+        text = self.registry.render()
+
+        self.assertIn('docker_ipv6fw_latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('docker_ipv6fw_latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('docker_ipv6fw_latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("docker_ipv6fw_latency_seconds_count 3", text)
+
+    def test_wrong_labels_rejected(self):
+        counter = metrics.Counter("calls", "调用次数", ["command"])
+        with self.assertRaises(ValueError):
+            counter.inc(cmd="ip6tables")
+
+    def test_backend_call_counts_spawns(self):
+        before = metrics.SUBPROCESS.value(command="ipset")
+        timed = metrics.BACKEND_CALL_SECONDS.count(command="ipset")
+        with metrics.backend_call(["/usr/sbin/ipset", "restore"]):
+            pass
+        with metrics.backend_call(["ipset", "restore"], spawn=False):
+            pass
+
+        self.assertEqual(metrics.SUBPROCESS.value(command="ipset"), before + 1)
+        self.assertEqual(metrics.BACKEND_CALL_SECONDS.count(command="ipset"), timed + 2)
+
+    def test_event_latency_observed_after_commit(self):
+        queue = ApplyQueue(RecordingManager(), window=0)
+        observed = metrics.EVENT_APPLY_SECONDS.count()
+        queue.submit(("container", "a"), lambda: None, received=0.0)
+        queue.submit(("container", "b"), lambda: None)  # 扫描提交的意图不计入事件延迟
+        queue.start()
+        try:
+            self.assertTrue(queue.wait_idle(timeout=5))
+        finally:
+            queue.stop()
+
+        self.assertEqual(metrics.EVENT_APPLY_SECONDS.count(), observed + 1)
+
+    def test_server_exports_metrics(self):
+        self.registry.register(metrics.Counter("requests", "请求数")).inc()
+        server = metrics.MetricsServer("127.0.0.1", 0, registry=self.registry)
+        server.start()
+        try:
+            url = f"http://127.0.0.1:{server.port}/metrics"
+            with urllib.request.urlopen(url, timeout=5) as response:
+                body = response.read().decode("utf-8")
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://127.0.0.1:{server.port}/", timeout=5)
+        finally:
+            server.stop()
+
+        self.assertIn("docker_ipv6fw_requests_total 1", body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from network_index import NetworkIndex
+from rule_compiler import ContainerState, StateSnapshot
+from test_rule_backend import DummyConfig
+
+
+def network(name, driver):
+    return mock.Mock(attrs={"Name": name, "Driver": driver})
+
+
+class TestNetworkIndex(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.networks.list.return_value = [network("lan", "macvlan"),
+                                                  network("macvlan_old", "overlay")]
+        self.index = NetworkIndex(DummyConfig())
+
+    def test_driver_decides_after_load(self):
+        self.assertTrue(self.index.is_monitored("macvlan_old"))  # 未建立索引：按名称匹配
+        self.assertTrue(self.index.load(self.client))
+
+        self.assertTrue(self.index.is_monitored("lan"))
+        self.assertFalse(self.index.is_monitored("macvlan_old"))
+
+    def test_events_keep_index_fresh(self):
+        self.index.load(self.client)
+        version = self.index.version
+
+        self.assertTrue(self.index.handle_event(
+            {"Type": "network", "Action": "create",
+             "Actor": {"Attributes": {"name": "dmz", "type": "macvlan"}}}))
+        self.assertTrue(self.index.handle_event(
+            {"Type": "network", "Action": "destroy",
+             "Actor": {"Attributes": {"name": "lan", "type": "macvlan"}}}))
+        self.assertFalse(self.index.handle_event(
+            {"Type": "network", "Action": "connect",
+             "Actor": {"Attributes": {"name": "dmz", "container": "a"}}}))
+
+        self.assertEqual(self.index.driver("dmz"), "macvlan")
+        self.assertIsNone(self.index.driver("lan"))
+        self.assertEqual(self.index.version, version + 2)
+
+
+class TestSharedNetworkIndex(unittest.TestCase):
+    def setUp(self):
+        self.fm = FirewallManager(DummyConfig())
+        self.monitor = DockerMonitor(DummyConfig(), self.fm)
+        self.monitor.client = mock.MagicMock()
+        networks = [network("macvlan_net", "overlay"), network("lan", "macvlan")]
+        self.monitor.client.networks.list.return_value = networks
+
+    def test_monitor_and_compiler_agree(self):
+        self.assertIs(self.monitor.networks, self.fm.compiler.networks)
+        self.monitor.networks.load(self.monitor.client)
+
+        for name in ("macvlan_net", "lan"):
+            self.assertEqual(self.monitor._should_monitor_network(name),
+                             self.fm.compiler.should_monitor_network(name))
+        self.monitor.client.networks.get.assert_not_called()
+
+    def test_unknown_network_looked_up_once(self):
+        self.monitor.networks.load(self.monitor.client)
+        self.monitor.client.networks.get.return_value = network("dmz", "macvlan")
+
+        self.assertTrue(self.monitor._should_monitor_network("dmz"))
+        self.assertTrue(self.monitor._should_monitor_network("dmz"))
+        self.monitor.client.networks.get.assert_called_once_with("dmz")
+
+    def test_index_change_invalidates_compile_cache(self):
+        snapshot = StateSnapshot(containers=(
+            ContainerState("a" * 64, "web",
+                           {"lan": {"GlobalIPv6Address": "2001:db8::10"}},
+                           port_mappings=({"port": 80, "protocol": "tcp"},)),))
+        unmonitored = self.fm.compiler.compile(snapshot).rule_count()  # 名称不匹配，只有基础规则
+
+        self.monitor.networks.set("lan", "macvlan")
+        self.assertGreater(self.fm.compiler.compile(snapshot).rule_count(), unmonitored)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig, completed
+
+
+class TestNftablesBackend(unittest.TestCase):
+    def setUp(self):
+        cfg = DummyConfig()
+        cfg.firewall_backend = "nftables"
+        self.fm = FirewallManager(cfg)
+        self.networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+        self.scripts = []
+
+    def fake_run(self, cmd, **kwargs):
+        if cmd[0] == "nft":
+            self.scripts.append(kwargs['input'])
+        return completed(1 if "-C" in cmd else 0)
+
+    def test_container_rules_become_set_elements(self):
+        with mock.patch('subprocess.run', side_effect=self.fake_run) as run:
+            self.fm.add_container_rules('cid', 'web', [{'port': 53, 'protocol': 'all'}],
+                                        self.networks)
+
+        self.assertFalse(any(c.args[0][0] == "ip6tables-restore"
+                             for c in run.call_args_list))
+        self.assertEqual(len(self.scripts), 1)
+        element = "ip6 docker_ipv6fw allowed { 2001:db8::10 . %s . 53 }"
+        self.assertIn("add element " + element % "tcp", self.scripts[0])
+        self.assertIn("add element " + element % "udp", self.scripts[0])
+        self.assertEqual(self.fm.nft.count("allowed"), 2)
+
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.remove_container_rules('cid')
+
+        self.assertIn("delete element " + element % "tcp", self.scripts[1])
+        self.assertEqual(self.fm.nft.count("allowed"), 0)
+
+    def test_service_rule_adds_allow_and_dnat_map(self):
+        containers = [{'container_id': 'c1', 'container_name': 'web.1',
+                       'ipv6_address': '2001:db8::20'}]
+        ports = [{'protocol': 'tcp', 'published_port': 80, 'target_port': 8080}]
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.add_service_rules('svc', 'web', ports, containers)
+
+        script = self.scripts[0]
+        self.assertIn("allowed { 2001:db8::20 . tcp . 8080 }", script)
+        self.assertIn("svc_dnat { 2001:db8::20 . tcp . 80 : 2001:db8::20 . 8080 }",
+                      script)
+
+    def test_failed_nft_commit_keeps_model_unchanged(self):
+        def failing_run(cmd, **kwargs):
+            return completed(1)
+
+        with mock.patch('subprocess.run', side_effect=failing_run):
+            self.fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                        self.networks)
+
+        self.assertEqual(self.fm.nft.count("allowed"), 0)
+        self.assertNotIn('cid', self.fm.active_rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
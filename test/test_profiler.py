@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from profiler import RuntimeProfiler
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestRuntimeProfiler(unittest.TestCase):
+    def test_dump_reports_profile_state_and_stacks(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+        worker.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                profiler = RuntimeProfiler(tmp, duration=0.1, interval=0.005,
+                                           modules=("test_profiler.py",),
+                                           state=lambda: {"apply_queue.pending": 3})
+                self.assertTrue(profiler.trigger())
+                self.assertFalse(profiler.trigger())  # 上一次尚未完成
+                profiler.wait(timeout=10)
+
+                reports = os.listdir(tmp)
+                self.assertEqual(len(reports), 1)
+                with open(os.path.join(tmp, reports[0]), encoding="utf-8") as f:
+                    report = f.read()
+        finally:
+            stop.set()
+            worker.join()
+
+        self.assertIn("apply_queue.pending: 3", report)
+        self.assertIn("test_profiler.py:", report)
+        self.assertIn("busy_loop", report)
+        self.assertIn("### busy-worker", report)
+        self.assertIn("## 内存分配热点", report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,273 @@
+import sys
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from rule_backend import RuleApplier, RuleTransaction, quote_arg, split_rule
+from apply_queue import ApplyQueue
+from firewall_manager import FirewallManager
+
+
+class DummyConfig:
+    def __init__(self):
+        self.monitored_networks = ["macvlan", "bridge"]
+        self.ip6tables_cmd = "ip6tables"
+        self.iptables_cmd = "iptables"
+        self.chain_name = "DOCKER_IPV6FW_FORWARD"
+        self.input_chain_name = "DOCKER_IPV6FW_INPUT"
+        self.nat_chain_name = "DOCKER_IPV6FW_NAT"
+        self.ipv4_chain_name = "DOCKER_IPV4FW_FORWARD"
+        self.ipv4_nat_chain_name = "DOCKER_IPV4FW_NAT"
+        self.parent_interface = "ens3"
+        self.gateway_macvlan = "macvlan_gw"
+        self.ipv6_link_local = "fe80::/10"
+        self.firewall_backend = "iptables"
+        self.nft_cmd = "nft"
+        self.nft_table = "docker_ipv6fw"
+        self.nft_accept_mark = "0x20000000"
+        self.forward_mode = "chain"
+        self.ipset_cmd = "ipset"
+        self.ipset_prefix = "docker_ipv6fw"
+        self.rule_applier = "oneshot"
+        self.warm_restart = False
+        self.apply_coalesce_window = 0.2
+        self.container_stop_grace = 10
+        self.event_engine = "thread"
+        self.inspect_concurrency = 8
+
+
+def completed(returncode=0, stdout=""):
+    return subprocess.CompletedProcess(args=[], returncode=returncode, stdout=stdout,
+                                       stderr="")
+
+
+class TestRuleTransaction(unittest.TestCase):
+    def test_split_rule_strips_table_and_insert_position(self):
+        table, action, chain, spec = split_rule(["-t", "nat", "-I", "PREROUTING", "1",
+                                                 "-j", "X"])
+        self.assertEqual((table, action, chain, spec),
+                         ("nat", "-I", "PREROUTING", ["-j", "X"]))
+
+    def test_quote_arg(self):
+        self.assertEqual(quote_arg("ACCEPT"), "ACCEPT")
+        self.assertEqual(quote_arg("Svc:web 80->8080"), '"Svc:web 80->8080"')
+
+    def test_render_groups_tables_and_dedupes(self):
+        txn = RuleTransaction()
+        rule = ["-A", "FW", "-p", "tcp", "--dport", "80", "-j", "ACCEPT",
+                "-m", "comment", "--comment", "Container:a b"]
+        txn.add("ip6tables", rule)
+        txn.add("ip6tables", rule)
+        txn.add("ip6tables", ["-t", "nat", "-A", "NAT", "-j", "DNAT",
+                              "--to-destination", "[::1]:80"])
+
+        self.assertEqual(len(txn), 2)
+        payload = txn.render("ip6tables")
+        self.assertEqual(payload, (
+            "*filter\n"
+            '-A FW -p tcp --dport 80 -j ACCEPT -m comment --comment "Container:a b"\n'
+            "COMMIT\n"
+            "*nat\n"
+            "-A NAT -j DNAT --to-destination [::1]:80\n"
+            "COMMIT\n"
+        ))
+
+    def test_readd_after_delete_is_kept(self):
+        txn = RuleTransaction()
+        rule = ["-A", "FW", "-j", "ACCEPT"]
+        txn.add("ip6tables", rule)
+        txn.add("ip6tables", ["-D", "FW", "-j", "ACCEPT"])
+        txn.add("ip6tables", rule)
+
+        self.assertEqual(txn.render("ip6tables"),
+                         "*filter\n-A FW -j ACCEPT\n-D FW -j ACCEPT\n"
+                         "-A FW -j ACCEPT\nCOMMIT\n")
+        self.assertTrue(txn.lookup("ip6tables", rule))
+
+    def test_delete_after_flush_is_skipped(self):
+        txn = RuleTransaction()
+        txn.add("ip6tables", ["-F", "FW"])
+        txn.add("ip6tables", ["-D", "FW", "-j", "ACCEPT"])
+        self.assertEqual(txn.render("ip6tables"), "*filter\n-F FW\nCOMMIT\n")
+
+    def test_lookup_tracks_pending_state(self):
+        txn = RuleTransaction()
+        rule = ["-A", "FW", "-j", "ACCEPT"]
+        self.assertIsNone(txn.lookup("ip6tables", rule))
+        txn.add("ip6tables", rule)
+        self.assertTrue(txn.lookup("ip6tables", ["-C", "FW", "-j", "ACCEPT"]))
+        txn.add("ip6tables", ["-F", "FW"])
+        self.assertFalse(txn.lookup("ip6tables", rule))
+
+    def test_commit_runs_one_restore_per_family(self):
+        txn = RuleTransaction()
+        txn.add("ip6tables", ["-A", "FW6", "-j", "ACCEPT"])
+        txn.add("ip6tables", ["-A", "FW6", "-p", "icmpv6", "-j", "ACCEPT"])
+        txn.add("iptables", ["-A", "FW4", "-j", "ACCEPT"])
+
+        with mock.patch('subprocess.run', return_value=completed()) as run:
+            txn.commit()
+
+        commands = [c.args[0] for c in run.call_args_list]
+        self.assertEqual(commands, [["ip6tables-restore", "--noflush"],
+                                    ["iptables-restore", "--noflush"]])
+
+    def test_commit_failure_raises(self):
+        txn = RuleTransaction()
+        txn.add("ip6tables", ["-D", "FW6", "-j", "ACCEPT"])
+        with mock.patch('subprocess.run', return_value=completed(1)):
+            with self.assertRaises(subprocess.CalledProcessError):
+                txn.commit()
+
+
+class FakeRestoreProcess:
+    """模拟常驻restore进程：记录写入内容，exit_on_write 时处理完写入内容后退出"""
+
+    def __init__(self, exit_on_write=None):
+        self.pid = 1
+        self.written = []
+        self.returncode = None
+        self.exit_on_write = exit_on_write
+        self.stdin = mock.Mock()
+        self.stdin.write.side_effect = self.written.append
+        self.stdin.close.side_effect = lambda: setattr(self, 'returncode',
+                                                       self.returncode or 0)
+        self.stderr = mock.Mock()
+        self.stderr.read.return_value = "line 2 failed"
+
+    def poll(self):
+        if self.returncode is None and self.written and self.exit_on_write is not None:
+            self.returncode = self.exit_on_write
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if self.poll() is None:
+            raise subprocess.TimeoutExpired("restore", timeout)
+        return self.returncode
+
+
+class TestRuleApplier(unittest.TestCase):
+    def test_batches_stream_into_one_process(self):
+        applier = RuleApplier()
+        process = FakeRestoreProcess()
+        with mock.patch('subprocess.Popen', return_value=process) as popen:
+            for port in ("80", "443"):
+                txn = RuleTransaction(applier=applier)
+                txn.add("ip6tables", ["-A", "FW6", "-p", "tcp", "--dport", port,
+                                      "-j", "ACCEPT"])
+                txn.commit()
+
+        popen.assert_called_once()
+        self.assertEqual(popen.call_args.args[0], ["ip6tables-restore", "--noflush"])
+        self.assertEqual(len(process.written), 2)
+        self.assertTrue(all(block.endswith("COMMIT\n") for block in process.written))
+
+        applier.close()
+        process.stdin.close.assert_called_once()
+
+    def test_late_failure_is_reported_and_next_batch_applied(self):
+        failures = []
+        applier = RuleApplier(on_failure=failures.append)
+        failing, fresh = FakeRestoreProcess(exit_on_write=2), FakeRestoreProcess()
+        with mock.patch('subprocess.Popen', side_effect=[failing, fresh]) as popen:
+            # 写入不等待确认：失败在写入下一批时才发现
+            txn = RuleTransaction(applier=applier)
+            txn.add("ip6tables", ["-D", "FW6", "-j", "ACCEPT"])
+            txn.commit()
+            self.assertEqual(failures, [])
+
+            txn = RuleTransaction(applier=applier)
+            txn.add("ip6tables", ["-A", "FW6", "-j", "ACCEPT"])
+            txn.commit()
+
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0].stderr, "line 2 failed")
+        self.assertEqual(popen.call_count, 2)
+        self.assertEqual(len(fresh.written), 1)
+
+    def test_write_to_fresh_process_failure_raises(self):
+        applier = RuleApplier()
+        process = FakeRestoreProcess()
+        process.returncode = 1
+        process.stdin.write.side_effect = BrokenPipeError()
+        with mock.patch('subprocess.Popen', return_value=process):
+            txn = RuleTransaction(applier=applier)
+            txn.add("ip6tables", ["-A", "FW6", "-j", "ACCEPT"])
+            with self.assertRaises(subprocess.CalledProcessError) as ctx:
+                txn.commit()
+        self.assertEqual(ctx.exception.stderr, "line 2 failed")
+
+    def test_late_failure_invalidates_snapshot_and_requests_sync(self):
+        config = DummyConfig()
+        config.rule_applier = "persistent"
+        fm = FirewallManager(config)
+        queue = ApplyQueue(fm)
+        ruleset = fm._ruleset("ip6tables")
+        ruleset.loaded = True
+
+        fm.applier.on_failure(subprocess.CalledProcessError(2, ["ip6tables-restore"]))
+
+        self.assertFalse(ruleset.loaded)
+        self.assertIn(ApplyQueue.SYNC_KEY, queue._intents)
+
+    def test_ipset_teardown_waits_for_restore(self):
+        applier = RuleApplier()
+        process = FakeRestoreProcess()
+        txn = RuleTransaction(applier=applier)
+        txn.add("ip6tables", ["-F", "FW6"])
+        txn.add_ipset("destroy docker_ipv6fw_tcp", post=True)
+
+        with mock.patch('subprocess.Popen', return_value=process), \
+                mock.patch('subprocess.run', return_value=completed()) as run:
+            txn.commit()
+
+        # 删除集合之前必须确认引用它的规则已经删除
+        process.stdin.close.assert_called_once()
+        self.assertEqual(run.call_args.args[0], ["ipset", "restore"])
+
+
+class TestFirewallManagerBatching(unittest.TestCase):
+    def setUp(self):
+        self.fm = FirewallManager(DummyConfig())
+
+    def test_add_container_rules_single_restore(self):
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+        ports = [{'port': 80, 'protocol': 'tcp'}, {'port': 53, 'protocol': 'all'}]
+
+        def fake_run(cmd, **kwargs):
+            # 所有 -C 探测都返回不存在
+            return completed(1 if "-C" in cmd else 0)
+
+        with mock.patch('subprocess.run', side_effect=fake_run) as run:
+            self.fm.add_container_rules('cid', 'web', ports, networks)
+
+        restores = [c for c in run.call_args_list
+                    if c.args[0][0] == "ip6tables-restore"]
+        self.assertEqual(len(restores), 1)
+        payload = restores[0].kwargs['input']
+        self.assertEqual(payload.count("-A DOCKER_IPV6FW_FORWARD"), 3)
+        self.assertEqual(len(self.fm.active_rules['cid']), 3)
+
+    def test_failed_commit_does_not_record_rules(self):
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+        def fake_run(cmd, **kwargs):
+            return completed(1)
+
+        with mock.patch('subprocess.run', side_effect=fake_run):
+            self.fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                        networks)
+
+        self.assertNotIn('cid', self.fm.active_rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from firewall_manager import FirewallManager
+from rule_compiler import (ContainerState, RuleCompiler, ServiceState,
+                           StateSnapshot)
+from rule_registry import RuleRegistry
+from test_rule_backend import DummyConfig, completed
+
+NETWORKS = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'},
+            'host': {'GlobalIPv6Address': '2001:db8::99'}}
+
+
+def snapshot(reverse=False):
+    containers = [
+        ContainerState('c1', 'web', NETWORKS,
+                       port_mappings=({'port': 80, 'protocol': 'tcp'},
+                                      {'port': 53, 'protocol': 'all'}),
+                       public_ports=({'container_port': 80, 'host_port': 8080,
+                                      'protocol': 'tcp'},
+                                     {'container_port': 443, 'host_port': 443,
+                                      'protocol': 'tcp'}),
+                       custom_ports=({'external_port': 22, 'internal_port': 22,
+                                      'protocol': 'tcp'},)),
+        ContainerState('c2', 'db',
+                       {'macvlan_net': {'GlobalIPv6Address': '2001:db8::20'}},
+                       port_mappings=({'port': 5432, 'protocol': 'tcp'},
+                                      {'port': 5432, 'protocol': 'tcp'})),
+    ]
+    services = [
+        ServiceState('s1', 'api',
+                     ({'published_port': 9000, 'target_port': 90, 'protocol': 'TCP'},),
+                     ({'container_id': 'c2', 'container_name': 'db',
+                       'ipv6_address': '2001:db8::20'},
+                      {'container_id': 'c3', 'container_name': 'none',
+                       'ipv6_address': None})),
+    ]
+    if reverse:
+        containers.reverse()
+    return StateSnapshot(tuple(containers), tuple(services))
+
+
+class TestRuleCompiler(unittest.TestCase):
+    def setUp(self):
+        self.compiler = RuleCompiler(DummyConfig())
+
+    def test_compile_has_no_side_effects(self):
+        with mock.patch('subprocess.run') as run, \
+                mock.patch('subprocess.Popen') as popen:
+            compiled = self.compiler.compile(snapshot())
+        run.assert_not_called()
+        popen.assert_not_called()
+
+        records = compiled.records
+        c1 = records[(RuleRegistry.CONTAINER, 'c1')]
+        self.assertEqual([(r.protocol, r.port) for r in c1],
+                         [('tcp', 53), ('tcp', 80), ('tcp', 443), ('udp', 53)])
+        self.assertEqual(len(records[(RuleRegistry.CONTAINER, 'c2')]), 1)  # 重复端口去重
+        self.assertEqual(len(records[(RuleRegistry.PUBLIC, 'c1')]), 1)
+        self.assertEqual(len(records[(RuleRegistry.SERVICE, 's1')]), 1)
+        self.assertEqual(records[(RuleRegistry.SERVICE, 's1')][0].protocol, 'tcp')
+
+    def test_output_is_canonical_and_cached(self):
+        first = self.compiler.compile(snapshot())
+        self.assertIs(self.compiler.compile(snapshot(reverse=True)), first)
+
+        other = RuleCompiler(DummyConfig()).compile(snapshot(reverse=True))
+        self.assertEqual(other.chains, first.chains)
+        forward = first.chains[("ip6tables", "filter", "DOCKER_IPV6FW_FORWARD")]
+        self.assertEqual(forward[0][0], "-I")  # DNAT conntrack规则在链首
+        self.assertEqual(len(forward), len({tuple(rule) for rule in forward}))
+
+    def test_records_match_firewall_manager(self):
+        """编译结果与逐个容器/Service下发后的登记表一致"""
+        fm = FirewallManager(DummyConfig())
+
+        def fake_run(cmd, **kwargs):
+            # 规则快照为空，restore提交成功
+            committed = cmd[0].endswith(("-restore", "-save"))
+            return completed(returncode=0 if committed else 1)
+
+        with mock.patch('subprocess.run', side_effect=fake_run):
+            for container in snapshot().containers:
+                cid, name = container.container_id, container.container_name
+                fm.add_container_rules(cid, name, list(container.port_mappings),
+                                       container.networks)
+                fm.add_container_public_rules(cid, name, list(container.public_ports),
+                                              container.networks)
+                fm.add_custom_firewall_rules(cid, name, list(container.custom_ports),
+                                             container.networks)
+            for service in snapshot().services:
+                fm.add_service_rules(service.service_id, service.service_name,
+                                     list(service.service_ports),
+                                     list(service.containers))
+
+        compiled = self.compiler.compile(snapshot())
+        self.assertEqual({key: set(rules) for key, rules in fm.registry.items()},
+                         {key: set(rules) for key, rules in compiled.records.items()})
+
+    def test_ipset_mode_moves_rules_to_elements(self):
+        config = DummyConfig()
+        config.forward_mode = "ipset"
+        compiled = RuleCompiler(config).compile(snapshot())
+
+        forward = compiled.chains[("ip6tables", "filter", "DOCKER_IPV6FW_FORWARD")]
+        self.assertFalse(any("Container:" in " ".join(rule) for rule in forward))
+        self.assertIn(("docker_ipv6fw_tcp", "2001:db8::10,tcp:22"),
+                      compiled.ipset_elements)
+
+
+if __name__ == '__main__':
+    unittest.main()
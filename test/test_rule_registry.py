@@ -0,0 +1,184 @@
+import sys
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from rule_registry import FirewallRule, ServiceRule, RuleRegistry, RegistryView
+from docker_monitor import DockerMonitor
+from test_rule_backend import DummyConfig, completed
+from firewall_manager import FirewallManager
+
+
+def fw_rule(cid="c1", port=80, address="2001:db8::10", protocol="tcp"):
+    return FirewallRule(cid, "web", protocol, port, address, "ens3", "macvlan_gw")
+
+
+def svc_rule(sid="s1", cid="c1", published=8080, target=80, address="2001:db8::10"):
+    return ServiceRule(sid, "svc", cid, "web", "tcp", published, target, address,
+                       "ens3", "macvlan_gw")
+
+
+class TestRuleRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = RuleRegistry()
+
+    def test_records_use_slots(self):
+        self.assertFalse(hasattr(fw_rule(), "__dict__"))
+        self.assertFalse(hasattr(svc_rule(), "__dict__"))
+
+    def test_secondary_indexes(self):
+        container = (RuleRegistry.CONTAINER, "c1")
+        service = (RuleRegistry.SERVICE, "s1")
+        self.registry.set(container, [fw_rule(), fw_rule(port=443)])
+        self.registry.set(service, [svc_rule()])
+
+        self.assertEqual(self.registry.keys_for_container("c1"), {container, service})
+        self.assertEqual(self.registry.keys_for_address("2001:db8::10"),
+                         {container, service})
+        self.assertEqual(self.registry.keys_for_port("tcp", 8080), {service})
+        self.assertEqual(self.registry.keys((RuleRegistry.SERVICE,)), [service])
+
+        self.registry.remove(container)
+        self.assertEqual(self.registry.keys_for_port("tcp", 443), set())
+        self.assertEqual(self.registry.keys_for_container("c1"), {service})
+
+    def test_signature_delta(self):
+        key = (RuleRegistry.SERVICE, "s1")
+        self.registry.set(key, [svc_rule(), svc_rule(published=8443, target=443)])
+
+        added, removed = self.registry.signature_delta(key, {
+            ("tcp", 8080, 80, "2001:db8::10"),
+            ("tcp", 9090, 90, "2001:db8::10"),
+        })
+        self.assertEqual(added, {("tcp", 9090, 90, "2001:db8::10")})
+        self.assertEqual(removed, {("tcp", 8443, 443, "2001:db8::10")})
+        self.assertTrue(self.registry.has_signature(key,
+                                                    ("tcp", 8080, 80, "2001:db8::10")))
+
+    def test_legacy_ids(self):
+        key_for_id, id_for_key = RuleRegistry.key_for_id, RuleRegistry.id_for_key
+        self.assertEqual(key_for_id("c1_public"), (RuleRegistry.PUBLIC, "c1"))
+        self.assertEqual(key_for_id("c1_custom"), (RuleRegistry.CUSTOM, "c1"))
+        self.assertEqual(key_for_id("svc"), (RuleRegistry.SERVICE, "svc"))
+        self.assertEqual(id_for_key((RuleRegistry.PUBLIC, "c1")), "c1_public")
+
+    def test_owner_tag_round_trip(self):
+        rule = svc_rule(sid="c1_public", cid="0123456789abcdef")
+        tag = RuleRegistry.owner_tag(RuleRegistry.PUBLIC, rule)
+        self.assertRegex(tag, r"^v6fw:p:0123456789ab:[0-9a-f]{8}$")
+
+        owner = RuleRegistry.parse_owner_tag(f"{tag} Svc:web 8080->80")
+        self.assertEqual(owner.kind, RuleRegistry.PUBLIC)
+        self.assertTrue(owner.owned_by("0123456789abcdef"))
+        # 同一容器的不同规则哈希不同
+        other = svc_rule(cid="0123456789abcdef", published=9090)
+        self.assertNotEqual(tag, RuleRegistry.owner_tag(RuleRegistry.PUBLIC, other))
+        self.assertIsNone(RuleRegistry.parse_owner_tag("Container:web"))
+        self.assertIsNone(RuleRegistry.parse_owner_tag(None))
+
+    def test_rollback_restores_records(self):
+        kept, dropped = (RuleRegistry.CONTAINER, "c1"), (RuleRegistry.CONTAINER, "c2")
+        self.registry.set(kept, [fw_rule()])
+        self.registry.set(dropped, [fw_rule(cid="c2", address="2001:db8::20")])
+
+        self.registry.begin()
+        self.registry.remove(kept)
+        self.registry.set(dropped,
+                          [fw_rule(cid="c2", port=443, address="2001:db8::20")])
+        self.registry.set((RuleRegistry.SERVICE, "s1"), [svc_rule()])
+        self.registry.rollback()
+
+        self.assertEqual(self.registry.get(kept), (fw_rule(),))
+        self.assertEqual([rule.port for rule in self.registry.get(dropped)], [80])
+        self.assertNotIn((RuleRegistry.SERVICE, "s1"), self.registry)
+        self.assertEqual(self.registry.keys_for_port("tcp", 443), set())
+
+    def test_counts_published_after_commit(self):
+        self.registry.set((RuleRegistry.CONTAINER, "c1"),
+                          [fw_rule(), fw_rule(port=443)])
+        self.assertEqual(self.registry.counts, (1, {RuleRegistry.CONTAINER: 2}))
+
+        # 事务中的修改在提交前对其他线程不可见，回滚后不发布
+        self.registry.begin()
+        self.registry.set((RuleRegistry.SERVICE, "s1"), [svc_rule()])
+        self.assertEqual(self.registry.counts.records, 1)
+        self.registry.rollback()
+        self.assertEqual(self.registry.counts.rules.get(RuleRegistry.SERVICE, 0), 0)
+
+        self.registry.begin()
+        self.registry.set((RuleRegistry.SERVICE, "s1"), [svc_rule()])
+        self.registry.remove((RuleRegistry.CONTAINER, "c1"))
+        self.registry.commit()
+        self.assertEqual(self.registry.counts,
+                         (1, {RuleRegistry.CONTAINER: 0, RuleRegistry.SERVICE: 1}))
+        self.assertEqual(self.registry.rule_count(), 1)
+
+        self.registry.clear()
+        self.assertEqual(self.registry.counts, (0, {}))
+
+    def test_view_mapping_interface(self):
+        services = RegistryView(self.registry, RuleRegistry.SERVICE_KINDS)
+        containers = RegistryView(self.registry, (RuleRegistry.CONTAINER,))
+
+        services["c1_public"] = [svc_rule(sid="c1_public")]
+        containers["c1"] = [fw_rule()]
+
+        self.assertIn((RuleRegistry.PUBLIC, "c1"), self.registry)
+        self.assertEqual(list(services), ["c1_public"])
+        self.assertEqual(list(containers), ["c1"])
+
+        services.clear()
+        self.assertEqual(len(services), 0)
+        self.assertEqual(len(containers), 1)
+
+
+class TestCommitThenRecord(unittest.TestCase):
+    def test_failed_batch_leaves_registry_unchanged(self):
+        fm = FirewallManager(DummyConfig())
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+        with mock.patch('subprocess.run', return_value=completed(1)):
+            with self.assertRaises(subprocess.CalledProcessError):
+                with fm.batch():
+                    fm.add_container_rules('cid', 'web',
+                                           [{'port': 80, 'protocol': 'tcp'}], networks)
+                    # 事务内可以读到自己的修改
+                    self.assertIn((RuleRegistry.CONTAINER, 'cid'), fm.registry)
+
+        self.assertEqual(len(fm.registry), 0)
+
+
+class TestStaleCleanup(unittest.TestCase):
+    def test_cleanup_uses_container_index(self):
+        fm = FirewallManager(DummyConfig())
+        fm.registry.set((RuleRegistry.CONTAINER, "gone"), [fw_rule(cid="gone")])
+        fm.registry.set((RuleRegistry.SERVICE, "s1"),
+                        [svc_rule(cid="gone"), svc_rule(cid="alive", published=81)])
+        fm.registry.set((RuleRegistry.SERVICE, "s2"),
+                        [svc_rule(sid="s2", cid="alive", published=82)])
+
+        monitor = DockerMonitor(DummyConfig(), fm)
+        monitor.client = mock.Mock()
+        monitor.client.containers.list.return_value = [mock.Mock(id="alive")]
+
+        with mock.patch.object(fm, 'remove_container_rules') as remove_container, \
+                mock.patch.object(fm, '_remove_service_rule') as remove_rule:
+            monitor._cleanup_stale_rules()
+
+        remove_container.assert_called_once_with("gone")
+        remove_rule.assert_called_once_with(svc_rule(cid="gone"))
+        remaining = fm.registry.get((RuleRegistry.SERVICE, "s1"))
+        self.assertEqual([rule.container_id for rule in remaining], ["alive"])
+        self.assertEqual(len(fm.registry.get((RuleRegistry.SERVICE, "s2"))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+import sys
+import os
+import subprocess
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from ruleset import Ruleset, rule_key
+from rule_registry import RuleRegistry
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig
+
+SAVE_OUTPUT = (
+    "# Generated by ip6tables-save v1.8.9\n"
+    "*nat\n"
+    ":PREROUTING ACCEPT [0:0]\n"
+    ":DOCKER_IPV6FW_NAT - [0:0]\n"
+    "-A PREROUTING -j DOCKER_IPV6FW_NAT\n"
+    "-A DOCKER_IPV6FW_NAT -d 2001:db8::20/128 -i ens3 -p tcp -m tcp --dport 80"
+    ' -m comment --comment "Svc:web 80->8080"'
+    " -j DNAT --to-destination [2001:db8::20]:8080\n"
+    "COMMIT\n"
+    "*filter\n"
+    ":INPUT ACCEPT [0:0]\n"
+    ":FORWARD DROP [0:0]\n"
+    ":DOCKER-USER - [0:0]\n"
+    ":DOCKER_IPV6FW_FORWARD - [0:0]\n"
+    ":DOCKER_IPV6FW_INPUT - [0:0]\n"
+    "-A FORWARD -j DOCKER_IPV6FW_FORWARD\n"
+    "-A FORWARD -j DOCKER-USER\n"
+    "-A DOCKER_IPV6FW_FORWARD -i ens3 -o macvlan_gw -m conntrack --ctstate DNAT"
+    " -j ACCEPT\n"
+    "-A DOCKER_IPV6FW_FORWARD -d 2001:db8::10/128 -i ens3 -o macvlan_gw"
+    " -p tcp -m tcp --dport 80"
+    ' -m comment --comment "v6fw:c:cid:e73dff58 Container:web" -j ACCEPT\n'
+    "-A DOCKER_IPV6FW_INPUT -p ipv6-icmp -m icmp6 --icmpv6-type 135 -j ACCEPT\n"
+    "COMMIT\n"
+)
+
+
+def completed(returncode=0, stdout=""):
+    return subprocess.CompletedProcess(args=[], returncode=returncode, stdout=stdout,
+                                       stderr="")
+
+
+class TestRuleset(unittest.TestCase):
+    def setUp(self):
+        self.ruleset = Ruleset("ip6tables", ["DOCKER_IPV6FW_FORWARD",
+                                             "DOCKER_IPV6FW_INPUT",
+                                             "DOCKER_IPV6FW_NAT"])
+        self.ruleset.parse(SAVE_OUTPUT)
+        self.ruleset.loaded = True
+
+    def test_rule_key_ignores_order_and_match_modules(self):
+        ours = ["-p", "tcp", "-d", "2001:db8::10", "--dport", "80", "-j", "ACCEPT"]
+        saved = ["-d", "2001:db8::10/128", "-p", "tcp", "-m", "tcp", "--dport", "80",
+                 "-j", "ACCEPT"]
+        self.assertEqual(rule_key(ours), rule_key(saved))
+
+    def test_contains_matches_saved_rules(self):
+        self.assertTrue(self.ruleset.contains([
+            "-A", "DOCKER_IPV6FW_FORWARD", "-p", "tcp", "-d", "2001:db8::10",
+            "--dport", "80", "-i", "ens3", "-o", "macvlan_gw", "-j", "ACCEPT",
+            "-m", "comment", "--comment", "v6fw:c:cid:e73dff58 Container:web"]))
+        self.assertTrue(self.ruleset.contains([
+            "-A", "DOCKER_IPV6FW_INPUT", "-p", "icmpv6",
+            "--icmpv6-type", "neighbor-solicitation", "-j", "ACCEPT"]))
+        self.assertTrue(self.ruleset.contains([
+            "-t", "nat", "-I", "PREROUTING", "1", "-j", "DOCKER_IPV6FW_NAT"]))
+        self.assertFalse(self.ruleset.contains([
+            "-A", "DOCKER_IPV6FW_INPUT", "-s", "fe80::/10", "-j", "ACCEPT"]))
+
+    def test_owned_entries_from_tags(self):
+        entries = self.ruleset.owned_entries()
+        self.assertEqual(len(entries), 1)
+        table, chain, spec, owner = entries[0]
+        self.assertEqual((table, chain), ("filter", "DOCKER_IPV6FW_FORWARD"))
+        self.assertEqual(owner.kind, RuleRegistry.CONTAINER)
+        self.assertTrue(owner.owned_by("cid"))
+        self.assertEqual(self.ruleset.owned_entries([RuleRegistry.SERVICE]), [])
+
+    def test_untracked_rules_fall_back(self):
+        self.assertIsNone(self.ruleset.contains(["-A", "FORWARD", "-j", "DOCKER-USER"]))
+        self.assertTrue(self.ruleset.has_chain("DOCKER_IPV6FW_NAT", "nat"))
+        self.assertFalse(self.ruleset.has_chain("DOCKER_IPV6FW_ISO"))
+
+    def test_apply_replays_restore_lines(self):
+        rule = ["-A", "DOCKER_IPV6FW_INPUT", "-d", "fe80::/10", "-j", "ACCEPT"]
+        self.ruleset.apply("filter", rule)
+        self.assertTrue(self.ruleset.contains(rule))
+        self.ruleset.apply("filter", ["-D"] + rule[1:])
+        self.assertFalse(self.ruleset.contains(rule))
+        self.ruleset.apply("filter", ["-F", "DOCKER_IPV6FW_FORWARD"])
+        self.assertEqual(self.ruleset.chain_rules("DOCKER_IPV6FW_FORWARD"), [])
+
+
+class TestFirewallManagerSnapshot(unittest.TestCase):
+    def test_existence_checks_use_one_snapshot(self):
+        fm = FirewallManager(DummyConfig())
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+        def fake_run(cmd, **kwargs):
+            if cmd[0] == "ip6tables-save":
+                return completed(stdout=SAVE_OUTPUT)
+            return completed()
+
+        with mock.patch('subprocess.run', side_effect=fake_run) as run:
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'},
+                                                  {'port': 443, 'protocol': 'tcp'}],
+                                   networks)
+            fm.remove_container_rules('cid')
+
+        commands = [c.args[0][0] for c in run.call_args_list]
+        self.assertEqual(commands, ["ip6tables-save", "ip6tables-restore",
+                                    "ip6tables-restore"])
+        # 80 已存在，只添加 443；删除时两条都在快照中
+        add_payload = run.call_args_list[1].kwargs['input']
+        self.assertNotIn("--dport 80", add_payload)
+        self.assertIn("--dport 443", add_payload)
+        remove_payload = run.call_args_list[2].kwargs['input']
+        self.assertEqual(remove_payload.count("-D DOCKER_IPV6FW_FORWARD"), 2)
+
+    def test_failed_commit_invalidates_snapshot(self):
+        fm = FirewallManager(DummyConfig())
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+        def fake_run(cmd, **kwargs):
+            if cmd[0] == "ip6tables-save":
+                return completed(stdout=SAVE_OUTPUT)
+            return completed(1)
+
+        with mock.patch('subprocess.run', side_effect=fake_run):
+            fm.add_container_rules('cid', 'web', [{'port': 443, 'protocol': 'tcp'}],
+                                   networks)
+
+        self.assertFalse(fm._ruleset("ip6tables").loaded)
+
+
+class TestReconcile(unittest.TestCase):
+    def test_sync_applies_only_the_diff(self):
+        fm = FirewallManager(DummyConfig())
+        networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+
+        # 内存中只有 web:80；快照中多了一条陈旧规则，缺少大部分基础规则
+        stale = ("DOCKER_IPV6FW_FORWARD -d 2001:db8::99/128 -p tcp -m tcp --dport 22"
+                 " -j ACCEPT")
+        saved = SAVE_OUTPUT.replace('-A DOCKER_IPV6FW_INPUT',
+                                    f'-A {stale}\n-A DOCKER_IPV6FW_INPUT')
+        restores = []
+
+        def fake_run(cmd, **kwargs):
+            if cmd[0] == "ip6tables-save":
+                return completed(stdout=saved)
+            if cmd[0].endswith("-restore"):
+                restores.append((cmd[0], kwargs['input']))
+            return completed()
+
+        with mock.patch('subprocess.run', side_effect=fake_run):
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                   networks)
+            self.assertEqual(restores, [])  # 规则已在快照中
+            added, removed = fm.sync_rules_with_reality()
+
+        self.assertEqual(removed, 2)  # 陈旧容器规则 + 没有对应Service的NAT规则
+        payload = dict(restores)["ip6tables-restore"]
+        self.assertIn(f"-D {stale}", payload)
+        self.assertNotIn("-A DOCKER_IPV6FW_FORWARD -p tcp -d 2001:db8::10", payload)
+        self.assertIn("-A DOCKER_IPV6FW_INPUT -s fe80::/10 -j ACCEPT", payload)
+        self.assertNotIn("neighbor-solicitation", payload)  # 以数字形式存在于快照中
+
+        # 再次同步时没有任何变更
+        restores.clear()
+        with mock.patch('subprocess.run', side_effect=fake_run), \
+                mock.patch.object(fm._ruleset("ip6tables"), "invalidate"), \
+                mock.patch.object(fm._ruleset("iptables"), "invalidate"):
+            self.assertEqual(fm.sync_rules_with_reality(), (0, 0))
+        self.assertEqual(restores, [])
+
+
+class TestForceCleanup(unittest.TestCase):
+    def test_one_save_one_restore_keeps_foreign_rules(self):
+        fm = FirewallManager(DummyConfig())
+        saved = SAVE_OUTPUT.replace(
+            '-A DOCKER_IPV6FW_INPUT',
+            '-A DOCKER_IPV6FW_FORWARD -d 2001:db8::30/128 -p tcp -m tcp --dport 22'
+            ' -m comment --comment "Svc:old 22->22" -j ACCEPT\n'
+            '-A DOCKER_IPV6FW_FORWARD -s 2001:db8::/64 -p tcp -m tcp --dport 443'
+            ' -m comment --comment "admin" -j ACCEPT\n'
+            '-A DOCKER_IPV6FW_INPUT')
+
+        def fake_run(cmd, **kwargs):
+            if cmd[0] == "ip6tables-save":
+                return completed(stdout=saved)
+            return completed()
+
+        with mock.patch('subprocess.run', side_effect=fake_run) as run:
+            fm.force_cleanup_all_container_rules()
+
+        commands = [c.args[0][0] for c in run.call_args_list]
+        self.assertEqual(commands, ["ip6tables-save", "ip6tables-restore"])
+        payload = run.call_args_list[1].kwargs['input']
+        self.assertEqual(payload.count("-D DOCKER_IPV6FW_FORWARD"), 2)
+        self.assertIn("v6fw:c:cid:e73dff58", payload)
+        self.assertIn("Svc:old 22->22", payload)
+        self.assertNotIn("admin", payload)
+        self.assertNotIn("ctstate", payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from functools import partial
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+for path in (SRC_DIR, os.path.abspath(TEST_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from bench_convergence import SyntheticFleet
+from docker_monitor import DockerMonitor
+from fake_netfilter import FakeNetfilter
+from firewall_manager import FirewallManager
+from rule_backend import RuleTransaction
+from scan_snapshot import ScanSnapshot, container_fingerprint
+from test_rule_backend import DummyConfig
+
+PORT_9000 = {"9000/tcp": [{"HostIp": "", "HostPort": "9000"}]}
+
+
+def info(service=None, status="running"):
+    labels = {"com.docker.swarm.service.name": service} if service else {}
+    return {"status": status, "config": {"Labels": labels}}
+
+
+class TestScanSnapshot(unittest.TestCase):
+    def test_indexes_services_and_running_containers(self):
+        snapshot = ScanSnapshot(["a", "b", "c", "d"],
+                                {"a": info("web"), "b": info("web", status="exited"),
+                                 "c": info()})
+
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot.service_names(), ["web"])
+        self.assertEqual([cid for cid, _ in snapshot.service_containers("web")], ["a"])
+        everything = snapshot.service_containers("web", running_only=False)
+        self.assertEqual([cid for cid, _ in everything], ["a", "b"])
+        self.assertEqual(snapshot.service_containers("db"), [])
+        with self.assertRaises(TypeError):
+            snapshot.containers["e"] = info()
+
+    def test_fingerprint_covers_rule_inputs_only(self):
+        base = info("web")
+        base["networks"] = {"macvlan_net": {"GlobalIPv6Address": "2001:db8::1",
+                                            "IPAddress": "10.0.0.2"}}
+        fingerprint = container_fingerprint(base)
+        labels = base["config"]["Labels"]
+
+        relabeled = dict(base, config={"Labels": dict(labels, maintainer="ops")})
+        self.assertEqual(container_fingerprint(relabeled), fingerprint)
+
+        moved = dict(base,
+                     networks={"macvlan_net": {"GlobalIPv6Address": "2001:db8::2"}})
+        self.assertNotEqual(container_fingerprint(moved), fingerprint)
+        ported = dict(base, config={"Labels": dict(labels, **{
+            "docker-ipv6-firewall.ports": "80"})})
+        self.assertNotEqual(container_fingerprint(ported), fingerprint)
+        self.assertNotEqual(container_fingerprint(base, salt=2), fingerprint)
+
+    def test_service_fingerprint_includes_version(self):
+        containers = {"a": info("web")}
+        first = ScanSnapshot(["a"], containers, {"web": 1})
+        second = ScanSnapshot(["a"], containers, {"web": 2})
+        self.assertNotEqual(first.service_fingerprint("web"),
+                            second.service_fingerprint("web"))
+
+
+class TestMonitorScan(unittest.TestCase):
+    def setUp(self):
+        self.fleet = SyntheticFleet(containers=6, ports=2, services=3, replicas=2)
+        config = DummyConfig()
+        config.container_stop_grace = 0
+        self.fm = FirewallManager(config)
+        self.monitor = DockerMonitor(config, self.fm)
+        self.monitor.client = self.fleet.client()
+        self.fake = FakeNetfilter()
+        patcher = self.fake.patch()
+        patcher.__enter__()
+        self.addCleanup(patcher.__exit__, None, None, None)
+        self.fm.initialize()
+        self.monitor.apply_queue.start()
+        self.addCleanup(self.monitor.apply_queue.stop)
+
+    def test_scan_lists_containers_once(self):
+        self.monitor.scan_once()  # 首轮：填充inspect缓存
+        self.fleet.api_calls.clear()
+        self.monitor.scan_once()
+
+        self.assertEqual(self.fleet.api_calls["containers.list"], 1)
+        self.assertEqual(self.fleet.api_calls["inspect_container"], 0)
+        self.assertEqual(len(self.fm.registry.container_ids()), 12)
+
+    def test_unchanged_targets_are_skipped(self):
+        self.monitor.scan_once()
+        changed = next(iter(self.fleet.containers.values()))
+        changed.inspect["HostConfig"]["PortBindings"] = PORT_9000
+        self.monitor.inspect_cache.invalidate(changed.id)
+
+        with mock.patch.object(self.monitor, "_handle_container_start",
+                               wraps=self.monitor._handle_container_start) as start, \
+                mock.patch.object(self.monitor, "_handle_service_update",
+                                  wraps=self.monitor._handle_service_update) as service:
+            self.monitor.scan_once()
+            self.assertEqual([call.args[0] for call in start.call_args_list],
+                             [changed.id])
+            self.assertEqual(service.call_count, 0)
+
+            self.monitor.forget_fingerprints()
+            self.monitor.scan_once()
+            self.assertEqual(start.call_count, 13)
+            self.assertEqual(service.call_count, 3)
+
+    def test_failed_commit_is_retried_by_next_scan(self):
+        self.monitor.scan_once()
+        changed = next(iter(self.fleet.containers.values()))
+        changed.inspect["HostConfig"]["PortBindings"] = PORT_9000
+        self.monitor.inspect_cache.invalidate(changed.id)
+
+        commit = RuleTransaction.commit
+        failures = []
+
+        def fail_once(transaction):
+            if not failures:
+                failures.append(transaction)
+                raise subprocess.CalledProcessError(1, ["ip6tables-restore"],
+                                                    stderr="injected")
+            return commit(transaction)
+
+        with mock.patch.object(RuleTransaction, "commit", autospec=True,
+                               side_effect=fail_once):
+            self.monitor.scan_once()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(self.fm.registry.keys_for_port("tcp", 9000), set())
+
+        # 指纹没有记录：下一轮扫描重新处理该容器并提交规则
+        self.monitor.scan_once()
+        self.assertTrue(self.fm.registry.keys_for_port("tcp", 9000))
+        rules = self.fake.rules("ip6tables", self.fm.config.chain_name)
+        self.assertTrue(any("9000" in rule for rule in rules))
+
+    def test_forget_fingerprints_runs_on_apply_thread(self):
+        self.monitor.scan_once()
+        self.monitor.apply_queue.stop()
+
+        # 其他线程只提交清空意图，不直接修改应用线程使用的字典
+        self.monitor.forget_fingerprints()
+        self.assertTrue(self.monitor._fingerprints)
+        self.monitor.apply_queue.start()
+        self.monitor.apply_queue.wait_idle()
+        self.assertEqual(self.monitor._fingerprints, {})
+
+    def test_cleanup_uses_snapshot_container_ids(self):
+        self.monitor.scan_once()
+        removed = next(iter(self.fleet.containers))
+        del self.fleet.containers[removed]
+        self.monitor.scan_once()
+
+        self.assertNotIn(removed, self.fm.registry.container_ids())
+        self.assertEqual(len(self.fm.registry.container_ids()), 11)
+
+    def test_snapshot_is_taken_on_scan_thread(self):
+        threads = []
+        list_containers = self.fleet.containers_api.list
+
+        def recording_list(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return list_containers(*args, **kwargs)
+
+        with mock.patch.object(self.fleet.containers_api, "list",
+                               side_effect=recording_list):
+            self.monitor.scan_once()
+        # Docker API调用不占用应用线程
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_container_started_after_listing_is_kept(self):
+        self.monitor.scan_once()
+        snapshot = self.monitor.take_snapshot()
+
+        # 列出容器之后启动的容器：事件意图先于扫描屏障执行
+        started = self.fleet.add_container()
+        self.monitor._submit_container(started.id, start=True)
+        self.monitor.apply_queue.wait_idle()
+        self.assertIn(started.id, self.fm.registry.container_ids())
+
+        self.monitor.apply_queue.submit(("scan",),
+                                        partial(self.monitor._scan_phases, snapshot),
+                                        barrier=True)
+        self.monitor.apply_queue.wait_idle()
+        self.assertIn(started.id, self.fm.registry.container_ids())
+
+        # 下一轮扫描的快照包含该容器，规则保持不变
+        self.monitor.scan_once()
+        self.assertIn(started.id, self.fm.registry.container_ids())
+        self.assertEqual(len(self.fm.registry.container_ids()), 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
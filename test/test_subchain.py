@@ -0,0 +1,84 @@
+import sys
+import os
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig, completed
+
+
+class TestSubchainMode(unittest.TestCase):
+    def setUp(self):
+        cfg = DummyConfig()
+        cfg.forward_mode = "subchain"
+        self.fm = FirewallManager(cfg)
+        self.networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+        self.subchain = self.fm.compiler.subchain_name('2001:db8::10')
+        self.saved = ""
+        self.payloads = []
+
+    def fake_run(self, cmd, **kwargs):
+        if cmd[0] == "ip6tables-save":
+            return completed(stdout=self.saved)
+        if cmd[0] == "ip6tables-restore":
+            self.payloads.append(kwargs['input'])
+        return completed()
+
+    def test_container_rules_dispatch_through_subchain(self):
+        ports = [{'port': 80, 'protocol': 'tcp'}, {'port': 443, 'protocol': 'tcp'}]
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.add_container_rules('cid', 'web', ports, self.networks)
+
+        self.assertTrue(len(self.subchain) <= 28)
+        payload = self.payloads[0]
+        self.assertEqual(payload.count(f"-N {self.subchain}"), 1)
+        self.assertEqual(payload.count(f"-j {self.subchain}"), 1)
+        self.assertIn(f"-A {self.subchain} -p tcp --dport 443 -j ACCEPT", payload)
+        self.assertNotIn("-A DOCKER_IPV6FW_FORWARD -p tcp", payload)
+
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.remove_container_rules('cid')
+
+        payload = self.payloads[1]
+        self.assertEqual(payload, (
+            "*filter\n"
+            "-D DOCKER_IPV6FW_FORWARD -d 2001:db8::10 -i ens3 -o macvlan_gw"
+            f" -j {self.subchain}\n"
+            f"-F {self.subchain}\n"
+            f"-X {self.subchain}\n"
+            "COMMIT\n"
+        ))
+
+    def test_sync_removes_stale_subchain(self):
+        stale = self.fm.compiler.subchain_name('2001:db8::99')
+        self.saved = (
+            "*filter\n"
+            ":FORWARD DROP [0:0]\n"
+            ":DOCKER_IPV6FW_FORWARD - [0:0]\n"
+            f":{stale} - [0:0]\n"
+            "-A FORWARD -j DOCKER_IPV6FW_FORWARD\n"
+            "-A DOCKER_IPV6FW_FORWARD -d 2001:db8::99/128 -i ens3 -o macvlan_gw"
+            f" -j {stale}\n"
+            f"-A {stale} -p tcp -m tcp --dport 22 -j ACCEPT\n"
+            "COMMIT\n"
+        )
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            self.fm.sync_rules_with_reality()
+
+        payload = self.payloads[0]
+        jump_delete = payload.index("-D DOCKER_IPV6FW_FORWARD -d 2001:db8::99/128"
+                                    f" -i ens3 -o macvlan_gw -j {stale}")
+        self.assertLess(jump_delete, payload.index(f"-X {stale}"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+import unittest
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig
+from timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(tick=0.1, slots=8)
+        self.wheel._current = 0
+        self.fired = []
+
+    def schedule(self, key, delay, now, max_delay=None):
+        self.wheel.schedule(key, delay, lambda: self.fired.append((key, now)),
+                            max_delay=max_delay, now=now)
+
+    def test_reschedule_pushes_back_and_keeps_one_timer(self):
+        self.schedule("svc", 2, now=0)
+        self.schedule("svc", 2, now=1.5)
+
+        self.assertEqual(self.wheel.advance(3.0), 0)
+        self.assertEqual(len(self.wheel), 1)
+        self.assertEqual(self.wheel.advance(3.5), 1)
+        self.assertEqual(self.fired, [("svc", 1.5)])  # 最后一次调度的回调
+        self.assertFalse(self.wheel.pending("svc"))
+
+    def test_max_delay_caps_push_back(self):
+        for second in range(10):
+            self.schedule("svc", 2, now=second, max_delay=5)
+
+        self.assertEqual(self.wheel.advance(4.9), 0)
+        self.assertEqual(self.wheel.advance(5.0), 1)
+
+    def test_cancel_and_gap_longer_than_one_round(self):
+        self.schedule("a", 0.5, now=0)
+        self.schedule("b", 3, now=0)  # 超过一圈（8 × 0.1秒）
+        self.assertTrue(self.wheel.cancel("a"))
+
+        self.assertEqual(self.wheel.advance(2.9), 0)
+        self.assertEqual(self.wheel.advance(60), 1)
+        self.assertEqual(self.fired, [("b", 0)])
+
+    def test_background_thread_fires_callbacks(self):
+        wheel = TimerWheel(tick=0.01)
+        fired = threading.Event()
+        wheel.start()
+        self.addCleanup(wheel.stop)
+        wheel.schedule("svc", 0.02, fired.set)
+        self.assertTrue(fired.wait(2))
+
+
+class TestServiceRecheck(unittest.TestCase):
+    def test_rollout_produces_one_service_update(self):
+        monitor = DockerMonitor(DummyConfig(), FirewallManager(DummyConfig()))
+        info = {"name": "web.1",
+                "config": {"Labels": {"com.docker.swarm.service.name": "web"}}}
+        for _ in range(50):
+            monitor._check_and_handle_service_container(info)
+
+        self.assertTrue(monitor.timers.pending(("service", "web")))
+        self.assertEqual(monitor.apply_queue.pending(), 0)  # 事件处理没有等待
+        monitor.timers.advance(10 ** 9)
+        self.assertEqual(list(monitor.apply_queue._intents), [("service", "web")])
+
+
+if __name__ == '__main__':
+    unittest.main()
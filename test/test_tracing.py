@@ -0,0 +1,113 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+import tracing
+from docker_monitor import DockerMonitor
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig, completed
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+
+    def test_disabled_tracer_records_nothing(self):
+        with self.tracer.span("noop") as span:
+            span.set_attribute("ignored", 1)
+        self.assertEqual(self.tracer.recent(), [])
+
+    def test_nested_spans_share_trace(self):
+        self.tracer.configure(True)
+        with self.tracer.span("parent", container_id="abc"):
+            with self.tracer.span("child"):
+                pass
+
+        child, parent = self.tracer.recent()
+        self.assertEqual(child["traceId"], parent["traceId"])
+        self.assertEqual(child["parentSpanId"], parent["spanId"])
+        self.assertEqual(parent["parentSpanId"], "")
+        self.assertEqual(parent["attributes"],
+                         [{"key": "container_id", "value": {"stringValue": "abc"}}])
+        self.assertLessEqual(int(parent["startTimeUnixNano"]),
+                             int(child["startTimeUnixNano"]))
+
+    def test_error_status_and_ring_buffer(self):
+        self.tracer.configure(True, buffer_size=2)
+        for name in ("a", "b"):
+            with self.tracer.span(name):
+                pass
+        with self.assertRaises(ValueError):
+            with self.tracer.span("failing"):
+                raise ValueError("boom")
+
+        names = [record["name"] for record in self.tracer.recent()]
+        self.assertEqual(names, ["b", "failing"])
+        self.assertEqual(self.tracer.recent()[-1]["status"],
+                         {"code": tracing.STATUS_ERROR, "message": "ValueError: boom"})
+
+    def test_json_lines_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.jsonl")
+            self.tracer.configure(True, path)
+            with self.tracer.span("written", port=80):
+                pass
+            self.tracer.close()
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(records[0]["name"], "written")
+        self.assertEqual(records[0]["attributes"][0]["value"], {"intValue": "80"})
+
+
+class TestContainerStartTrace(unittest.TestCase):
+    def setUp(self):
+        tracing.TRACER.configure(True)
+        self.addCleanup(tracing.TRACER.close)
+
+    def test_container_start_breakdown(self):
+        config = DummyConfig()
+        fm = FirewallManager(config)
+        monitor = DockerMonitor(config, fm)
+        monitor.client = mock.MagicMock()
+        container_id = "c" * 64
+        monitor.client.api.inspect_container.return_value = {
+            "Name": "/web",
+            "Config": {"Labels": {}},
+            "HostConfig": {"NetworkMode": "macvlan_net",
+                           "PortBindings": {"80/tcp": [{"HostIp": "",
+                                                        "HostPort": "8080"}]}},
+            "NetworkSettings": {"Ports": {}, "Networks": {
+                "macvlan_net": {"GlobalIPv6Address": "2001:db8::10"}}},
+        }
+
+        def fake_run(cmd, *args, **kwargs):
+            committed = cmd[0].endswith(("-restore", "-save"))
+            return completed(returncode=0 if committed else 1)
+
+        def start():
+            monitor._handle_container_start(container_id)
+
+        with mock.patch("subprocess.run", side_effect=fake_run):
+            monitor.apply_queue.apply([(("container", container_id), start, False)])
+
+        spans = {record["name"]: record for record in tracing.TRACER.recent()}
+        batch = spans["apply.batch"]
+        for name in ("apply.intent", "docker inspect_container",
+                     "extract_container_ports", "backend ip6tables-restore"):
+            self.assertIn(name, spans)
+            self.assertEqual(spans[name]["traceId"], batch["traceId"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import sys
+import os
+import json
+import subprocess
+import unittest
+from unittest import mock
+
+# Ensure src/ is importable
+TEST_DIR = os.path.dirname(__file__)
+REPO_ROOT = os.path.abspath(os.path.join(TEST_DIR, ".."))
+SRC_DIR = os.path.join(REPO_ROOT, "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+if TEST_DIR not in sys.path:
+    sys.path.insert(0, TEST_DIR)
+
+from firewall_manager import FirewallManager
+from test_rule_backend import DummyConfig, completed
+from test_ruleset import SAVE_OUTPUT
+
+NFT_LIST = json.dumps({"nftables": [
+    {"metainfo": {"json_schema_version": 1}},
+    {"table": {"family": "ip6", "name": "docker_ipv6fw", "handle": 1}},
+    {"set": {"family": "ip6", "name": "allowed", "table": "docker_ipv6fw",
+             "elem": [{"concat": ["2001:db8::10", "tcp", 80]},
+                      {"concat": ["2001:db8::99", "tcp", 22]}]}},
+    {"map": {"family": "ip6", "name": "svc_dnat", "table": "docker_ipv6fw",
+             "elem": [[{"concat": ["2001:db8::20", "tcp", 80]},
+                       {"concat": ["2001:db8::20", 8080]}]]}},
+]})
+
+
+def warm_config(**overrides):
+    cfg = DummyConfig()
+    cfg.warm_restart = True
+    for key, value in overrides.items():
+        setattr(cfg, key, value)
+    return cfg
+
+
+class TestWarmRestart(unittest.TestCase):
+    def setUp(self):
+        self.networks = {'macvlan_net': {'GlobalIPv6Address': '2001:db8::10'}}
+        self.restores = []
+        self.nft_scripts = []
+
+    def fake_run(self, cmd, **kwargs):
+        if cmd[0] == "ip6tables-save":
+            saved = SAVE_OUTPUT.replace(
+                '-A DOCKER_IPV6FW_INPUT',
+                '-A DOCKER_IPV6FW_FORWARD -d 2001:db8::99/128 -p tcp -m tcp --dport 22'
+                ' -j ACCEPT\n'
+                '-A DOCKER_IPV6FW_INPUT')
+            return completed(stdout=saved)
+        if cmd[0].endswith("-restore"):
+            self.restores.append((cmd[0], kwargs['input']))
+        if cmd[:2] == ["nft", "-j"]:
+            return completed(stdout=NFT_LIST)
+        if cmd[0] == "nft":
+            self.nft_scripts.append(kwargs['input'])
+        return completed()
+
+    def test_initialize_keeps_container_rules(self):
+        fm = FirewallManager(warm_config())
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            fm.initialize()
+
+        payload = "".join(payload for cmd, payload in self.restores
+                          if cmd == "ip6tables-restore")
+        self.assertNotIn("-F DOCKER_IPV6FW_FORWARD", payload)
+        self.assertNotIn("-D DOCKER_IPV6FW_FORWARD", payload)
+
+    def test_initialize_adopts_base_rules(self):
+        fm = FirewallManager(warm_config())
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            with self.assertLogs('firewall_manager', level='INFO') as logs:
+                fm.initialize()
+
+        adopted = [rule for rule in fm.ipv6_base_rules
+                   if "neighbor-solicitation" in rule]
+        self.assertEqual(len(adopted), 1)
+        self.assertFalse(any("已清空所有旧规则" in line for line in logs.output))
+        self.assertTrue(any("接管 1 条已有规则" in line for line in logs.output))
+
+    def test_startup_scan_then_sync_changes_only_the_diff(self):
+        fm = FirewallManager(warm_config())
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            fm.initialize()
+            self.restores.clear()
+
+            # 启动扫描：规则已在内核中，不提交任何变更
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                   self.networks)
+            self.assertEqual(self.restores, [])
+
+            fm.sync_rules_with_reality()
+
+        payload = dict(self.restores)["ip6tables-restore"]
+        self.assertIn("-D DOCKER_IPV6FW_FORWARD -d 2001:db8::99/128", payload)
+        self.assertNotIn("2001:db8::10", payload)
+
+    def test_nft_table_is_adopted(self):
+        fm = FirewallManager(warm_config(firewall_backend="nftables"))
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            fm.initialize()
+
+        self.assertNotIn("delete table", self.nft_scripts[0])
+        self.assertIn("flush chain ip6 docker_ipv6fw forward", self.nft_scripts[0])
+        self.assertEqual(fm.nft.count("allowed"), 2)
+        self.assertEqual(fm.nft.lookup(("svc_dnat", "2001:db8::20 . tcp . 80")),
+                         "2001:db8::20 . 8080")
+
+        with mock.patch('subprocess.run', side_effect=self.fake_run):
+            fm.add_container_rules('cid', 'web', [{'port': 80, 'protocol': 'tcp'}],
+                                   self.networks)
+            self.assertEqual(len(self.nft_scripts), 1)  # 元素已存在
+            fm.sync_rules_with_reality()
+
+        self.assertIn("delete element ip6 docker_ipv6fw allowed"
+                      " { 2001:db8::99 . tcp . 22 }", self.nft_scripts[-1])
+        self.assertIn("delete element ip6 docker_ipv6fw svc_dnat", self.nft_scripts[-1])
+        self.assertEqual(set(fm.nft.elements), {("allowed", "2001:db8::10 . tcp . 80")})
+
+    def test_initialize_commit_failure_is_reported_once(self):
+        def failing_run(cmd, **kwargs):
+            if cmd[0].endswith("-restore"):
+                return completed(returncode=2)
+            return self.fake_run(cmd, **kwargs)
+
+        fm = FirewallManager(DummyConfig())
+        with mock.patch('subprocess.run', side_effect=failing_run):
+            with self.assertLogs('firewall_manager', level='ERROR') as logs:
+                with self.assertRaises(subprocess.CalledProcessError):
+                    fm.initialize()
+
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(fm.ipv6_base_rules, [])
+
+    def test_shutdown_keeps_rules(self):
+        fm = FirewallManager(warm_config())
+        with mock.patch.object(fm, 'cleanup') as cleanup:
+            fm.shutdown()
+        cleanup.assert_not_called()
+
+        fm = FirewallManager(DummyConfig())
+        with mock.patch.object(fm, 'cleanup') as cleanup:
+            fm.shutdown()
+        cleanup.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,18 @@ class Config:
         self.ipv4_nat_chain_name = "DOCKER_IPV4_NAT"
         self.parent_interface = "eth0"
         self.gateway_macvlan = "macvlan_gw"
+        self.ipv6_link_local = "fe80::/10"
+        self.firewall_backend = "iptables"
+        self.nft_cmd = "nft"
+        self.nft_table = "docker_ipv6fw"
+        self.nft_accept_mark = "0x20000000"
+        self.forward_mode = "chain"
+        self.ipset_cmd = "ipset"
+        self.ipset_prefix = "docker_ipv6fw"
+        self.rule_applier = "oneshot"
+        self.warm_restart = False
+        self.apply_coalesce_window = 0.2
+        self.container_stop_grace = 10
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("LiveVerification")